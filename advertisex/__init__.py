@@ -0,0 +1,40 @@
+"""
+AdvertiseX data pipeline.
+
+The pipeline modules live at the repository root; this package gives them
+one import location and a command-line interface (`python -m advertisex`).
+Attributes are imported on first access, so `import advertisex` loads
+neither pandas nor SQLAlchemy.
+"""
+import importlib
+import os
+import sys
+
+# Make the pipeline modules next to this package importable
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.append(_ROOT)
+
+# Public names mapped to the module defining them
+_EXPORTS = {
+    'DataProcessor': 'process',
+    'get_processor': 'process',
+    'process_data': 'process',
+    'read_file': 'ingest',
+    'discover_files': 'ingest',
+    'Pipeline': 'pipeline',
+    'ingestion_pipeline': 'pipeline',
+    'StreamConsumer': 'streaming',
+    'Profiler': 'profiling',
+    'FrequencyCapStore': 'freqcap',
+    'PartitionedStore': 'partitions',
+    'CampaignReports': 'reports',
+    'WarmWorkerPool': 'advertisex.workers',
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_EXPORTS[name]), name)
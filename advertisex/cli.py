@@ -0,0 +1,98 @@
+import argparse
+import logging
+import runpy
+import sys
+import time
+
+import advertisex  # Puts the pipeline modules on sys.path
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Commands running an existing module's command line; the module, and the
+# libraries it needs, are only imported when its command runs
+SCRIPT_COMMANDS = {
+    'generate': ('generate_sample_data', 'Generate sample data files'),
+    'ingest': ('ingest', 'Read data files'),
+    'pipeline': ('pipeline', 'Load data files through the staged asyncio pipeline'),
+    'stream': ('streaming', 'Consume the impression, click and bid topics'),
+    'serve-metrics': ('metrics', 'Serve Prometheus metrics while loading new data'),
+    'bench': ('bench', 'Benchmark the pipeline'),
+    'freqcap': ('freqcap', 'Benchmark the frequency-capping state store'),
+    'partitions': ('partitions', 'List, prune or archive daily partitions'),
+    'report': ('reports', 'Run campaign performance reports'),
+    'codecs': ('decompress', 'Compare compression codecs on data files'),
+}
+
+def run_script(command, args):
+    """
+    Run a module's command line as if it were started directly.
+
+    Parameters:
+        command (str): Key of SCRIPT_COMMANDS.
+        args (list): Arguments for the module's own parser.
+    """
+    module, _ = SCRIPT_COMMANDS[command]
+    sys.argv = [f"advertisex {command}"] + list(args)
+    runpy.run_module(module, run_name='__main__', alter_sys=True)
+
+def process_command(args):
+    """Process data files on warm workers, once or every `--interval` seconds with `--watch`."""
+    from advertisex.workers import WarmWorkerPool
+    from ingest import discover_files
+
+    with WarmWorkerPool(args.workers, args.db_url, args.geoip_db_path) as pool:
+        while True:
+            # Workers resume every file from its checkpoint, so unchanged files cost a stat and a lookup
+            paths = [path for files in discover_files(args.input or args.data_dir).values() for path in files]
+            start_time = time.perf_counter()
+            results = pool.run(paths)
+            failed = [result for result in results if 'error' in result]
+            logging.info(
+                f"Processed {sum(result['rows'] for result in results)} rows from {len(results) - len(failed)} files "
+                f"in {time.perf_counter() - start_time:.2f}s ({len(failed)} failed)"
+            )
+            if not args.watch:
+                return 1 if failed else 0
+            time.sleep(args.interval)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='advertisex', description='AdvertiseX data pipeline')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    for command, (module, description) in SCRIPT_COMMANDS.items():
+        commands.add_parser(command, help=f"{description} (options: advertisex {command} --help)", add_help=False)
+
+    process = commands.add_parser('process', help='Process and store data files on warm worker processes')
+    process.add_argument('--data-dir', default='data/', help='Directory containing data files')
+    process.add_argument('--input', help='Glob pattern of input files (overrides --data-dir)')
+    process.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+    process.add_argument('--db-url', help='Database URL (default: DATABASE_URL)')
+    process.add_argument('--geoip-db-path', help='GeoIP2 Country database (default: GEOIP_DB_PATH)')
+    process.add_argument('--watch', action='store_true', help='Keep the workers running and process new files every interval')
+    process.add_argument('--interval', type=float, default=60, help='Seconds between passes with --watch')
+    return parser
+
+def main(argv=None):
+    """
+    Run the advertisex command line.
+
+    Parameters:
+        argv (list, optional): Arguments; sys.argv[1:] by default.
+
+    Returns:
+        int: Exit status.
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] in SCRIPT_COMMANDS:
+        run_script(argv[0], argv[1:])
+        return 0
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    try:
+        return process_command(args)
+    except RuntimeError as e:
+        logging.error(str(e))
+        return 1
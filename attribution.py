@@ -0,0 +1,246 @@
+import concurrent.futures
+import logging
+
+import numpy as np
+import pandas as pd
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+DEFAULT_LOOKBACK = '24h'
+ATTRIBUTION_MODELS = ('last_touch', 'first_touch')
+# Raw and processed labels of the conversion types that count as conversions
+DEFAULT_CONVERSION_TYPES = ('purchase', 'signup', 'Purchase', 'Sign-Up')
+
+def partition_by_user(df, partitions):
+    """
+    Split a DataFrame into partitions by a hash of `user_id`.
+
+    Every row of a user lands in the same partition, so partitions of two
+    frames with the same count can be joined independently. Partitions are
+    built one at a time as they are consumed.
+
+    Parameters:
+        df (pandas.DataFrame): Frame with a `user_id` column.
+        partitions (int): Number of partitions.
+
+    Yields:
+        pandas.DataFrame: Each of the `partitions` partitions.
+    """
+    if partitions <= 1:
+        yield df
+        return
+    codes = pd.util.hash_pandas_object(df['user_id'], index=False).to_numpy() % partitions
+    for partition in range(partitions):
+        yield df[codes == partition]
+
+def attribute_partition(impressions, clicks, lookback, model):
+    """
+    Attribute each click to one earlier impression of the same user.
+
+    This is a sorted as-of join, not a cartesian merge: every click is
+    matched with the latest (last touch) or earliest (first touch)
+    impression of its user within `lookback` before the click.
+
+    Parameters:
+        impressions (pandas.DataFrame): Impressions with `user_id` and `timestamp`.
+        clicks (pandas.DataFrame): Clicks with `user_id` and `timestamp`.
+        lookback (pandas.Timedelta): Attribution window.
+        model (str): 'last_touch' or 'first_touch'.
+
+    Returns:
+        pandas.DataFrame: Clicks with the attributed impression's columns, suffixed
+        `_impression`, and its `impression_timestamp`. Unattributed clicks have nulls.
+    """
+    impressions = impressions.rename(columns={'timestamp': 'impression_timestamp'})
+    impressions = impressions.rename(columns={
+        column: f"{column}_impression" for column in impressions.columns
+        if column in clicks.columns and column != 'user_id'
+    })
+    impressions = impressions.dropna(subset=['impression_timestamp']).sort_values('impression_timestamp')
+    clicks = clicks.dropna(subset=['timestamp'])
+
+    if model == 'last_touch':
+        attributed = pd.merge_asof(
+            clicks.sort_values('timestamp'), impressions,
+            left_on='timestamp', right_on='impression_timestamp', by='user_id',
+            direction='backward', tolerance=lookback,
+        )
+    else:
+        # The first impression at or after the window start, if it precedes the click
+        clicks = clicks.assign(window_start=clicks['timestamp'] - lookback).sort_values('window_start')
+        attributed = pd.merge_asof(
+            clicks, impressions,
+            left_on='window_start', right_on='impression_timestamp', by='user_id',
+            direction='forward', tolerance=lookback,
+        ).drop(columns='window_start')
+        late = attributed['impression_timestamp'] > attributed['timestamp']
+        impression_columns = [column for column in impressions.columns if column != 'user_id']
+        attributed.loc[late, impression_columns] = None
+    return attributed
+
+def attach_bids(attributed, bids, lookback):
+    """
+    Attach the latest bid request of the user before each attributed impression.
+
+    Parameters:
+        attributed (pandas.DataFrame): Output of `attribute_partition`.
+        bids (pandas.DataFrame): Bid requests with `user_id` and `timestamp`.
+        lookback (pandas.Timedelta): Maximum gap between bid and impression.
+
+    Returns:
+        pandas.DataFrame: Attributed clicks with bid columns suffixed `_bid`.
+    """
+    bids = bids.rename(columns={column: f"{column}_bid" for column in bids.columns if column != 'user_id'})
+    bids = bids.dropna(subset=['timestamp_bid']).sort_values('timestamp_bid')
+    matched = attributed[attributed['impression_timestamp'].notna()].sort_values('impression_timestamp')
+    matched = pd.merge_asof(
+        matched, bids, left_on='impression_timestamp', right_on='timestamp_bid', by='user_id',
+        direction='backward', tolerance=lookback,
+    )
+    return pd.concat([matched, attributed[attributed['impression_timestamp'].isna()]], ignore_index=True)
+
+def _attribute_partition_task(args):
+    impressions, clicks, bids, lookback, model = args
+    attributed = attribute_partition(impressions, clicks, lookback, model)
+    if bids is not None:
+        attributed = attach_bids(attributed, bids, lookback)
+    return attributed
+
+class AttributionEngine:
+    """
+    Join impressions, clicks/conversions and bid requests per user.
+
+    Inputs are partitioned by a hash of `user_id` and each partition is
+    joined on its own, sequentially or on a process pool. The input frames
+    are held in memory in full; partitioning only bounds the join's
+    intermediate state (sorted copies and as-of matches) by the largest
+    partition. Sequential joins build each partition just before joining
+    it, while a process pool is handed every partition up front.
+    """
+
+    def __init__(self, lookback=DEFAULT_LOOKBACK, model='last_touch', partitions=1, workers=None,
+                 campaign_key='ad_campaign_id', conversion_types=DEFAULT_CONVERSION_TYPES):
+        """
+        Parameters:
+            lookback (str or pandas.Timedelta): Attribution window, e.g. '30min' or '7d'.
+            model (str): 'last_touch' or 'first_touch'.
+            partitions (int): Number of user hash partitions.
+            workers (int, optional): Worker processes for the partitions; None joins them
+                sequentially in this process.
+            campaign_key (str): Column identifying the campaign in the reports.
+            conversion_types (tuple): Values of `conversion_type` that count as conversions.
+        """
+        if model not in ATTRIBUTION_MODELS:
+            raise ValueError(f"Unknown attribution model '{model}', expected one of {ATTRIBUTION_MODELS}")
+        self.lookback = pd.Timedelta(lookback)
+        self.model = model
+        self.partitions = partitions
+        self.workers = workers
+        self.campaign_key = campaign_key
+        self.conversion_types = conversion_types
+
+    @staticmethod
+    def prepare(df):
+        """Give a frame comparable `user_id` values and datetime timestamps."""
+        df = df.copy()
+        df['user_id'] = pd.to_numeric(df['user_id'], errors='coerce').astype('Int64')
+        if 'timestamp' in df.columns:
+            df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+        return df.dropna(subset=['user_id'])
+
+    def attribute(self, impressions, clicks, bids=None):
+        """
+        Attribute clicks to impressions, and impressions to bid requests.
+
+        Parameters:
+            impressions (pandas.DataFrame): Processed ad impressions.
+            clicks (pandas.DataFrame): Processed clicks and conversions.
+            bids (pandas.DataFrame, optional): Processed bid requests. They are only
+                joined if they carry a `timestamp` column.
+
+        Returns:
+            pandas.DataFrame: One row per click, with the attributed impression (and bid) columns.
+        """
+        impressions, clicks = self.prepare(impressions), self.prepare(clicks)
+        if bids is not None and 'timestamp' not in bids.columns:
+            logging.warning("Bid requests have no timestamp column; skipping the bid join")
+            bids = None
+        bids = self.prepare(bids) if bids is not None else None
+
+        tasks = zip(
+            partition_by_user(impressions, self.partitions),
+            partition_by_user(clicks, self.partitions),
+            partition_by_user(bids, self.partitions) if bids is not None else [None] * max(self.partitions, 1),
+        )
+        tasks = ((imps, clks, bds, self.lookback, self.model) for imps, clks, bds in tasks if not clks.empty)
+        if self.workers and self.partitions > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(_attribute_partition_task, tasks))
+        else:
+            results = [_attribute_partition_task(task) for task in tasks]
+
+        if not results:
+            return pd.DataFrame(columns=list(clicks.columns) + ['impression_timestamp'])
+        attributed = pd.concat(results, ignore_index=True)
+        logging.info(f"Attributed {attributed['impression_timestamp'].notna().sum()} of {len(attributed)} clicks ({self.model})")
+        return attributed
+
+    def campaign_report(self, impressions, attributed):
+        """
+        Build the per-campaign CTR and conversion rate table.
+
+        Impressions without a campaign column are assigned to campaigns through
+        their creative, using the campaign most often attributed to it.
+
+        Parameters:
+            impressions (pandas.DataFrame): Processed ad impressions.
+            attributed (pandas.DataFrame): Output of `attribute`.
+
+        Returns:
+            pandas.DataFrame: Per-campaign impressions, clicks, attributed clicks,
+            conversions, CTR and conversion rate.
+        """
+        key = self.campaign_key
+        matched = attributed[attributed['impression_timestamp'].notna()]
+        if key in impressions.columns:
+            impression_campaigns = impressions[key]
+        elif 'ad_creative_id' in impressions.columns and 'ad_creative_id' in matched.columns:
+            creative_campaigns = (
+                matched.groupby(['ad_creative_id', key]).size()
+                .sort_values(ascending=False).reset_index()
+                .drop_duplicates('ad_creative_id').set_index('ad_creative_id')[key]
+            )
+            impression_campaigns = impressions['ad_creative_id'].map(creative_campaigns)
+        else:
+            impression_campaigns = pd.Series(np.nan, index=impressions.index)
+
+        is_conversion = matched['conversion_type'].isin(self.conversion_types) if 'conversion_type' in matched.columns else False
+        report = pd.DataFrame({
+            'impressions': impression_campaigns.value_counts(),
+            'clicks': attributed[key].value_counts(),
+            'attributed_clicks': matched[key].value_counts(),
+            'conversions': matched.assign(is_conversion=is_conversion).groupby(key)['is_conversion'].sum(),
+        }).fillna(0).astype('int64')
+        if 'bid_amount_bid' in matched.columns:
+            report['avg_bid_amount'] = matched.groupby(key)['bid_amount_bid'].mean()
+        report['ctr'] = report['attributed_clicks'] / report['impressions'].replace(0, np.nan)
+        report['conversion_rate'] = report['conversions'] / report['attributed_clicks'].replace(0, np.nan)
+        report.index.name = key
+        return report.reset_index()
+
+    def run(self, impressions, clicks, bids=None):
+        """
+        Run attribution and build the campaign report.
+
+        Parameters:
+            impressions (pandas.DataFrame): Processed ad impressions.
+            clicks (pandas.DataFrame): Processed clicks and conversions.
+            bids (pandas.DataFrame, optional): Processed bid requests.
+
+        Returns:
+            dict: 'attributed' clicks and the 'campaigns' report.
+        """
+        attributed = self.attribute(impressions, clicks, bids)
+        return {'attributed': attributed, 'campaigns': self.campaign_report(self.prepare(impressions), attributed)}
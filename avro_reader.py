@@ -0,0 +1,187 @@
+import concurrent.futures
+import json
+import logging
+import mmap
+import operator
+import os
+
+import fastavro
+import numpy as np
+import pandas as pd
+
+from schemas import coerce_frame
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+SYNC_SIZE = 16
+# Files smaller than this are decoded in one piece even when workers are available
+MIN_SPLIT_BYTES = 4 << 20
+
+# Avro primitive types decoded into numpy arrays; anything else becomes an object array
+NUMERIC_TYPES = {'int': np.int32, 'long': np.int64, 'float': np.float32, 'double': np.float64, 'boolean': np.bool_}
+
+def open_mmap(path):
+    """
+    Map an Avro file into memory read-only.
+
+    Returns:
+        tuple: (file, mmap); close both when done.
+    """
+    f = open(path, 'rb')
+    try:
+        return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except Exception:
+        f.close()
+        raise
+
+def read_header(path):
+    """
+    Read the header of an Avro container file.
+
+    Parameters:
+        path (str): Path to the Avro file.
+
+    Returns:
+        dict: 'schema' (the writer schema), 'codec', 'sync' (the 16-byte sync
+        marker), 'data_start' (offset of the first block) and 'size'.
+    """
+    f, mm = open_mmap(path)
+    try:
+        header = fastavro.schemaless_reader(mm, fastavro.read.HEADER_SCHEMA)
+        return {
+            'schema': json.loads(header['meta']['avro.schema'].decode('utf-8')),
+            'codec': header['meta'].get('avro.codec', b'null').decode('utf-8'),
+            'sync': header['sync'],
+            'data_start': mm.tell(),
+            'size': len(mm),
+        }
+    finally:
+        mm.close()
+        f.close()
+
+def split_ranges(path, parts):
+    """
+    Split an Avro file into byte ranges that start and end on block boundaries.
+
+    Every block ends with the file's sync marker, so the first block starting
+    at or after an offset is found by searching for the marker. Ranges are
+    roughly equal in size; empty ones are dropped.
+
+    Parameters:
+        path (str): Path to the Avro file.
+        parts (int): Number of ranges wanted.
+
+    Returns:
+        list: (start, end) byte offsets covering every block once.
+    """
+    header = read_header(path)
+    start, size, sync = header['data_start'], header['size'], header['sync']
+    boundaries = [start]
+    f, mm = open_mmap(path)
+    try:
+        step = (size - start) / max(parts, 1)
+        for i in range(1, parts):
+            position = mm.find(sync, max(int(start + i * step) - SYNC_SIZE, boundaries[-1]))
+            boundary = size if position == -1 else position + SYNC_SIZE
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    finally:
+        mm.close()
+        f.close()
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return [(begin, end) for begin, end in zip(boundaries, boundaries[1:]) if end > begin]
+
+def column_types(schema):
+    """Get the numpy dtype of every field of a record schema, or None for object columns."""
+    return {field['name']: NUMERIC_TYPES.get(field['type']) if isinstance(field['type'], str) else None
+            for field in schema['fields']}
+
+def decode_range(path, start=None, end=None):
+    """
+    Decode the blocks of an Avro file between two offsets into columns.
+
+    Blocks are decoded one at a time by fastavro straight from the memory map,
+    and each block's records are turned into one array per field, so the
+    whole file never exists as a list of dictionaries.
+
+    This is the unit of work submitted to the process pool, so it must stay a
+    module-level function that can be pickled.
+
+    Parameters:
+        path (str): Path to the Avro file.
+        start (int, optional): Block boundary to start at; the first block by default.
+        end (int, optional): Offset to stop at; the end of the file by default.
+
+    Returns:
+        dict: Field names mapped to numpy arrays.
+    """
+    f, mm = open_mmap(path)
+    try:
+        blocks = fastavro.block_reader(mm)
+        types = column_types(blocks.writer_schema)
+        chunks = {name: [] for name in types}
+        if start is not None:
+            mm.seek(start)
+        end = len(mm) if end is None else end
+        while mm.tell() < end:
+            block = next(blocks, None)
+            if block is None:
+                break
+            records = list(block)
+            for name, dtype in types.items():
+                values = map(operator.itemgetter(name), records)
+                if dtype is None:
+                    chunks[name].append(np.array(list(values), dtype=object))
+                else:
+                    chunks[name].append(np.fromiter(values, dtype, len(records)))
+    finally:
+        mm.close()
+        f.close()
+    return {
+        name: np.concatenate(arrays) if arrays else np.empty(0, dtype=types[name] or object)
+        for name, arrays in chunks.items()
+    }
+
+def read_avro_columns(path, workers=None, min_split_bytes=MIN_SPLIT_BYTES):
+    """
+    Decode an Avro container file into columns, in parallel for large files.
+
+    Files of at least `min_split_bytes` are split at sync markers into one
+    range per worker, and the ranges are decoded in separate processes.
+
+    Parameters:
+        path (str): Path to the Avro file.
+        workers (int, optional): Number of worker processes. Defaults to the CPU count;
+            1 decodes in this process.
+        min_split_bytes (int): Smallest file size worth splitting.
+
+    Returns:
+        dict: Field names mapped to numpy arrays, in file order.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or os.path.getsize(path) < min_split_bytes:
+        return decode_range(path)
+    ranges = split_ranges(path, workers)
+    if len(ranges) == 1:
+        return decode_range(path)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+        parts = list(pool.map(decode_range, [path] * len(ranges), *zip(*ranges)))
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+def read_avro_frame(path, source='bid_requests', workers=None, min_split_bytes=MIN_SPLIT_BYTES):
+    """
+    Read an Avro container file into a DataFrame typed by a source's schema.
+
+    Parameters:
+        path (str): Path to the Avro file.
+        source (str): Source whose schema types the columns.
+        workers (int, optional): Number of worker processes (see `read_avro_columns`).
+        min_split_bytes (int): Smallest file size worth splitting.
+
+    Returns:
+        pandas.DataFrame: Typed DataFrame.
+    """
+    return coerce_frame(pd.DataFrame(read_avro_columns(path, workers, min_split_bytes), copy=False), source)
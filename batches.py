@@ -0,0 +1,308 @@
+import itertools
+import socket
+
+import numpy as np
+import pandas as pd
+
+from schemas import column_encodings, coerce_frame, infer_source
+
+# Define constants
+# Code of a missing value in a dictionary-encoded column
+MISSING_CODE = -1
+
+def pack_ipv4(addresses):
+    """
+    Pack dotted-quad IPv4 addresses into unsigned 32-bit integers.
+
+    Parameters:
+        addresses (array-like): Address strings.
+
+    Returns:
+        numpy.ndarray: uint32 addresses.
+
+    Raises:
+        ValueError: If a value is not an IPv4 address in canonical dotted-quad form.
+    """
+    addresses = np.asarray(addresses, dtype=object)
+    try:
+        packed = np.frombuffer(b''.join(map(socket.inet_aton, addresses)), dtype='>u4').astype(np.uint32)
+    except (OSError, TypeError):
+        raise ValueError("Values are not all IPv4 addresses")
+    # inet_aton also accepts forms such as '10.1' or octal octets, which would not survive a round trip
+    if not (unpack_ipv4(packed) == addresses).all():
+        raise ValueError("Values are not all canonical IPv4 addresses")
+    return packed
+
+def unpack_ipv4(packed):
+    """
+    Format packed IPv4 addresses as dotted-quad strings.
+
+    Parameters:
+        packed (numpy.ndarray): uint32 addresses.
+
+    Returns:
+        numpy.ndarray: Address strings (object dtype).
+    """
+    raw = np.asarray(packed, dtype='>u4').tobytes()
+    return np.array([socket.inet_ntoa(raw[start:start + 4]) for start in range(0, len(raw), 4)], dtype=object)
+
+class DictionaryArray:
+    """
+    A dictionary-encoded column: one integer code per row, indexing an array of distinct values.
+
+    Missing values have code MISSING_CODE. IPv4 dictionaries hold the packed
+    uint32 addresses instead of strings. Slices share the codes' memory and
+    the dictionary, so they cost no copy.
+    """
+
+    __slots__ = ('codes', 'dictionary')
+
+    def __init__(self, codes, dictionary):
+        """
+        Parameters:
+            codes (numpy.ndarray): Integer codes, MISSING_CODE for missing values.
+            dictionary (numpy.ndarray): Distinct values.
+        """
+        self.codes = codes
+        self.dictionary = dictionary
+
+    @classmethod
+    def encode(cls, values, ipv4=False):
+        """
+        Dictionary-encode a column.
+
+        Categorical columns keep their codes and categories. Otherwise every
+        distinct value is hashed once; with `ipv4`, a dictionary of canonical
+        IPv4 addresses is packed into uint32, and any other dictionary is kept
+        as strings so no value is lost.
+
+        Parameters:
+            values (array-like, pandas.Series or pandas.Categorical): Column values.
+            ipv4 (bool): Pack the dictionary as IPv4 addresses when possible.
+
+        Returns:
+            DictionaryArray: The encoded column.
+        """
+        if isinstance(values, pd.Series):
+            values = values.array
+        if isinstance(values, pd.Categorical):
+            codes, dictionary = values.codes, values.categories.to_numpy(dtype=object)
+        else:
+            codes, dictionary = pd.factorize(np.asarray(values, dtype=object))
+            codes = codes.astype(np.int32)
+        if ipv4:
+            try:
+                dictionary = pack_ipv4(dictionary)
+            except ValueError:
+                pass
+        return cls(codes, dictionary)
+
+    @property
+    def is_ipv4(self):
+        """Whether the dictionary holds packed IPv4 addresses."""
+        return self.dictionary.dtype == np.uint32
+
+    @property
+    def nbytes(self):
+        """Bytes used by the codes and the dictionary's array."""
+        return self.codes.nbytes + self.dictionary.nbytes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, key):
+        return DictionaryArray(self.codes[key], self.dictionary)
+
+    def categories(self):
+        """Get the dictionary as strings, formatting packed IPv4 addresses."""
+        return unpack_ipv4(self.dictionary) if self.is_ipv4 else self.dictionary
+
+    def to_categorical(self):
+        """
+        Convert the column to a pandas Categorical over the same codes.
+
+        Only the distinct values are turned into Python strings.
+
+        Returns:
+            pandas.Categorical: The column.
+        """
+        return pd.Categorical.from_codes(self.codes, self.categories())
+
+    def decode(self):
+        """
+        Get the values row by row.
+
+        Returns:
+            numpy.ndarray: Object array, None for missing values.
+        """
+        values = np.append(self.categories(), None)
+        return values[self.codes]
+
+# Function to get the array behind a typed pandas column
+def column_array(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return DictionaryArray.encode(column)
+    if isinstance(column.dtype, np.dtype):
+        return column.to_numpy()
+    # Nullable integer columns keep their pandas extension array
+    return column.array
+
+class RecordBatch:
+    """
+    A batch of records stored column by column.
+
+    Every field is one array: numeric and timestamp fields are NumPy arrays,
+    enums and the string fields the schema marks with an `encoding` are
+    DictionaryArrays. A batch pickles as a handful of buffers, which makes it
+    cheap to send between processes, and `select`, `rename` and `slice`
+    return new batches over the same arrays without copying them.
+    """
+
+    def __init__(self, columns, source=None):
+        """
+        Parameters:
+            columns (dict): Column names mapped to arrays of equal length.
+            source (str, optional): Source of the records.
+        """
+        self.columns = dict(columns)
+        self.source = source
+        lengths = {len(column) for column in self.columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns of a record batch must have equal lengths, got {sorted(lengths)}")
+        self.num_rows = lengths.pop() if lengths else 0
+
+    @classmethod
+    def from_columns(cls, columns, source):
+        """
+        Build a batch from plain columns, typed and encoded by the source's schema.
+
+        Parameters:
+            columns (dict): Column names mapped to arrays, lists or Series, e.g.
+                the output of `avro_reader.decode_range`.
+            source (str): Source name.
+
+        Returns:
+            RecordBatch: The batch.
+        """
+        encodings = column_encodings(source)
+        plain = {name: values for name, values in columns.items() if name not in encodings}
+        typed = coerce_frame(pd.DataFrame(plain, copy=False), source) if plain else {}
+        return cls({
+            name: DictionaryArray.encode(values, encodings[name] == 'ipv4') if name in encodings else column_array(typed[name])
+            for name, values in columns.items()
+        }, source)
+
+    @classmethod
+    def from_records(cls, records, source):
+        """
+        Build a batch from ingested records.
+
+        Each field is gathered from the records once; no per-record copies
+        are made.
+
+        Parameters:
+            records (list): Dictionaries, as returned by the ingest readers.
+            source (str): Source name.
+
+        Returns:
+            RecordBatch: The batch.
+        """
+        names = dict.fromkeys(itertools.chain.from_iterable(records))
+        return cls.from_columns({name: [record.get(name) for record in records] for name in names}, source)
+
+    @classmethod
+    def from_frame(cls, df, source=None):
+        """
+        Build a batch from a DataFrame; categorical columns keep their codes.
+
+        Parameters:
+            df (pandas.DataFrame): Ingested or typed records.
+            source (str, optional): Source name; inferred from the columns by default.
+
+        Returns:
+            RecordBatch: The batch.
+        """
+        return cls.from_columns({name: df[name] for name in df.columns}, source or infer_source(df))
+
+    @property
+    def column_names(self):
+        return list(self.columns)
+
+    @property
+    def nbytes(self):
+        """Bytes used by the columns' arrays."""
+        return sum(column.nbytes for column in self.columns.values())
+
+    def __len__(self):
+        return self.num_rows
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def select(self, names):
+        """
+        Project the batch onto some columns, without copying them.
+
+        Parameters:
+            names (list): Column names, in the order wanted.
+
+        Returns:
+            RecordBatch: The projected batch.
+        """
+        return RecordBatch({name: self.columns[name] for name in names}, self.source)
+
+    def rename(self, mapping):
+        """
+        Rename columns, without copying them.
+
+        Parameters:
+            mapping (dict): Old names mapped to new names; other columns keep theirs.
+
+        Returns:
+            RecordBatch: The renamed batch.
+        """
+        return RecordBatch({mapping.get(name, name): column for name, column in self.columns.items()}, self.source)
+
+    def slice(self, start, stop=None):
+        """
+        Get a range of rows as views of this batch's arrays.
+
+        Parameters:
+            start (int): First row.
+            stop (int, optional): Row to stop before; the end of the batch by default.
+
+        Returns:
+            RecordBatch: The rows.
+        """
+        return RecordBatch({name: column[start:stop] for name, column in self.columns.items()}, self.source)
+
+    def take(self, rows):
+        """
+        Get rows by position or boolean mask; unlike `slice`, this copies the codes and values.
+
+        Parameters:
+            rows (array-like): Row positions or a boolean mask.
+
+        Returns:
+            RecordBatch: The rows.
+        """
+        rows = np.asarray(rows)
+        return RecordBatch({name: column[rows] for name, column in self.columns.items()}, self.source)
+
+    def to_frame(self):
+        """
+        Build a DataFrame over the batch's arrays.
+
+        Numeric and timestamp columns are used without a copy, and
+        dictionary-encoded columns become categoricals sharing their codes.
+
+        Returns:
+            pandas.DataFrame: The records.
+        """
+        return pd.DataFrame({
+            name: column.to_categorical() if isinstance(column, DictionaryArray) else column
+            for name, column in self.columns.items()
+        }, index=pd.RangeIndex(self.num_rows), copy=False)
@@ -0,0 +1,287 @@
+import argparse
+import json
+import logging
+import os
+import pickle
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import decompress
+import freqcap
+import generate_sample_data
+import ingest
+import streaming
+from profiling import current_rss_bytes
+from avro_reader import read_avro_frame
+from urls import DomainDictionary, parse_urls
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+DEFAULT_SIZES = [10000, 100000, 1000000]
+BENCH_SOURCES = ['ad_impressions', 'clicks_conversions', 'bid_requests']
+
+# Function to get the peak resident set size of this process
+def peak_rss_mb():
+    """
+    Get the peak resident set size of this process so far.
+
+    Returns:
+        float: Peak RSS in megabytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+# Function to get the commit being benchmarked
+def git_commit():
+    """
+    Get the current git commit, marked dirty when the tree has local changes.
+
+    Returns:
+        str: Commit hash, or None outside a git checkout.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Function to extract domains the way process_ad_impressions used to, as a baseline
+def apply_domains(urls):
+    """Extract the host of each URL with a per-row Python call."""
+    return urls.apply(lambda x: x.split('/')[2] if '/' in x else x).astype('category')
+
+# Function to time one benchmark stage
+def measure(stages, stage, rows, func, *args, **kwargs):
+    """
+    Run a stage and record its time, throughput and memory.
+
+    Memory is recorded as the change in RSS from the stage's start to its
+    end, and as how far the stage raised the process's peak RSS (zero when
+    it stayed below the peak of an earlier stage). A failing stage is
+    recorded with its error instead of stopping the run.
+
+    Parameters:
+        stages (dict): Results to add the stage to.
+        stage (str): Stage name.
+        rows (int): Rows the stage handles, used for rows per second.
+        func (callable): Stage function.
+        *args, **kwargs: Arguments of the stage function.
+
+    Returns:
+        The stage's result, or None if it failed.
+    """
+    rss_before, peak_before = current_rss_bytes(), peak_rss_mb()
+    start_time = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        error = None
+    except Exception as e:
+        result = None
+        error = f"{type(e).__name__}: {e}"
+        logging.error(f"Benchmark stage {stage} failed: {error}")
+    seconds = time.perf_counter() - start_time
+    rss_after = current_rss_bytes()
+    stages[stage] = {
+        'rows': rows,
+        'seconds': round(seconds, 6),
+        'rows_per_second': round(rows / seconds, 1) if seconds > 0 and error is None else None,
+        'rss_delta_mb': round((rss_after - rss_before) / (1 << 20), 1) if rss_before is not None and rss_after is not None else None,
+        'peak_rss_growth_mb': round(peak_rss_mb() - peak_before, 1),
+    }
+    if error is not None:
+        stages[stage]['error'] = error
+    return result
+
+# Function to add the input size and read throughput to a read stage
+def record_file_mb(stage, file_mb):
+    """Record the MB of a read stage's files on disk and the MB/s it read them at."""
+    stage['file_mb'] = round(file_mb, 2)
+    stage['mb_per_second'] = round(file_mb / stage['seconds'], 1) if stage['seconds'] > 0 and 'error' not in stage else None
+
+# Function to benchmark the pipeline at one data size
+def run_size(processor, rows, data_dir, seed=generate_sample_data.DEFAULT_SEED, shards=1, sources=BENCH_SOURCES,
+             stream_batch_size=None, compression=None):
+    """
+    Generate data of one size and benchmark every pipeline stage on it.
+
+    For each source the stages are: generate, read (ingest), process
+    (the matching DataProcessor.process_* method), deduplicate and store.
+    Ad impressions also time domain extraction with the old per-row apply
+    against the vectorized URL parser, and bid requests time the columnar
+    Avro reader against the record list. Every source also times reading
+    into a compact RecordBatch ('read_batch_<source>'), recording its
+    pickled size. Impressions and clicks are counted into a fresh
+    frequency-capping store ('freqcap_<source>'), whose users are then
+    looked up in one batch ('freqcap_lookup'). With a stream batch size,
+    the 'stream' stage replays every source through the streaming consumer.
+    With a compression codec the JSON and CSV files are written compressed;
+    every read stage records the MB of its files on disk and MB/s, and the
+    'decompress' entry holds the decompression totals per codec.
+
+    Parameters:
+        processor (DataProcessor): Processor to benchmark.
+        rows (int): Rows per source.
+        data_dir (str): Directory to generate the data in.
+        seed (int): Generator seed.
+        shards (int): Files per source.
+        sources (list): Sources to benchmark.
+        stream_batch_size (int, optional): Micro-batch size of the streaming stage; skipped by default.
+        compression (str, optional): Codec of the generated JSON and CSV files ('gzip' or 'zstd').
+
+    Returns:
+        dict: Stage names mapped to their measurements.
+    """
+    stages = {}
+    os.makedirs(data_dir, exist_ok=True)
+    # Every size starts deduplicating from an empty window
+    processor.deduplicators.clear()
+    caps = freqcap.FrequencyCapStore()
+    decompress.reset_stats()
+    for source in sources:
+        paths = measure(stages, f"generate_{source}", rows, generate_sample_data.generate_source, source, rows, shards, data_dir, seed,
+                        compression=compression)
+        records = measure(stages, f"read_{source}", rows, lambda: [record for path in paths for record in ingest.read_file(path)])
+        if records is None:
+            continue
+        file_mb = sum(os.path.getsize(path) for path in paths) / 1e6
+        record_file_mb(stages[f"read_{source}"], file_mb)
+        batches = measure(stages, f"read_batch_{source}", rows, lambda: [ingest.read_batch(path) for path in paths])
+        record_file_mb(stages[f"read_batch_{source}"], file_mb)
+        if batches is not None:
+            # What a pool worker sends back to the parent per file
+            stages[f"read_batch_{source}"]['pickled_mb'] = round(sum(len(pickle.dumps(batch)) for batch in batches) / (1 << 20), 2)
+            del batches
+        if source == 'bid_requests':
+            # Compare block-wise columnar decoding against the record list above
+            measure(stages, 'read_bid_requests_columnar', rows, lambda: [read_avro_frame(path) for path in paths])
+        if source == 'ad_impressions':
+            # Compare the vectorized URL parser against the old per-row apply
+            urls = pd.Series([record['website_url'] for record in records])
+            measure(stages, 'domain_apply', rows, apply_domains, urls)
+            measure(stages, 'domain_vectorized', rows, parse_urls, urls, DomainDictionary())
+            del urls
+        df = measure(stages, f"process_{source}", rows, getattr(processor, f"process_{source}"), records)
+        del records
+        if df is None:
+            continue
+        if source in freqcap.SOURCE_EVENTS:
+            measure(stages, f"freqcap_{source}", len(df), caps.update, df, source)
+            measure(stages, 'freqcap_lookup', len(df), caps.lookup_many, df['user_id'])
+        deduplicated = measure(stages, f"deduplicate_{source}", len(df), processor.deduplicate_data, df)
+        # The loader raises on errors, where store_data would log them and return None
+        measure(stages, f"store_{source}", len(df), processor.loader.load, df, f"bench_{source}", mode='replace')
+        del df, deduplicated
+    if compression:
+        stages['decompress'] = decompress.read_stats()
+    if stream_batch_size:
+        stream = measure(stages, 'stream', rows * len(sources), run_stream, processor, data_dir, sources, stream_batch_size)
+        if stream is not None:
+            stages['stream'].update({
+                name: stream[name] for name in ('batches', 'backpressure_seconds', 'latency_p50', 'latency_p99')
+            })
+    return stages
+
+# Function to benchmark the streaming consumer against the in-process broker
+def run_stream(processor, data_dir, sources=BENCH_SOURCES, batch_size=streaming.DEFAULT_MAX_BATCH_SIZE):
+    """
+    Publish the generated files to a MemoryBroker and consume them with a StreamConsumer.
+
+    Parameters:
+        processor (DataProcessor): Processor to benchmark.
+        data_dir (str): Directory of the generated data.
+        sources (list): Sources to publish.
+        batch_size (int): Maximum records per micro-batch.
+
+    Returns:
+        dict: The consumer's statistics.
+    """
+    topics = {source: source for source in sources}
+    broker = streaming.MemoryBroker()
+    streaming.produce_files(broker, data_dir, topics)
+    consumer = streaming.StreamConsumer(processor, broker.consumer(topics), topics, max_batch_size=batch_size)
+    return consumer.run(idle_timeout=streaming.POLL_TIMEOUT * 5)
+
+# Function to run the benchmark suite
+def run_benchmark(sizes=DEFAULT_SIZES, seed=generate_sample_data.DEFAULT_SEED, shards=1, db_url=None, work_dir=None, sources=BENCH_SOURCES,
+                  stream_batch_size=None, compression=None):
+    """
+    Benchmark the pipeline at several data sizes.
+
+    Parameters:
+        sizes (list): Rows per source for each run.
+        seed (int): Generator seed, so runs on different commits see the same data.
+        shards (int): Files per source.
+        db_url (str, optional): Database to store into. Defaults to a SQLite file in the work directory.
+        work_dir (str, optional): Directory for generated data. Defaults to a temporary directory.
+        sources (list): Sources to benchmark.
+        stream_batch_size (int, optional): Micro-batch size of the streaming stage; skipped by default.
+        compression (str, optional): Codec of the generated JSON and CSV files; uncompressed by default.
+
+    Returns:
+        dict: JSON-serializable report with the environment and per-size stage results.
+    """
+    from process import DataProcessor
+
+    report = {
+        'commit': git_commit(),
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'seed': seed,
+        'shards': shards,
+        'compression': compression,
+        'runs': [],
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = work_dir or tmp_dir
+        processor = DataProcessor(db_url or f"sqlite:///{os.path.join(work_dir, 'bench.db')}")
+        try:
+            for rows in sizes:
+                logging.info(f"Benchmarking {rows} rows per source")
+                start_time = time.perf_counter()
+                stages = run_size(processor, rows, os.path.join(work_dir, f"rows_{rows}"), seed, shards, sources, stream_batch_size,
+                                  compression)
+                report['runs'].append({
+                    'rows': rows,
+                    'seconds': round(time.perf_counter() - start_time, 6),
+                    'peak_rss_mb': round(peak_rss_mb(), 1),
+                    'stages': stages,
+                })
+        finally:
+            processor.engine.dispose()
+    return report
+
+if __name__ == '__main__':
+    # Configure command-line arguments
+    parser = argparse.ArgumentParser(description='AdvertiseX Pipeline Benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Rows per source for each run')
+    parser.add_argument('--seed', type=int, default=generate_sample_data.DEFAULT_SEED, help='Generator seed')
+    parser.add_argument('--shards', type=int, default=1, help='Files per source')
+    parser.add_argument('--sources', nargs='+', choices=BENCH_SOURCES, default=BENCH_SOURCES, help='Sources to benchmark')
+    parser.add_argument('--db-url', help='Database to store into (default: SQLite file in the work directory)')
+    parser.add_argument('--work-dir', help='Directory for generated data (default: temporary directory)')
+    parser.add_argument('--stream-batch-size', type=int, help='Also benchmark the streaming consumer with this micro-batch size')
+    parser.add_argument('--compression', choices=sorted(decompress.CODEC_SUFFIXES), help='Write the JSON and CSV files compressed')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.sizes, args.seed, args.shards, args.db_url, args.work_dir, args.sources, args.stream_batch_size,
+                           args.compression)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        logging.info(f"Benchmark report written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
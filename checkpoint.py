@@ -0,0 +1,324 @@
+from sqlalchemy import BigInteger, Column, Float, Integer, MetaData, String, Table, select
+import argparse
+import hashlib
+import logging
+import os
+import time
+
+import db
+import ingest
+from ingest import DEFAULT_BATCH_SIZE, DEFAULT_DATA_DIR, discover_files, source_for_path
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+CHECKPOINT_TABLE = 'ingest_checkpoints'
+QUARANTINE_TABLE = 'ingest_quarantine'
+HEAD_HASH_BYTES = 64 * 1024
+# A file unmodified for this long is complete, so its last line is loaded even without a newline
+DEFAULT_SETTLE_SECONDS = 60
+
+def head_hash(path, length):
+    """
+    Hash the first `length` bytes of a file.
+
+    Appending to a file leaves its head unchanged, while rewriting it almost
+    always changes it, so this tells the two apart without hashing the
+    whole file.
+
+    Parameters:
+        path (str): Path to the file.
+        length (int): Number of leading bytes to hash.
+
+    Returns:
+        str: Hex digest.
+    """
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(length)).hexdigest()
+
+class CheckpointStore:
+    """
+    Per-file ingestion positions stored in a database table.
+
+    Each row records how far a file has been loaded: the byte offset (CSV and
+    JSON Lines) or Avro block position to resume from, the number of records
+    loaded, and the file's size, mtime and head hash when it was read.
+    Keeping the table in the target database lets a checkpoint be committed
+    in the same transaction as the rows it covers. Files that were rewritten
+    after they were loaded are recorded in a quarantine table.
+    """
+
+    def __init__(self, engine, table_name=CHECKPOINT_TABLE, quarantine_table_name=QUARANTINE_TABLE):
+        """
+        Parameters:
+            engine (sqlalchemy.engine.Engine): Database holding the checkpoint table.
+            table_name (str): Name of the checkpoint table.
+            quarantine_table_name (str): Name of the table of quarantined files.
+        """
+        self.engine = engine
+        self.table = Table(
+            table_name, MetaData(),
+            Column('path', String(1024), primary_key=True),
+            Column('source', String(64)),
+            # Byte offsets and sizes of a day's shard can exceed 2 GiB
+            Column('offset', BigInteger, nullable=False),
+            Column('records', BigInteger, nullable=False),
+            Column('size', BigInteger, nullable=False),
+            Column('mtime', Float, nullable=False),
+            Column('head_hash', String(40), nullable=False),
+            Column('head_length', Integer, nullable=False),
+        )
+        self.quarantine_table = Table(
+            quarantine_table_name, MetaData(),
+            Column('path', String(1024), primary_key=True),
+            Column('source', String(64)),
+            Column('size', BigInteger, nullable=False),
+            Column('mtime', Float, nullable=False),
+            Column('reason', String(256), nullable=False),
+            Column('quarantined_at', Float, nullable=False),
+        )
+        self.table.create(engine, checkfirst=True)
+        self.quarantine_table.create(engine, checkfirst=True)
+
+    def get(self, path):
+        """
+        Get the checkpoint of a file.
+
+        Parameters:
+            path (str): Path to the file.
+
+        Returns:
+            dict: The checkpoint row, or None if the file was never loaded.
+        """
+        with self.engine.connect() as conn:
+            row = conn.execute(select(self.table).where(self.table.c.path == path)).mappings().first()
+        return dict(row) if row else None
+
+    def plan(self, path):
+        """
+        Decide how much of a file still has to be loaded.
+
+        Parameters:
+            path (str): Path to the file.
+
+        A file that shrank, whose head changed, or that was modified without
+        growing is 'rewritten'.
+
+        Returns:
+            dict: 'status' ('new', 'unchanged', 'appended' or 'rewritten'), the
+            'offset' and 'records' to resume from, and the file's 'size' and 'mtime'.
+        """
+        stat = os.stat(path)
+        plan = {'status': 'new', 'offset': 0, 'records': 0, 'size': stat.st_size, 'mtime': stat.st_mtime}
+        checkpoint = self.get(path)
+        if checkpoint is None:
+            return plan
+        if (
+            stat.st_size < checkpoint['size']
+            or (stat.st_size == checkpoint['size'] and stat.st_mtime != checkpoint['mtime'])
+            or head_hash(path, checkpoint['head_length']) != checkpoint['head_hash']
+        ):
+            plan['status'] = 'rewritten'
+            return plan
+        plan['status'] = 'unchanged' if stat.st_size == checkpoint['offset'] else 'appended'
+        plan['offset'] = checkpoint['offset']
+        plan['records'] = checkpoint['records']
+        return plan
+
+    def commit(self, conn, path, offset, records, size, mtime):
+        """
+        Record a file's position inside the caller's transaction.
+
+        Parameters:
+            conn (sqlalchemy.engine.Connection): Connection with an open transaction.
+            path (str): Path to the file.
+            offset (int): Position to resume from.
+            records (int): Total records loaded from the file.
+            size (int): File size when it was read.
+            mtime (float): File modification time when it was read.
+        """
+        head_length = min(HEAD_HASH_BYTES, size)
+        conn.execute(self.table.delete().where(self.table.c.path == path))
+        conn.execute(self.table.insert().values(
+            path=path, source=source_for_path(path), offset=offset, records=records,
+            size=size, mtime=mtime, head_hash=head_hash(path, head_length), head_length=head_length,
+        ))
+
+    def quarantine(self, path, size, mtime, reason):
+        """
+        Record a file that must not be loaded until it is reset.
+
+        Parameters:
+            path (str): Path to the file.
+            size (int): File size when it was quarantined.
+            mtime (float): File modification time when it was quarantined.
+            reason (str): Why the file was quarantined.
+        """
+        with db.begin(self.engine) as conn:
+            conn.execute(self.quarantine_table.delete().where(self.quarantine_table.c.path == path))
+            conn.execute(self.quarantine_table.insert().values(
+                path=path, source=source_for_path(path), size=size, mtime=mtime, reason=reason, quarantined_at=time.time(),
+            ))
+
+    def quarantined(self):
+        """
+        Get the quarantined files.
+
+        Returns:
+            dict: File paths mapped to their quarantine rows.
+        """
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(self.quarantine_table)).mappings().all()
+        return {row['path']: dict(row) for row in rows}
+
+    def reset(self, path):
+        """
+        Forget a file's checkpoint and quarantine, so it is loaded again from the start.
+
+        Rows loaded from the file before are not deleted; remove them first.
+
+        Parameters:
+            path (str): Path to the file.
+        """
+        with db.begin(self.engine) as conn:
+            conn.execute(self.table.delete().where(self.table.c.path == path))
+            conn.execute(self.quarantine_table.delete().where(self.quarantine_table.c.path == path))
+
+class IncrementalIngestor:
+    """
+    Load only new and appended data, committing a checkpoint with every batch.
+
+    When the checkpoint store lives in the processor's database, each batch
+    and its checkpoint are written in one transaction, so a crash can neither
+    load a batch twice nor skip one. A file rewritten after it was loaded is
+    quarantined rather than loaded again, since its earlier rows are already
+    stored.
+    """
+
+    def __init__(self, processor, store=None, batch_size=DEFAULT_BATCH_SIZE, validate=False,
+                 settle_seconds=DEFAULT_SETTLE_SECONDS):
+        """
+        Parameters:
+            processor (DataProcessor): Processor used to process and store batches.
+            store (CheckpointStore, optional): Checkpoint store. Defaults to one in the
+                processor's database.
+            batch_size (int): Maximum number of records per batch.
+            validate (bool): Validate every batch (DataProcessor.validate_data) before
+                storing it; rejected rows are quarantined instead of loaded.
+            settle_seconds (float): Seconds after its last modification when a file
+                is complete, so a last line without a newline is loaded.
+        """
+        self.processor = processor
+        self.store = store or CheckpointStore(processor.engine)
+        self.batch_size = batch_size
+        self.validate = validate
+        self.settle_seconds = settle_seconds
+        self.batches = 0
+        self.rows = 0
+        self.busy_seconds = 0.0
+        if self.store.engine is not processor.engine:
+            logging.warning("Checkpoints are stored outside the target database; loads and checkpoints are not atomic")
+
+    def ingest_file(self, path):
+        """
+        Load the unprocessed part of one file.
+
+        Parameters:
+            path (str): Path to the file.
+
+        Returns:
+            int: Number of records loaded.
+        """
+        plan = self.store.plan(path)
+        if plan['status'] == 'unchanged':
+            logging.info(f"Skipping unchanged file {path}")
+            return 0
+        if plan['status'] == 'rewritten':
+            # Reloading would store the rows loaded before a second time
+            logging.error(f"File {path} was rewritten since it was last loaded; quarantining it instead of loading it again")
+            self.store.quarantine(path, plan['size'], plan['mtime'], 'rewritten after it was loaded')
+            return 0
+
+        table_name = source_for_path(path)
+        process_batch = self.processor.get_batch_processor(path)
+        records = plan['records']
+        loaded = 0
+        # An unterminated last line is only a record once the writer is done with the file
+        final = time.time() - plan['mtime'] >= self.settle_seconds
+        for batch, offset in ingest.iter_file_from(path, plan['offset'], plan['records'], self.batch_size, final):
+            if not batch:
+                continue
+            start_time = time.perf_counter()
+            df = process_batch(batch)
+            records += len(batch)
+            if self.store.engine is self.processor.engine:
+                with db.begin(self.processor.engine) as conn:
+                    df = self.store_batch(df, table_name, conn)
+                    self.store.commit(conn, path, offset, records, plan['size'], plan['mtime'])
+            else:
+                with db.begin(self.processor.engine) as conn:
+                    df = self.store_batch(df, table_name, conn)
+                with db.begin(self.store.engine) as conn:
+                    self.store.commit(conn, path, offset, records, plan['size'], plan['mtime'])
+            loaded += len(batch)
+            self.record(table_name, len(df), time.perf_counter() - start_time)
+        logging.info(f"Loaded {loaded} new records from {path} ({plan['status']})")
+        return loaded
+
+    def store_batch(self, df, table_name, conn):
+        """
+        Validate a processed batch, if enabled, and load it in the caller's transaction.
+
+        Rejected rows are quarantined in the same transaction, so a batch that
+        fails and is loaded again is not quarantined twice.
+
+        Returns:
+            pandas.DataFrame: The rows loaded.
+        """
+        if self.validate:
+            df = self.processor.validate_data(df, table_name, conn=conn)
+        self.processor.loader.load(df, table_name, conn=conn)
+        return df
+
+    def record(self, source, rows, seconds):
+        """Record one stored batch; metrics.py wraps this to export it."""
+        self.batches += 1
+        self.rows += rows
+        self.busy_seconds += seconds
+
+    def run(self, source=DEFAULT_DATA_DIR):
+        """
+        Load new and appended data from every shard in a directory or glob.
+
+        Parameters:
+            source (str): Data directory or glob pattern.
+
+        Returns:
+            dict: File paths mapped to the number of records loaded.
+        """
+        loaded = {}
+        for paths in discover_files(source).values():
+            for path in paths:
+                try:
+                    loaded[path] = self.ingest_file(path)
+                except Exception as e:
+                    logging.error(f"Error ingesting data from {path}: {e}")
+        return loaded
+
+if __name__ == '__main__':
+    # Configure command-line arguments
+    parser = argparse.ArgumentParser(description='Incremental Data Ingestion for AdvertiseX')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Directory or glob pattern of data files')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Records per batch and checkpoint')
+    parser.add_argument('--checkpoint-db', help='Separate SQLite file for checkpoints (not atomic with loads)')
+    parser.add_argument('--reset', metavar='PATH', action='append', default=[],
+                        help='Forget the checkpoint and quarantine of a file before loading (repeatable)')
+    args = parser.parse_args()
+
+    from process import processor
+    store = CheckpointStore(db.get_engine(f"sqlite:///{args.checkpoint_db}")) if args.checkpoint_db else None
+    ingestor = IncrementalIngestor(processor, store, args.batch_size)
+    for path in args.reset:
+        ingestor.store.reset(path)
+    ingestor.run(args.data_dir)
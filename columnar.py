@@ -0,0 +1,116 @@
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs
+import pandas as pd
+from schemas import parse_records
+import logging
+import os
+import uuid
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+DEFAULT_COLUMNAR_DIR = 'data/columnar/'
+COLUMNAR_FORMATS = {'parquet': 'parquet', 'arrow': 'ipc'}
+PARTITION_COLUMN = 'event_hour'
+EVENT_HOUR_FORMAT = '%Y-%m-%dT%H'
+# Hive-style event hour partitions, declared so all-null partitions still read back
+PARTITIONING = ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor='hive')
+
+def write_shards(data, source, root=DEFAULT_COLUMNAR_DIR, format='parquet'):
+    """
+    Write records as columnar shards partitioned by source and event hour.
+
+    Columns are typed from the source's schema. Shards land in
+    `<root>/<source>/event_hour=<YYYY-MM-DDTHH>/`; records without a
+    timestamp go to the default (null) hour partition.
+
+    Parameters:
+        data (list or pandas.DataFrame): Ingested records.
+        source (str): Source name, e.g. 'ad_impressions'.
+        root (str): Root directory of the columnar store.
+        format (str): 'parquet' or 'arrow' (Arrow IPC, memory-mappable).
+
+    Returns:
+        int: Number of records written.
+    """
+    df = parse_records(data, source)
+    if df.empty:
+        return 0
+    if 'timestamp' in df.columns:
+        df[PARTITION_COLUMN] = df['timestamp'].dt.strftime(EVENT_HOUR_FORMAT)
+    else:
+        df[PARTITION_COLUMN] = None
+    df[PARTITION_COLUMN] = df[PARTITION_COLUMN].astype(object)
+
+    extension = 'parquet' if format == 'parquet' else 'arrow'
+    ds.write_dataset(
+        pa.Table.from_pandas(df, preserve_index=False),
+        base_dir=os.path.join(root, source),
+        format=COLUMNAR_FORMATS[format],
+        partitioning=PARTITIONING,
+        # A unique prefix per call keeps shards written by parallel workers apart
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.{extension}",
+        existing_data_behavior='overwrite_or_ignore',
+    )
+    logging.info(f"Wrote {len(df)} {source} records to {root}")
+    return len(df)
+
+def write_shards_task(records, source, root=DEFAULT_COLUMNAR_DIR, format='parquet'):
+    """
+    Write records as shards inside an ingestion worker.
+
+    Use with `functools.partial` as the `task` of `ingest.read_file` or
+    `ingest.ingest_files`, so records are written where they are decoded
+    instead of being sent back to the parent process.
+
+    Returns:
+        int: Number of records written.
+    """
+    return write_shards(records, source, root, format)
+
+def read_shards(source, root=DEFAULT_COLUMNAR_DIR, columns=None, start=None, end=None, format='parquet'):
+    """
+    Read columnar shards back with column projection and timestamp pushdown.
+
+    The time range prunes whole event-hour partitions before any file is
+    opened, and is then pushed down to row groups. Files are memory-mapped.
+
+    Parameters:
+        source (str): Source name, e.g. 'ad_impressions'.
+        root (str): Root directory of the columnar store.
+        columns (list, optional): Columns to read; all columns by default.
+        start (str or datetime, optional): Inclusive lower bound on `timestamp`.
+        end (str or datetime, optional): Exclusive upper bound on `timestamp`.
+        format (str): 'parquet' or 'arrow'.
+
+    Returns:
+        pandas.DataFrame: The selected rows and columns.
+
+    Raises:
+        ValueError: If a time range is given for shards without a `timestamp` column.
+    """
+    dataset = ds.dataset(
+        os.path.join(root, source),
+        format=COLUMNAR_FORMATS[format],
+        partitioning=PARTITIONING,
+        filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True),
+    )
+    if (start is not None or end is not None) and 'timestamp' not in dataset.schema.names:
+        # e.g. bid requests, which are all in the null event-hour partition
+        raise ValueError(f"{source} shards have no timestamp column to select a time range on")
+    filter = None
+    if start is not None:
+        start = pd.Timestamp(start)
+        filter = (ds.field(PARTITION_COLUMN) >= start.strftime(EVENT_HOUR_FORMAT)) & (ds.field('timestamp') >= start.to_datetime64())
+    if end is not None:
+        end = pd.Timestamp(end)
+        end_filter = (ds.field(PARTITION_COLUMN) <= end.strftime(EVENT_HOUR_FORMAT)) & (ds.field('timestamp') < end.to_datetime64())
+        filter = end_filter if filter is None else filter & end_filter
+
+    table = dataset.to_table(columns=columns, filter=filter)
+    df = table.to_pandas()
+    if PARTITION_COLUMN in df.columns and (columns is None or PARTITION_COLUMN not in columns):
+        df = df.drop(columns=PARTITION_COLUMN)
+    return df
@@ -0,0 +1,170 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from contextlib import contextmanager
+import logging
+import os
+import threading
+import time
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Pool settings and the environment variables that override them
+POOL_SETTINGS_ENV = {
+    'pool_size': ('DB_POOL_SIZE', 10, int),
+    'max_overflow': ('DB_MAX_OVERFLOW', 5, int),
+    'pool_timeout': ('DB_POOL_TIMEOUT', 30, float),
+    'pool_recycle': ('DB_POOL_RECYCLE', 1800, int),
+    'pool_pre_ping': ('DB_POOL_PRE_PING', True, lambda value: value.lower() in ('1', 'true', 'yes')),
+}
+
+# Settings only a queue-based pool accepts
+QUEUE_POOL_SETTINGS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+def pool_settings_from_env(**overrides):
+    """
+    Build connection pool settings from defaults, environment variables and overrides.
+
+    Parameters:
+        **overrides: Explicit settings, taking precedence over the environment.
+
+    Returns:
+        dict: Keyword arguments for `sqlalchemy.create_engine`.
+    """
+    settings = {}
+    for name, (env_var, default, parse) in POOL_SETTINGS_ENV.items():
+        value = os.getenv(env_var)
+        settings[name] = parse(value) if value is not None else default
+    settings.update({name: value for name, value in overrides.items() if value is not None})
+    return settings
+
+class PoolMetrics:
+    """
+    Connection pool checkout and wait-time metrics for one engine.
+
+    Checkouts and checkins are counted from pool events; the time spent
+    waiting for a connection is recorded by `connect` and `begin`.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections_opened = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.waits = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def attach(self, engine):
+        """Subscribe to the engine's pool events."""
+        event.listen(engine, 'connect', self.on_connect)
+        event.listen(engine, 'checkout', self.on_checkout)
+        event.listen(engine, 'checkin', self.on_checkin)
+
+    def on_connect(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.connections_opened += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self.lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.checkins += 1
+            self.checked_out = max(self.checked_out - 1, 0)
+
+    def record_wait(self, seconds):
+        """Record how long a caller waited for a pooled connection."""
+        with self.lock:
+            self.waits += 1
+            self.total_wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def snapshot(self):
+        """
+        Get the current metrics.
+
+        Returns:
+            dict: Counters, connections currently checked out and wait times.
+        """
+        with self.lock:
+            return {
+                'connections_opened': self.connections_opened,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'checked_out': self.checked_out,
+                'max_checked_out': self.max_checked_out,
+                'avg_wait_seconds': self.total_wait_seconds / self.waits if self.waits else 0.0,
+                'max_wait_seconds': self.max_wait_seconds,
+            }
+
+def create_db_engine(db_url, **pool_settings):
+    """
+    Create an engine with a sized, pre-pinging connection pool and attached metrics.
+
+    Parameters:
+        db_url (str): Database URL.
+        **pool_settings: Overrides for `pool_settings_from_env`.
+
+    Returns:
+        sqlalchemy.engine.Engine: The engine, with its PoolMetrics as `engine.pool_metrics`.
+    """
+    settings = pool_settings_from_env(**pool_settings)
+    url = make_url(db_url)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # In-memory SQLite uses a per-thread singleton pool without sizing options
+        settings = {name: value for name, value in settings.items() if name not in QUEUE_POOL_SETTINGS}
+    engine = create_engine(db_url, **settings)
+    engine.pool_metrics = PoolMetrics()
+    engine.pool_metrics.attach(engine)
+    logging.info(f"Created database engine for {url.render_as_string(hide_password=True)} with {settings}")
+    return engine
+
+def pool_size(engine):
+    """Get the number of persistent connections an engine's pool keeps."""
+    size = engine.pool.size
+    return size() if callable(size) else size
+
+# One engine per database URL, pool settings and process
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_engine(db_url, **pool_settings):
+    """
+    Get the shared engine for a database URL in the current process.
+
+    Engines are keyed by process id as well, since pooled connections must not
+    be shared with forked workers.
+
+    Parameters:
+        db_url (str): Database URL.
+        **pool_settings: Overrides for `pool_settings_from_env`.
+
+    Returns:
+        sqlalchemy.engine.Engine: The process-wide engine.
+    """
+    key = (os.getpid(), db_url, tuple(sorted(pool_settings.items())))
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = create_db_engine(db_url, **pool_settings)
+        return _engines[key]
+
+@contextmanager
+def connect(engine):
+    """Check a connection out of the engine's pool, recording the wait."""
+    start_time = time.perf_counter()
+    with engine.connect() as conn:
+        engine.pool_metrics.record_wait(time.perf_counter() - start_time)
+        yield conn
+
+@contextmanager
+def begin(engine):
+    """Check a connection out and open a transaction, recording the wait."""
+    with connect(engine) as conn:
+        with conn.begin():
+            yield conn
@@ -0,0 +1,614 @@
+import argparse
+import concurrent.futures
+import io
+import json
+import logging
+import mmap
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+ZSTD_FRAME_MAGIC = 0xFD2FB528
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A50
+# File name suffixes of compressed files, mapped to their codec
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.gzip': 'gzip', '.zst': 'zstd', '.zstd': 'zstd'}
+CODEC_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+GZIP_WBITS = 31
+READ_SIZE = 1 << 20
+# Decompressed chunks a background reader keeps ready ahead of its consumer
+DEFAULT_PREFETCH = 8
+# Compressed inputs smaller than this are decompressed in one thread
+MIN_PARALLEL_BYTES = 1 << 20
+# BGZF blocks: gzip members of at most 64 KiB carrying their own size, see BGZFWriter
+BGZF_BLOCK_INPUT = 0xff00
+GZIP_HEADER = struct.Struct('<4BI2BH')
+BGZF_HEADER = struct.Struct('<4BI2BH2B2H')
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+DEFAULT_ZSTD_FRAME_BYTES = 1 << 20
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+def detect_compression(path):
+    """
+    Detect whether a file is gzip or zstd compressed from its first bytes.
+
+    Parameters:
+        path (str): Path to the file.
+
+    Returns:
+        str: 'gzip' or 'zstd', or None for uncompressed files.
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic == ZSTD_MAGIC:
+        return 'zstd'
+    return None
+
+def strip_compression(path):
+    """Remove a compression suffix from a file name, e.g. 'a.json.gz' -> 'a.json'."""
+    base, suffix = os.path.splitext(path)
+    return base if suffix in COMPRESSION_SUFFIXES else path
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing zstd files requires the zstandard package: pip install zstandard")
+    return zstandard
+
+# Read statistics per codec, accumulated over the process
+_stats = {}
+_stats_lock = threading.Lock()
+
+def record_read(path, codec, compressed_bytes, raw_bytes, seconds, threads=1):
+    """
+    Record and log the throughput of decompressing one file.
+
+    Parameters:
+        path (str): Path to the file.
+        codec (str): Compression codec.
+        compressed_bytes (int): Bytes read from the file.
+        raw_bytes (int): Decompressed bytes.
+        seconds (float): Time spent decompressing.
+        threads (int): Threads that decompressed the file.
+    """
+    with _stats_lock:
+        totals = _stats.setdefault(codec, {'files': 0, 'compressed_bytes': 0, 'raw_bytes': 0, 'seconds': 0.0})
+        totals['files'] += 1
+        totals['compressed_bytes'] += compressed_bytes
+        totals['raw_bytes'] += raw_bytes
+        totals['seconds'] += seconds
+    logging.info(
+        f"Decompressed {path} ({codec}, {threads} thread{'s' if threads != 1 else ''}): "
+        f"{compressed_bytes / 1e6:.1f} MB -> {raw_bytes / 1e6:.1f} MB in {seconds:.2f}s "
+        f"({throughput(raw_bytes, seconds):.1f} MB/s)"
+    )
+
+def throughput(num_bytes, seconds):
+    """Megabytes per second."""
+    return num_bytes / 1e6 / seconds if seconds > 0 else float('inf')
+
+def read_stats():
+    """
+    Get decompression totals per codec for this process.
+
+    Returns:
+        dict: Codecs mapped to files, compressed and raw bytes, seconds, and
+        compressed and raw MB/s.
+    """
+    with _stats_lock:
+        return {
+            codec: {
+                **totals,
+                'compressed_mb_per_second': round(throughput(totals['compressed_bytes'], totals['seconds']), 1),
+                'raw_mb_per_second': round(throughput(totals['raw_bytes'], totals['seconds']), 1),
+            }
+            for codec, totals in _stats.items()
+        }
+
+def reset_stats():
+    """Forget the decompression totals of this process."""
+    with _stats_lock:
+        _stats.clear()
+
+def gzip_members(data):
+    """
+    Find the members of a BGZF file from the block sizes in their headers.
+
+    BGZF (as written by `bgzip`, or BGZFWriter) is gzip made of members of
+    at most 64 KiB that each record their size, so a file can be split into
+    independently decompressible members without inflating it.
+
+    Parameters:
+        data (bytes or mmap): Whole compressed file.
+
+    Returns:
+        list: (start, end) offsets of every member, or None if the file is
+        not BGZF and has to be decompressed as one stream.
+    """
+    members = []
+    position, size = 0, len(data)
+    while position < size:
+        if size - position < GZIP_HEADER.size:
+            return None
+        id1, id2, method, flags, _, _, _, extra_length = GZIP_HEADER.unpack_from(data, position)
+        if (id1, id2, method) != (0x1f, 0x8b, 8) or not flags & 4:
+            return None
+        # The BC subfield is usually the only one, but may follow others
+        extra_start, extra_end = position + GZIP_HEADER.size, position + GZIP_HEADER.size + extra_length
+        block_size = None
+        while extra_start + 4 <= extra_end:
+            si1, si2, subfield_length = data[extra_start], data[extra_start + 1], struct.unpack_from('<H', data, extra_start + 2)[0]
+            if (si1, si2, subfield_length) == (66, 67, 2):
+                block_size = struct.unpack_from('<H', data, extra_start + 4)[0] + 1
+                break
+            extra_start += 4 + subfield_length
+        if block_size is None:
+            return None
+        members.append((position, position + block_size))
+        position += block_size
+    return members
+
+def zstd_frames(data):
+    """
+    Find the frames of a zstd file by walking frame and block headers.
+
+    Files written by `pzstd` or ZstdFrameWriter consist of independent frames, which can be decompressed in
+    parallel. Skippable frames are left out.
+
+    Parameters:
+        data (bytes or mmap): Whole compressed file.
+
+    Returns:
+        list: (start, end) offsets of every frame, or None if the file is malformed.
+    """
+    frames = []
+    position, size = 0, len(data)
+    try:
+        while position < size:
+            magic, = struct.unpack_from('<I', data, position)
+            if magic & 0xFFFFFFF0 == ZSTD_SKIPPABLE_MAGIC:
+                position += 8 + struct.unpack_from('<I', data, position + 4)[0]
+                continue
+            if magic != ZSTD_FRAME_MAGIC:
+                return None
+            start = position
+            descriptor = data[position + 4]
+            single_segment = descriptor >> 5 & 1
+            content_size_bytes = (1 if single_segment else 0, 2, 4, 8)[descriptor >> 6]
+            header_size = 1 + (0 if single_segment else 1) + (0, 1, 2, 4)[descriptor & 3] + content_size_bytes
+            position += 4 + header_size
+            while True:
+                block_header = int.from_bytes(data[position:position + 3], 'little')
+                block_type, block_size = block_header >> 1 & 3, block_header >> 3
+                if block_type == 3:
+                    return None
+                # RLE blocks store one byte, whatever their decompressed size
+                position += 3 + (1 if block_type == 1 else block_size)
+                if block_header & 1:
+                    break
+            if descriptor >> 2 & 1:
+                position += 4
+            if position > size:
+                return None
+            frames.append((start, position))
+    except (struct.error, IndexError):
+        return None
+    return frames
+
+def iter_gzip(chunks):
+    """
+    Decompress a gzip stream of one or more members, chunk by chunk.
+
+    Parameters:
+        chunks (iterable): Compressed bytes-like chunks.
+
+    Yields:
+        bytes: Decompressed chunks.
+    """
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    pending = False
+    for data in chunks:
+        while data:
+            pending = True
+            output = decompressor.decompress(data)
+            if output:
+                yield output
+            if decompressor.eof:
+                # The next member starts right after this one; padding zeros are ignored
+                data = decompressor.unused_data.lstrip(b'\x00')
+                decompressor = zlib.decompressobj(GZIP_WBITS)
+                pending = False
+            else:
+                data = b''
+    if pending:
+        raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+def iter_zstd(source):
+    """Decompress every frame of a zstd file object or buffer, chunk by chunk."""
+    reader = import_zstandard().ZstdDecompressor().stream_reader(source, read_size=READ_SIZE, read_across_frames=True)
+    for chunk in iter(lambda: reader.read(READ_SIZE), b''):
+        yield chunk
+
+def decode_parts(data, ranges, codec):
+    """Decompress a run of members or frames, in a worker thread."""
+    with memoryview(data) as view:
+        if codec == 'gzip':
+            # zlib checks each member's CRC and length; it releases the GIL while inflating
+            return b''.join(zlib.decompress(view[start:end], GZIP_WBITS) for start, end in ranges)
+        decompressor = import_zstandard().ZstdDecompressor()
+        return b''.join(decompressor.decompressobj().decompress(view[start:end]) for start, end in ranges)
+
+def decompress_buffer(data, codec, workers=None, path='<buffer>'):
+    """
+    Decompress a whole gzip or zstd file held in memory.
+
+    BGZF members and zstd frames are decompressed in parallel threads, in
+    runs of roughly equal compressed size; single-stream files are
+    decompressed in one thread.
+
+    Parameters:
+        data (bytes or mmap): Compressed file contents.
+        codec (str): 'gzip' or 'zstd'.
+        workers (int, optional): Decompression threads. Defaults to the CPU count.
+        path (str): Name used when recording the throughput.
+
+    Returns:
+        bytes: Decompressed contents.
+    """
+    start_time = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    ranges = None
+    if workers > 1 and len(data) >= MIN_PARALLEL_BYTES:
+        ranges = gzip_members(data) if codec == 'gzip' else zstd_frames(data)
+
+    if ranges and len(ranges) > 1:
+        # A few runs per thread even out members that compress differently
+        run_bytes = max(len(data) // (workers * 4), 1)
+        runs, run, run_start = [], [], ranges[0][0]
+        for member in ranges:
+            run.append(member)
+            if member[1] - run_start >= run_bytes:
+                runs.append(run)
+                run, run_start = [], member[1]
+        if run:
+            runs.append(run)
+        threads = min(workers, len(runs))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+            result = b''.join(pool.map(decode_parts, [data] * len(runs), runs, [codec] * len(runs)))
+    else:
+        threads = 1
+        if codec == 'gzip':
+            with memoryview(data) as view:
+                result = b''.join(iter_gzip(view[offset:offset + READ_SIZE] for offset in range(0, len(view), READ_SIZE)))
+        else:
+            result = b''.join(iter_zstd(data))
+    record_read(path, codec, len(data), len(result), time.perf_counter() - start_time, threads)
+    return result
+
+@contextmanager
+def input_buffer(path, workers=None):
+    """
+    Get the whole contents of a data file as a buffer.
+
+    Uncompressed files are memory-mapped, so nothing is copied until the
+    buffer is read. Compressed files are decompressed into memory, in
+    parallel where their members or frames allow (see `decompress_buffer`),
+    without staging a decompressed copy on disk.
+
+    Parameters:
+        path (str): Path to the file.
+        workers (int, optional): Decompression threads. Defaults to the CPU count.
+
+    Yields:
+        bytes or mmap: The (decompressed) contents; a memory map is only
+        valid inside the `with` block.
+    """
+    codec = detect_compression(path)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if codec is None:
+                yield mm
+                return
+            data = decompress_buffer(mm, codec, workers, path)
+    yield data
+
+class PrefetchReader(io.RawIOBase):
+    """
+    Read a compressed file decompressed ahead by a background thread.
+
+    The thread decompresses up to `prefetch` chunks ahead of the reader, so
+    decompression overlaps with whatever the reader does with the data
+    (zlib and zstd release the GIL while they work). Read through
+    `open_input`, which adds buffering and line reading.
+    """
+
+    def __init__(self, path, codec, prefetch=DEFAULT_PREFETCH):
+        """
+        Parameters:
+            path (str): Path to the compressed file.
+            codec (str): 'gzip' or 'zstd'.
+            prefetch (int): Decompressed chunks to keep ready.
+        """
+        super().__init__()
+        if codec == 'zstd':
+            import_zstandard()
+        self.path = path
+        self.codec = codec
+        self.file = open(path, 'rb')
+        self.queue = queue.Queue(prefetch)
+        self.stopping = threading.Event()
+        self.chunk = memoryview(b'')
+        self.position = 0
+        self.finished = False
+        self.complete = False
+        self.raw_bytes = 0
+        self.seconds = 0.0
+        self.thread = threading.Thread(target=self.produce, name=f"decompress {os.path.basename(path)}", daemon=True)
+        self.thread.start()
+
+    def chunks(self):
+        if self.codec == 'gzip':
+            return iter_gzip(iter(lambda: self.file.read(READ_SIZE), b''))
+        return iter_zstd(self.file)
+
+    def produce(self):
+        try:
+            chunks = self.chunks()
+            while not self.stopping.is_set():
+                start_time = time.perf_counter()
+                chunk = next(chunks, None)
+                self.seconds += time.perf_counter() - start_time
+                if chunk is None:
+                    break
+                self.raw_bytes += len(chunk)
+                self.put(chunk)
+            self.put(None)
+        except Exception as e:
+            self.put(e)
+
+    def put(self, item):
+        # Give up once the reader is closed, rather than block on a full queue forever
+        while not self.stopping.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.chunk:
+            if self.finished:
+                return 0
+            item = self.queue.get()
+            if item is None:
+                self.finished = self.complete = True
+                return 0
+            if isinstance(item, Exception):
+                self.finished = True
+                raise item
+            self.chunk = memoryview(item)
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        self.position += size
+        return size
+
+    def tell(self):
+        """Position in the decompressed data."""
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            self.stopping.set()
+            self.thread.join()
+            if self.complete:
+                record_read(self.path, self.codec, self.file.tell(), self.raw_bytes, self.seconds)
+            self.file.close()
+        super().close()
+
+def open_input(path, prefetch=DEFAULT_PREFETCH, mapped=False):
+    """
+    Open a data file for binary reading, decompressing gzip and zstd files on the fly.
+
+    Parameters:
+        path (str): Path to the file.
+        prefetch (int): Decompressed chunks a compressed file's background
+            thread keeps ready.
+        mapped (bool): Memory-map uncompressed files instead of opening them
+            buffered. A map supports read, readline, seek and tell, but cannot
+            be wrapped for text reading.
+
+    Returns:
+        file: Binary file or memory map; `tell()` is the position in the decompressed data.
+    """
+    codec = detect_compression(path)
+    if codec is None:
+        if mapped and os.path.getsize(path):
+            # The map stays valid after the file is closed
+            with open(path, 'rb') as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return open(path, 'rb')
+    return io.BufferedReader(PrefetchReader(path, codec, prefetch), READ_SIZE)
+
+def open_text(path, newline=None, prefetch=DEFAULT_PREFETCH):
+    """Open a data file as UTF-8 text, decompressing it on the fly; see `open_input`."""
+    if detect_compression(path) is None:
+        return open(path, 'r', encoding='utf-8', newline=newline)
+    return io.TextIOWrapper(open_input(path, prefetch), encoding='utf-8', newline=newline)
+
+class BGZFWriter(io.RawIOBase):
+    """
+    Write gzip as BGZF: independent members of at most 64 KiB recording their size.
+
+    Any gzip reader can read the result, and `decompress_buffer` can split
+    it into members and decompress them in parallel.
+    """
+
+    def __init__(self, f, level=DEFAULT_LEVELS['gzip']):
+        super().__init__()
+        self.file = f
+        self.level = level
+        self.pending = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.pending += data
+        while len(self.pending) >= BGZF_BLOCK_INPUT:
+            self.write_block(bytes(self.pending[:BGZF_BLOCK_INPUT]))
+            del self.pending[:BGZF_BLOCK_INPUT]
+        return len(data)
+
+    def write_block(self, block):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        deflated = compressor.compress(block) + compressor.flush()
+        header = BGZF_HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 66, 67, 2, BGZF_HEADER.size + len(deflated) + 8 - 1)
+        self.file.write(header + deflated + struct.pack('<2I', zlib.crc32(block), len(block)))
+
+    def close(self):
+        if not self.closed:
+            if self.pending:
+                self.write_block(bytes(self.pending))
+            self.file.write(BGZF_EOF)
+            self.file.close()
+        super().close()
+
+class ZstdFrameWriter(io.RawIOBase):
+    """Write zstd as independent frames of `frame_bytes` input each, for frame-parallel reads."""
+
+    def __init__(self, f, level=DEFAULT_LEVELS['zstd'], frame_bytes=DEFAULT_ZSTD_FRAME_BYTES):
+        super().__init__()
+        self.file = f
+        self.compressor = import_zstandard().ZstdCompressor(level=level, write_content_size=True)
+        self.frame_bytes = frame_bytes
+        self.pending = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.pending += data
+        while len(self.pending) >= self.frame_bytes:
+            self.file.write(self.compressor.compress(bytes(self.pending[:self.frame_bytes])))
+            del self.pending[:self.frame_bytes]
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            if self.pending:
+                self.file.write(self.compressor.compress(bytes(self.pending)))
+            self.file.close()
+        super().close()
+
+def open_output(path, codec=None, level=None):
+    """
+    Open a file for binary writing, compressed in a parallel-readable layout.
+
+    Parameters:
+        path (str): Path to the file.
+        codec (str, optional): 'gzip' (BGZF members) or 'zstd' (independent
+            frames); uncompressed by default.
+        level (int, optional): Compression level; see DEFAULT_LEVELS.
+
+    Returns:
+        file: Buffered binary file.
+    """
+    if codec is None:
+        return open(path, 'wb')
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    writer = BGZFWriter(open(path, 'wb'), level) if codec == 'gzip' else ZstdFrameWriter(open(path, 'wb'), level)
+    return io.BufferedWriter(writer, READ_SIZE)
+
+def benchmark(paths, codecs=('gzip', 'zstd'), workers=None, repeat=3):
+    """
+    Measure compression ratio and decompression speed of data files per codec.
+
+    Each file is compressed with every codec into a temporary file, then
+    read back whole in parallel (`input_buffer`) and streamed through a
+    background thread (`open_input`). The best of `repeat` runs is reported.
+
+    Parameters:
+        paths (list): Uncompressed data files.
+        codecs (tuple): Codecs to compare; codecs whose package is missing are skipped.
+        workers (int, optional): Decompression threads for whole-file reads.
+        repeat (int): Runs per measurement.
+
+    Returns:
+        dict: Codecs mapped to compressed size, ratio and MB/s of each read mode.
+    """
+    raw_bytes = sum(os.path.getsize(path) for path in paths)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for codec in codecs:
+            try:
+                compressed = []
+                start_time = time.perf_counter()
+                for path in paths:
+                    target = os.path.join(tmp_dir, os.path.basename(path) + CODEC_SUFFIXES[codec])
+                    with open(path, 'rb') as source, open_output(target, codec) as f:
+                        for chunk in iter(lambda: source.read(READ_SIZE), b''):
+                            f.write(chunk)
+                    compressed.append(target)
+                compress_seconds = time.perf_counter() - start_time
+            except ImportError as e:
+                logging.warning(f"Skipping {codec}: {e}")
+                continue
+
+            def whole():
+                for target in compressed:
+                    with input_buffer(target, workers):
+                        pass
+
+            def streamed():
+                for target in compressed:
+                    with open_input(target) as f:
+                        while f.read(READ_SIZE):
+                            pass
+
+            compressed_bytes = sum(os.path.getsize(target) for target in compressed)
+            results[codec] = {
+                'raw_mb': round(raw_bytes / 1e6, 2),
+                'compressed_mb': round(compressed_bytes / 1e6, 2),
+                'ratio': round(raw_bytes / compressed_bytes, 2) if compressed_bytes else None,
+                'compress_mb_per_second': round(throughput(raw_bytes, compress_seconds), 1),
+            }
+            for mode, read in (('parallel', whole), ('streamed', streamed)):
+                seconds = []
+                for _ in range(repeat):
+                    start_time = time.perf_counter()
+                    read()
+                    seconds.append(time.perf_counter() - start_time)
+                results[codec][f"{mode}_mb_per_second"] = round(throughput(raw_bytes, min(seconds)), 1)
+    return results
+
+if __name__ == '__main__':
+    # Configure command-line arguments
+    parser = argparse.ArgumentParser(description='Compare compression codecs for AdvertiseX data files')
+    parser.add_argument('paths', nargs='+', help='Uncompressed data files')
+    parser.add_argument('--codecs', nargs='+', choices=list(CODEC_SUFFIXES), default=list(CODEC_SUFFIXES), help='Codecs to compare')
+    parser.add_argument('--workers', type=int, help='Decompression threads (default: CPU count)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    print(json.dumps(benchmark(args.paths, tuple(args.codecs), args.workers, args.repeat), indent=2))
@@ -0,0 +1,252 @@
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+DEFAULT_WINDOW = '1h'
+DEFAULT_BUCKET = '1min'
+DEFAULT_FP_RATE = 0.001
+DEFAULT_BUCKET_CAPACITY = 100000
+
+# Columns identifying an event, per source; the first set fully present in a frame is used
+DEDUP_KEYS = {
+    'bid_requests': ['auction_id', 'user_id'],
+    'ad_impressions': ['timestamp', 'user_id', 'ad_creative_id'],
+    'clicks_conversions': ['timestamp', 'user_id', 'ad_campaign_id', 'conversion_type'],
+}
+
+def infer_keys(df):
+    """
+    Get the event key columns of a processed DataFrame.
+
+    Parameters:
+        df (pandas.DataFrame): Processed events.
+
+    Returns:
+        list: Key columns from DEDUP_KEYS, or every column if no source matches.
+    """
+    for keys in DEDUP_KEYS.values():
+        if all(column in df.columns for column in keys):
+            return keys
+    return list(df.columns)
+
+def hash_rows(df, keys):
+    """
+    Hash the key columns of every row to an unsigned 64-bit integer.
+
+    Parameters:
+        df (pandas.DataFrame): Events.
+        keys (list): Key columns.
+
+    Returns:
+        numpy.ndarray: uint64 row hashes.
+    """
+    return pd.util.hash_pandas_object(df[keys], index=False).to_numpy()
+
+class BloomFilter:
+    """
+    Bloom filter over 64-bit hashes, sized for a capacity and false-positive rate.
+
+    Membership tests never miss an added hash and wrongly report a new one
+    with probability about `fp_rate` while at most `capacity` hashes are added.
+    """
+
+    def __init__(self, capacity=DEFAULT_BUCKET_CAPACITY, fp_rate=DEFAULT_FP_RATE):
+        """
+        Parameters:
+            capacity (int): Expected number of hashes.
+            fp_rate (float): Target false-positive rate at capacity.
+        """
+        self.num_bits = max(8, int(np.ceil(-capacity * np.log(fp_rate) / np.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * np.log(2))))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def positions(self, hashes):
+        """Get the bit positions of each hash, by double hashing."""
+        low = (hashes & np.uint64(0xFFFFFFFF)).astype(np.int64)
+        high = (hashes >> np.uint64(32)).astype(np.int64) | 1
+        return [(low + i * high) % self.num_bits for i in range(self.num_hashes)]
+
+    def contains_many(self, hashes):
+        """
+        Test hashes for membership.
+
+        Parameters:
+            hashes (numpy.ndarray): uint64 hashes.
+
+        Returns:
+            numpy.ndarray: Boolean mask, True where the hash was probably added.
+        """
+        found = np.ones(len(hashes), dtype=bool)
+        for position in self.positions(hashes):
+            found &= (self.bits[position >> 3] >> (position & 7).astype(np.uint8)) & 1 == 1
+        return found
+
+    def add_many(self, hashes):
+        """Add hashes to the filter."""
+        for position in self.positions(hashes):
+            np.bitwise_or.at(self.bits, position >> 3, (1 << (position & 7)).astype(np.uint8))
+        self.count += len(hashes)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+class HashSet:
+    """Exact set of 64-bit hashes, kept as a sorted array."""
+
+    def __init__(self):
+        self.hashes = np.empty(0, dtype=np.uint64)
+
+    def contains_many(self, hashes):
+        return np.isin(hashes, self.hashes)
+
+    def add_many(self, hashes):
+        self.hashes = np.union1d(self.hashes, hashes)
+
+    @property
+    def count(self):
+        return len(self.hashes)
+
+    @property
+    def nbytes(self):
+        return self.hashes.nbytes
+
+class StreamingDeduplicator:
+    """
+    Drop repeated events across batches and files within a time window.
+
+    Events are identified by a 64-bit hash of their key columns and remembered
+    in buckets by event time. Buckets older than the window, measured from
+    the latest event time seen (the watermark), are evicted, so memory is
+    bounded by the number of events per window rather than by the whole
+    stream. Each bucket is an exact hash set, or a Bloom filter trading a
+    configurable false-positive rate (new events wrongly dropped) for a
+    fixed size. Events older than the window can no longer be checked and
+    are passed through and counted as late.
+    """
+
+    def __init__(self, keys=None, time_column='timestamp', window=DEFAULT_WINDOW, bucket=DEFAULT_BUCKET,
+                 method='hashset', fp_rate=DEFAULT_FP_RATE, bucket_capacity=DEFAULT_BUCKET_CAPACITY):
+        """
+        Parameters:
+            keys (list, optional): Key columns; inferred from the first batch by default.
+            time_column (str): Event time column. Frames without it are bucketed by arrival time.
+            window (str): How long an event is remembered, e.g. '1h'.
+            bucket (str): Time span of one bucket, e.g. '1min'.
+            method (str): 'hashset' (exact) or 'bloom'.
+            fp_rate (float): False-positive rate of each Bloom filter.
+            bucket_capacity (int): Events per bucket each Bloom filter is sized for.
+        """
+        if method not in ('hashset', 'bloom'):
+            raise ValueError(f"Unknown deduplication method: {method}")
+        self.keys = keys
+        self.time_column = time_column
+        self.window = pd.Timedelta(window)
+        self.bucket = pd.Timedelta(bucket)
+        self.method = method
+        self.fp_rate = fp_rate
+        self.bucket_capacity = bucket_capacity
+        self.buckets = {}
+        self.watermark = None
+        self.rows_seen = 0
+        self.duplicates_dropped = 0
+        self.late_rows = 0
+
+    def new_bucket(self):
+        if self.method == 'bloom':
+            return BloomFilter(self.bucket_capacity, self.fp_rate)
+        return HashSet()
+
+    def event_buckets(self, df):
+        """Get the bucket start of every row, by event time or, without one, by arrival time."""
+        if self.time_column in df.columns:
+            times = pd.to_datetime(df[self.time_column])
+        else:
+            times = pd.Series(pd.Timestamp(time.time(), unit='s'), index=df.index)
+        return times.dt.floor(self.bucket)
+
+    def deduplicate(self, df):
+        """
+        Drop events seen earlier in this batch or in previous batches within the window.
+
+        Parameters:
+            df (pandas.DataFrame): Batch of events.
+
+        Returns:
+            pandas.DataFrame: The batch without duplicates, in its original order.
+        """
+        if df.empty:
+            return df
+        if self.keys is None:
+            self.keys = infer_keys(df)
+        hashes = hash_rows(df, self.keys)
+        buckets = self.event_buckets(df)
+        keep = ~pd.Series(hashes).duplicated().to_numpy()
+        # Rows without an event time cannot be placed in the window; keep them
+        known_time = buckets.notna().to_numpy()
+
+        # Only events behind the watermark of earlier batches are late; a batch
+        # spanning more than the window is still deduplicated in full
+        if self.watermark is not None:
+            late = known_time & (buckets < self.watermark - self.window).to_numpy()
+        else:
+            late = np.zeros(len(df), dtype=bool)
+
+        codes, starts = pd.factorize(buckets)
+        for code, start in enumerate(starts):
+            rows = (codes == code) & keep & ~late
+            if not rows.any():
+                continue
+            bucket = self.buckets.get(start)
+            if bucket is None:
+                bucket = self.buckets[start] = self.new_bucket()
+            seen = bucket.contains_many(hashes[rows])
+            indexes = np.flatnonzero(rows)
+            keep[indexes[seen]] = False
+            bucket.add_many(hashes[indexes[~seen]])
+
+        latest = buckets.max()
+        if pd.notna(latest) and (self.watermark is None or latest > self.watermark):
+            self.watermark = latest
+        self.evict()
+        self.rows_seen += len(df)
+        self.duplicates_dropped += int((~keep).sum())
+        self.late_rows += int(late.sum())
+        return df[keep]
+
+    def evict(self):
+        """Forget buckets that ended before the window."""
+        if self.watermark is None:
+            return
+        horizon = self.watermark - self.window
+        for start in [start for start in self.buckets if start + self.bucket <= horizon]:
+            del self.buckets[start]
+
+    @property
+    def memory_bytes(self):
+        """Bytes used by the remembered hashes."""
+        return sum(bucket.nbytes for bucket in self.buckets.values())
+
+    def stats(self):
+        """
+        Get deduplication statistics.
+
+        Returns:
+            dict: Rows seen, duplicates dropped, late rows, remembered events,
+            open buckets and memory used.
+        """
+        return {
+            'rows_seen': self.rows_seen,
+            'duplicates_dropped': self.duplicates_dropped,
+            'late_rows': self.late_rows,
+            'remembered': sum(bucket.count for bucket in self.buckets.values()),
+            'buckets': len(self.buckets),
+            'memory_bytes': self.memory_bytes,
+        }
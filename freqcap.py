@@ -0,0 +1,498 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from schemas import infer_source
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+DEFAULT_WINDOWS = ['10min', '1h', '24h']
+DEFAULT_BUCKETS = 12  # Ring-buffer buckets per window; a window's resolution is its length / buckets
+DEFAULT_TTL = '24h'
+DEFAULT_MAX_KEYS = 2000000
+INITIAL_CAPACITY = 1024
+EVENTS = ('impressions', 'clicks')
+# Sources counted by the store, with the event their rows count as
+SOURCE_EVENTS = {'ad_impressions': 'impressions', 'clicks_conversions': 'clicks'}
+# Campaign id under which a user's events across all campaigns are counted
+ALL_CAMPAIGNS = -1
+# Counters saturate instead of wrapping around
+COUNTER_MAX = np.iinfo(np.uint16).max
+# Last-seen time and last bucket of a slot that holds no key
+NEVER = np.iinfo(np.int64).min // 2
+
+# Function to pack user and campaign ids into one int64 key per event
+def pack_keys(user_ids, campaign_ids):
+    return (np.asarray(user_ids, dtype=np.int64) << 32) | (np.asarray(campaign_ids, dtype=np.int64) & 0xFFFFFFFF)
+
+# Function to convert timestamps to epoch seconds
+def to_seconds(timestamp):
+    return int(pd.Timestamp(timestamp).value // 10**9) if not isinstance(timestamp, (int, np.integer)) else int(timestamp)
+
+class FrequencyCapStore:
+    """
+    In-process per-user, per-campaign impression and click counts over sliding windows.
+
+    Every key (a user and a campaign, or a user across all campaigns) owns a
+    slot in preallocated NumPy arrays: a ring of `buckets` counters per
+    window and event, the last bucket each ring was advanced to, and the
+    time the key was last seen. Updates are vectorized per batch; rings are
+    rotated lazily, clearing only the buckets that fell out of the window,
+    so idle keys cost nothing until they are touched again. Window counts
+    are exact at bucket resolution: a '1h' window with 12 buckets covers
+    the current 5-minute bucket and the 11 before it.
+
+    Memory is bounded by `max_keys`: keys idle for longer than `ttl` are
+    evicted as time advances, and when the store is full the least recently
+    seen keys make room for new ones.
+    """
+
+    def __init__(self, windows=DEFAULT_WINDOWS, buckets=DEFAULT_BUCKETS, ttl=DEFAULT_TTL, max_keys=DEFAULT_MAX_KEYS,
+                 user_totals=True, creative_campaigns=None, initial_capacity=INITIAL_CAPACITY):
+        """
+        Parameters:
+            windows (list): Window lengths as pandas offsets, e.g. ['10min', '1h', '24h'].
+            buckets (int): Ring-buffer buckets per window; each window must split into whole seconds.
+            ttl (str): Idle time after which a key is evicted.
+            max_keys (int): Maximum number of keys held.
+            user_totals (bool): Also count every user's events across all campaigns.
+            creative_campaigns (dict or pandas.Series, optional): Creative ids mapped to
+                campaign ids, used for impressions, which carry no campaign. Without it
+                impressions only count towards the user totals.
+            initial_capacity (int): Slots allocated up front; the arrays grow by doubling.
+        """
+        self.windows = list(windows)
+        seconds = np.array([int(pd.Timedelta(window).total_seconds()) for window in self.windows], dtype=np.int64)
+        if (seconds % buckets).any() or (seconds < buckets).any():
+            raise ValueError(f"Windows {self.windows} do not split into {buckets} buckets of whole seconds")
+        self.buckets = buckets
+        self.widths = seconds // buckets
+        self.ttl = int(pd.Timedelta(ttl).total_seconds())
+        self.max_keys = max_keys
+        self.user_totals = user_totals
+        self.creative_campaigns = None if creative_campaigns is None else pd.Series(creative_campaigns)
+        # Per counter position: its window, its place in the ring and the window's first position
+        self.window_of = np.repeat(np.arange(len(self.windows)), buckets)
+        self.position = np.tile(np.arange(buckets), len(self.windows))
+        self.window_starts = np.arange(len(self.windows)) * buckets
+
+        self.index = {}
+        self.free = []
+        self.size = 0
+        self.capacity = 0
+        self.keys = np.empty(0, dtype=np.int64)
+        self.last_seen = np.empty(0, dtype=np.int64)
+        self.last_bucket = np.empty((0, len(self.windows)), dtype=np.int64)
+        self.counts = np.empty((0, len(EVENTS), len(self.windows) * buckets), dtype=np.uint16)
+        self.grow(min(initial_capacity, max_keys))
+        self.watermark = None
+        self.next_expiry = None
+        self.current = None
+        # Updates come from the consumer's writer thread while bidders look keys up
+        self.lock = threading.RLock()
+        self.totals = {'events': 0, 'late': 0, 'expired': 0, 'evicted': 0}
+
+    def grow(self, capacity):
+        """Reallocate the slot arrays to hold `capacity` keys."""
+        def resized(array, fill):
+            new = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            new[:len(array)] = array
+            return new
+
+        self.keys = resized(self.keys, 0)
+        self.last_seen = resized(self.last_seen, NEVER)
+        self.last_bucket = resized(self.last_bucket, NEVER)
+        self.counts = resized(self.counts, 0)
+        self.capacity = capacity
+
+    def __len__(self):
+        return len(self.index)
+
+    def allocate(self, keys, protect=None):
+        """
+        Assign empty slots to new keys, evicting the least recently seen keys when full.
+
+        Parameters:
+            keys (numpy.ndarray): Distinct packed keys not in the store.
+            protect (numpy.ndarray, optional): Slots that must not be evicted, e.g.
+                those of the other keys in the same batch.
+
+        Returns:
+            numpy.ndarray: Their slots.
+        """
+        needed = len(keys)
+        shortfall = needed - (len(self.free) + self.max_keys - self.size)
+        if shortfall > 0:
+            candidates = self.last_seen[:self.size] > NEVER
+            if protect is not None:
+                candidates[protect] = False
+            used = np.flatnonzero(candidates)
+            if len(used) < shortfall:
+                raise ValueError(f"A batch with {needed} distinct keys does not fit in max_keys={self.max_keys}")
+            oldest = used[np.argpartition(self.last_seen[used], shortfall - 1)[:shortfall]]
+            self.evict(oldest)
+            self.totals['evicted'] += len(oldest)
+
+        reused = min(len(self.free), needed)
+        slots = np.empty(needed, dtype=np.int64)
+        slots[:reused] = self.free[len(self.free) - reused:]
+        del self.free[len(self.free) - reused:]
+        if reused < needed:
+            end = self.size + needed - reused
+            if end > self.capacity:
+                self.grow(min(self.max_keys, max(end, 2 * self.capacity)))
+            slots[reused:] = np.arange(self.size, end)
+            self.size = end
+
+        self.keys[slots] = keys
+        self.last_bucket[slots] = NEVER
+        self.counts[slots] = 0
+        self.index.update(zip(keys.tolist(), slots.tolist()))
+        return slots
+
+    def evict(self, slots):
+        """Remove the keys in some slots and free the slots."""
+        for key in self.keys[slots].tolist():
+            del self.index[key]
+        self.last_seen[slots] = NEVER
+        self.free.extend(slots.tolist())
+
+    def expire(self, now=None):
+        """
+        Evict keys idle for longer than the TTL.
+
+        Parameters:
+            now (int or timestamp, optional): Current time; the latest event time by default.
+
+        Returns:
+            int: Number of keys evicted.
+        """
+        with self.lock:
+            now = self.watermark if now is None else to_seconds(now)
+            if now is None:
+                return 0
+            last_seen = self.last_seen[:self.size]
+            expired = np.flatnonzero((last_seen > NEVER) & (last_seen < now - self.ttl))
+            self.evict(expired)
+            self.totals['expired'] += len(expired)
+            # Nothing else can expire before a TTL fraction has passed
+            self.next_expiry = now + max(1, self.ttl // 10)
+            return len(expired)
+
+    def event_columns(self, df, source):
+        """Get the user ids, campaign ids (NaN when unknown) and epoch seconds of processed rows."""
+        users = pd.to_numeric(df['user_id'], errors='coerce')
+        timestamps = pd.to_datetime(df['timestamp'], errors='coerce')
+        if 'ad_campaign_id' in df.columns:
+            campaigns = pd.to_numeric(df['ad_campaign_id'], errors='coerce')
+        elif self.creative_campaigns is not None and 'ad_creative_id' in df.columns:
+            campaigns = df['ad_creative_id'].map(self.creative_campaigns)
+        else:
+            campaigns = pd.Series(np.nan, index=df.index)
+        valid = (users.notna() & timestamps.notna()).to_numpy()
+        seconds = timestamps[valid].to_numpy(dtype='datetime64[s]').astype(np.int64)
+        return users[valid].to_numpy(dtype=np.int64), campaigns[valid].to_numpy(dtype=np.float64, na_value=np.nan), seconds
+
+    def update(self, df, source=None):
+        """
+        Count a processed batch of ad impressions or clicks.
+
+        Parameters:
+            df (pandas.DataFrame): Processed impressions or clicks/conversions.
+            source (str, optional): Source of the rows; inferred from the columns by default.
+
+        Returns:
+            int: Number of events counted.
+        """
+        source = source or infer_source(df)
+        if source not in SOURCE_EVENTS:
+            raise ValueError(f"Frequency caps count {list(SOURCE_EVENTS)}, not {source}")
+        users, campaigns, seconds = self.event_columns(df, source)
+        return self.add(SOURCE_EVENTS[source], users, campaigns, seconds)
+
+    def add(self, event, user_ids, campaign_ids, seconds):
+        """
+        Count events given as arrays.
+
+        Parameters:
+            event (str): 'impressions' or 'clicks'.
+            user_ids (numpy.ndarray): User id per event.
+            campaign_ids (numpy.ndarray or None): Campaign id per event, NaN when unknown.
+            seconds (numpy.ndarray): Event time per event, in epoch seconds.
+
+        Returns:
+            int: Number of events counted.
+        """
+        with self.lock:
+            event_index = EVENTS.index(event)
+            user_ids = np.asarray(user_ids, dtype=np.int64)
+            seconds = np.asarray(seconds, dtype=np.int64)
+            keys, times = [], []
+            if campaign_ids is not None:
+                known = ~np.isnan(np.asarray(campaign_ids, dtype=np.float64))
+                keys.append(pack_keys(user_ids[known], np.asarray(campaign_ids)[known]))
+                times.append(seconds[known])
+            if self.user_totals:
+                keys.append(pack_keys(user_ids, ALL_CAMPAIGNS))
+                times.append(seconds)
+            if not keys or not sum(map(len, keys)):
+                return 0
+            keys, seconds = np.concatenate(keys), np.concatenate(times)
+
+            latest = int(seconds.max())
+            self.watermark = latest if self.watermark is None else max(self.watermark, latest)
+            if self.next_expiry is None or self.watermark >= self.next_expiry:
+                self.expire()
+
+            unique_keys, inverse = np.unique(keys, return_inverse=True)
+            get = self.index.get
+            unique_slots = np.fromiter((get(key, -1) for key in unique_keys.tolist()), np.int64, len(unique_keys))
+            missing = unique_slots < 0
+            if missing.any():
+                unique_slots[missing] = self.allocate(unique_keys[missing], unique_slots[~missing])
+            key_latest = np.full(len(unique_keys), NEVER, dtype=np.int64)
+            np.maximum.at(key_latest, inverse, seconds)
+            self.last_seen[unique_slots] = np.maximum(self.last_seen[unique_slots], key_latest)
+
+            slots = unique_slots[inverse]
+            ring = np.arange(self.buckets)
+            for window, width in enumerate(self.widths):
+                ring_columns = slice(window * self.buckets, (window + 1) * self.buckets)
+                # Advance every touched ring to its newest bucket, clearing the buckets that fell out
+                old_last = self.last_bucket[unique_slots, window]
+                new_last = np.maximum(old_last, key_latest // width)
+                held = old_last[:, None] - (old_last[:, None] - ring) % self.buckets
+                stale = held <= new_last[:, None] - self.buckets
+                block = self.counts[unique_slots, :, ring_columns]
+                block[np.broadcast_to(stale[:, None, :], block.shape)] = 0
+                self.counts[unique_slots, :, ring_columns] = block
+                self.last_bucket[unique_slots, window] = new_last
+
+                # Events older than their key's ring are too late for this window
+                buckets = seconds // width
+                live = buckets > new_last[inverse] - self.buckets
+                if window == len(self.widths) - 1:
+                    self.totals['late'] += int((~live).sum())
+                cells, added = np.unique(slots[live] * self.buckets + buckets[live] % self.buckets, return_counts=True)
+                rows, columns = cells // self.buckets, window * self.buckets + cells % self.buckets
+                self.counts[rows, event_index, columns] = np.minimum(
+                    self.counts[rows, event_index, columns].astype(np.int64) + added, COUNTER_MAX,
+                )
+            self.totals['events'] += len(user_ids)
+            return len(user_ids)
+
+    def window_counts(self, slots, now=None):
+        """
+        Sum the live buckets of one or more slots.
+
+        Parameters:
+            slots (int or numpy.ndarray): Slot, or slots, to read.
+            now (int or timestamp, optional): Time the windows end at; the latest event time by default.
+
+        Returns:
+            numpy.ndarray: Counts of shape (events, windows), or (slots, events, windows).
+        """
+        now = self.watermark if now is None else to_seconds(now)
+        if now is None:
+            return np.zeros(np.shape(slots) + (len(EVENTS), len(self.windows)), dtype=np.int64)
+        if self.current is None or self.current[0] != now:
+            # Bucket bounds per counter position, reused while `now` stays the same
+            current = (now // self.widths)[self.window_of]
+            self.current = (now, current - self.buckets, current)
+        _, oldest, newest = self.current
+        last = self.last_bucket[slots][..., self.window_of]
+        held = last - (last - self.position) % self.buckets
+        live = (held > oldest) & (held <= newest)
+        return np.add.reduceat(self.counts[slots] * live[..., None, :], self.window_starts, axis=-1, dtype=np.int64)
+
+    def lookup(self, user_id, campaign_id=None, now=None):
+        """
+        Get a user's impression and click counts per window.
+
+        Parameters:
+            user_id (int): User id.
+            campaign_id (int, optional): Campaign id; the user's totals across campaigns by default.
+            now (int or timestamp, optional): Time the windows end at; the latest event time by default.
+
+        Returns:
+            dict: Windows mapped to {'impressions': n, 'clicks': n}.
+        """
+        with self.lock:
+            key = (int(user_id) << 32) | ((ALL_CAMPAIGNS if campaign_id is None else int(campaign_id)) & 0xFFFFFFFF)
+            slot = self.index.get(key)
+            if slot is None:
+                return {window: dict.fromkeys(EVENTS, 0) for window in self.windows}
+            counts = self.window_counts(slot, now).tolist()
+            return {
+                window: {event: counts[event_index][window_index] for event_index, event in enumerate(EVENTS)}
+                for window_index, window in enumerate(self.windows)
+            }
+
+    def lookup_many(self, user_ids, campaign_ids=None, now=None):
+        """
+        Get impression and click counts per window for many users at once.
+
+        Parameters:
+            user_ids (array-like): User ids.
+            campaign_ids (array-like, optional): Campaign id per user; user totals by default.
+            now (int or timestamp, optional): Time the windows end at; the latest event time by default.
+
+        Returns:
+            pandas.DataFrame: One row per query with '<event>_<window>' columns.
+        """
+        with self.lock:
+            user_ids = np.asarray(user_ids, dtype=np.int64)
+            campaign_ids = np.full(len(user_ids), ALL_CAMPAIGNS) if campaign_ids is None else campaign_ids
+            get = self.index.get
+            slots = np.fromiter((get(key, -1) for key in pack_keys(user_ids, campaign_ids).tolist()), np.int64, len(user_ids))
+            found = slots >= 0
+            counts = np.zeros((len(user_ids), len(EVENTS), len(self.windows)), dtype=np.int64)
+            counts[found] = self.window_counts(slots[found], now)
+            return pd.DataFrame(
+                counts.reshape(len(user_ids), -1),
+                columns=[f"{event}_{window}" for event in EVENTS for window in self.windows],
+            )
+
+    def stats(self):
+        """
+        Get store statistics.
+
+        Returns:
+            dict: Keys held, allocated slots, array and index memory, and the
+            counts of events, late events and evicted keys.
+        """
+        array_bytes = self.keys.nbytes + self.last_seen.nbytes + self.last_bucket.nbytes + self.counts.nbytes
+        return dict(self.totals, keys=len(self.index), capacity=self.capacity,
+                    memory_bytes=array_bytes + sys.getsizeof(self.index), watermark=self.watermark)
+
+    def snapshot(self, path):
+        """
+        Write the store to a .npz file, atomically replacing any previous snapshot.
+
+        Parameters:
+            path (str): Snapshot file.
+        """
+        with self.lock:
+            used = np.flatnonzero(self.last_seen[:self.size] > NEVER)
+            config = {'windows': self.windows, 'buckets': self.buckets, 'ttl': f"{self.ttl}s",
+                      'max_keys': self.max_keys, 'user_totals': self.user_totals}
+            mapping = self.creative_campaigns if self.creative_campaigns is not None else pd.Series(dtype=np.int64)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f, config=np.array(json.dumps(config)), keys=self.keys[used], last_seen=self.last_seen[used],
+                    last_bucket=self.last_bucket[used], counts=self.counts[used],
+                    watermark=np.array(NEVER if self.watermark is None else self.watermark, dtype=np.int64),
+                    creatives=mapping.index.to_numpy(dtype=np.int64), campaigns=mapping.to_numpy(dtype=np.int64),
+                )
+            os.replace(tmp_path, path)
+            logging.info(f"Wrote frequency caps snapshot of {len(used)} keys to {path}")
+
+    @classmethod
+    def restore(cls, path):
+        """
+        Load a store written by `snapshot`.
+
+        Parameters:
+            path (str): Snapshot file.
+
+        Returns:
+            FrequencyCapStore: The store.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            config = json.loads(str(data['config']))
+            creatives = pd.Series(data['campaigns'], index=data['creatives'])
+            store = cls(**config, creative_campaigns=creatives if len(creatives) else None,
+                        initial_capacity=max(len(data['keys']), INITIAL_CAPACITY))
+            size = len(data['keys'])
+            store.keys[:size] = data['keys']
+            store.last_seen[:size] = data['last_seen']
+            store.last_bucket[:size] = data['last_bucket']
+            store.counts[:size] = data['counts']
+            watermark = int(data['watermark'])
+        store.size = size
+        store.index = dict(zip(store.keys[:size].tolist(), range(size)))
+        store.watermark = None if watermark == NEVER else watermark
+        logging.info(f"Restored frequency caps snapshot of {size} keys from {path}")
+        return store
+
+# Function to benchmark updates and lookups on synthetic events
+def benchmark(users=1000000, events=5000000, campaigns=10, batch_size=100000, lookups=100000, seed=0, **options):
+    """
+    Measure update and lookup throughput of a FrequencyCapStore.
+
+    Events are spread over a day for `users` users with Zipf-skewed
+    activity, fed in batches of `batch_size`, then looked up in one batch
+    and one at a time.
+
+    Parameters:
+        users (int): Distinct users.
+        events (int): Events to count, half impressions and half clicks.
+        campaigns (int): Distinct campaigns.
+        batch_size (int): Events per update.
+        lookups (int): Queries for the lookup measurements.
+        seed (int): Random seed.
+        **options: FrequencyCapStore settings.
+
+    Returns:
+        dict: Updates per second, batched and single lookups per second,
+        single lookup latency percentiles (microseconds) and store statistics.
+    """
+    rng = np.random.default_rng(seed)
+    store = FrequencyCapStore(**{'max_keys': users * (campaigns + 1), **options})
+    user_ids = rng.permutation(users)[np.minimum(rng.zipf(1.2, events), users) - 1]
+    campaign_ids = rng.integers(1, campaigns + 1, events)
+    start = pd.Timestamp('2024-04-01').value // 10**9
+    seconds = start + np.sort(rng.integers(0, 86400, events))
+
+    start_time = time.perf_counter()
+    for begin in range(0, events, batch_size):
+        end = min(begin + batch_size, events)
+        store.add(EVENTS[(begin // batch_size) % 2], user_ids[begin:end], campaign_ids[begin:end], seconds[begin:end])
+    update_seconds = time.perf_counter() - start_time
+
+    queries = user_ids[rng.integers(0, events, lookups)]
+    query_campaigns = rng.integers(1, campaigns + 1, lookups)
+    start_time = time.perf_counter()
+    store.lookup_many(queries, query_campaigns)
+    batch_seconds = time.perf_counter() - start_time
+
+    latencies = np.empty(min(lookups, 20000))
+    for i in range(len(latencies)):
+        query_start = time.perf_counter()
+        store.lookup(queries[i], query_campaigns[i])
+        latencies[i] = time.perf_counter() - query_start
+    return {
+        'updates_per_second': round(events / update_seconds, 1),
+        'batched_lookups_per_second': round(lookups / batch_seconds, 1),
+        'single_lookups_per_second': round(len(latencies) / latencies.sum(), 1),
+        'lookup_p50_us': round(float(np.percentile(latencies, 50)) * 1e6, 2),
+        'lookup_p99_us': round(float(np.percentile(latencies, 99)) * 1e6, 2),
+        **store.stats(),
+    }
+
+if __name__ == '__main__':
+    # Configure command-line arguments
+    parser = argparse.ArgumentParser(description='Benchmark the frequency-capping state store')
+    parser.add_argument('--users', type=int, default=1000000, help='Distinct users')
+    parser.add_argument('--events', type=int, default=5000000, help='Events to count')
+    parser.add_argument('--campaigns', type=int, default=10, help='Distinct campaigns')
+    parser.add_argument('--batch-size', type=int, default=100000, help='Events per update')
+    parser.add_argument('--lookups', type=int, default=100000, help='Queries per lookup measurement')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = benchmark(args.users, args.events, args.campaigns, args.batch_size, args.lookups)
+    logging.info(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -1,109 +1,324 @@
+import hashlib
+import io
 import json
 import csv
-import random
-from datetime import datetime, timedelta
+import argparse
+from datetime import datetime
 import fastavro
-import io
+import numpy as np
 import os
 import logging
+from decompress import CODEC_SUFFIXES, open_output
+from schemas import AD_IMPRESSION_SCHEMA, BID_REQUEST_SCHEMA, CLICK_CONVERSION_SCHEMA
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 
 # Define constants
 DATA_DIR = 'data/'
+DEFAULT_SEED = 42
+DEFAULT_ROWS = 1000
+DEFAULT_CHUNK_SIZE = 100000
+AVRO_CODECS = ('null', 'deflate', 'snappy')
+START_DATE = datetime(2023, 1, 1)
+END_DATE = datetime(2023, 12, 31)
+
+# Shape of the generated data
+DEFAULT_CONFIG = {
+    'min_user_id': 10000,
+    'num_users': 90000,
+    'num_creatives': 1000,
+    'num_campaigns': 10,
+    'num_websites': 10,
+    'zipf_exponent': 1.1,       # Skew of user, creative, campaign and website popularity
+    'duplicate_rate': 0.01,     # Fraction of events delivered twice
+    'late_rate': 0.02,          # Fraction of events arriving out of order
+    'max_lateness_seconds': 3600,
+}
+
+# Output file name, format and schema per source
+SOURCES = {
+    'ad_impressions': ('json', AD_IMPRESSION_SCHEMA),
+    'clicks_conversions': ('csv', CLICK_CONVERSION_SCHEMA),
+    'bid_requests': ('avro', BID_REQUEST_SCHEMA),
+}
+
+# Function to build a sampler of Zipf-distributed ids
+def zipf_sampler(rng, num_ids, exponent, first_id=1, seed=DEFAULT_SEED):
+    """
+    Build a sampler drawing ids from a finite Zipf distribution.
+
+    Ranks are shuffled over the id range, so the most popular ids are not
+    simply the smallest ones. The shuffle depends only on `seed`, so the same
+    users are popular in every source and shard.
+
+    Parameters:
+        rng (numpy.random.Generator): Random generator.
+        num_ids (int): Number of distinct ids.
+        exponent (float): Zipf exponent; larger values mean more skew.
+        first_id (int): Smallest id.
+        seed (int): Seed of the popularity ranking.
+
+    Returns:
+        callable: Function taking a sample size and returning an int array of ids.
+    """
+    weights = 1.0 / np.arange(1, num_ids + 1) ** exponent
+    cdf = np.cumsum(weights / weights.sum())
+    ids = np.random.default_rng([seed, num_ids]).permutation(num_ids) + first_id
+
+    def sample(size):
+        return ids[np.minimum(np.searchsorted(cdf, rng.random(size)), num_ids - 1)]
+    return sample
+
+# Function to generate time-ordered event timestamps with some late arrivals
+def event_timestamps(rng, start, end, count, config):
+    """
+    Generate increasing event timestamps between two dates, with late events.
+
+    Inter-arrival gaps are exponential, so timestamps are ordered as they
+    would be in a log; a `late_rate` fraction is then moved back by up to
+    `max_lateness_seconds` to simulate events arriving out of order.
+
+    Parameters:
+        rng (numpy.random.Generator): Random generator.
+        start (numpy.datetime64): First possible timestamp.
+        end (numpy.datetime64): Last possible timestamp.
+        count (int): Number of timestamps.
+        config (dict): Generator configuration.
+
+    Returns:
+        list: Timestamps formatted as 'YYYY-MM-DD HH:MM:SS'.
+    """
+    span = (end - start) / np.timedelta64(1, 's')
+    seconds = np.cumsum(rng.exponential(span / max(count, 1), count))
+    seconds = np.minimum(seconds, span)
+    late = rng.random(count) < config['late_rate']
+    seconds[late] -= rng.uniform(0, config['max_lateness_seconds'], late.sum())
+    timestamps = start + np.maximum(seconds, 0).astype('timedelta64[s]')
+    return np.char.replace(np.datetime_as_string(timestamps, unit='s'), 'T', ' ').tolist()
+
+# Function to duplicate a fraction of the events
+def add_duplicates(rng, records, config):
+    """
+    Replace a fraction of records with a copy of the record before them.
+
+    Parameters:
+        rng (numpy.random.Generator): Random generator.
+        records (list): Records to modify in place.
+        config (dict): Generator configuration.
 
-# Function to generate random timestamp
-def random_timestamp(start_date, end_date):
-    delta = end_date - start_date
-    random_days = random.randint(0, delta.days)
-    random_hours = random.randint(0, 23)
-    random_minutes = random.randint(0, 59)
-    random_seconds = random.randint(0, 59)
-    return start_date + timedelta(days=random_days, hours=random_hours, minutes=random_minutes, seconds=random_seconds)
+    Returns:
+        list: The same records.
+    """
+    for index in np.flatnonzero(rng.random(len(records)) < config['duplicate_rate']):
+        if index > 0:
+            records[index] = dict(records[index - 1])
+    return records
 
 # Function to generate ad impressions data
-def generate_ad_impressions_data(num_entries):
-    data = []
-    for _ in range(num_entries):
-        ad_impression = {
-            "ad_creative_id": random.randint(1, 1000),
-            "user_id": random.randint(10000, 99999),
-            "timestamp": random_timestamp(datetime(2023, 1, 1), datetime(2023, 12, 31)).strftime('%Y-%m-%d %H:%M:%S'),
-            "website_url": f"http://example{random.randint(1, 10)}.com/path/{random.randint(1, 100)}"
+def generate_ad_impressions_data(rng, start, end, count, config, first_index=0):
+    users = zipf_sampler(rng, config['num_users'], config['zipf_exponent'], config['min_user_id'], config['seed'])
+    creatives = zipf_sampler(rng, config['num_creatives'], config['zipf_exponent'], 1, config['seed'])
+    websites = zipf_sampler(rng, config['num_websites'], config['zipf_exponent'], 1, config['seed'])
+    paths = rng.integers(1, 101, count).tolist()
+    records = [
+        {
+            "ad_creative_id": creative,
+            "user_id": user,
+            "timestamp": timestamp,
+            "website_url": f"http://example{website}.com/path/{path}"
         }
-        data.append(ad_impression)
-    return data
+        for creative, user, timestamp, website, path in zip(
+            creatives(count).tolist(), users(count).tolist(),
+            event_timestamps(rng, start, end, count, config), websites(count).tolist(), paths,
+        )
+    ]
+    return add_duplicates(rng, records, config)
 
 # Function to generate clicks and conversions data
-def generate_clicks_conversions_data(num_entries):
-    data = []
-    for _ in range(num_entries):
-        click_conversion = {
-            "timestamp": random_timestamp(datetime(2023, 1, 1), datetime(2023, 12, 31)).strftime('%Y-%m-%d %H:%M:%S'),
-            "user_id": random.randint(10000, 99999),
-            "ad_campaign_id": random.randint(1, 10),
-            "conversion_type": random.choice(["purchase", "signup", "visit"])
+def generate_clicks_conversions_data(rng, start, end, count, config, first_index=0):
+    users = zipf_sampler(rng, config['num_users'], config['zipf_exponent'], config['min_user_id'], config['seed'])
+    campaigns = zipf_sampler(rng, config['num_campaigns'], config['zipf_exponent'], 1, config['seed'])
+    conversion_types = np.array(["purchase", "signup", "visit"])[rng.choice(3, count, p=[0.05, 0.15, 0.8])]
+    records = [
+        {
+            "timestamp": timestamp,
+            "user_id": user,
+            "ad_campaign_id": campaign,
+            "conversion_type": conversion_type
         }
-        data.append(click_conversion)
-    return data
+        for timestamp, user, campaign, conversion_type in zip(
+            event_timestamps(rng, start, end, count, config), users(count).tolist(),
+            campaigns(count).tolist(), conversion_types.tolist(),
+        )
+    ]
+    return add_duplicates(rng, records, config)
 
 # Function to generate bid requests data
-def generate_bid_requests_data(num_entries):
-    data = []
-    for _ in range(num_entries):
-        bid_request = {
-            "bid_amount": round(random.uniform(0.1, 10), 2),
-            "user_id": random.randint(10000, 99999),
-            "auction_id": f"AUCTION-{random.randint(1, 1000)}",
-            "ip_address": f"192.168.{random.randint(1, 255)}.{random.randint(1, 255)}"
+def generate_bid_requests_data(rng, start, end, count, config, first_index=0):
+    users = zipf_sampler(rng, config['num_users'], config['zipf_exponent'], config['min_user_id'], config['seed'])(count)
+    # Each user keeps a stable IP address
+    ips = (users.astype(np.uint64) * np.uint64(2654435761)) % np.uint64(1 << 32)
+    records = [
+        {
+            "bid_amount": bid_amount,
+            "user_id": user,
+            "auction_id": f"AUCTION-{first_index + index}",
+            "ip_address": f"{ip >> 24}.{(ip >> 16) & 255}.{(ip >> 8) & 255}.{ip & 255}"
         }
-        data.append(bid_request)
-    return data
+        for index, (bid_amount, user, ip) in enumerate(zip(
+            np.round(rng.lognormal(0, 0.75, count).clip(0.1, 10), 2).tolist(), users.tolist(), ips.tolist(),
+        ))
+    ]
+    return add_duplicates(rng, records, config)
+
+GENERATORS = {
+    'ad_impressions': generate_ad_impressions_data,
+    'clicks_conversions': generate_clicks_conversions_data,
+    'bid_requests': generate_bid_requests_data,
+}
+
+# Function to generate the record chunks of one shard
+def generate_shard(source, shard, num_shards, rows, seed=DEFAULT_SEED, config=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Generate the records of one shard in chunks.
+
+    Each shard covers its own slice of the time range and has its own random
+    stream, derived from the seed, source and shard number, so shards are
+    reproducible and can be generated independently.
+
+    Parameters:
+        source (str): Source name.
+        shard (int): Shard number.
+        num_shards (int): Total number of shards of the source.
+        rows (int): Number of rows in this shard.
+        seed (int): Random seed.
+        config (dict, optional): Overrides of DEFAULT_CONFIG.
+        chunk_size (int): Number of records generated at a time.
+
+    Yields:
+        list: Chunks of record dictionaries.
+    """
+    config = {**DEFAULT_CONFIG, **(config or {}), 'seed': seed}
+    rng = np.random.default_rng([seed, list(SOURCES).index(source), shard])
+    start, end = np.datetime64(START_DATE, 's'), np.datetime64(END_DATE, 's')
+    shard_span = (end - start) / num_shards
+    shard_start = start + shard_span * shard
+    first_index = shard * rows
+    for chunk_start in range(0, rows, chunk_size):
+        count = min(chunk_size, rows - chunk_start)
+        chunk_span = shard_span * count / rows
+        chunk_begin = shard_start + shard_span * chunk_start / rows
+        yield GENERATORS[source](rng, chunk_begin, chunk_begin + chunk_span, count, config, first_index + chunk_start)
 
 # Function to write data to files
-def write_data_to_files(data, filename, format):
+def write_data_to_files(chunks, filename, format, data_dir=DATA_DIR, sync_marker=None, compression=None, avro_codec='null'):
+    """
+    Stream chunks of records into a file without holding the whole file in memory.
+
+    Parameters:
+        chunks (iterable): Iterable of lists of records.
+        filename (str): Output file name.
+        format (str): 'json', 'csv' or 'avro'.
+        data_dir (str): Output directory.
+        sync_marker (bytes, optional): 16-byte Avro sync marker; random by default.
+        compression (str, optional): 'gzip' or 'zstd' to compress JSON and CSV
+            files in a parallel-readable layout (see decompress.open_output).
+        avro_codec (str): Block codec of Avro files: 'null', 'deflate' or 'snappy'.
+    """
+    path = os.path.join(data_dir, filename)
+
+    def open_text(newline=None):
+        if compression is None:
+            return open(path, 'w', newline=newline)
+        return io.TextIOWrapper(open_output(path, compression), encoding='utf-8', newline=newline)
+
     try:
         if format == 'json':
-            with open(os.path.join(DATA_DIR, filename), 'w') as f:
-                json.dump(data, f, indent=4)
+            with open_text() as f:
+                f.write('[')
+                separator = '\n'
+                for chunk in chunks:
+                    for record in chunk:
+                        f.write(separator + json.dumps(record))
+                        separator = ',\n'
+                f.write('\n]\n')
         elif format == 'csv':
-            with open(os.path.join(DATA_DIR, filename), 'w', newline='') as f:
-                writer = csv.DictWriter(f, fieldnames=["timestamp", "user_id", "ad_campaign_id", "conversion_type"])
+            with open_text(newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=[field["name"] for field in CLICK_CONVERSION_SCHEMA["fields"]])
                 writer.writeheader()
-                writer.writerows(data)
+                for chunk in chunks:
+                    writer.writerows(chunk)
         elif format == 'avro':
-            avro_schema = {
-                "type": "record",
-                "name": "BidRequest",
-                "fields": [
-                    {"name": "bid_amount", "type": "float"},
-                    {"name": "user_id", "type": "int"},
-                    {"name": "auction_id", "type": "string"},
-                    {"name": "ip_address", "type": "string"}
-                ]
-            }
-            with io.BytesIO() as avro_output:
-                fastavro.writer(avro_output, avro_schema, data)
-                avro_output.seek(0)
-                with open(os.path.join(DATA_DIR, filename), 'wb') as f:
-                    f.write(avro_output.read())
+            with open(path, 'wb') as f:
+                fastavro.writer(f, BID_REQUEST_SCHEMA, (record for chunk in chunks for record in chunk), codec=avro_codec, sync_marker=sync_marker)
         logging.info(f"Sample data generated successfully and written to {filename}")
     except Exception as e:
         logging.error(f"Error writing sample data to {filename}: {e}")
 
-if __name__ == '__main__':
-    # Create data directory if it doesn't exist
-    os.makedirs(DATA_DIR, exist_ok=True)
+# Function to generate all shards of one source
+def generate_source(source, rows, shards=1, data_dir=DATA_DIR, seed=DEFAULT_SEED, config=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                    compression=None, avro_codec='null'):
+    """
+    Generate a source's data files.
+
+    A single shard keeps the historical file name (e.g. 'ad_impressions.json');
+    several shards are numbered (e.g. 'ad_impressions_00003.json'). Compressed
+    JSON and CSV files get a '.gz' or '.zst' suffix; Avro files are compressed
+    block by block with `avro_codec` instead.
+
+    Parameters:
+        source (str): Source name.
+        rows (int): Total number of rows.
+        shards (int): Number of files to split the rows over.
+        data_dir (str): Output directory.
+        seed (int): Random seed.
+        config (dict, optional): Overrides of DEFAULT_CONFIG.
+        chunk_size (int): Number of records generated at a time.
+        compression (str, optional): 'gzip' or 'zstd' for JSON and CSV files.
+        avro_codec (str): Block codec of Avro files: 'null', 'deflate' or 'snappy'.
 
-    # Generate ad impressions data
-    ad_impressions_data = generate_ad_impressions_data(1000)
-    write_data_to_files(ad_impressions_data, 'ad_impressions.json', 'json')
+    Returns:
+        list: Paths of the written files.
+    """
+    format, _ = SOURCES[source]
+    paths = []
+    for shard in range(shards):
+        shard_rows = rows // shards + (1 if shard < rows % shards else 0)
+        filename = f"{source}.{format}" if shards == 1 else f"{source}_{shard:05d}.{format}"
+        if compression and format != 'avro':
+            filename += CODEC_SUFFIXES[compression]
+        chunks = generate_shard(source, shard, shards, shard_rows, seed, config, chunk_size)
+        # Derive the Avro sync marker from the seed too, so files are byte-for-byte reproducible
+        sync_marker = hashlib.md5(f"{seed}:{filename}".encode()).digest()
+        write_data_to_files(chunks, filename, format, data_dir, sync_marker, compression, avro_codec)
+        paths.append(os.path.join(data_dir, filename))
+    return paths
 
-    # Generate clicks and conversions data
-    clicks_conversions_data = generate_clicks_conversions_data(1000)
-    write_data_to_files(clicks_conversions_data, 'clicks_conversions.csv', 'csv')
+if __name__ == '__main__':
+    # Configure command-line arguments
+    parser = argparse.ArgumentParser(description='Sample Data Generator for AdvertiseX')
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help='Rows per source')
+    parser.add_argument('--shards', type=int, default=1, help='Files per source')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='Random seed')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='Output directory')
+    parser.add_argument('--sources', nargs='+', choices=list(SOURCES), default=list(SOURCES), help='Sources to generate')
+    parser.add_argument('--zipf-exponent', type=float, default=DEFAULT_CONFIG['zipf_exponent'], help='Popularity skew of ids')
+    parser.add_argument('--duplicate-rate', type=float, default=DEFAULT_CONFIG['duplicate_rate'], help='Fraction of duplicated events')
+    parser.add_argument('--late-rate', type=float, default=DEFAULT_CONFIG['late_rate'], help='Fraction of out-of-order events')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Records generated at a time')
+    parser.add_argument('--compression', choices=list(CODEC_SUFFIXES), help='Compress JSON and CSV files')
+    parser.add_argument('--avro-codec', choices=AVRO_CODECS, default='null', help='Block codec of Avro files')
+    args = parser.parse_args()
+
+    # Create data directory if it doesn't exist
+    os.makedirs(args.data_dir, exist_ok=True)
 
-    # Generate bid requests data
-    bid_requests_data = generate_bid_requests_data(1000)
-    write_data_to_files(bid_requests_data, 'bid_requests.avro', 'avro')
\ No newline at end of file
+    config = {
+        'zipf_exponent': args.zipf_exponent,
+        'duplicate_rate': args.duplicate_rate,
+        'late_rate': args.late_rate,
+    }
+    for source in args.sources:
+        generate_source(source, args.rows, args.shards, args.data_dir, args.seed, config, args.chunk_size,
+                        args.compression, args.avro_codec)
@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+import logging
+import os
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+DEFAULT_GEOIP_DB_PATH = 'data/GeoLite2-Country.mmdb'
+DEFAULT_CACHE_SIZE = 100000
+UNKNOWN_COUNTRY = 'Unknown'
+
+class GeoIPResolver:
+    """
+    Resolve IP addresses to country names with one long-lived reader and an LRU cache.
+
+    The MaxMind database is opened once in memory-mapped mode and shared by
+    every lookup in the process. Results are cached by IP address, or by /24
+    prefix for IPv4 when `prefix_cache` is set, since country assignments
+    practically never change inside a /24.
+    """
+
+    def __init__(self, db_path=None, cache_size=DEFAULT_CACHE_SIZE, prefix_cache=False, reader=None):
+        """
+        Parameters:
+            db_path (str, optional): Path to the GeoIP2 Country database. Defaults to
+                the GEOIP_DB_PATH environment variable, then DEFAULT_GEOIP_DB_PATH.
+            cache_size (int): Maximum number of cached lookups.
+            prefix_cache (bool): Cache IPv4 results per /24 prefix instead of per address.
+            reader (geoip2.database.Reader, optional): Already opened reader to use.
+        """
+        self.db_path = db_path or os.getenv('GEOIP_DB_PATH', DEFAULT_GEOIP_DB_PATH)
+        self.cache_size = cache_size
+        self.prefix_cache = prefix_cache
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._reader = reader
+
+    @property
+    def reader(self):
+        """Open the database on first use, memory-mapped so pages are shared across lookups."""
+        if self._reader is None:
+            # geoip2 is only needed once a lookup misses the cache
+            import geoip2.database
+            self._reader = geoip2.database.Reader(self.db_path, mode=geoip2.database.MODE_MMAP)
+            logging.info(f"Opened GeoIP database {self.db_path}")
+        return self._reader
+
+    def cache_key(self, ip_address):
+        """
+        Get the cache key for an IP address.
+
+        Parameters:
+            ip_address (str): IP address.
+
+        Returns:
+            str: The address itself, or its /24 prefix for IPv4 when prefix caching is on.
+        """
+        if self.prefix_cache and ip_address.count('.') == 3:
+            return ip_address.rsplit('.', 1)[0]
+        return ip_address
+
+    def resolve(self, ip_address):
+        """
+        Look an IP address up in the database, bypassing the cache.
+
+        Parameters:
+            ip_address (str): IP address.
+
+        Returns:
+            str: Country name, or UNKNOWN_COUNTRY if the address is invalid or not found.
+        """
+        from geoip2.errors import AddressNotFoundError
+        try:
+            return self.reader.country(ip_address).country.name or UNKNOWN_COUNTRY
+        except (AddressNotFoundError, ValueError, TypeError):
+            return UNKNOWN_COUNTRY
+
+    def country(self, ip_address):
+        """
+        Get the country for an IP address, using the LRU cache.
+
+        Parameters:
+            ip_address (str): IP address.
+
+        Returns:
+            str: Country name.
+        """
+        if not isinstance(ip_address, str):
+            return UNKNOWN_COUNTRY
+        key = self.cache_key(ip_address)
+        country = self.cache.get(key)
+        if country is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return country
+        self.misses += 1
+        country = self.resolve(ip_address)
+        self.cache[key] = country
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return country
+
+    def lookup_many(self, ip_addresses):
+        """
+        Resolve a column of IP addresses, looking each distinct address up only once.
+
+        Parameters:
+            ip_addresses (pandas.Series): IP addresses.
+
+        Returns:
+            pandas.Series: Country names aligned with the input index.
+        """
+        codes, uniques = pd.factorize(ip_addresses)
+        # Missing addresses get code -1, which picks the trailing UNKNOWN_COUNTRY
+        countries = np.array([self.country(ip_address) for ip_address in uniques] + [UNKNOWN_COUNTRY], dtype=object)
+        return pd.Series(countries[codes], index=ip_addresses.index, name='user_country')
+
+    @property
+    def hit_rate(self):
+        """Fraction of cached lookups answered without touching the database."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        """
+        Get cache statistics.
+
+        Returns:
+            dict: Hits, misses, hit rate and current cache size.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate, 'size': len(self.cache)}
+
+    def close(self):
+        """Close the database reader and clear the cache."""
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        self.cache.clear()
+
+# One resolver per database path and process
+_resolvers = {}
+
+def get_resolver(db_path=None, **kwargs):
+    """
+    Get the shared resolver for a database path in the current process.
+
+    Resolvers are keyed by process id as well, so a worker forked from a parent
+    that already opened the database gets its own reader and cache.
+
+    Parameters:
+        db_path (str, optional): Path to the GeoIP2 Country database.
+        **kwargs: Extra GeoIPResolver arguments used when the resolver is created.
+
+    Returns:
+        GeoIPResolver: The process-wide resolver.
+    """
+    db_path = db_path or os.getenv('GEOIP_DB_PATH', DEFAULT_GEOIP_DB_PATH)
+    key = (os.getpid(), db_path)
+    if key not in _resolvers:
+        _resolvers[key] = GeoIPResolver(db_path, **kwargs)
+    return _resolvers[key]
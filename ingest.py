@@ -1,18 +1,108 @@
+import io
 import json
 import csv
-from avro import datafile, io
+import re
+import fastavro
+import itertools
 import logging
 import argparse
+import glob
 import os
 import asyncio
 import aiofiles
+import profiling
+from avro_reader import read_avro_columns, read_avro_frame
+from batches import RecordBatch
+from decompress import detect_compression, input_buffer, open_text, strip_compression
+from schemas import parse_records, read_csv_typed
 import concurrent.futures
+import functools
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 
 # Define constants
 DEFAULT_DATA_DIR = 'data/'
+DEFAULT_BATCH_SIZE = 10000
+READ_CHUNK_SIZE = 1 << 20  # 1 MiB of text per read
+FIRST_NON_SPACE = re.compile(rb'\S')
+
+# Shard file patterns per source within a data directory; JSON and CSV
+# shards may be gzip or zstd compressed, e.g. 'ad_impressions.json.gz'
+SOURCE_PATTERNS = {
+    'ad_impressions': 'ad_impressions*.json*',
+    'clicks_conversions': 'clicks_conversions*.csv*',
+    'bid_requests': 'bid_requests*.avro',
+}
+
+# Define a function to get the format of a possibly compressed data file
+def data_extension(path):
+    """
+    Get the format extension of a data file, looking through a compression suffix.
+
+    Avro compresses its own blocks (deflate or snappy codecs), so a
+    compressed Avro file keeps its compression suffix and is not read.
+
+    Parameters:
+        path (str): Path to a data file, e.g. 'clicks_conversions.csv.zst'.
+
+    Returns:
+        str: Extension such as '.csv'.
+    """
+    base = strip_compression(path)
+    extension = os.path.splitext(base)[1]
+    if base != path and extension == '.avro':
+        return os.path.splitext(path)[1]
+    return extension
+
+class AsyncTextStream:
+    """
+    Asynchronous reads from a blocking text file, one worker thread call per read.
+
+    Used for compressed files, which aiofiles cannot open; the file itself
+    decompresses ahead in a background thread (see decompress.open_text).
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await asyncio.to_thread(self.f.close)
+
+    async def read(self, size=-1):
+        return await asyncio.to_thread(self.f.read, size)
+
+    async def readlines(self):
+        return await asyncio.to_thread(self.f.readlines)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        line = await asyncio.to_thread(self.f.readline)
+        if not line:
+            raise StopAsyncIteration
+        return line
+
+# Define a function to open a data file for asynchronous text reads
+def open_text_async(path, newline=None):
+    """
+    Open a data file for asynchronous text reads, decompressing gzip and zstd files.
+
+    Parameters:
+        path (str): Path to the file.
+        newline (str, optional): Newline mode, as for `open`.
+
+    Returns:
+        Async context manager yielding a file with async `read`, `readlines`
+        and line iteration.
+    """
+    if detect_compression(path) is None:
+        return aiofiles.open(path, 'r', newline=newline)
+    return AsyncTextStream(open_text(path, newline=newline))
 
 # Define a function to ingest JSON data (ad impressions) asynchronously
 async def ingest_ad_impressions(json_file):
@@ -26,7 +116,7 @@ async def ingest_ad_impressions(json_file):
         list: List of dictionaries containing ad impressions data.
     """
     try:
-        async with aiofiles.open(json_file, 'r') as f:
+        async with open_text_async(json_file) as f:
             ad_impressions_data = json.loads(await f.read())
         return ad_impressions_data
     except Exception as e:
@@ -45,7 +135,7 @@ async def ingest_clicks_conversions(csv_file):
         list: List of dictionaries containing clicks and conversions data.
     """
     try:
-        async with aiofiles.open(csv_file, 'r') as f:
+        async with open_text_async(csv_file) as f:
             reader = csv.DictReader(await f.readlines())
             clicks_conversions_data = list(reader)
         return clicks_conversions_data
@@ -65,36 +155,640 @@ async def ingest_bid_requests(avro_file):
         list: List of dictionaries containing bid requests data.
     """
     try:
-        async with aiofiles.open(avro_file, 'rb') as f:
-            reader = datafile.DataFileReader(f, io.DatumReader())
-            bid_requests_data = [record for record in reader]
-        return bid_requests_data
+        # Avro decoding is blocking and needs a regular file, so it runs in a worker thread
+        return await asyncio.to_thread(read_bid_requests, avro_file)
     except Exception as e:
         logging.error(f"Error ingesting bid requests data from {avro_file}: {e}")
         return []
 
+# Define a function to stream JSON data (ad impressions) in fixed-size batches
+async def iter_ad_impressions(json_file, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Stream ad impressions from a JSON array or JSON Lines file in batches.
+
+    The file is read in fixed-size chunks and decoded incrementally, so memory
+    use is bounded by the chunk size plus one batch, whatever the file size.
+
+    Parameters:
+        json_file (str): Path to the JSON or JSON Lines file.
+        batch_size (int): Maximum number of records per batch.
+
+    Yields:
+        list: List of dictionaries containing at most `batch_size` records.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    in_array = None
+    batch = []
+    async with open_text_async(json_file) as f:
+        while True:
+            # Skip whitespace and, inside an array, the separating commas
+            while pos < len(buffer) and (buffer[pos].isspace() or (in_array and buffer[pos] == ',')):
+                pos += 1
+            if pos == len(buffer):
+                if eof:
+                    break
+                chunk = await f.read(READ_CHUNK_SIZE)
+                eof = not chunk
+                buffer, pos = chunk, 0
+                continue
+            if in_array is None:
+                # A leading '[' means a JSON array, anything else is JSON Lines
+                in_array = buffer[pos] == '['
+                if in_array:
+                    pos += 1
+                continue
+            if in_array and buffer[pos] == ']':
+                break
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The record straddles a chunk boundary, so read more text
+                chunk = await f.read(READ_CHUNK_SIZE)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            pos = end
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+# Define a function to stream CSV data (clicks and conversions) in fixed-size batches
+async def iter_clicks_conversions(csv_file, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Stream clicks and conversions from a CSV file in batches.
+
+    Lines are parsed as they are read; a record whose quoted field spans
+    several lines is held back until its closing quote arrives.
+
+    Parameters:
+        csv_file (str): Path to the CSV file.
+        batch_size (int): Maximum number of records per batch.
+
+    Yields:
+        list: List of dictionaries containing at most `batch_size` records.
+    """
+    fieldnames = None
+    lines = []
+    record_count = 0
+    open_quotes = False
+    async with open_text_async(csv_file, newline='') as f:
+        async for line in f:
+            if fieldnames is None:
+                fieldnames = next(csv.reader([line]))
+                continue
+            lines.append(line)
+            if line.count('"') % 2:
+                open_quotes = not open_quotes
+            if open_quotes:
+                continue
+            record_count += 1
+            if record_count < batch_size:
+                continue
+            yield list(csv.DictReader(lines, fieldnames=fieldnames))
+            lines = []
+            record_count = 0
+    if lines:
+        yield list(csv.DictReader(lines, fieldnames=fieldnames))
+
+# Define a function to stream Avro data (bid requests) in fixed-size batches
+async def iter_bid_requests(avro_file, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Stream bid requests from an Avro container file in batches.
+
+    Decoding is blocking, so each batch is pulled in a worker thread to keep
+    the event loop responsive.
+
+    Parameters:
+        avro_file (str): Path to the Avro file.
+        batch_size (int): Maximum number of records per batch.
+
+    Yields:
+        list: List of dictionaries containing at most `batch_size` records.
+    """
+    with open(avro_file, 'rb') as f:
+        records = fastavro.reader(f)
+        while True:
+            batch = await asyncio.to_thread(list, itertools.islice(records, batch_size))
+            if not batch:
+                break
+            yield batch
+
+# Map file extensions to their batch readers
+STREAM_READERS = {
+    '.json': iter_ad_impressions,
+    '.jsonl': iter_ad_impressions,
+    '.csv': iter_clicks_conversions,
+    '.avro': iter_bid_requests,
+}
+
+# Define a function to stream any supported file in fixed-size batches
+async def stream_file(path, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Stream records from a data file, picking the reader by file extension.
+
+    Parameters:
+        path (str): Path to a .json, .jsonl, .csv or .avro file; JSON and CSV
+            files may be gzip or zstd compressed.
+        batch_size (int): Maximum number of records per batch.
+
+    Yields:
+        list: List of dictionaries containing at most `batch_size` records.
+
+    Raises:
+        Exception: Any error reading or parsing the file, after logging it, so a
+            corrupt file does not look like one that simply ended.
+    """
+    reader = STREAM_READERS.get(data_extension(path))
+    if reader is None:
+        raise ValueError(f"Unsupported file format: {path}")
+    try:
+        async for batch in reader(path, batch_size):
+            yield batch
+    except Exception as e:
+        logging.error(f"Error streaming data from {path}: {e}")
+        raise
+
+# Define a function to build batch streams for every input shard
+def stream_data(data_dir=DEFAULT_DATA_DIR, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Build batch streams for the input shards in a data directory or glob.
+
+    Parameters:
+        data_dir (str): Directory containing data files, or a glob pattern.
+        batch_size (int): Maximum number of records per batch.
+
+    Returns:
+        dict: File paths mapped to async generators of record batches, ready
+        for `DataProcessor.process_stream`.
+    """
+    return {
+        path: stream_file(path, batch_size)
+        for paths in discover_files(data_dir).values()
+        for path in paths
+    }
+
+# Define a function to read a JSON array or JSON Lines file synchronously
+def read_ad_impressions(json_file):
+    """
+    Read ad impressions from a JSON array or JSON Lines file.
+
+    Uncompressed files are memory-mapped; compressed files are decompressed
+    into memory, in parallel where the file allows.
+
+    Parameters:
+        json_file (str): Path to the JSON or JSON Lines file, optionally gzip or zstd compressed.
+
+    Returns:
+        list: List of dictionaries containing ad impressions data.
+    """
+    with input_buffer(json_file) as data:
+        first = FIRST_NON_SPACE.search(data)
+        if first is None:
+            return []
+        if data[first.start():first.start() + 1] == b'[':
+            return json.loads(data[:])
+        return [json.loads(line) for line in data[:].splitlines() if line.strip()]
+
+# Define a function to read a CSV file synchronously
+def read_clicks_conversions(csv_file):
+    """
+    Read clicks and conversions from a CSV file.
+
+    Compressed files are decompressed in a background thread while the
+    rows are parsed.
+
+    Parameters:
+        csv_file (str): Path to the CSV file, optionally gzip or zstd compressed.
+
+    Returns:
+        list: List of dictionaries containing clicks and conversions data.
+    """
+    with open_text(csv_file, newline='') as f:
+        return list(csv.DictReader(f))
+
+# Define a function to read an Avro file synchronously
+def read_bid_requests(avro_file):
+    """
+    Read bid requests from an Avro container file.
+
+    Parameters:
+        avro_file (str): Path to the Avro file.
+
+    Returns:
+        list: List of dictionaries containing bid requests data.
+    """
+    with open(avro_file, 'rb') as f:
+        return list(fastavro.reader(f))
+
+# Define a function to read a CSV file straight into typed columns
+def read_csv_frame(csv_file, source='clicks_conversions'):
+    """
+    Read a CSV file into a typed DataFrame.
+
+    Uncompressed files are parsed from a memory map; compressed files are
+    decompressed into memory first, in parallel where the file allows.
+
+    Parameters:
+        csv_file (str): Path to the CSV file, optionally gzip or zstd compressed.
+        source (str): Source whose schema types the columns.
+
+    Returns:
+        pandas.DataFrame: Typed DataFrame.
+    """
+    if detect_compression(csv_file) is None:
+        return read_csv_typed(csv_file, source, memory_map=True)
+    with input_buffer(csv_file) as data:
+        return read_csv_typed(io.BytesIO(data), source)
+
+# Map file extensions to their synchronous whole-file readers
+FILE_READERS = {
+    '.json': read_ad_impressions,
+    '.jsonl': read_ad_impressions,
+    '.csv': read_clicks_conversions,
+    '.avro': read_bid_requests,
+}
+
+# Define a function to read any supported file synchronously
+def read_file(path, task=None, typed=False):
+    """
+    Read a data file, picking the reader by file extension.
+
+    This is the unit of work submitted to the process pool, so it must stay a
+    module-level function that can be pickled.
+
+    Parameters:
+        path (str): Path to a .json, .jsonl, .csv or .avro file; JSON and CSV
+            files may be gzip or zstd compressed.
+        task (callable, optional): Module-level function applied to the records
+            inside the worker, e.g. to process or summarize them before they
+            are sent back to the parent process.
+        typed (bool): Return a DataFrame typed by the source's schema instead of
+            a list of dictionaries.
+
+    Returns:
+        The records, or the result of `task(records)`.
+    """
+    reader = FILE_READERS.get(data_extension(path))
+    if reader is None:
+        raise ValueError(f"Unsupported file format: {path}")
+    if typed and reader is read_clicks_conversions:
+        # The CSV parser can type the columns itself
+        records = read_csv_frame(path, source_for_path(path))
+    elif typed and reader is read_bid_requests:
+        # Avro blocks are decoded straight into columns; this already runs in a pool worker
+        records = read_avro_frame(path, workers=1)
+    elif typed:
+        records = parse_records(reader(path), source_for_path(path))
+    else:
+        records = reader(path)
+    return task(records) if task else records
+
+# Define a function to read any supported file into a compact record batch
+def read_batch(path, task=None):
+    """
+    Read a data file into a RecordBatch typed by the source's schema.
+
+    URLs, auction ids and IP addresses are dictionary-encoded (IPs packed
+    into uint32), so a batch is much smaller to send back from a pool worker
+    than a list of dictionaries or a DataFrame of Python strings.
+
+    This is a unit of work for the process pool, like `read_file`.
+
+    Parameters:
+        path (str): Path to a .json, .jsonl, .csv or .avro file; JSON and CSV
+            files may be gzip or zstd compressed.
+        task (callable, optional): Module-level function applied to the batch
+            inside the worker.
+
+    Returns:
+        The RecordBatch, or the result of `task(batch)`.
+    """
+    reader = FILE_READERS.get(data_extension(path))
+    if reader is None:
+        raise ValueError(f"Unsupported file format: {path}")
+    source = source_for_path(path)
+    if reader is read_clicks_conversions:
+        batch = RecordBatch.from_frame(read_csv_frame(path, source), source)
+    elif reader is read_bid_requests:
+        batch = RecordBatch.from_columns(read_avro_columns(path, workers=1), source)
+    else:
+        batch = RecordBatch.from_records(reader(path), source)
+    return task(batch) if task else batch
+
+# Map file extensions to source names
+SOURCE_EXTENSIONS = {
+    '.json': 'ad_impressions',
+    '.jsonl': 'ad_impressions',
+    '.csv': 'clicks_conversions',
+    '.avro': 'bid_requests',
+}
+
+# Define a function to find the source a file belongs to
+def source_for_path(path):
+    """
+    Get the source name of a data file from its extension.
+
+    Parameters:
+        path (str): Path to a data file, optionally with a compression suffix.
+
+    Returns:
+        str: Source name from SOURCE_PATTERNS, or None for unsupported files.
+    """
+    return SOURCE_EXTENSIONS.get(data_extension(path))
+
+# Define a function to find the shard files for each source
+def discover_files(source, sources=None):
+    """
+    Find input shards in a directory or matching a glob pattern.
+
+    Parameters:
+        source (str): Data directory, or a glob pattern such as 'data/2024-04-01/*.json'.
+        sources (list, optional): Source names from SOURCE_PATTERNS to look for
+            in a directory. Defaults to all sources.
+
+    Returns:
+        dict: Source names mapped to sorted lists of file paths.
+    """
+    if os.path.isdir(source):
+        # Patterns also match compression suffixes, so leave out anything else they catch
+        return {
+            name: sorted(path for path in glob.glob(os.path.join(source, pattern)) if source_for_path(path) == name)
+            for name, pattern in SOURCE_PATTERNS.items()
+            if sources is None or name in sources
+        }
+
+    # A glob pattern: assign each match to a source by its extension
+    files = {}
+    for path in sorted(glob.glob(source, recursive=True)):
+        name = source_for_path(path)
+        if name is not None and (sources is None or name in sources):
+            files.setdefault(name, []).append(path)
+    return files
+
+# Define a function to ingest many files in parallel on a process pool
+def ingest_files(paths, workers=None, task=None):
+    """
+    Decode many files in parallel and yield results as they complete.
+
+    Parsing JSON, building CSV dictionaries and decoding Avro are CPU-bound,
+    so each file is decoded in a separate worker process.
+
+    Parameters:
+        paths (list): Paths of the files to ingest.
+        workers (int, optional): Number of worker processes. Defaults to the CPU count.
+        task (callable, optional): Module-level function applied to each file's
+            records inside the worker (see `read_file`).
+
+    Yields:
+        tuple: (path, records or task result) in completion order. Files that
+        fail to decode are logged and skipped.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(read_file, path, task): path for path in paths}
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            try:
+                yield path, future.result()
+            except Exception as e:
+                logging.error(f"Error ingesting data from {path}: {e}")
+
+# Define a function to read complete lines from a byte offset
+def iter_lines_from(f, batch_size, quoted=False, final=False):
+    """
+    Read complete records of newline-terminated lines from a binary file.
+
+    A trailing line without a newline may still be being written, so it is
+    left for the next run, unless `final` says the file is complete. With
+    `quoted`, lines are joined until CSV quotes balance, so multi-line fields
+    stay in one record.
+
+    Parameters:
+        f (file): Binary file positioned at a record boundary.
+        batch_size (int): Maximum number of records per batch.
+        quoted (bool): Whether records may span lines inside double quotes.
+        final (bool): Whether the file is no longer written, so a last line
+            without a newline is a complete record.
+
+    Yields:
+        tuple: (list of decoded lines, byte offset after the last complete record).
+    """
+    lines = []
+    complete_lines = 0
+    record_count = 0
+    open_quotes = False
+    end_offset = f.tell()
+    for line in iter(f.readline, b''):
+        if not line.endswith(b'\n') and not final:
+            break
+        lines.append(line.decode('utf-8'))
+        if quoted and line.count(b'"') % 2:
+            open_quotes = not open_quotes
+        if open_quotes:
+            continue
+        complete_lines = len(lines)
+        record_count += 1
+        end_offset = f.tell()
+        if record_count >= batch_size:
+            yield lines, end_offset
+            lines = []
+            complete_lines = 0
+            record_count = 0
+    if record_count:
+        # Leave out a record whose closing quote has not arrived yet
+        yield lines[:complete_lines], end_offset
+
+# Define a function to read a file in batches from a checkpointed position
+def iter_file_from(path, offset=0, skip_records=0, batch_size=DEFAULT_BATCH_SIZE, final=False):
+    """
+    Read a data file in batches, resuming from a committed position.
+
+    CSV and JSON Lines files resume from a byte offset, Avro files from the
+    start of a data block. JSON arrays and compressed files cannot be entered
+    mid-way, so they are re-read and the first `skip_records` records are
+    skipped instead.
+
+    Parameters:
+        path (str): Path to a .json, .jsonl, .csv or .avro file; JSON and CSV
+            files may be gzip or zstd compressed.
+        offset (int): Byte offset to resume from (0 for the start of the data).
+        skip_records (int): Records already committed, used for JSON arrays.
+        batch_size (int): Maximum number of records per batch.
+        final (bool): Whether the file is no longer written, so the last line of
+            a CSV or JSON Lines file counts even without a trailing newline.
+
+    Yields:
+        tuple: (list of records, position to commit once the batch is stored).
+    """
+    extension = data_extension(path)
+    if detect_compression(path) is not None and extension in ('.csv', '.json', '.jsonl'):
+        yield from iter_compressed_from(path, skip_records, batch_size)
+    elif extension == '.csv':
+        with open(path, 'rb') as f:
+            fieldnames = next(csv.reader([f.readline().decode('utf-8')]))
+            f.seek(max(offset, f.tell()))
+            for lines, end_offset in iter_lines_from(f, batch_size, quoted=True, final=final):
+                yield list(csv.DictReader(lines, fieldnames=fieldnames)), end_offset
+    elif extension == '.avro':
+        with open(path, 'rb') as f:
+            blocks = fastavro.block_reader(f)
+            if offset:
+                f.seek(offset)
+            batch = []
+            for block in blocks:
+                batch.extend(block)
+                # Positions are only committed at block boundaries
+                if len(batch) >= batch_size:
+                    yield batch, f.tell()
+                    batch = []
+            if batch:
+                yield batch, f.tell()
+    elif extension in ('.json', '.jsonl'):
+        with open(path, 'rb') as f:
+            first_char = f.read(1)
+            while first_char.isspace():
+                first_char = f.read(1)
+            f.seek(offset)
+            if first_char != b'[':
+                for lines, end_offset in iter_lines_from(f, batch_size, final=final):
+                    yield [json.loads(line) for line in lines if line.strip()], end_offset
+                return
+        records = read_ad_impressions(path)[skip_records:]
+        size = os.path.getsize(path)
+        for start in range(0, len(records), batch_size):
+            # Only the last batch marks the array as fully read
+            end = start + batch_size
+            yield records[start:end], size if end >= len(records) else 0
+    else:
+        raise ValueError(f"Unsupported file format: {path}")
+
+# Define a function to read a compressed file in batches from a checkpointed position
+def iter_compressed_from(path, skip_records=0, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Read a compressed CSV or JSON file in batches, skipping committed records.
+
+    Offsets into compressed data cannot be resumed from, so the file is
+    decompressed from the start. Until the last batch the committed position
+    is 0; the last one commits the compressed file size, so the file counts
+    as unchanged until more data (e.g. another gzip member) is appended.
+
+    Parameters:
+        path (str): Path to the compressed file.
+        skip_records (int): Records already committed.
+        batch_size (int): Maximum number of records per batch.
+
+    Yields:
+        tuple: (list of records, position to commit once the batch is stored).
+    """
+    size = os.path.getsize(path)
+    with open_text(path, newline='' if data_extension(path) == '.csv' else None) as f:
+        if data_extension(path) == '.csv':
+            records = csv.DictReader(f)
+        else:
+            first_char = f.read(1)
+            while first_char.isspace():
+                first_char = f.read(1)
+            if first_char == '[':
+                records = iter(json.loads(first_char + f.read()))
+            else:
+                lines = itertools.chain([first_char + f.readline()], f)
+                records = (json.loads(line) for line in lines if line.strip())
+        records = itertools.islice(records, skip_records, None)
+        batch = list(itertools.islice(records, batch_size))
+        while batch:
+            next_batch = list(itertools.islice(records, batch_size))
+            # Only the last batch marks the file as fully read
+            yield batch, size if not next_batch else 0
+            batch = next_batch
+
 # Main function to orchestrate data ingestion asynchronously
 async def main():
     # Configure command-line arguments
     parser = argparse.ArgumentParser(description='Data Ingestion for AdvertiseX')
     parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Directory containing data files')
+    parser.add_argument('--input', help='Glob pattern of input shards (overrides --data-dir)')
+    parser.add_argument('--workers', type=int, help='Number of ingestion worker processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, help='Stream the files in batches of this many records')
+    parser.add_argument('--columnar-dir', help='Write typed columnar shards under this directory instead of returning records')
+    parser.add_argument('--columnar-format', choices=['parquet', 'arrow'], default='parquet', help='Format of the columnar shards')
+    parser.add_argument('--profile', nargs='?', const='stages', help='Profile the run: stages, cprofile and/or tracemalloc, comma-separated')
+    parser.add_argument('--profile-output', help='File for the JSON profile report (default: profile.json)')
     args = parser.parse_args()
 
-    # Specify file paths for data ingestion
-    ad_impressions_file = os.path.join(args.data_dir, 'ad_impressions.json')
-    clicks_conversions_file = os.path.join(args.data_dir, 'clicks_conversions.csv')
-    bid_requests_file = os.path.join(args.data_dir, 'bid_requests.avro')
+    if args.profile:
+        # The report is written, with a summary table, when the process exits
+        profiler = profiling.enable(profiling.parse_modes(args.profile), args.profile_output)
+    else:
+        profiler = profiling.enable_from_env()
+
+    if args.batch_size:
+        # Streaming mode: process, validate and store every batch without holding whole files in memory
+        import db
+        from process import get_processor
+        processor = get_processor()
+        record_counts = {}
+        for filename, batches in stream_data(args.input or args.data_dir, args.batch_size).items():
+            source = source_for_path(filename)
+            record_counts[filename] = 0
+            try:
+                async for _, df in processor.process_stream({filename: batches}):
+                    # Rejected rows are quarantined only if the batch is stored
+                    with db.begin(processor.engine) as conn:
+                        df = processor.validate_data(df, source, conn=conn)
+                        if processor.store_data(df, source, conn=conn) is None:
+                            raise RuntimeError(f"Could not store a batch in table '{source}'")
+                    record_counts[filename] += len(df)
+            except Exception as e:
+                logging.error(f"Error ingesting data from {filename}: {e}")
+                continue
+            logging.info(f"Stored {record_counts[filename]} records from {filename}")
+        logging.info("Data ingestion completed")
+        return record_counts
+
+    # Fan all shards of every source out to a process pool
+    files = discover_files(args.input or args.data_dir)
+    file_sources = {path: name for name, paths in files.items() for path in paths}
+    data = {name: [] for name in SOURCE_PATTERNS}
+    loop = asyncio.get_running_loop()
+    # Profiled readers only run in this process, so decode inline when profiling
+    executor = profiling.InlineExecutor if profiler else concurrent.futures.ProcessPoolExecutor
+    with executor(max_workers=args.workers) as pool:
+        if args.columnar_dir:
+            # Workers write shards where they decode, so records never travel back here
+            from columnar import write_shards_task
+            tasks = {
+                loop.run_in_executor(pool, read_file, path, functools.partial(
+                    write_shards_task, source=name, root=args.columnar_dir, format=args.columnar_format,
+                ), True): path
+                for path, name in file_sources.items()
+            }
+        else:
+            tasks = {loop.run_in_executor(pool, read_file, path): path for path in file_sources}
+
+        async def completed(task, path):
+            try:
+                return path, await task, None
+            except Exception as e:
+                return path, None, e
 
-    # Ingest data concurrently using asyncio
-    async with concurrent.futures.ThreadPoolExecutor() as pool:
-        ad_impressions_task = asyncio.get_event_loop().run_in_executor(pool, ingest_ad_impressions, ad_impressions_file)
-        clicks_conversions_task = asyncio.get_event_loop().run_in_executor(pool, ingest_clicks_conversions, clicks_conversions_file)
-        bid_requests_task = asyncio.get_event_loop().run_in_executor(pool, ingest_bid_requests, bid_requests_file)
-        ad_impressions_data, clicks_conversions_data, bid_requests_data = await asyncio.gather(ad_impressions_task, clicks_conversions_task, bid_requests_task)
+        # Handle files as they finish, so one slow file does not hold up the others
+        for next_done in asyncio.as_completed([completed(task, path) for task, path in tasks.items()]):
+            path, result, error = await next_done
+            if error is not None:
+                logging.error(f"Error ingesting data from {path}: {error}")
+            elif not args.columnar_dir:
+                data[file_sources[path]].extend(result)
 
-    logging.info("Data ingestion completed")
+    logging.info(f"Data ingestion completed for {len(file_sources)} files")
 
-    return ad_impressions_data, clicks_conversions_data, bid_requests_data
+    return data['ad_impressions'], data['clicks_conversions'], data['bid_requests']
 
 if __name__ == '__main__':
-    ad_impressions_data, clicks_conversions_data, bid_requests_data = asyncio.run(main())  # Call the main function when the script is executed
\ No newline at end of file
+    ingested_data = asyncio.run(main())  # Call the main function when the script is executed
\ No newline at end of file
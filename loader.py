@@ -0,0 +1,263 @@
+import contextlib
+import csv
+import io
+import logging
+import time
+
+import pandas as pd
+from sqlalchemy import exc, inspect
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+DEFAULT_CHUNK_SIZE = 50000
+LOAD_MODES = ('append', 'upsert', 'replace')
+COPY_NULL = '\\N'
+# Upsert merge functions combining a stored value ({current}) with a conflicting new one ({new})
+MERGE_FUNCTIONS = {
+    'sum': 'COALESCE({current}, 0) + COALESCE({new}, 0)',
+    'min': 'CASE WHEN {current} IS NULL OR {new} < {current} THEN {new} ELSE {current} END',
+    'max': 'CASE WHEN {current} IS NULL OR {new} > {current} THEN {new} ELSE {current} END',
+}
+
+def collapse_duplicate_keys(df, keys, merge=None):
+    """
+    Combine rows sharing a key into one, as an upsert applying them in order would.
+
+    PostgreSQL's INSERT ... ON CONFLICT DO UPDATE cannot affect a row twice in
+    one statement, so rows upserted from the temporary table must have unique
+    keys. Columns merged with a MERGE_FUNCTIONS function are aggregated with it;
+    every other column keeps the last row's value (columns with an SQL template
+    are recomputed from the combined values by the upsert).
+
+    Parameters:
+        df (pandas.DataFrame): Rows to upsert.
+        keys (list): Key columns.
+        merge (dict, optional): Columns merged into conflicting rows; see `BulkLoader.load`.
+
+    Returns:
+        pandas.DataFrame: Rows with unique keys, in order of their last occurrence.
+    """
+    if not df.duplicated(keys).any():
+        return df
+    last = df.drop_duplicates(keys, keep='last')
+    merged = {
+        column: function for column, function in (merge or {}).items()
+        if function in MERGE_FUNCTIONS and column in df.columns and column not in keys
+    }
+    if not merged:
+        return last
+    combined = df.groupby(keys, sort=False, dropna=False)[list(merged)].agg(merged)
+    return last.drop(columns=list(merged)).merge(combined, left_on=keys, right_index=True, how='left')[list(df.columns)]
+
+class BulkLoader:
+    """
+    Load DataFrames into database tables in bulk.
+
+    On PostgreSQL rows are streamed through `COPY ... FROM STDIN` in CSV
+    format, one chunk at a time. Other databases (SQLite in particular) fall
+    back to chunked `executemany` inserts, so the same load modes can be
+    tested without a PostgreSQL server.
+
+    Load modes:
+        append: insert the rows into the table, creating it if needed.
+        upsert: insert the rows, updating existing rows with the same key;
+            `merge` combines columns with the stored values instead of
+            overwriting them.
+        replace: load the rows into a staging table, then swap it in for
+            the target table in the same transaction.
+    """
+
+    def __init__(self, engine, chunksize=DEFAULT_CHUNK_SIZE):
+        """
+        Parameters:
+            engine (sqlalchemy.engine.Engine): Engine to load through.
+            chunksize (int): Number of rows sent to the database per chunk.
+        """
+        self.engine = engine
+        self.chunksize = chunksize
+
+    def load(self, df, table_name, mode='append', key=None, conn=None, merge=None):
+        """
+        Load a DataFrame into a table.
+
+        Parameters:
+            df (pandas.DataFrame): DataFrame to load.
+            table_name (str): Name of the target table.
+            mode (str): One of 'append', 'upsert' or 'replace'.
+            key (str or list, optional): Column(s) identifying a row; required for 'upsert'.
+            conn (sqlalchemy.engine.Connection, optional): Connection with an open
+                transaction to load in. By default a new transaction is committed
+                when the load finishes, so pass a connection to make the load
+                atomic with other writes.
+            merge (dict, optional): For 'upsert', columns mapped to how a conflicting
+                row's value is combined with the stored one: a name in MERGE_FUNCTIONS,
+                or an SQL template where {current[column]} and {new[column]} refer to
+                the stored and new values. Other columns are overwritten.
+
+        Returns:
+            dict: Number of rows loaded, elapsed seconds and rows per second.
+        """
+        if mode not in LOAD_MODES:
+            raise ValueError(f"Unknown load mode '{mode}', expected one of {LOAD_MODES}")
+        if mode == 'upsert' and not key:
+            raise ValueError("Upsert mode requires a key")
+        keys = [key] if isinstance(key, str) else list(key or [])
+
+        start_time = time.perf_counter()
+        if conn is None:
+            with self.engine.begin() as conn:
+                self._load(conn, df, table_name, mode, keys, merge)
+        else:
+            self._load(conn, df, table_name, mode, keys, merge)
+        elapsed = time.perf_counter() - start_time
+
+        stats = {
+            'rows': len(df),
+            'seconds': elapsed,
+            'rows_per_second': len(df) / elapsed if elapsed > 0 else float('inf'),
+        }
+        logging.info(f"Loaded {stats['rows']} rows into '{table_name}' ({mode}) at {stats['rows_per_second']:.0f} rows/s")
+        return stats
+
+    def _load(self, conn, df, table_name, mode, keys, merge=None):
+        if mode == 'replace':
+            staging_table = f"{table_name}_staging"
+            self.drop_table(conn, staging_table)
+            self.create_table(conn, df, staging_table)
+            self.insert(conn, df, staging_table)
+            # Swap the staging table in; readers see either the old or the new table
+            self.drop_table(conn, table_name)
+            conn.exec_driver_sql(f"ALTER TABLE {self.quote(conn, staging_table)} RENAME TO {self.quote(conn, table_name)}")
+            return
+
+        self.create_table(conn, df, table_name)
+        if mode == 'append':
+            self.insert(conn, df, table_name)
+        else:
+            self.create_unique_index(conn, table_name, keys)
+            self.insert(conn, df, table_name, keys, merge)
+
+    @staticmethod
+    def quote(conn, name):
+        """Quote an identifier for the connection's dialect."""
+        return conn.dialect.identifier_preparer.quote(name)
+
+    @staticmethod
+    def is_postgres(conn):
+        """Whether the connection can use PostgreSQL's COPY."""
+        return conn.dialect.name == 'postgresql'
+
+    def create_table(self, conn, df, table_name):
+        """
+        Create the table from the DataFrame's columns and dtypes if it does not exist.
+
+        Another process may create the same table between the existence check
+        and the CREATE TABLE, so that failure is ignored once the table is there.
+        """
+        if inspect(conn).has_table(table_name):
+            return
+        # A failed statement aborts a PostgreSQL transaction, so the table is created in a savepoint there
+        savepoint = conn.begin_nested() if self.is_postgres(conn) else contextlib.nullcontext()
+        try:
+            with savepoint:
+                df.head(0).to_sql(table_name, conn, if_exists='append', index=False)
+        except exc.DBAPIError:
+            if not inspect(conn).has_table(table_name):
+                raise
+
+    def drop_table(self, conn, table_name):
+        """Drop a table if it exists."""
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {self.quote(conn, table_name)}")
+
+    def create_unique_index(self, conn, table_name, keys):
+        """Create the unique index an upsert needs to detect conflicting rows."""
+        index_name = self.quote(conn, f"{table_name}_{'_'.join(keys)}_key")
+        columns = ', '.join(self.quote(conn, column) for column in keys)
+        conn.exec_driver_sql(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {self.quote(conn, table_name)} ({columns})")
+
+    def upsert_clause(self, conn, columns, keys, table_name=None, merge=None):
+        """Build the ON CONFLICT clause updating every non-key column, merging those in `merge`; see `load`."""
+        conflict = ', '.join(self.quote(conn, column) for column in keys)
+        current = {column: f"{self.quote(conn, table_name)}.{self.quote(conn, column)}" for column in columns}
+        new = {column: f"excluded.{self.quote(conn, column)}" for column in columns}
+        updates = []
+        for column in columns:
+            if column in keys:
+                continue
+            function = (merge or {}).get(column)
+            if function is None:
+                value = new[column]
+            elif function in MERGE_FUNCTIONS:
+                value = MERGE_FUNCTIONS[function].format(current=current[column], new=new[column])
+            else:
+                value = function.format(current=current, new=new)
+            updates.append(f"{self.quote(conn, column)} = {value}")
+        if not updates:
+            return f" ON CONFLICT ({conflict}) DO NOTHING"
+        return f" ON CONFLICT ({conflict}) DO UPDATE SET {', '.join(updates)}"
+
+    def insert(self, conn, df, table_name, keys=None, merge=None):
+        """
+        Insert DataFrame rows into an existing table in chunks.
+
+        Parameters:
+            conn (sqlalchemy.engine.Connection): Connection with an open transaction.
+            df (pandas.DataFrame): Rows to insert.
+            table_name (str): Target table.
+            keys (list, optional): Key columns; when given, conflicting rows are updated.
+            merge (dict, optional): Columns merged into conflicting rows; see `load`.
+        """
+        if df.empty:
+            return
+        if self.is_postgres(conn):
+            self.copy_insert(conn, df, table_name, keys, merge)
+        else:
+            self.executemany_insert(conn, df, table_name, keys, merge)
+
+    def copy_insert(self, conn, df, table_name, keys=None, merge=None):
+        """Stream rows into PostgreSQL with COPY FROM STDIN, via a temporary table for upserts."""
+        columns = ', '.join(self.quote(conn, column) for column in df.columns)
+        target_table = self.quote(conn, table_name)
+        copy_table = target_table
+        if keys:
+            df = collapse_duplicate_keys(df, keys, merge)
+            copy_table = self.quote(conn, f"{table_name}_upsert")
+            conn.exec_driver_sql(f"CREATE TEMP TABLE {copy_table} (LIKE {target_table} INCLUDING DEFAULTS) ON COMMIT DROP")
+
+        cursor = conn.connection.cursor()
+        try:
+            copy_sql = f"COPY {copy_table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+            for start in range(0, len(df), self.chunksize):
+                buffer = io.StringIO()
+                df.iloc[start:start + self.chunksize].to_csv(buffer, header=False, index=False, na_rep=COPY_NULL, quoting=csv.QUOTE_MINIMAL)
+                buffer.seek(0)
+                cursor.copy_expert(copy_sql, buffer)
+        finally:
+            cursor.close()
+
+        if keys:
+            conn.exec_driver_sql(
+                f"INSERT INTO {target_table} ({columns}) SELECT {columns} FROM {copy_table}"
+                + self.upsert_clause(conn, df.columns, keys, table_name, merge)
+            )
+            conn.exec_driver_sql(f"DROP TABLE {copy_table}")
+
+    def executemany_insert(self, conn, df, table_name, keys=None, merge=None):
+        """Insert rows with chunked executemany, for databases without COPY."""
+        columns = ', '.join(self.quote(conn, column) for column in df.columns)
+        placeholders = ', '.join('?' if conn.dialect.paramstyle == 'qmark' else '%s' for _ in df.columns)
+        sql = f"INSERT INTO {self.quote(conn, table_name)} ({columns}) VALUES ({placeholders})"
+        if keys:
+            sql += self.upsert_clause(conn, df.columns, keys, table_name, merge)
+
+        for start in range(0, len(df), self.chunksize):
+            chunk = df.iloc[start:start + self.chunksize]
+            # Plain Python values, with missing values as NULL
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            rows = [
+                tuple(value.to_pydatetime() if isinstance(value, pd.Timestamp) else value for value in row)
+                for row in chunk.itertuples(index=False, name=None)
+            ]
+            conn.exec_driver_sql(sql, rows)
@@ -1,9 +1,11 @@
-from prometheus_client import start_http_server, Counter, Histogram
-import time
-import json
-import csv
-from avro import datafile, io
+from prometheus_client import start_http_server, Counter, Gauge, Histogram
+from sqlalchemy import event
+import argparse
+import functools
+import inspect
 import logging
+import os
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
@@ -13,115 +15,377 @@ REQUESTS_TOTAL = Counter('advertisex_requests_total', 'Total number of requests
 INGESTION_ERRORS = Counter('advertisex_ingestion_errors_total', 'Total number of ingestion errors')
 PROCESSING_TIME = Histogram('advertisex_processing_time_seconds', 'Histogram of processing times')
 
-# Function to ingest ad impressions data from JSON file
-def ingest_ad_impressions(json_file):
-    try:
-        with open(json_file, 'r') as f:
-            ad_impressions_data = json.load(f)
-        logging.info(f"Ad impressions data ingested successfully from {json_file}")
-        return ad_impressions_data
-    except Exception as e:
-        logging.error(f"Error ingesting ad impressions data from {json_file}: {e}")
-        INGESTION_ERRORS.inc()
-        return []
-
-# Function to ingest clicks and conversions data from CSV file
-def ingest_clicks_conversions(csv_file):
-    try:
-        with open(csv_file, 'r') as f:
-            clicks_conversions_data = list(csv.DictReader(f))
-        logging.info(f"Clicks and conversions data ingested successfully from {csv_file}")
-        return clicks_conversions_data
-    except Exception as e:
-        logging.error(f"Error ingesting clicks and conversions data from {csv_file}: {e}")
-        INGESTION_ERRORS.inc()
-        return []
-
-# Function to ingest bid requests data from Avro file
-def ingest_bid_requests(avro_file):
-    try:
-        with open(avro_file, 'rb') as f:
-            reader = datafile.DataFileReader(f, io.DatumReader())
-            bid_requests_data = [record for record in reader]
-        logging.info(f"Bid requests data ingested successfully from {avro_file}")
-        return bid_requests_data
-    except Exception as e:
-        logging.error(f"Error ingesting bid requests data from {avro_file}: {e}")
-        INGESTION_ERRORS.inc()
-        return []
-
-# Function to process ad impressions data
-def process_ad_impressions(data):
-    logging.info("Processing ad impressions data...")
-    # Implement data validation, transformation, aggregation, correlation, etc.
-    # Example: Extract relevant fields, calculate impressions per website, etc.
-    processed_data = []
-    for impression in data:
-        processed_impression = {
-            "ad_creative_id": impression.get("ad_creative_id"),
-            "user_id": impression.get("user_id"),
-            "timestamp": impression.get("timestamp"),
-            "website_url": impression.get("website_url"),
-            # Additional processing steps can be added here
-        }
-        processed_data.append(processed_impression)
-    time.sleep(1)  # Simulating processing time
-    return processed_data
-
-# Function to process clicks and conversions data
-def process_clicks_conversions(data):
-    logging.info("Processing clicks and conversions data...")
-    # Implement data validation, transformation, aggregation, correlation, etc.
-    # Example: Calculate conversion rates, analyze click-through rates, etc.
-    processed_data = []
-    for entry in data:
-        processed_entry = {
-            "timestamp": entry.get("timestamp"),
-            "user_id": entry.get("user_id"),
-            "ad_campaign_id": entry.get("ad_campaign_id"),
-            "conversion_type": entry.get("conversion_type"),
-            # Additional processing steps can be added here
-        }
-        processed_data.append(processed_entry)
-    time.sleep(1)  # Simulating processing time
-    return processed_data
-
-# Function to process bid requests data
-def process_bid_requests(data):
-    logging.info("Processing bid requests data...")
-    # Implement data validation, transformation, aggregation, correlation, etc.
-    # Example: Analyze bidding patterns, identify top-performing users, etc.
-    processed_data = []
-    for request in data:
-        processed_request = {
-            "bid_amount": request.get("bid_amount"),
-            "user_id": request.get("user_id"),
-            "auction_id": request.get("auction_id"),
-            "ip_address": request.get("ip_address"),
-            # Additional processing steps can be added here
-        }
-        processed_data.append(processed_request)
-    time.sleep(1)  # Simulating processing time
-    return processed_data
+# Metrics referenced by alert.rules.yml
+AD_IMPRESSIONS_TOTAL = Counter('ad_impressions_total', 'Total number of ad impressions processed')
+CLICKS_TOTAL = Counter('clicks_total', 'Total number of clicks and conversions processed')
+TOTAL_BID_REQUESTS = Counter('total_bid_requests_total', 'Total number of bid requests processed')
+SUCCESSFUL_BID_REQUESTS = Counter('successful_bid_requests_total', 'Total number of bid requests that passed validation')
+DATA_VALIDATION_ERRORS = Counter('data_validation_errors_total', 'Total number of rows rejected by validation')
+DATA_INGESTION_ERRORS = Counter('data_ingestion_errors_total', 'Total number of files or batches that failed to ingest')
+VALIDATION_RULE_FAILURES = Counter('advertisex_validation_rule_failures_total', 'Rows failing each validation rule', ['source', 'rule'])
+DATABASE_CONNECTION_ERRORS = Counter('database_connection_errors_total', 'Total number of database connection errors')
+PROCESS_DURATION = Gauge('process_duration_seconds', 'Duration of the last run of each pipeline stage', ['stage'])
+BATCH_DURATION = Histogram(
+    'advertisex_batch_duration_seconds', 'Time to process, validate and store one ingested batch', ['source'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 1.5, 2.5, 5.0, 10.0, 30.0),
+)
+QUERY_EXECUTION_TIME = Gauge('query_execution_time_seconds', 'Duration of the last database statement')
 
-if __name__ == '__main__':
-    # Start Prometheus HTTP server
-    start_http_server(9090)
+# Pipeline metrics
+RECORDS_TOTAL = Counter('advertisex_records_total', 'Records read per source', ['source'])
+BATCH_SIZE = Histogram(
+    'advertisex_batch_size_records', 'Records per ingested batch', ['source'],
+    buckets=(10, 100, 1000, 5000, 10000, 50000, 100000, 500000, 1000000),
+)
+STAGE_DURATION = Histogram('advertisex_stage_duration_seconds', 'Latency of pipeline stages', ['stage'])
+DB_WRITE_DURATION = Histogram('advertisex_db_write_seconds', 'Duration of bulk table loads', ['table'])
+DB_ROWS_WRITTEN = Counter('advertisex_db_rows_written_total', 'Rows loaded into the database', ['table'])
+QUERY_DURATION = Histogram('advertisex_query_duration_seconds', 'Duration of database statements')
+GEOIP_CACHE_HITS = Gauge('advertisex_geoip_cache_hits', 'GeoIP cache hits in this process')
+GEOIP_CACHE_MISSES = Gauge('advertisex_geoip_cache_misses', 'GeoIP cache misses in this process')
+DEDUP_DUPLICATES = Counter('advertisex_dedup_duplicates_total', 'Duplicate events dropped', ['keys'])
+DEDUP_LATE_ROWS = Counter('advertisex_dedup_late_rows_total', 'Events too late to be checked for duplicates', ['keys'])
+DEDUP_MEMORY = Gauge('advertisex_dedup_memory_bytes', 'Memory used by remembered event hashes', ['keys'])
+PIPELINE_QUEUE_DEPTH = Gauge('advertisex_pipeline_queue_depth', 'Items waiting in front of each pipeline stage', ['stage'])
+PIPELINE_STAGE_ROWS = Counter('advertisex_pipeline_stage_rows_total', 'Rows output by each pipeline stage', ['stage'])
+PIPELINE_STAGE_ITEMS = Counter('advertisex_pipeline_stage_items_total', 'Items processed by each pipeline stage', ['stage'])
+RUN_DURATION = Histogram('advertisex_run_duration_seconds', 'Duration of one ingestion run over the data directory')
+GEOIP_CACHE_HIT_RATIO = Gauge('advertisex_geoip_cache_hit_ratio', 'GeoIP cache hit ratio in this process')
+INPUT_BYTES = Counter('advertisex_input_bytes_total', 'Bytes of compressed input read and decompressed', ['codec', 'kind'])
+DECOMPRESS_SECONDS = Counter('advertisex_decompress_seconds_total', 'Time spent decompressing input files', ['codec'])
+DECOMPRESS_THROUGHPUT = Gauge('advertisex_decompress_mb_per_second', 'Decompressed MB/s of the last input file', ['codec'])
+
+# Per-source record counters used by the alert rules
+SOURCE_COUNTERS = {
+    'ad_impressions': AD_IMPRESSIONS_TOTAL,
+    'clicks_conversions': CLICKS_TOTAL,
+    'bid_requests': TOTAL_BID_REQUESTS,
+}
+
+# DataProcessor methods instrumented as stages, with the source whose records they count
+PROCESSOR_STAGES = {
+    'process_ad_impressions': 'ad_impressions',
+    'process_clicks_conversions': 'clicks_conversions',
+    'process_bid_requests': 'bid_requests',
+    'process_shards': None,
+    'correlate_data': None,
+    'filter_data': None,
+    'deduplicate_data': None,
+}
+
+def record_stage(stage, seconds):
+    """Record the latency of one run of a pipeline stage."""
+    STAGE_DURATION.labels(stage).observe(seconds)
+    PROCESS_DURATION.labels(stage).set(seconds)
+    PROCESSING_TIME.observe(seconds)
+
+def record_batch(source, records):
+    """Record an ingested batch of records."""
+    RECORDS_TOTAL.labels(source).inc(records)
+    BATCH_SIZE.labels(source).observe(records)
+
+def record_ingestion_error():
+    """Record a file or batch that failed to ingest."""
+    INGESTION_ERRORS.inc()
+    DATA_INGESTION_ERRORS.inc()
+
+def instrument_reader(func, source):
+    """
+    Wrap a synchronous whole-file reader with record, latency and error metrics.
+
+    Parameters:
+        func (callable): Reader returning a list of records.
+        source (str): Source the reader ingests.
+
+    Returns:
+        callable: The wrapped reader.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            records = func(*args, **kwargs)
+        except Exception:
+            record_ingestion_error()
+            raise
+        record_stage(f"read_{source}", time.perf_counter() - start_time)
+        record_batch(source, len(records))
+        return records
+    return wrapper
+
+def instrument_batches(func, source=None):
+    """
+    Wrap a batch generator (sync or async) with per-batch record metrics.
+
+    Parameters:
+        func (callable): Generator function yielding batches, or (batch, position) pairs.
+        source (str, optional): Source the generator ingests. By default it is derived
+            from the path passed as the first argument.
+
+    Returns:
+        callable: The wrapped generator function.
+    """
+    from ingest import source_for_path
+
+    def batch_records(item):
+        return len(item[0]) if isinstance(item, tuple) else len(item)
+
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def wrapper(path, *args, **kwargs):
+            batch_source = source or source_for_path(path)
+            try:
+                async for item in func(path, *args, **kwargs):
+                    record_batch(batch_source, batch_records(item))
+                    yield item
+            except Exception:
+                record_ingestion_error()
+                raise
+        return wrapper
+
+    @functools.wraps(func)
+    def wrapper(path, *args, **kwargs):
+        batch_source = source or source_for_path(path)
+        try:
+            for item in func(path, *args, **kwargs):
+                record_batch(batch_source, batch_records(item))
+                yield item
+        except Exception:
+            record_ingestion_error()
+            raise
+    return wrapper
+
+def instrument_stage(func, stage, source=None):
+    """
+    Wrap a DataProcessor method with stage latency and processed record metrics.
+
+    Parameters:
+        func (callable): Method to wrap.
+        stage (str): Stage label.
+        source (str, optional): Source whose alert-rule counter counts the output rows.
+
+    Returns:
+        callable: The wrapped method.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        result = func(*args, **kwargs)
+        record_stage(stage, time.perf_counter() - start_time)
+        if source is not None and result is not None:
+            SOURCE_COUNTERS[source].inc(len(result))
+        return result
+    return wrapper
+
+def instrument_validation(func):
+    """Wrap DataProcessor.validate_data to count rejected rows and successful bid requests."""
+    @functools.wraps(func)
+    def wrapper(self, df, *args, **kwargs):
+        start_time = time.perf_counter()
+        result = func(self, df, *args, **kwargs)
+        record_stage('validate_data', time.perf_counter() - start_time)
+        DATA_VALIDATION_ERRORS.inc(len(df) - len(result))
+        if 'bid_amount' in result.columns:
+            SUCCESSFUL_BID_REQUESTS.inc(len(result))
+        return result
+    return wrapper
+
+def instrument_rules(func):
+    """Wrap RuleSet.apply to count failures per source and rule."""
+    @functools.wraps(func)
+    def wrapper(self, df, *args, **kwargs):
+        result = func(self, df, *args, **kwargs)
+        for rule, failures in result['counts'].items():
+            if failures:
+                VALIDATION_RULE_FAILURES.labels(self.source or 'unknown', rule).inc(failures)
+        return result
+    return wrapper
+
+def instrument_load(func):
+    """Wrap BulkLoader.load with per-table write timings and row counts."""
+    @functools.wraps(func)
+    def wrapper(self, df, table_name, *args, **kwargs):
+        start_time = time.perf_counter()
+        stats = func(self, df, table_name, *args, **kwargs)
+        DB_WRITE_DURATION.labels(table_name).observe(time.perf_counter() - start_time)
+        DB_ROWS_WRITTEN.labels(table_name).inc(len(df))
+        return stats
+    return wrapper
+
+def instrument_dedup(func):
+    """Wrap StreamingDeduplicator.deduplicate with dropped-duplicate, late-row and memory metrics."""
+    @functools.wraps(func)
+    def wrapper(self, df, *args, **kwargs):
+        dropped, late = self.duplicates_dropped, self.late_rows
+        result = func(self, df, *args, **kwargs)
+        keys = ','.join(self.keys or [])
+        DEDUP_DUPLICATES.labels(keys).inc(self.duplicates_dropped - dropped)
+        DEDUP_LATE_ROWS.labels(keys).inc(self.late_rows - late)
+        DEDUP_MEMORY.labels(keys).set(self.memory_bytes)
+        return result
+    return wrapper
 
-    # Ingest data from files
-    ad_impressions_data = ingest_ad_impressions('ad_impressions.json')
-    clicks_conversions_data = ingest_clicks_conversions('clicks_conversions.csv')
-    bid_requests_data = ingest_bid_requests('bid_requests.avro')
+def instrument_pipeline_stage(func):
+    """Wrap pipeline.Stage.record with per-stage item, row, latency and queue depth metrics."""
+    @functools.wraps(func)
+    def wrapper(self, rows, seconds, queue_depth):
+        func(self, rows, seconds, queue_depth)
+        PIPELINE_STAGE_ITEMS.labels(self.name).inc()
+        PIPELINE_STAGE_ROWS.labels(self.name).inc(rows)
+        PIPELINE_QUEUE_DEPTH.labels(self.name).set(queue_depth)
+        record_stage(f"pipeline_{self.name}", seconds)
+    return wrapper
 
-    # Process data and record metrics
-    start_time = time.time()
+def instrument_decompression(func):
+    """Wrap decompress.record_read with compressed/raw byte, time and throughput metrics."""
+    from decompress import throughput
+
+    @functools.wraps(func)
+    def wrapper(path, codec, compressed_bytes, raw_bytes, seconds, threads=1):
+        func(path, codec, compressed_bytes, raw_bytes, seconds, threads)
+        INPUT_BYTES.labels(codec, 'compressed').inc(compressed_bytes)
+        INPUT_BYTES.labels(codec, 'raw').inc(raw_bytes)
+        DECOMPRESS_SECONDS.labels(codec).inc(seconds)
+        if seconds > 0:
+            DECOMPRESS_THROUGHPUT.labels(codec).set(throughput(raw_bytes, seconds))
+    return wrapper
+
+def instrument_ingestor_batch(func):
+    """Wrap checkpoint.IncrementalIngestor.record with the per-batch duration histogram."""
+    @functools.wraps(func)
+    def wrapper(self, source, rows, seconds):
+        func(self, source, rows, seconds)
+        BATCH_DURATION.labels(source).observe(seconds)
+    return wrapper
+
+def instrument_engine(engine):
+    """
+    Record statement timings and connection errors of a SQLAlchemy engine.
+
+    Parameters:
+        engine (sqlalchemy.engine.Engine): Engine to instrument.
+    """
+    if getattr(engine, 'metrics_instrumented', False):
+        return
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_times', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_start_times'].pop()
+        QUERY_DURATION.observe(seconds)
+        QUERY_EXECUTION_TIME.set(seconds)
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        if context.is_disconnect or context.connection is None:
+            DATABASE_CONNECTION_ERRORS.inc()
+
+    engine.metrics_instrumented = True
+
+def instrument_geoip():
+    """Expose the GeoIP cache statistics of this process as gauges."""
+    import geoip
+
+    def resolver_stats():
+        resolvers = [resolver for (pid, _), resolver in geoip._resolvers.items() if pid == os.getpid()]
+        return sum(r.hits for r in resolvers), sum(r.misses for r in resolvers)
+
+    def hit_ratio():
+        hits, misses = resolver_stats()
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    GEOIP_CACHE_HITS.set_function(lambda: resolver_stats()[0])
+    GEOIP_CACHE_MISSES.set_function(lambda: resolver_stats()[1])
+    GEOIP_CACHE_HIT_RATIO.set_function(hit_ratio)
+
+_instrumented = False
+
+def instrument_pipeline():
+    """
+    Instrument the real ingestion functions, DataProcessor methods and bulk loader.
+
+    Wrappers are installed on the `ingest` module (including its reader
+    lookup tables), the DataProcessor class and BulkLoader, so every caller in
+    this process is measured. Calling this more than once has no effect.
+    """
+    global _instrumented
+    if _instrumented:
+        return
+    import checkpoint
+    import decompress
+    import dedup
+    import ingest
+    import loader
+    import pipeline
+    import rules
+    from process import DataProcessor
+
+    for name, source in (
+        ('read_ad_impressions', 'ad_impressions'),
+        ('read_clicks_conversions', 'clicks_conversions'),
+        ('read_bid_requests', 'bid_requests'),
+    ):
+        original = getattr(ingest, name)
+        wrapped = instrument_reader(original, source)
+        setattr(ingest, name, wrapped)
+        for extension, reader in ingest.FILE_READERS.items():
+            if reader is original:
+                ingest.FILE_READERS[extension] = wrapped
+
+    ingest.stream_file = instrument_batches(ingest.stream_file)
+    ingest.iter_file_from = instrument_batches(ingest.iter_file_from)
+
+    for method, source in PROCESSOR_STAGES.items():
+        setattr(DataProcessor, method, instrument_stage(getattr(DataProcessor, method), method, source))
+    DataProcessor.validate_data = instrument_validation(DataProcessor.validate_data)
+    rules.RuleSet.apply = instrument_rules(rules.RuleSet.apply)
+    loader.BulkLoader.load = instrument_load(loader.BulkLoader.load)
+    dedup.StreamingDeduplicator.deduplicate = instrument_dedup(dedup.StreamingDeduplicator.deduplicate)
+    pipeline.Stage.record = instrument_pipeline_stage(pipeline.Stage.record)
+    decompress.record_read = instrument_decompression(decompress.record_read)
+    checkpoint.IncrementalIngestor.record = instrument_ingestor_batch(checkpoint.IncrementalIngestor.record)
+    instrument_geoip()
+    _instrumented = True
+    logging.info("Pipeline instrumentation installed")
+
+def serve(port=9090):
+    """
+    Instrument the pipeline and start the Prometheus HTTP endpoint.
+
+    Parameters:
+        port (int): Port to expose /metrics on.
+    """
+    instrument_pipeline()
+    start_http_server(port)
+    logging.info(f"Serving Prometheus metrics on port {port}")
+
+if __name__ == '__main__':
+    # Configure command-line arguments
+    parser = argparse.ArgumentParser(description='Instrumented AdvertiseX Pipeline')
+    parser.add_argument('--port', type=int, default=9090, help='Port to expose Prometheus metrics on')
+    parser.add_argument('--data-dir', default='data/', help='Directory or glob pattern of data files')
+    parser.add_argument('--interval', type=float, default=60, help='Seconds between ingestion runs')
+    args = parser.parse_args()
+
+    # Start Prometheus HTTP server
+    serve(args.port)
 
-    processed_ad_impressions = process_ad_impressions(ad_impressions_data)
-    processed_clicks_conversions = process_clicks_conversions(clicks_conversions_data)
-    processed_bid_requests = process_bid_requests(bid_requests_data)
+    from checkpoint import IncrementalIngestor
+    from process import processor
+    instrument_engine(processor.engine)
+    # Batches are validated so the bid request success and validation error counters move
+    ingestor = IncrementalIngestor(processor, validate=True)
 
-    processing_time = time.time() - start_time
-    PROCESSING_TIME.observe(processing_time)
+    # Load new data on every interval for as long as the process runs
+    while True:
+        start_time = time.perf_counter()
+        ingestor.run(args.data_dir)
+        # A whole run is not a stage: it grows with the data, so keep it out of process_duration_seconds
+        RUN_DURATION.observe(time.perf_counter() - start_time)
 
-    # Increment request counter
-    REQUESTS_TOTAL.inc()
\ No newline at end of file
+        # Increment request counter
+        REQUESTS_TOTAL.inc()
+        time.sleep(args.interval)
@@ -0,0 +1,337 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import threading
+
+import pandas as pd
+from sqlalchemy import text
+
+import db
+from loader import BulkLoader
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+CATALOG_TABLE = 'partitions'
+DAY_FORMAT = '%Y-%m-%d'
+# Bid requests carry no event time, so they are partitioned by the time they were stored
+INGESTED_COLUMN = 'ingested_at'
+PARTITION_COLUMNS = {
+    'ad_impressions': 'timestamp',
+    'clicks_conversions': 'timestamp',
+    'bid_requests': INGESTED_COLUMN,
+}
+# Every partition gets an index on each of these columns it has
+INDEX_COLUMNS = ['user_id', 'ad_campaign_id', 'ad_creative_id', 'auction_id']
+
+def to_day(value):
+    """Get the date of a timestamp, date or date string."""
+    return pd.Timestamp(value).date()
+
+class PartitionedStore:
+    """
+    Store each source in daily partition tables, e.g. 'ad_impressions_p20240401'.
+
+    Rows are split by the day of their partition column (`timestamp`, or the
+    time they were stored for bid requests). Each partition is indexed on the
+    partition column and the user, campaign, creative and auction columns it
+    has, and is registered in a catalog table with its row count and a
+    version that increases with every write. Queries read the catalog to
+    visit only the partitions overlapping their time range, and old
+    partitions are dropped or archived to Parquet files with `prune`.
+
+    Plain tables are used rather than PostgreSQL declarative partitioning so
+    that the same layout works on SQLite.
+    """
+
+    def __init__(self, engine, loader=None, catalog_table=CATALOG_TABLE, partition_columns=None, index_columns=None):
+        """
+        Parameters:
+            engine (sqlalchemy.engine.Engine): Engine to store through.
+            loader (BulkLoader, optional): Loader used to insert rows; a new one by default.
+            catalog_table (str): Name of the partition catalog table.
+            partition_columns (dict, optional): Sources mapped to the column they are
+                partitioned on; see PARTITION_COLUMNS.
+            index_columns (list, optional): Columns indexed in every partition that has them.
+        """
+        self.engine = engine
+        self.loader = loader or BulkLoader(engine)
+        self.catalog_table = catalog_table
+        self.partition_columns = partition_columns or PARTITION_COLUMNS
+        self.index_columns = index_columns or INDEX_COLUMNS
+        # Partition tables known to exist, so creating them is checked once per process
+        self.created = set()
+        self.lock = threading.Lock()
+        with db.begin(self.engine) as conn:
+            self.create_catalog(conn)
+
+    def create_catalog(self, conn):
+        """Create the partition catalog table if it does not exist."""
+        conn.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {self.loader.quote(conn, self.catalog_table)} ("
+            "table_name VARCHAR(255) PRIMARY KEY, "
+            "source VARCHAR(64) NOT NULL, "
+            "day CHAR(10) NOT NULL, "
+            "row_count BIGINT NOT NULL DEFAULT 0, "
+            "version BIGINT NOT NULL DEFAULT 0, "
+            "archive_path TEXT)"
+        )
+        index_name = self.loader.quote(conn, f"{self.catalog_table}_source_day_idx")
+        conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {index_name} ON {self.loader.quote(conn, self.catalog_table)} (source, day)")
+
+    def partition_column(self, source):
+        """Get the column a source is partitioned on."""
+        return self.partition_columns.get(source, 'timestamp')
+
+    def partition_name(self, source, day):
+        """Get the name of a source's partition table for a day."""
+        return f"{source}_p{to_day(day):%Y%m%d}"
+
+    def write(self, df, source, conn=None):
+        """
+        Append rows to the daily partitions of a source, creating new partitions as needed.
+
+        Parameters:
+            df (pandas.DataFrame): Processed rows of one source.
+            source (str): Source of the rows.
+            conn (sqlalchemy.engine.Connection, optional): Connection with an open
+                transaction to write in; a new transaction by default.
+
+        Returns:
+            dict: Partition table names mapped to the number of rows written.
+        """
+        column = self.partition_column(source)
+        if column not in df.columns:
+            if column != INGESTED_COLUMN:
+                raise ValueError(f"Cannot partition {source} data without a '{column}' column")
+            df = df.assign(**{INGESTED_COLUMN: pd.Timestamp.now().floor('s')})
+        days = pd.to_datetime(df[column]).dt.floor('D')
+        if days.isna().any():
+            logging.warning(f"Skipping {int(days.isna().sum())} {source} rows without a {column}")
+
+        groups = [(self.partition_name(source, day), day, rows) for day, rows in df.groupby(days.to_numpy(), sort=True)]
+        if conn is None:
+            self.create_partitions(source, groups)
+            with db.begin(self.engine) as conn:
+                return self._write(conn, source, groups)
+        # In the caller's transaction, partitions are created along with their first rows
+        for table_name, day, rows in groups:
+            self.create_partition(conn, rows, source, table_name, day)
+        return self._write(conn, source, groups)
+
+    def _write(self, conn, source, groups):
+        written = {}
+        for table_name, _, rows in groups:
+            self.loader.insert(conn, rows, table_name)
+            conn.execute(
+                text(f"UPDATE {self.loader.quote(conn, self.catalog_table)} "
+                     "SET row_count = row_count + :rows, version = version + 1 WHERE table_name = :table_name"),
+                {'rows': len(rows), 'table_name': table_name},
+            )
+            written[table_name] = len(rows)
+        if written:
+            logging.info(f"Stored {sum(written.values())} {source} rows in {len(written)} partitions")
+        return written
+
+    def create_partitions(self, source, groups):
+        """
+        Create missing partitions in their own transaction.
+
+        Partitions are committed before rows are written to them, so concurrent
+        writers of the same day find the table instead of racing to create it.
+        """
+        with self.lock:
+            missing = [(table_name, day, rows) for table_name, day, rows in groups if table_name not in self.created]
+            if missing:
+                with db.begin(self.engine) as conn:
+                    for table_name, day, rows in missing:
+                        self.create_partition(conn, rows, source, table_name, day)
+                self.created.update(table_name for table_name, _, _ in missing)
+
+    def create_partition(self, conn, df, source, table_name, day):
+        """Create a partition table with its indexes and register it in the catalog, unless it exists."""
+        self.loader.create_table(conn, df, table_name)
+        for column in [self.partition_column(source)] + self.index_columns:
+            if column in df.columns:
+                index_name = self.loader.quote(conn, f"{table_name}_{column}_idx")
+                conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {index_name} ON {self.loader.quote(conn, table_name)} ({self.loader.quote(conn, column)})")
+        conn.execute(
+            text(f"INSERT INTO {self.loader.quote(conn, self.catalog_table)} (table_name, source, day) "
+                 "VALUES (:table_name, :source, :day) ON CONFLICT (table_name) DO NOTHING"),
+            {'table_name': table_name, 'source': source, 'day': f"{to_day(day):{DAY_FORMAT}}"},
+        )
+
+    def partitions(self, source=None, start=None, end=None, archived=False, conn=None):
+        """
+        List partitions from the catalog, pruned to a time range.
+
+        Parameters:
+            source (str, optional): Only partitions of this source; all sources by default.
+            start (str or datetime, optional): Only partitions with rows at or after this time.
+            end (str or datetime, optional): Only partitions with rows before this time.
+            archived (bool): List archived partitions instead of live ones.
+            conn (sqlalchemy.engine.Connection, optional): Connection to read the catalog on.
+
+        Returns:
+            pandas.DataFrame: One row per partition (table_name, source, day,
+            row_count, version, archive_path), ordered by source and day.
+        """
+        conditions = ['archive_path IS NOT NULL' if archived else 'archive_path IS NULL']
+        params = {}
+        if source is not None:
+            conditions.append('source = :source')
+            params['source'] = source
+        if start is not None:
+            conditions.append('day >= :start_day')
+            params['start_day'] = f"{to_day(start):{DAY_FORMAT}}"
+        if end is not None:
+            # A partition starting at `end` holds no rows before it
+            end = pd.Timestamp(end)
+            last_day = end.date() - datetime.timedelta(days=1) if end == end.floor('D') else end.date()
+            conditions.append('day <= :end_day')
+            params['end_day'] = f"{last_day:{DAY_FORMAT}}"
+
+        query = (f"SELECT table_name, source, day, row_count, version, archive_path FROM {self.engine.dialect.identifier_preparer.quote(self.catalog_table)} "
+                 f"WHERE {' AND '.join(conditions)} ORDER BY source, day")
+        if conn is None:
+            with db.connect(self.engine) as conn:
+                return pd.read_sql(text(query), conn, params=params)
+        return pd.read_sql(text(query), conn, params=params)
+
+    def select(self, catalog, source, start=None, end=None, columns=None, where=None, quote=None):
+        """
+        Build a query over the partitions listed in a catalog, filtered to a time range.
+
+        Only partitions cut by the range filter on the partition column; the
+        ones it covers entirely are read without a predicate.
+
+        Parameters:
+            catalog (pandas.DataFrame): Partitions to read, as returned by `partitions`.
+            source (str): Source of the partitions.
+            start (str or datetime, optional): Only rows at or after this time.
+            end (str or datetime, optional): Only rows before this time.
+            columns (list, optional): Columns to select; all by default.
+            where (str, optional): SQL condition added to every partition's WHERE
+                clause, so each partition can use its own indexes.
+            quote (callable, optional): Identifier quoting; the engine dialect's by default.
+
+        Returns:
+            tuple: SQL text of a UNION ALL of the partitions (None without
+            partitions) and its bound parameters.
+        """
+        quote = quote or self.engine.dialect.identifier_preparer.quote
+        column = quote(self.partition_column(source))
+        selected = ', '.join(quote(name) for name in columns) if columns else '*'
+        params = {}
+        if start is not None:
+            params['start'] = pd.Timestamp(start).to_pydatetime()
+        if end is not None:
+            params['end'] = pd.Timestamp(end).to_pydatetime()
+
+        selects = []
+        for partition in catalog.itertuples(index=False):
+            day_start = pd.Timestamp(partition.day)
+            conditions = [f"({where})"] if where else []
+            if start is not None and pd.Timestamp(start) > day_start:
+                conditions.append(f"{column} >= :start")
+            if end is not None and pd.Timestamp(end) < day_start + pd.Timedelta(days=1):
+                conditions.append(f"{column} < :end")
+            clause = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+            selects.append(f"SELECT {selected} FROM {quote(partition.table_name)}{clause}")
+        return (' UNION ALL '.join(selects) or None), params
+
+    def read(self, source, start=None, end=None, columns=None):
+        """
+        Read a source's rows in a time range, visiting only the partitions it overlaps.
+
+        Parameters:
+            source (str): Source to read.
+            start (str or datetime, optional): Only rows at or after this time.
+            end (str or datetime, optional): Only rows before this time.
+            columns (list, optional): Columns to read; all by default.
+
+        Returns:
+            pandas.DataFrame: The rows, in partition order.
+        """
+        with db.connect(self.engine) as conn:
+            catalog = self.partitions(source, start, end, conn=conn)
+            query, params = self.select(catalog, source, start, end, columns)
+            if query is None:
+                return pd.DataFrame(columns=columns)
+            return pd.read_sql(text(query), conn, params=params)
+
+    def prune(self, source=None, before=None, keep_days=None, archive_dir=None):
+        """
+        Drop partitions older than a cutoff day, archiving them first if asked.
+
+        Parameters:
+            source (str, optional): Only prune this source; all sources by default.
+            before (str or date, optional): Drop partitions of days before this one.
+            keep_days (int, optional): Keep this many days per source, counted back
+                from its newest partition, so retention follows event time rather
+                than the wall clock. Used when `before` is not given.
+            archive_dir (str, optional): Write each partition to
+                '<archive_dir>/<source>/<day>.parquet' before dropping it; archived
+                partitions stay in the catalog with their archive path.
+
+        Returns:
+            list: Names of the dropped partition tables.
+        """
+        if before is None and keep_days is None:
+            raise ValueError("Either before or keep_days is required")
+        catalog = self.partitions(source)
+        if before is not None:
+            expired = catalog[catalog['day'] < f"{to_day(before):{DAY_FORMAT}}"]
+        else:
+            newest = pd.to_datetime(catalog.groupby('source')['day'].transform('max'))
+            expired = catalog[pd.to_datetime(catalog['day']) <= newest - pd.Timedelta(days=keep_days)]
+
+        dropped = []
+        for partition in expired.itertuples(index=False):
+            with db.begin(self.engine) as conn:
+                archive_path = None
+                if archive_dir:
+                    archive_path = os.path.join(archive_dir, partition.source, f"{partition.day}.parquet")
+                    os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+                    pd.read_sql(text(f"SELECT * FROM {self.loader.quote(conn, partition.table_name)}"), conn).to_parquet(archive_path, index=False)
+                    conn.execute(
+                        text(f"UPDATE {self.loader.quote(conn, self.catalog_table)} "
+                             "SET archive_path = :archive_path, version = version + 1 WHERE table_name = :table_name"),
+                        {'archive_path': archive_path, 'table_name': partition.table_name},
+                    )
+                else:
+                    conn.execute(
+                        text(f"DELETE FROM {self.loader.quote(conn, self.catalog_table)} WHERE table_name = :table_name"),
+                        {'table_name': partition.table_name},
+                    )
+                self.loader.drop_table(conn, partition.table_name)
+            with self.lock:
+                self.created.discard(partition.table_name)
+            dropped.append(partition.table_name)
+            logging.info(f"Dropped partition '{partition.table_name}'" + (f", archived to {archive_path}" if archive_path else ''))
+        return dropped
+
+if __name__ == '__main__':
+    # Configure command-line arguments
+    parser = argparse.ArgumentParser(description='Manage daily partitions of the AdvertiseX tables')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    list_parser = subparsers.add_parser('list', help='List live or archived partitions')
+    list_parser.add_argument('--source', help='Only this source')
+    list_parser.add_argument('--archived', action='store_true', help='List archived partitions')
+    prune_parser = subparsers.add_parser('prune', help='Drop or archive old partitions')
+    prune_parser.add_argument('--source', help='Only this source')
+    prune_parser.add_argument('--before', help='Drop partitions of days before this date (YYYY-MM-DD)')
+    prune_parser.add_argument('--keep-days', type=int, help='Days to keep per source, counted back from its newest partition')
+    prune_parser.add_argument('--archive-dir', help='Archive partitions to Parquet files here before dropping them')
+    args = parser.parse_args()
+
+    from process import processor
+    store = processor.partitions
+    if args.command == 'list':
+        print(store.partitions(args.source, archived=args.archived).to_string(index=False))
+    else:
+        dropped = store.prune(args.source, args.before, args.keep_days, args.archive_dir)
+        logging.info(f"Pruned partitions: {json.dumps(dropped)}")
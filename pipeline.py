@@ -0,0 +1,403 @@
+import argparse
+import asyncio
+import concurrent.futures
+import io
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import pandas as pd
+
+import db
+from avro_reader import decode_range, split_ranges
+from batches import RecordBatch
+from decompress import open_input
+from ingest import DEFAULT_DATA_DIR, data_extension, discover_files, source_for_path
+from schemas import read_csv_typed
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+DEFAULT_CHUNK_BYTES = 8 << 20  # 8 MiB of raw input per parse task
+DEFAULT_QUEUE_SIZE = 4
+DEFAULT_WRITE_CONCURRENCY = 2
+
+# Marks the end of a stage's input
+_DONE = object()
+
+def item_rows(item):
+    """Count the rows of the DataFrames or RecordBatches in a stage result (one, or a tuple holding them)."""
+    if isinstance(item, (pd.DataFrame, RecordBatch)):
+        return len(item)
+    if isinstance(item, tuple):
+        return sum(len(value) for value in item if isinstance(value, (pd.DataFrame, RecordBatch)))
+    return 0
+
+class Stage:
+    """
+    One step of a Pipeline.
+
+    `func` takes an item and returns the item for the next stage, or None to
+    drop it. It runs `concurrency` times in parallel: directly on the event
+    loop for coroutine functions, in threads with executor='thread', or in a
+    pool of `concurrency` processes with executor='process' (then `func` and
+    its items must be picklable). An item failing a stage is logged and
+    dropped, unless the stage is created with fail=True: then the error
+    stops the pipeline and is raised by `Pipeline.run`.
+    """
+
+    def __init__(self, name, func, concurrency=1, executor=None, queue_size=DEFAULT_QUEUE_SIZE, fail=False):
+        """
+        Parameters:
+            name (str): Stage name used in statistics and metrics.
+            func (callable): Function or coroutine function processing one item.
+            concurrency (int): Items processed at the same time.
+            executor (str, optional): None, 'thread' or 'process'.
+            queue_size (int): Items that may wait for this stage before upstream stages block.
+            fail (bool): Stop the pipeline on the first failing item instead of dropping it.
+        """
+        if executor not in (None, 'thread', 'process'):
+            raise ValueError(f"Unknown executor: {executor}")
+        self.name = name
+        self.func = func
+        self.concurrency = concurrency
+        self.executor = executor
+        self.queue_size = queue_size
+        self.fail = fail
+        self.items = 0
+        self.rows = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+
+    def record(self, rows, seconds, queue_depth):
+        """Record one processed item; metrics.py wraps this to export it."""
+        self.items += 1
+        self.rows += rows
+        self.busy_seconds += seconds
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+class Pipeline:
+    """
+    Stages connected by bounded asyncio queues.
+
+    Every stage pulls from its own queue and pushes into the next one, so
+    reading, parsing, enrichment and writing overlap. Queues hold at most
+    `queue_size` items: when a downstream stage (e.g. the database) falls
+    behind, the stages before it block on a full queue instead of buffering,
+    which bounds memory by the queue sizes. Items failing a stage are logged
+    and dropped, so one bad file or batch does not stop the pipeline, except
+    in stages created with fail=True, whose errors stop it.
+    """
+
+    def __init__(self, source, stages):
+        """
+        Parameters:
+            source (iterable or async iterable): Items fed to the first stage.
+            stages (list): Stage objects, in order.
+        """
+        self.source = source
+        self.stages = stages
+        self.queues = None
+        self.wall_seconds = 0.0
+
+    async def feed(self):
+        queue = self.queues[0]
+        if hasattr(self.source, '__aiter__'):
+            async for item in self.source:
+                await queue.put(item)
+        else:
+            for item in self.source:
+                await queue.put(item)
+        for _ in range(self.stages[0].concurrency):
+            await queue.put(_DONE)
+
+    async def call(self, stage, pool, item):
+        if stage.executor == 'process':
+            return await asyncio.get_running_loop().run_in_executor(pool, stage.func, item)
+        if stage.executor == 'thread':
+            return await asyncio.to_thread(stage.func, item)
+        result = stage.func(item)
+        return await result if asyncio.iscoroutine(result) else result
+
+    async def worker(self, index, pool):
+        stage = self.stages[index]
+        queue = self.queues[index]
+        next_queue = self.queues[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            depth = queue.qsize()
+            start_time = time.perf_counter()
+            try:
+                result = await self.call(stage, pool, item)
+            except Exception as e:
+                stage.errors += 1
+                logging.error(f"Pipeline stage {stage.name} failed: {e}")
+                if stage.fail:
+                    raise
+                continue
+            stage.record(item_rows(result), time.perf_counter() - start_time, depth)
+            if next_queue is not None and result is not None:
+                await next_queue.put(result)
+
+    async def run_stage(self, index, pool):
+        stage = self.stages[index]
+        await asyncio.gather(*(self.worker(index, pool) for _ in range(stage.concurrency)))
+        if index + 1 < len(self.stages):
+            for _ in range(self.stages[index + 1].concurrency):
+                await self.queues[index + 1].put(_DONE)
+
+    async def run(self):
+        """
+        Run every item through the stages.
+
+        Returns:
+            dict: Per-stage statistics; see `stats`.
+
+        Raises:
+            Exception: The first error of a stage created with fail=True.
+        """
+        self.queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        pools = {
+            index: concurrent.futures.ProcessPoolExecutor(max_workers=stage.concurrency)
+            for index, stage in enumerate(self.stages) if stage.executor == 'process'
+        }
+        start_time = time.perf_counter()
+        tasks = [asyncio.ensure_future(self.feed())]
+        tasks.extend(asyncio.ensure_future(self.run_stage(index, pools.get(index))) for index in range(len(self.stages)))
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Stages blocked on a queue the failed stage no longer drains would never finish
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            for pool in pools.values():
+                pool.shutdown()
+            self.wall_seconds = time.perf_counter() - start_time
+        return self.stats()
+
+    def queue_depths(self):
+        """Get the number of items waiting for each stage."""
+        return {stage.name: queue.qsize() for stage, queue in zip(self.stages, self.queues or [])}
+
+    def stats(self):
+        """
+        Get per-stage statistics.
+
+        Returns:
+            dict: Stage names mapped to items, rows and errors, seconds spent
+            processing, rows per second of wall time, and the deepest its input
+            queue got. 'wall_seconds' holds the duration of the run.
+        """
+        stats = {
+            stage.name: {
+                'items': stage.items,
+                'rows': stage.rows,
+                'errors': stage.errors,
+                'busy_seconds': round(stage.busy_seconds, 6),
+                'rows_per_second': round(stage.rows / self.wall_seconds, 1) if self.wall_seconds else None,
+                'max_queue_depth': stage.max_queue_depth,
+            }
+            for stage in self.stages
+        }
+        stats['wall_seconds'] = round(self.wall_seconds, 6)
+        return stats
+
+# Function to split a CSV or JSON file into raw chunks, run in a worker thread
+def text_chunks(path, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Split a CSV or JSON file into independently parseable chunks.
+
+    Uncompressed files are read from a memory map; gzip and zstd files are
+    decompressed on the fly by a background thread, so no decompressed copy
+    is staged on disk.
+
+    Parameters:
+        path (str): Path to a CSV, JSON or JSON Lines file, optionally compressed.
+        chunk_bytes (int): Approximate (decompressed) bytes per chunk.
+
+    Yields:
+        tuple: (kind, payload) with kind 'csv', 'jsonl' or 'json'.
+    """
+    extension = data_extension(path)
+    with open_input(path, mapped=True) as f:
+        data = f.read(chunk_bytes)
+        while data.isspace():
+            more = f.read(chunk_bytes)
+            if not more:
+                break
+            data += more
+        if extension != '.csv' and data.lstrip()[:1] == b'[':
+            yield 'json', data + f.read()
+            return
+        header = b''
+        if extension == '.csv':
+            if b'\n' not in data:
+                data += f.readline()
+            newline = data.find(b'\n') + 1 or len(data)
+            header, data = data[:newline], data[newline:]
+        kind = 'csv' if extension == '.csv' else 'jsonl'
+        rest = b''
+        while data:
+            buffer = rest + data
+            cut = buffer.rfind(b'\n') + 1
+            # Do not cut inside a quoted CSV field that spans lines
+            while kind == 'csv' and cut and buffer.count(b'"', 0, cut) % 2:
+                cut = buffer.rfind(b'\n', 0, cut - 1) + 1
+            if cut:
+                yield kind, header + buffer[:cut]
+                rest = buffer[cut:]
+            else:
+                rest = buffer
+            data = f.read(chunk_bytes)
+        if rest.strip():
+            yield kind, header + rest
+
+# Function to split input files into raw chunks that can be parsed independently
+async def read_chunks(paths, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Read data files as independently parseable chunks.
+
+    CSV and JSON Lines files, plain or gzip/zstd compressed, are read in
+    chunks of about `chunk_bytes`, ending on a line boundary outside CSV
+    quotes; each CSV chunk carries the header (see `text_chunks`). Avro files
+    are not read here: they are split at sync markers into block-aligned byte
+    ranges that the parse stage decodes from a memory map. JSON array files
+    cannot be split and form one chunk.
+
+    Parameters:
+        paths (list): Data file paths.
+        chunk_bytes (int): Approximate raw bytes per chunk.
+
+    Yields:
+        tuple: (source, kind, payload) for `parse_chunk`.
+    """
+    for path in paths:
+        source = source_for_path(path)
+        if data_extension(path) == '.avro':
+            parts = max(1, math.ceil(os.path.getsize(path) / chunk_bytes))
+            for start, end in split_ranges(path, parts):
+                yield source, 'avro', (path, start, end)
+            continue
+        chunks = text_chunks(path, chunk_bytes)
+        while True:
+            # Reading and decompressing block, so every chunk is cut in a worker thread
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            kind, payload = chunk
+            yield source, kind, payload
+
+# Function to parse one raw chunk into a typed DataFrame, run in a worker process
+def parse_chunk(chunk):
+    """
+    Parse a chunk from `read_chunks` into a typed RecordBatch.
+
+    This is the unit of work submitted to the process pool, so it must stay a
+    module-level function that can be pickled. Batches keep strings
+    dictionary-encoded, so they are cheap to send back to the parent.
+
+    Parameters:
+        chunk (tuple): (source, kind, payload).
+
+    Returns:
+        tuple: (source, batches.RecordBatch).
+    """
+    source, kind, payload = chunk
+    if kind == 'avro':
+        batch = RecordBatch.from_columns(decode_range(*payload), source)
+    elif kind == 'csv':
+        batch = RecordBatch.from_frame(read_csv_typed(io.BytesIO(payload), source), source)
+    elif kind == 'json':
+        batch = RecordBatch.from_records(json.loads(payload), source)
+    else:
+        batch = RecordBatch.from_records([json.loads(line) for line in payload.splitlines() if line.strip()], source)
+    return source, batch
+
+def ingestion_pipeline(processor, paths, chunk_bytes=DEFAULT_CHUNK_BYTES, parse_workers=None,
+                       write_concurrency=DEFAULT_WRITE_CONCURRENCY, queue_size=DEFAULT_QUEUE_SIZE, table_prefix='',
+                       partitioned=False):
+    """
+    Build the read -> parse -> enrich -> write pipeline for data files.
+
+    Reading is asynchronous file I/O, parsing runs in a process pool,
+    enrichment (the DataProcessor's process_* method and validation) runs in
+    one thread because it updates shared state such as the domain dictionary,
+    and writes run in `write_concurrency` threads, each on its own pooled
+    connection. Each target table is created once, in its own committed
+    transaction, before the first rows are written to it, so concurrent
+    writers do not race to create it. A failed write stops the pipeline and
+    is raised by `run()` rather than dropping the batch.
+
+    Parameters:
+        processor (DataProcessor): Processor used to enrich and store batches.
+        paths (list): Data file paths.
+        chunk_bytes (int): Approximate raw bytes per parse task.
+        parse_workers (int, optional): Parser processes. Defaults to the CPU count.
+        write_concurrency (int): Concurrent table loads.
+        queue_size (int): Items buffered in front of each stage.
+        table_prefix (str): Prefix of the table names the sources are written to.
+        partitioned (bool): Write to the daily partitions of each source instead
+            (see DataProcessor.store_partitioned); `table_prefix` is then ignored.
+
+    Returns:
+        Pipeline: The pipeline; `await pipeline.run()` to run it.
+    """
+    def enrich(item):
+        source, batch = item
+        df = getattr(processor, f"process_{source}")(batch)
+        return source, processor.validate_data(df, source)
+
+    created = set()
+    create_lock = threading.Lock()
+
+    def create_table(df, table_name):
+        with create_lock:
+            if table_name not in created:
+                with db.begin(processor.engine) as conn:
+                    processor.loader.create_table(conn, df, table_name)
+                created.add(table_name)
+
+    def write(item):
+        source, df = item
+        if df.empty:
+            return df
+        if partitioned:
+            processor.partitions.write(df, source)
+        else:
+            create_table(df, f"{table_prefix}{source}")
+            processor.loader.load(df, f"{table_prefix}{source}")
+        return df
+
+    return Pipeline(read_chunks(paths, chunk_bytes), [
+        Stage('parse', parse_chunk, parse_workers or os.cpu_count() or 1, 'process', queue_size),
+        Stage('enrich', enrich, 1, 'thread', queue_size),
+        Stage('write', write, write_concurrency, 'thread', queue_size, fail=True),
+    ])
+
+if __name__ == '__main__':
+    # Configure command-line arguments
+    parser = argparse.ArgumentParser(description='Pipelined Data Ingestion for AdvertiseX')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Directory containing data files')
+    parser.add_argument('--input', help='Glob pattern of input shards (overrides --data-dir)')
+    parser.add_argument('--chunk-mb', type=float, default=DEFAULT_CHUNK_BYTES / (1 << 20), help='Raw megabytes per parse task')
+    parser.add_argument('--parse-workers', type=int, help='Parser processes (default: CPU count)')
+    parser.add_argument('--write-concurrency', type=int, default=DEFAULT_WRITE_CONCURRENCY, help='Concurrent table loads')
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE, help='Items buffered in front of each stage')
+    parser.add_argument('--partitioned', action='store_true', help='Write to daily partitioned tables')
+    args = parser.parse_args()
+
+    from process import processor
+    paths = [path for files in discover_files(args.input or args.data_dir).values() for path in files]
+    pipeline = ingestion_pipeline(processor, paths, int(args.chunk_mb * (1 << 20)), args.parse_workers,
+                                  args.write_concurrency, args.queue_size, partitioned=args.partitioned)
+    logging.info(f"Pipeline finished: {json.dumps(asyncio.run(pipeline.run()))}")
@@ -1,52 +1,176 @@
-import pandas as pd
-import geoip2.database
-from sqlalchemy import create_engine, pool
-import geoip2.errors
+# pandas, SQLAlchemy and the stages built on them are imported where they
+# are used, so importing this module stays cheap for commands that need none
+from schemas import infer_source, parse_records
+from decompress import strip_compression
+import collections
+import profiling
+import concurrent.futures
 import logging
 import os
-import sys
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 
 class DataProcessor:
-    def __init__(self, db_url):
-        # Use a connection pool for managing database connections
-        self.pool = pool.QueuePool(lambda: create_engine(db_url, pool_size=20, max_overflow=0))
-
-    def store_data(self, df, table_name):
+    def __init__(self, db_url, geoip_db_path=None, pool_settings=None, dedup_options=None, rules=None, rollup_options=None,
+                 frequency_cap_options=None):
+        import db
+        from loader import BulkLoader
+        from urls import DomainDictionary
+        from rules import compile_rules
+        from windows import RollupEngine
+        from freqcap import FrequencyCapStore
+        # One engine per process; its pool is sized from DB_POOL_* settings
+        self.engine = db.get_engine(db_url, **(pool_settings or {}))
+        self.loader = BulkLoader(self.engine)
+        # The GeoIP database is opened lazily on the first lookup
+        self.geoip_db_path = geoip_db_path or os.getenv('GEOIP_DB_PATH')
+        self._geoip = None
+        # Domains are interned into one categorical dictionary across all batches
+        self.domains = DomainDictionary()
+        # One streaming deduplicator per event key, remembering events across batches
+        self.dedup_options = dedup_options or {}
+        self.deduplicators = {}
+        # Validation rules and named filters, compiled once per processor
+        self.rules = compile_rules(rules)
+        self.validation_counts = {}
+        self.quarantine_sink = self.store_quarantine
+        # Windowed rollup tables, updated incrementally per batch
+        self.rollups = RollupEngine(self.loader, **(rollup_options or {}))
+        # Per-user impression and click counts for frequency capping, held in memory
+        self.frequency_caps = FrequencyCapStore(**(frequency_cap_options or {}))
+        # Daily partition tables and their catalog are set up on first use
+        self._partitions = None
+        # Profiling wraps the pipeline's functions only when ADVERTISEX_PROFILE is set
+        profiling.enable_from_env()
+
+    @property
+    def geoip(self):
+        """Shared, cached GeoIP resolver for this process."""
+        from geoip import get_resolver
+        if self._geoip is None:
+            self._geoip = get_resolver(self.geoip_db_path)
+        return self._geoip
+
+    @property
+    def partitions(self):
+        """Daily partitioned tables of every source, sharing the processor's loader."""
+        from partitions import PartitionedStore
+        if self._partitions is None:
+            self._partitions = PartitionedStore(self.engine, self.loader)
+        return self._partitions
+
+    def store_data(self, df, table_name, mode='append', key=None, conn=None):
         """
         Store DataFrame into PostgreSQL table.
 
         Parameters:
             df (pandas.DataFrame): DataFrame to store.
             table_name (str): Name of the table in the database.
+            mode (str): 'append' to keep existing rows, 'upsert' to update rows
+                with the same key, or 'replace' to swap in a new table.
+            key (str or list, optional): Key column(s) for 'upsert'.
+            conn (sqlalchemy.engine.Connection, optional): Connection with an open
+                transaction to store in.
+
+        Returns:
+            dict: Load statistics (rows, seconds, rows_per_second), or None on error.
         """
+        import db
         try:
-            with self.pool.connect() as conn:
-                df.to_sql(table_name, conn, if_exists='replace', index=False)
+            if conn is None:
+                with db.begin(self.engine) as conn:
+                    stats = self.loader.load(df, table_name, mode=mode, key=key, conn=conn)
+            else:
+                stats = self.loader.load(df, table_name, mode=mode, key=key, conn=conn)
             logging.info(f"Data stored successfully in table '{table_name}'")
+            return stats
         except Exception as e:
             logging.error(f"Error storing data in table '{table_name}': {e}")
 
+    def store_partitioned(self, df, source=None, conn=None):
+        """
+        Store processed data in the daily partitions of its source.
+
+        Unlike `store_data`, rows go to indexed tables per day (e.g.
+        'ad_impressions_p20240401') that reports can prune by time range and
+        that `self.partitions.prune` can drop or archive; see partitions.PartitionedStore.
+
+        Parameters:
+            df (pandas.DataFrame): Processed ad impressions, clicks or bid requests.
+            source (str, optional): Source of the data; inferred from the columns by default.
+            conn (sqlalchemy.engine.Connection, optional): Connection with an open
+                transaction to store in.
+
+        Returns:
+            dict: Partition table names mapped to the number of rows written, or None on error.
+        """
+        source = source or infer_source(df)
+        try:
+            return self.partitions.write(df, source, conn)
+        except Exception as e:
+            logging.error(f"Error storing {source} data in partitions: {e}")
+            return None
+
+    def store_many(self, tables, mode='append', keys=None, max_workers=None):
+        """
+        Store several DataFrames concurrently over the shared connection pool.
+
+        Parameters:
+            tables (dict): Table names mapped to DataFrames.
+            mode (str): Load mode passed to `store_data`.
+            keys (dict, optional): Table names mapped to key column(s) for 'upsert'.
+            max_workers (int, optional): Number of concurrent writers. Defaults to the
+                pool size, so writers never queue behind each other for connections.
+
+        Returns:
+            dict: Table names mapped to load statistics (None for failed loads).
+        """
+        import db
+        keys = keys or {}
+        max_workers = max_workers or min(len(tables), db.pool_size(self.engine)) or 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as writers:
+            futures = {
+                table_name: writers.submit(self.store_data, df, table_name, mode, keys.get(table_name))
+                for table_name, df in tables.items()
+            }
+        return {table_name: future.result() for table_name, future in futures.items()}
+
+    def pool_metrics(self):
+        """
+        Get connection pool metrics for the shared engine.
+
+        Returns:
+            dict: Checkout counts, connections in use and wait times.
+        """
+        return self.engine.pool_metrics.snapshot()
+
     def process_data(self, data):
         """
         Process ingested data.
 
         Parameters:
             data (dict): Dictionary containing ingested data with file names as keys.
+                Each value is a list of records, a RecordBatch, or an iterable of record batches.
 
         Returns:
             dict: Dictionary containing processed data with file names as keys.
+                Batched inputs map to generators of processed DataFrames.
         """
+        from batches import RecordBatch
         processed_data = {}
         try:
             for filename, dataset in data.items():
-                if filename.endswith('.json'):
+                # Compressed files are dispatched by the name of the file they contain
+                name = strip_compression(filename)
+                if not isinstance(dataset, (list, RecordBatch)):
+                    # An iterable of record batches is processed lazily, one batch at a time
+                    processed_data[filename] = self.process_batches(filename, dataset)
+                elif name.endswith(('.json', '.jsonl')):
                     processed_data[filename] = self.process_ad_impressions(dataset)
-                elif filename.endswith('.csv'):
+                elif name.endswith('.csv'):
                     processed_data[filename] = self.process_clicks_conversions(dataset)
-                elif filename.endswith('.avro'):
+                elif name.endswith('.avro'):
                     processed_data[filename] = self.process_bid_requests(dataset)
                 else:
                     logging.warning(f"Unsupported file format: {filename}")
@@ -55,21 +179,105 @@ class DataProcessor:
 
         return processed_data
 
+    def get_batch_processor(self, filename):
+        """
+        Get the processing method for a file name.
+
+        Parameters:
+            filename (str): Name of the ingested file, possibly with a .gz or .zst suffix.
+
+        Returns:
+            callable: Method turning a list of records into a DataFrame.
+        """
+        name = strip_compression(filename)
+        if name.endswith(('.json', '.jsonl')):
+            return self.process_ad_impressions
+        if name.endswith('.csv'):
+            return self.process_clicks_conversions
+        if name.endswith('.avro'):
+            return self.process_bid_requests
+        raise ValueError(f"Unsupported file format: {filename}")
+
+    def process_batches(self, filename, batches):
+        """
+        Process an iterable of record batches from one file.
+
+        Parameters:
+            filename (str): Name of the ingested file.
+            batches (iterable): Iterable of lists of records.
+
+        Yields:
+            pandas.DataFrame: One processed DataFrame per non-empty batch.
+        """
+        process_batch = self.get_batch_processor(filename)
+        for batch in batches:
+            if batch:
+                yield process_batch(batch)
+
+    async def process_stream(self, streams):
+        """
+        Process batch streams produced by `ingest.stream_data`.
+
+        Parameters:
+            streams (dict): File names mapped to async iterables of record batches.
+
+        Yields:
+            tuple: (file name, processed DataFrame) for every non-empty batch.
+        """
+        for filename, batches in streams.items():
+            process_batch = self.get_batch_processor(filename)
+            async for batch in batches:
+                if batch:
+                    yield filename, process_batch(batch)
+
+    def process_shards(self, source, root=None, columns=None, start=None, end=None, format='parquet'):
+        """
+        Process columnar shards written by `ingest.py --columnar-dir`.
+
+        Only the requested columns and the partitions overlapping the time range
+        are read, so reprocessing does not re-parse the raw JSON/CSV/Avro files.
+
+        Parameters:
+            source (str): 'ad_impressions', 'clicks_conversions' or 'bid_requests'.
+            root (str, optional): Root directory of the columnar store.
+            columns (list, optional): Columns to read.
+            start (str or datetime, optional): Inclusive lower bound on `timestamp`.
+            end (str or datetime, optional): Exclusive upper bound on `timestamp`.
+            format (str): 'parquet' or 'arrow'.
+
+        Returns:
+            pandas.DataFrame: Processed DataFrame.
+        """
+        from columnar import DEFAULT_COLUMNAR_DIR, read_shards
+        source_processors = {
+            'ad_impressions': self.process_ad_impressions,
+            'clicks_conversions': self.process_clicks_conversions,
+            'bid_requests': self.process_bid_requests,
+        }
+        df = read_shards(source, root or DEFAULT_COLUMNAR_DIR, columns, start, end, format)
+        return source_processors[source](df)
+
     def process_ad_impressions(self, data):
         """
         Process ad impressions data.
 
         Parameters:
-            data (list): List of dictionaries containing ad impressions data.
+            data (list, pandas.DataFrame or batches.RecordBatch): Ad impressions records.
 
         Returns:
             pandas.DataFrame: Processed DataFrame.
         """
-        df = pd.DataFrame(data)
-        # Convert timestamp to datetime
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        # Extract domain from website URL
-        df['domain'] = df['website'].apply(lambda x: x.split('/')[2] if '/' in x else x)
+        from urls import parse_urls, url_column
+        # Build typed columns, parsing timestamps with the schema's fixed format
+        df = parse_records(data, 'ad_impressions')
+        # Parse scheme, host, registrable domain and path from the website URL
+        column = url_column(df)
+        if column is not None:
+            urls = parse_urls(df[column], self.domains)
+            df['url_scheme'] = urls['scheme']
+            df['url_host'] = urls['host']
+            df['url_path'] = urls['path']
+            df['domain'] = urls['domain']
         return df
 
     def process_clicks_conversions(self, data):
@@ -77,14 +285,13 @@ class DataProcessor:
         Process clicks and conversions data.
 
         Parameters:
-            data (list): List of dictionaries containing clicks and conversions data.
+            data (list, pandas.DataFrame or batches.RecordBatch): Clicks and conversions records.
 
         Returns:
             pandas.DataFrame: Processed DataFrame.
         """
-        df = pd.DataFrame(data)
-        # Convert timestamp to datetime
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        # Build typed columns, parsing timestamps with the schema's fixed format
+        df = parse_records(data, 'clicks_conversions')
         # Map conversion type to human-readable labels
         conversion_type_mapping = {'purchase': 'Purchase', 'signup': 'Sign-Up', 'visit': 'Website Visit'}
         df['conversion_type'] = df['conversion_type'].map(conversion_type_mapping)
@@ -95,14 +302,15 @@ class DataProcessor:
         Process bid requests data.
 
         Parameters:
-            data (list): List of dictionaries containing bid requests data.
+            data (list, pandas.DataFrame or batches.RecordBatch): Bid requests records.
 
         Returns:
             pandas.DataFrame: Processed DataFrame.
         """
-        df = pd.DataFrame(data)
-        # Extract user country from IP address
-        df['user_country'] = df['user_ip'].apply(self.get_country_from_ip)
+        df = parse_records(data, 'bid_requests')
+        # Extract user country from IP address, resolving each distinct IP once
+        ip_column = 'user_ip' if 'user_ip' in df.columns else 'ip_address'
+        df['user_country'] = self.geoip.lookup_many(df[ip_column])
         return df
 
     def get_country_from_ip(self, ip_address):
@@ -115,62 +323,214 @@ class DataProcessor:
         Returns:
             str: Country name.
         """
-        # Placeholder implementation: Use GeoIP2 database to retrieve country
-        # Replace 'GeoLite2-Country.mmdb' with the actual path to the GeoIP2 Country database file
-        with geoip2.database.Reader('data/GeoLite2-Country.mmdb') as reader:
-            try:
-                response = reader.country(ip_address)
-                return response.country.name
-            except geoip2.errors.AddressNotFoundError:
-                return 'Unknown'
+        return self.geoip.country(ip_address)
 
     # Additional processing functions
-    def validate_data(self, df):
+    def validate_data(self, df, source=None, conn=None):
         """
         Validate processed data.
 
+        The source's validation rules (see rules.DEFAULT_RULES) are evaluated
+        in one pass. Rejected rows, with the rules they failed, are handed to
+        `quarantine_sink`, and rejections are counted per rule in
+        `validation_counts`.
+
         Parameters:
             df (pandas.DataFrame): Processed DataFrame.
+            source (str, optional): Source of the data; inferred from the columns by default.
+            conn (sqlalchemy.engine.Connection, optional): Transaction of the batch,
+                so rejected rows are quarantined only if the batch is stored.
 
         Returns:
             pandas.DataFrame: DataFrame with invalid rows removed.
         """
-        # Remove rows with negative bid amounts
-        return df[df['bid_amount'] >= 0]
+        source = source or infer_source(df)
+        if source not in self.rules:
+            logging.warning(f"No validation rules for columns {list(df.columns)}; data left unvalidated")
+            return df
+        result = self.rules[source]['validate'].apply(df)
+        self.validation_counts.setdefault(source, collections.Counter()).update(result['counts'])
+        if not result['rejected'].empty and self.quarantine_sink is not None:
+            self.quarantine_sink(result['rejected'], source, conn)
+        return result['valid']
+
+    def store_quarantine(self, rejected, source, conn=None):
+        """
+        Store rows rejected by validation in the source's quarantine table.
+
+        Unlike `store_data`, errors are raised, so rejected rows are never
+        dropped without notice.
+
+        Parameters:
+            rejected (pandas.DataFrame): Rejected rows with their 'rejected_by' rules.
+            source (str): Source of the rows.
+            conn (sqlalchemy.engine.Connection, optional): Transaction to store in;
+                a new one by default.
+        """
+        self.loader.load(rejected, f"{source}_quarantine", conn=conn)
 
-    def filter_data(self, df, condition):
+    def filter_data(self, df, condition, source=None):
         """
         Filter processed data based on condition.
 
         Parameters:
             df (pandas.DataFrame): Processed DataFrame.
-            condition (str): Filtering condition.
+            condition (str, list or RuleSet): Name of a filter declared for the source,
+                rule specifications, a compiled RuleSet, or a country to keep.
+            source (str, optional): Source of the data; inferred from the columns by default.
 
         Returns:
             pandas.DataFrame: Filtered DataFrame.
         """
-        # Filter data based on user country
-        return df[df['user_country'] == condition]
-
-    def deduplicate_data(self, df):
+        from rules import RuleSet
+        if isinstance(condition, RuleSet):
+            rules = condition
+        elif isinstance(condition, (list, dict)):
+            rules = RuleSet(condition if isinstance(condition, list) else [condition], source)
+        else:
+            source = source or infer_source(df)
+            rules = self.rules.get(source, {}).get('filters', {}).get(condition)
+            if rules is None:
+                # Filter data based on user country
+                rules = RuleSet([{'name': 'user_country', 'column': 'user_country', 'type': 'equals', 'value': condition}], source)
+        return rules.filter(df)
+
+    def deduplicate_data(self, df, keys=None):
         """
         Deduplicate processed data.
 
+        Events repeated within this batch, or within the deduplication window
+        of earlier batches and files, are dropped.
+
         Parameters:
             df (pandas.DataFrame): Processed DataFrame.
+            keys (list, optional): Columns identifying an event; inferred from the
+                source's columns by default (see dedup.DEDUP_KEYS).
+
+        Returns:
+            pandas.DataFrame: DataFrame with duplicate events removed.
+        """
+        from dedup import StreamingDeduplicator, infer_keys
+        keys = list(keys or infer_keys(df))
+        deduplicator = self.deduplicators.get(tuple(keys))
+        if deduplicator is None:
+            deduplicator = self.deduplicators[tuple(keys)] = StreamingDeduplicator(keys, **self.dedup_options)
+        return deduplicator.deduplicate(df)
+
+    def correlate_data(self, impressions, clicks, bids=None, **options):
+        """
+        Correlate ad impressions with clicks/conversions and bid requests.
+
+        Parameters:
+            impressions (pandas.DataFrame): Processed ad impressions.
+            clicks (pandas.DataFrame): Processed clicks and conversions.
+            bids (pandas.DataFrame, optional): Processed bid requests.
+            **options: AttributionEngine settings (lookback, model, partitions, workers, ...).
+
+        Returns:
+            dict: 'attributed' clicks and the per-campaign 'campaigns' report.
+        """
+        from attribution import AttributionEngine
+        return AttributionEngine(**options).run(impressions, clicks, bids)
+
+    def aggregate_data(self, df, source=None, conn=None):
+        """
+        Update the windowed rollup tables with a processed batch.
+
+        Only the window rows the batch changes are upserted, into tables such as
+        'bid_requests_rollup_1min'; see windows.RollupEngine.
+
+        Parameters:
+            df (pandas.DataFrame): Processed ad impressions, clicks or bid requests.
+            source (str, optional): Source of the data; inferred from the columns by default.
+            conn (sqlalchemy.engine.Connection, optional): Transaction to write in.
+
+        Returns:
+            dict: Rollup table names mapped to the number of rows written.
+        """
+        source = source or infer_source(df)
+        try:
+            return self.rollups.update(df, source, conn)
+        except Exception as e:
+            logging.error(f"Error aggregating {source} data: {e}")
+            return None
+
+    def count_frequency(self, df, source=None):
+        """
+        Add processed impressions or clicks to the per-user frequency-capping counters.
+
+        Other sources are ignored. Counts are looked up with
+        `self.frequency_caps.lookup(user_id, campaign_id)`; see freqcap.FrequencyCapStore.
+
+        Parameters:
+            df (pandas.DataFrame): Processed ad impressions or clicks/conversions.
+            source (str, optional): Source of the data; inferred from the columns by default.
 
         Returns:
-            pandas.DataFrame: DataFrame with duplicate rows removed.
+            int: Number of events counted, or None on error.
         """
-        # Remove duplicate rows based on user ID
-        return df.drop_duplicates(subset='user_id')
+        from freqcap import SOURCE_EVENTS
+        source = source or infer_source(df)
+        if source not in SOURCE_EVENTS:
+            return 0
+        try:
+            return self.frequency_caps.update(df, source)
+        except Exception as e:
+            logging.error(f"Error counting {source} for frequency caps: {e}")
+            return None
 
-# Check if the database URL is provided as an environment variable
-db_url = os.getenv('DATABASE_URL')
+    def sketch_data(self, df, sketches=None, **options):
+        """
+        Add processed data to constant-memory reporting sketches.
 
-if not db_url:
-    print("Error: DATABASE_URL environment variable is not set.")
-    sys.exit(1)
+        Parameters:
+            df (pandas.DataFrame): Processed ad impressions, clicks or bid requests.
+            sketches (CampaignSketches, optional): Sketches to update; new ones by default.
+            **options: CampaignSketches settings (freq, precision, top_k).
 
-# Now db_url can be used to create the DataProcessor instance
-processor = DataProcessor(db_url)
\ No newline at end of file
+        Returns:
+            CampaignSketches: Distinct users per campaign, creative and domain per
+            period, and the most frequent users and auctions.
+        """
+        from sketches import CampaignSketches
+        return (sketches or CampaignSketches(**options)).update(df)
+
+# The shared processor is created on first use, so importing this module
+# neither reads DATABASE_URL nor opens a connection pool
+_processor = None
+
+def get_processor(db_url=None):
+    """
+    Get the process-wide DataProcessor, creating it on first use.
+
+    Parameters:
+        db_url (str, optional): Database URL; the DATABASE_URL environment variable by default.
+
+    Returns:
+        DataProcessor: The shared processor.
+    """
+    global _processor
+    if _processor is None:
+        db_url = db_url or os.getenv('DATABASE_URL')
+        if not db_url:
+            raise RuntimeError("DATABASE_URL environment variable is not set")
+        _processor = DataProcessor(db_url)
+    return _processor
+
+def process_data(data):
+    """
+    Process ingested data with the shared processor.
+
+    Parameters:
+        data (dict): File names mapped to lists of records (see DataProcessor.process_data).
+
+    Returns:
+        dict: File names mapped to processed DataFrames.
+    """
+    return get_processor().process_data(data)
+
+def __getattr__(name):
+    # `from process import processor` still works, creating the processor lazily
+    if name == 'processor':
+        return get_processor()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,448 @@
+import atexit
+import concurrent.futures
+import cProfile
+import functools
+import importlib.abc
+import importlib.machinery
+import inspect
+import io
+import json
+import logging
+import os
+import platform
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+PROFILE_ENV = 'ADVERTISEX_PROFILE'
+PROFILE_OUTPUT_ENV = 'ADVERTISEX_PROFILE_OUTPUT'
+DEFAULT_PROFILE_OUTPUT = 'profile.json'
+PROFILE_MODES = ('stages', 'cprofile', 'tracemalloc')
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 15
+
+# Functions timed as stages: (module, attribute path) pairs. Stages nest, so
+# e.g. process_bid_requests includes its lookup_many and coerce_frame calls.
+PROFILED_FUNCTIONS = (
+    ('ingest', 'read_ad_impressions'),
+    ('ingest', 'read_clicks_conversions'),
+    ('ingest', 'read_bid_requests'),
+    ('ingest', 'iter_file_from'),
+    ('schemas', 'coerce_frame'),
+    ('geoip', 'GeoIPResolver.lookup_many'),
+    ('process', 'DataProcessor.process_ad_impressions'),
+    ('process', 'DataProcessor.process_clicks_conversions'),
+    ('process', 'DataProcessor.process_bid_requests'),
+    ('process', 'DataProcessor.validate_data'),
+    ('process', 'DataProcessor.deduplicate_data'),
+    ('process', 'DataProcessor.filter_data'),
+    ('process', 'DataProcessor.correlate_data'),
+    ('process', 'DataProcessor.aggregate_data'),
+    ('process', 'DataProcessor.store_data'),
+    ('loader', 'BulkLoader.load'),
+)
+
+def current_rss_bytes():
+    """
+    Get the current resident set size of this process.
+
+    Returns:
+        int: RSS in bytes, or None where /proc is unavailable.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def loaded_module(name):
+    """Get an imported module by name, including a script run as __main__, or None."""
+    module = sys.modules.get(name)
+    if module is None:
+        main = sys.modules.get('__main__')
+        if os.path.splitext(os.path.basename(getattr(main, '__file__', None) or ''))[0] == name:
+            module = main
+    return module
+
+class ProfiledImports(importlib.abc.MetaPathFinder):
+    """
+    Import hook wrapping the profiled functions of modules imported after profiling started.
+
+    process, loader and geoip are imported lazily, usually after a command
+    has enabled profiling, so their functions are wrapped as soon as the
+    module has been executed.
+    """
+
+    def __init__(self, profiler, functions=PROFILED_FUNCTIONS):
+        self.profiler = profiler
+        self.functions = functions
+        self.modules = {module_name for module_name, _ in functions}
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in self.modules:
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path, target)
+        if spec is None or not hasattr(spec.loader, 'exec_module'):
+            return None
+        exec_module = spec.loader.exec_module
+        profiler, functions = self.profiler, [entry for entry in self.functions if entry[0] == fullname]
+
+        def exec_and_install(module):
+            exec_module(module)
+            profiler.install(functions)
+        spec.loader.exec_module = exec_and_install
+        return spec
+
+def count_rows(value):
+    """Get the number of rows of a list, array, Series or DataFrame, or None for anything else."""
+    if isinstance(value, (list, tuple)) or hasattr(value, 'shape'):
+        return len(value)
+    return None
+
+class Profiler:
+    """
+    Per-stage and per-batch wall time, CPU time, rows and memory of a run.
+
+    Every call of a profiled function is one batch record. CPU time is the
+    calling thread's, and memory is the change in traced allocations when
+    tracemalloc is on, otherwise the change in RSS. Optionally the whole run
+    is also profiled with cProfile and tracemalloc, whose top entries are
+    added to the report.
+    """
+
+    def __init__(self, modes=('stages',)):
+        """
+        Parameters:
+            modes (iterable): Any of 'stages', 'cprofile' and 'tracemalloc'.
+        """
+        unknown = set(modes) - set(PROFILE_MODES)
+        if unknown:
+            raise ValueError(f"Unknown profile modes: {', '.join(sorted(unknown))}")
+        self.modes = set(modes) | {'stages'}
+        self.batches = []
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.originals = []
+        self.installed = set()
+        self.import_hook = None
+        self.cprofile = None
+        self.started_at = None
+        self.start_time = None
+        self.wall_seconds = None
+        self.allocations = None
+
+    def memory(self):
+        if tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[0]
+        return current_rss_bytes()
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Measure a block of code as one batch of a stage.
+
+        Parameters:
+            name (str): Stage name.
+            rows_in (int, optional): Rows the batch received.
+
+        Yields:
+            dict: The batch record; set 'rows_out' on it to record output rows.
+        """
+        record = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+        memory_before = self.memory()
+        cpu_start = time.thread_time()
+        start_time = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['wall_seconds'] = time.perf_counter() - start_time
+            record['cpu_seconds'] = time.thread_time() - cpu_start
+            memory_after = self.memory()
+            record['memory_delta_bytes'] = None if memory_before is None or memory_after is None else memory_after - memory_before
+            with self.lock:
+                record['batch'] = self.calls.get(name, 0)
+                self.calls[name] = record['batch'] + 1
+                self.batches.append(record)
+
+    def wrap(self, func, name):
+        """
+        Wrap a function (or generator function) so every call is recorded as a batch of a stage.
+
+        Rows in are taken from the first argument that is a DataFrame or list,
+        rows out from the result; generators record one batch per item.
+        """
+        profiler = self
+
+        def rows_in(args):
+            for arg in args:
+                rows = count_rows(arg)
+                if rows is not None:
+                    return rows
+            return None
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                items = func(*args, **kwargs)
+                while True:
+                    with profiler.stage(name) as record:
+                        try:
+                            item = next(items)
+                        except StopIteration:
+                            record['rows_out'] = 0
+                            return
+                        record['rows_out'] = count_rows(item[0] if isinstance(item, tuple) else item)
+                    yield item
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiler.stage(name, rows_in(args)) as record:
+                result = func(*args, **kwargs)
+                record['rows_out'] = count_rows(result)
+            return result
+        return wrapper
+
+    def install(self, functions=PROFILED_FUNCTIONS):
+        """
+        Wrap the pipeline's functions so every call is recorded.
+
+        Module-level functions are replaced in their module, and in the
+        `ingest` reader lookup table, so callers looking them up by module
+        attribute are measured. Modules this process has not imported yet
+        are skipped (`start` wraps them when they are imported), functions
+        already wrapped are left alone, and work done in worker processes is
+        not seen.
+
+        Parameters:
+            functions (iterable): (module name, attribute path) pairs.
+        """
+        for module_name, path in functions:
+            owner = loaded_module(module_name)
+            if owner is None or (module_name, path) in self.installed:
+                continue
+            self.installed.add((module_name, path))
+            *parents, attribute = path.split('.')
+            for parent in parents:
+                owner = getattr(owner, parent)
+            original = getattr(owner, attribute)
+            wrapped = self.wrap(original, attribute)
+            setattr(owner, attribute, wrapped)
+            self.originals.append((owner, attribute, original))
+            if module_name == 'ingest':
+                readers = owner.FILE_READERS
+                for extension, reader in readers.items():
+                    if reader is original:
+                        readers[extension] = wrapped
+                        self.originals.append((readers, extension, original))
+
+    def uninstall(self):
+        """Restore every function wrapped by `install` and remove the import hook."""
+        if self.import_hook in sys.meta_path:
+            sys.meta_path.remove(self.import_hook)
+        self.import_hook = None
+        for owner, attribute, original in reversed(self.originals):
+            if isinstance(owner, dict):
+                owner[attribute] = original
+            else:
+                setattr(owner, attribute, original)
+        self.originals = []
+        self.installed = set()
+
+    def start(self):
+        """Install the stage wrappers and start the optional whole-run profilers."""
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self.start_time = time.perf_counter()
+        self.install()
+        self.import_hook = ProfiledImports(self)
+        sys.meta_path.insert(0, self.import_hook)
+        if 'tracemalloc' in self.modes and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if 'cprofile' in self.modes:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        return self
+
+    def stop(self):
+        """Stop profiling and restore the wrapped functions."""
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if 'tracemalloc' in self.modes:
+            self.allocations = self.top_allocations()
+        if 'tracemalloc' in self.modes and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.uninstall()
+        self.wall_seconds = time.perf_counter() - self.start_time
+
+    def summary(self):
+        """
+        Aggregate the batch records per stage.
+
+        Returns:
+            dict: Stage names mapped to calls, total wall and CPU seconds, rows
+            in and out, output rows per wall second, and total and largest memory delta.
+        """
+        stages = {}
+        for record in self.batches:
+            stage = stages.setdefault(record['stage'], {
+                'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows_in': 0, 'rows_out': 0,
+                'memory_delta_bytes': 0, 'max_memory_delta_bytes': None,
+            })
+            stage['calls'] += 1
+            stage['wall_seconds'] += record['wall_seconds']
+            stage['cpu_seconds'] += record['cpu_seconds']
+            stage['rows_in'] += record['rows_in'] or 0
+            stage['rows_out'] += record['rows_out'] or 0
+            if record['memory_delta_bytes'] is not None:
+                stage['memory_delta_bytes'] += record['memory_delta_bytes']
+                stage['max_memory_delta_bytes'] = max(stage['max_memory_delta_bytes'] or 0, record['memory_delta_bytes'])
+        for stage in stages.values():
+            stage['rows_per_second'] = round(stage['rows_out'] / stage['wall_seconds'], 1) if stage['wall_seconds'] > 0 else None
+            stage['wall_seconds'] = round(stage['wall_seconds'], 6)
+            stage['cpu_seconds'] = round(stage['cpu_seconds'], 6)
+        return dict(sorted(stages.items(), key=lambda item: -item[1]['wall_seconds']))
+
+    def top_functions(self, limit=TOP_FUNCTIONS):
+        """Get the functions with the most cumulative time from cProfile."""
+        if self.cprofile is None:
+            return None
+        stats = pstats.Stats(self.cprofile, stream=io.StringIO())
+        rows = []
+        for (filename, line, function), (calls, primitive_calls, total, cumulative, _) in stats.stats.items():
+            rows.append({
+                'function': f"{os.path.basename(filename)}:{line}({function})",
+                'calls': calls,
+                'total_seconds': round(total, 6),
+                'cumulative_seconds': round(cumulative, 6),
+            })
+        return sorted(rows, key=lambda row: -row['cumulative_seconds'])[:limit]
+
+    def top_allocations(self, limit=TOP_ALLOCATIONS):
+        """Get the source lines holding the most traced memory."""
+        if not tracemalloc.is_tracing():
+            return None
+        statistics = tracemalloc.take_snapshot().statistics('lineno')[:limit]
+        return [
+            {'location': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", 'bytes': stat.size, 'blocks': stat.count}
+            for stat in statistics
+        ]
+
+    def report(self):
+        """
+        Build the structured report.
+
+        Returns:
+            dict: JSON-serializable run information, per-stage summary, every
+            batch record and, when enabled, the top cProfile functions and
+            tracemalloc allocations.
+        """
+        return {
+            'started_at': self.started_at,
+            'wall_seconds': round(self.wall_seconds, 6) if self.wall_seconds is not None else None,
+            'python': platform.python_version(),
+            'argv': sys.argv,
+            'modes': sorted(self.modes),
+            'stages': self.summary(),
+            'batches': self.batches,
+            'functions': self.top_functions(),
+            'allocations': self.allocations,
+        }
+
+    def table(self):
+        """Format the per-stage summary as a text table, slowest stage first."""
+        header = f"{'stage':<28} {'calls':>7} {'wall s':>10} {'cpu s':>10} {'rows out':>10} {'rows/s':>12} {'mem MB':>9}"
+        lines = [header, '-' * len(header)]
+        for name, stage in self.summary().items():
+            rate = f"{stage['rows_per_second']:.0f}" if stage['rows_per_second'] is not None else '-'
+            lines.append(
+                f"{name:<28} {stage['calls']:>7} {stage['wall_seconds']:>10.3f} {stage['cpu_seconds']:>10.3f} "
+                f"{stage['rows_out']:>10} {rate:>12} {stage['memory_delta_bytes'] / 2 ** 20:>9.1f}"
+            )
+        return '\n'.join(lines)
+
+    def write(self, path=None):
+        """
+        Stop profiling, write the JSON report and log the summary table.
+
+        Parameters:
+            path (str, optional): Report file; ADVERTISEX_PROFILE_OUTPUT or profile.json by default.
+
+        Returns:
+            dict: The report.
+        """
+        if self.wall_seconds is None:
+            self.stop()
+        path = path or os.getenv(PROFILE_OUTPUT_ENV, DEFAULT_PROFILE_OUTPUT)
+        report = self.report()
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        logging.info(f"Profile written to {path}\n{self.table()}")
+        return report
+
+class InlineExecutor(concurrent.futures.Executor):
+    """
+    Executor running every task immediately in the calling thread.
+
+    Used in place of worker pools while profiling, so the profiled functions
+    and cProfile, which only sees its own thread, observe all the work.
+    """
+
+    def __init__(self, max_workers=None):
+        pass
+
+    def submit(self, func, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+def parse_modes(value):
+    """Parse a comma-separated list of profile modes; '1', 'true' or 'on' mean 'stages'."""
+    modes = [mode.strip().lower() for mode in value.split(',') if mode.strip()]
+    return ['stages' if mode in ('1', 'true', 'on', 'yes') else mode for mode in modes]
+
+_active = None
+
+def enable(modes=('stages',), output=None):
+    """
+    Start profiling this process and write the report when it exits.
+
+    Calling this while profiling is already active returns the active profiler.
+
+    Parameters:
+        modes (iterable): Profile modes (see Profiler).
+        output (str, optional): Report file (see Profiler.write).
+
+    Returns:
+        Profiler: The active profiler.
+    """
+    global _active
+    if _active is None:
+        _active = Profiler(modes).start()
+        atexit.register(_active.write, output)
+    return _active
+
+def enable_from_env():
+    """
+    Enable profiling when the ADVERTISEX_PROFILE environment variable is set.
+
+    Its value is a comma-separated list of modes, e.g. '1', 'cprofile' or
+    'cprofile,tracemalloc'. When it is unset this only reads the environment.
+
+    Returns:
+        Profiler: The active profiler, or None.
+    """
+    value = os.getenv(PROFILE_ENV)
+    if not value or value.lower() in ('0', 'false', 'off', 'no'):
+        return _active
+    return enable(parse_modes(value))
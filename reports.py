@@ -0,0 +1,250 @@
+import argparse
+import logging
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+from sqlalchemy import text
+
+import db
+from attribution import DEFAULT_CONVERSION_TYPES
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_TOP = 10
+CAMPAIGN_COLUMNS = ['ad_campaign_id', 'clicks', 'users', 'conversions', 'conversion_rate']
+CREATIVE_COLUMNS = ['ad_creative_id', 'impressions', 'users', 'domains']
+ACTIVITY_SOURCES = ('ad_impressions', 'clicks_conversions')
+
+class CampaignReports:
+    """
+    Campaign performance queries over a PartitionedStore, with a result cache.
+
+    Every query reads the partition catalog first, so only the daily
+    partitions overlapping its time range are scanned, and partitions the
+    range covers entirely are read without a time predicate. Results are
+    cached in an LRU keyed by the query, its parameters and the version of
+    each partition it read: a write to any of those partitions, or a new
+    partition landing in the range, changes the key, so stale results are
+    never returned and writes to other days keep the cached ones valid.
+    """
+
+    def __init__(self, store, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        Parameters:
+            store (PartitionedStore): Partitioned tables to query.
+            cache_size (int): Maximum number of cached results.
+        """
+        self.store = store
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def query(self, name, params, sources, start, end, build):
+        """
+        Run a query over the partitions of some sources, or return its cached result.
+
+        Parameters:
+            name (str): Name of the query.
+            params (tuple): Hashable query parameters other than the time range.
+            sources (tuple): Sources the query reads.
+            start, end: Time range passed to partition pruning.
+            build (callable): Called with a connection and the pruned catalogs
+                (source -> DataFrame) to compute the result on a cache miss.
+
+        Returns:
+            pandas.DataFrame: Copy of the result.
+        """
+        with db.connect(self.store.engine) as conn:
+            catalogs = {source: self.store.partitions(source, start, end, conn=conn) for source in sources}
+            versions = tuple(
+                (partition.table_name, partition.version)
+                for catalog in catalogs.values() for partition in catalog.itertuples(index=False)
+            )
+            key = (name, params, str(start), str(end), versions)
+            with self.lock:
+                result = self.cache.get(key)
+                if result is not None:
+                    self.hits += 1
+                    self.cache.move_to_end(key)
+                    return result.copy()
+                self.misses += 1
+            result = build(conn, catalogs)
+
+        with self.lock:
+            self.cache[key] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result.copy()
+
+    def invalidate(self):
+        """Drop every cached result."""
+        with self.lock:
+            self.cache.clear()
+
+    def stats(self):
+        """Get cache hits, misses and size."""
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.cache)}
+
+    def select(self, conn, catalog, source, start, end, columns, where=None):
+        """Build the UNION ALL over a source's pruned partitions; see PartitionedStore.select."""
+        return self.store.select(catalog, source, start, end, columns, where=where, quote=lambda name: conn.dialect.identifier_preparer.quote(name))
+
+    def campaign_performance(self, start=None, end=None, campaigns=None):
+        """
+        Clicks, distinct users and conversions per campaign.
+
+        Parameters:
+            start (str or datetime, optional): Only events at or after this time.
+            end (str or datetime, optional): Only events before this time.
+            campaigns (list, optional): Only these campaign ids; all by default.
+
+        Returns:
+            pandas.DataFrame: One row per campaign (ad_campaign_id, clicks, users,
+            conversions, conversion_rate), ordered by campaign id.
+        """
+        campaigns = tuple(sorted(int(campaign) for campaign in campaigns)) if campaigns is not None else None
+
+        def build(conn, catalogs):
+            params = {f"campaign_{index}": campaign for index, campaign in enumerate(campaigns or ())}
+            where = f"ad_campaign_id IN ({', '.join(':' + name for name in params)})" if campaigns is not None else None
+            inner, time_params = self.select(conn, catalogs['clicks_conversions'], 'clicks_conversions', start, end,
+                                             ['user_id', 'ad_campaign_id', 'conversion_type'], where)
+            if inner is None or campaigns == ():
+                return pd.DataFrame(columns=CAMPAIGN_COLUMNS)
+            conversions = {f"conversion_{index}": conversion for index, conversion in enumerate(DEFAULT_CONVERSION_TYPES)}
+            df = pd.read_sql(text(
+                "SELECT ad_campaign_id, COUNT(*) AS clicks, COUNT(DISTINCT user_id) AS users, "
+                f"SUM(CASE WHEN conversion_type IN ({', '.join(':' + name for name in conversions)}) THEN 1 ELSE 0 END) AS conversions "
+                f"FROM ({inner}) AS events GROUP BY ad_campaign_id ORDER BY ad_campaign_id"
+            ), conn, params={**params, **time_params, **conversions})
+            df['conversion_rate'] = df['conversions'] / df['clicks']
+            return df
+
+        return self.query('campaign_performance', (campaigns,), ('clicks_conversions',), start, end, build)
+
+    def top_campaigns(self, start=None, end=None, n=DEFAULT_TOP, by='conversions'):
+        """
+        The campaigns with the most conversions, clicks or users in a time range.
+
+        Parameters:
+            start (str or datetime, optional): Only events at or after this time.
+            end (str or datetime, optional): Only events before this time.
+            n (int): Number of campaigns.
+            by (str): Column of `campaign_performance` to rank by.
+
+        Returns:
+            pandas.DataFrame: The top `n` rows of `campaign_performance`.
+        """
+        if by not in CAMPAIGN_COLUMNS[1:]:
+            raise ValueError(f"Cannot rank campaigns by '{by}', expected one of {CAMPAIGN_COLUMNS[1:]}")
+        df = self.campaign_performance(start, end)
+        return df.sort_values([by, 'ad_campaign_id'], ascending=[False, True]).head(n).reset_index(drop=True)
+
+    def creative_performance(self, start=None, end=None, creatives=None):
+        """
+        Impressions, distinct users and distinct domains per creative.
+
+        Parameters:
+            start (str or datetime, optional): Only impressions at or after this time.
+            end (str or datetime, optional): Only impressions before this time.
+            creatives (list, optional): Only these creative ids; all by default.
+
+        Returns:
+            pandas.DataFrame: One row per creative (ad_creative_id, impressions,
+            users, domains), ordered by creative id.
+        """
+        creatives = tuple(sorted(int(creative) for creative in creatives)) if creatives is not None else None
+
+        def build(conn, catalogs):
+            params = {f"creative_{index}": creative for index, creative in enumerate(creatives or ())}
+            where = f"ad_creative_id IN ({', '.join(':' + name for name in params)})" if creatives is not None else None
+            inner, time_params = self.select(conn, catalogs['ad_impressions'], 'ad_impressions', start, end,
+                                             ['user_id', 'ad_creative_id', 'domain'], where)
+            if inner is None or creatives == ():
+                return pd.DataFrame(columns=CREATIVE_COLUMNS)
+            return pd.read_sql(text(
+                "SELECT ad_creative_id, COUNT(*) AS impressions, COUNT(DISTINCT user_id) AS users, COUNT(DISTINCT domain) AS domains "
+                f"FROM ({inner}) AS events GROUP BY ad_creative_id ORDER BY ad_creative_id"
+            ), conn, params={**params, **time_params})
+
+        return self.query('creative_performance', (creatives,), ('ad_impressions',), start, end, build)
+
+    def user_activity(self, user_id, start=None, end=None):
+        """
+        Impressions and clicks of one user, read through the user_id indexes.
+
+        Parameters:
+            user_id (int): User to look up.
+            start (str or datetime, optional): Only events at or after this time.
+            end (str or datetime, optional): Only events before this time.
+
+        Returns:
+            pandas.DataFrame: One row per source (events, first_seen, last_seen).
+        """
+        def build(conn, catalogs):
+            rows = []
+            for source in ACTIVITY_SOURCES:
+                inner, params = self.select(conn, catalogs[source], source, start, end, ['timestamp'], 'user_id = :user_id')
+                activity = {'source': source, 'events': 0, 'first_seen': None, 'last_seen': None}
+                if inner is not None:
+                    activity.update(pd.read_sql(text(
+                        'SELECT COUNT(*) AS events, MIN("timestamp") AS first_seen, MAX("timestamp") AS last_seen '
+                        f"FROM ({inner}) AS events"
+                    ), conn, params={**params, 'user_id': int(user_id)}).iloc[0].to_dict())
+                rows.append(activity)
+            df = pd.DataFrame(rows).set_index('source')
+            for column in ('first_seen', 'last_seen'):
+                df[column] = pd.to_datetime(df[column])
+            return df
+
+        return self.query('user_activity', (int(user_id),), ACTIVITY_SOURCES, start, end, build)
+
+    def daily_volume(self, source, start=None, end=None):
+        """
+        Rows per day of a source, read from the partition catalog without scanning.
+
+        Parameters:
+            source (str): Source to count.
+            start (str or datetime, optional): First day.
+            end (str or datetime, optional): End of the range (exclusive).
+
+        Returns:
+            pandas.Series: Row counts indexed by day.
+        """
+        catalog = self.store.partitions(source, start, end)
+        return catalog.set_index(pd.to_datetime(catalog['day']).rename('day'))['row_count']
+
+if __name__ == '__main__':
+    # Configure command-line arguments
+    parser = argparse.ArgumentParser(description='Campaign performance reports for AdvertiseX')
+    parser.add_argument('report', choices=['campaigns', 'top-campaigns', 'creatives', 'user', 'daily'], help='Report to run')
+    parser.add_argument('--start', help='Start of the time range (inclusive)')
+    parser.add_argument('--end', help='End of the time range (exclusive)')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP, help='Campaigns in the top-campaigns report')
+    parser.add_argument('--by', default='conversions', help='Column ranking the top-campaigns report')
+    parser.add_argument('--user-id', type=int, help='User of the user report')
+    parser.add_argument('--source', default='ad_impressions', help='Source of the daily report')
+    args = parser.parse_args()
+
+    from process import processor
+    reports = CampaignReports(processor.partitions)
+    if args.report == 'campaigns':
+        result = reports.campaign_performance(args.start, args.end)
+    elif args.report == 'top-campaigns':
+        result = reports.top_campaigns(args.start, args.end, args.top, args.by)
+    elif args.report == 'creatives':
+        result = reports.creative_performance(args.start, args.end)
+    elif args.report == 'user':
+        if args.user_id is None:
+            parser.error('the user report requires --user-id')
+        result = reports.user_activity(args.user_id, args.start, args.end)
+    else:
+        result = reports.daily_volume(args.source, args.start, args.end)
+    print(result.to_string())
@@ -0,0 +1,255 @@
+import ipaddress
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+RULES_PATH_ENV = 'VALIDATION_RULES_PATH'
+QUARANTINE_REASON_COLUMN = 'rejected_by'
+
+# Validation rules and named filters per source. A rule checks one column,
+# or the first present of several alternatives; rules whose column is
+# missing from a frame are skipped. Missing values fail every check except
+# when the rule sets 'allow_null'.
+DEFAULT_RULES = {
+    'ad_impressions': {
+        'validate': [
+            {'name': 'user_id_present', 'column': 'user_id', 'type': 'not_null'},
+            {'name': 'ad_creative_id_present', 'column': 'ad_creative_id', 'type': 'not_null'},
+            {'name': 'website_present', 'column': ['website_url', 'website'], 'type': 'not_null'},
+            {'name': 'timestamp_valid', 'column': 'timestamp', 'type': 'timestamp', 'start': '2000-01-01', 'end': '2100-01-01'},
+        ],
+        'filters': {},
+    },
+    'clicks_conversions': {
+        'validate': [
+            {'name': 'user_id_present', 'column': 'user_id', 'type': 'not_null'},
+            {'name': 'ad_campaign_id_present', 'column': 'ad_campaign_id', 'type': 'not_null'},
+            # Conversion types outside the schema's enum are already missing here
+            {'name': 'conversion_type_known', 'column': 'conversion_type', 'type': 'not_null'},
+            {'name': 'timestamp_valid', 'column': 'timestamp', 'type': 'timestamp', 'start': '2000-01-01', 'end': '2100-01-01'},
+        ],
+        'filters': {
+            'purchases': [{'name': 'purchase', 'column': 'conversion_type', 'type': 'enum', 'values': ['purchase', 'Purchase']}],
+        },
+    },
+    'bid_requests': {
+        'validate': [
+            {'name': 'bid_amount_non_negative', 'column': 'bid_amount', 'type': 'range', 'min': 0},
+            {'name': 'user_id_present', 'column': 'user_id', 'type': 'not_null'},
+            {'name': 'auction_id_format', 'column': 'auction_id', 'type': 'regex', 'pattern': r'AUCTION-\d+'},
+            {'name': 'ip_address_valid', 'column': ['ip_address', 'user_ip'], 'type': 'ip'},
+        ],
+        'filters': {
+            'high_value': [{'name': 'bid_amount_at_least_5', 'column': 'bid_amount', 'type': 'range', 'min': 5}],
+        },
+    },
+}
+
+def load_rules(path=None):
+    """
+    Load the rule configuration.
+
+    Rules from a JSON file, given or named by the VALIDATION_RULES_PATH
+    environment variable, replace the default 'validate' list and extend the
+    default 'filters' of each source they mention.
+
+    Parameters:
+        path (str, optional): JSON file with the same layout as DEFAULT_RULES.
+
+    Returns:
+        dict: Rule configuration per source.
+    """
+    config = {source: {'validate': list(rules['validate']), 'filters': dict(rules['filters'])}
+              for source, rules in DEFAULT_RULES.items()}
+    path = path or os.getenv(RULES_PATH_ENV)
+    if not path:
+        return config
+    with open(path) as f:
+        overrides = json.load(f)
+    for source, rules in overrides.items():
+        source_config = config.setdefault(source, {'validate': [], 'filters': {}})
+        if 'validate' in rules:
+            source_config['validate'] = rules['validate']
+        source_config['filters'].update(rules.get('filters', {}))
+    logging.info(f"Loaded validation rules from {path}")
+    return config
+
+# Function to check IP address validity, once per distinct value
+def valid_ips(values, version=None):
+    codes, uniques = pd.factorize(values)
+
+    def is_valid(value):
+        try:
+            address = ipaddress.ip_address(str(value))
+        except ValueError:
+            return False
+        return version is None or address.version == version
+
+    # Missing values get code -1, which picks the trailing False
+    return np.append(np.array([is_valid(value) for value in uniques], dtype=bool), False)[codes]
+
+# Checks by rule type, each returning a boolean Series of passing rows
+CHECKS = {
+    'not_null': lambda column, rule: column.notna(),
+    'range': lambda column, rule: (
+        (column >= rule['min'] if 'min' in rule else column.notna())
+        & (column <= rule['max'] if 'max' in rule else column.notna())
+    ),
+    'equals': lambda column, rule: column == rule['value'],
+    'enum': lambda column, rule: column.isin(rule['values']),
+    'regex': lambda column, rule: column.astype('string').str.fullmatch(rule['pattern']),
+    'ip': lambda column, rule: pd.Series(valid_ips(column, rule.get('version')), index=column.index),
+    'timestamp': lambda column, rule: (
+        pd.to_datetime(column, errors='coerce').between(
+            pd.Timestamp(rule.get('start', pd.Timestamp.min)), pd.Timestamp(rule.get('end', pd.Timestamp.max)), inclusive='left',
+        )
+    ),
+}
+
+class Rule:
+    """One compiled predicate over a column."""
+
+    def __init__(self, spec):
+        """
+        Parameters:
+            spec (dict): 'type' (a key of CHECKS), 'column' (a name or a list of
+                alternatives), an optional 'name', 'allow_null' and the
+                type's parameters ('min', 'max', 'value', 'values', 'pattern',
+                'version', 'start', 'end').
+        """
+        if spec.get('type') not in CHECKS:
+            raise ValueError(f"Unknown rule type: {spec.get('type')}")
+        self.spec = spec
+        self.check = CHECKS[spec['type']]
+        self.columns = [spec['column']] if isinstance(spec['column'], str) else list(spec['column'])
+        self.name = spec.get('name') or f"{self.columns[0]}_{spec['type']}"
+        self.allow_null = spec.get('allow_null', False)
+
+    def column(self, df):
+        """Get the first of the rule's columns present in the frame, or None."""
+        for column in self.columns:
+            if column in df.columns:
+                return column
+        return None
+
+    def evaluate(self, df):
+        """
+        Evaluate the rule.
+
+        Parameters:
+            df (pandas.DataFrame): Frame to check.
+
+        Returns:
+            numpy.ndarray: Boolean mask of passing rows, or None if the rule's
+            column is missing from the frame.
+        """
+        column = self.column(df)
+        if column is None:
+            return None
+        values = df[column]
+        passed = self.check(values, self.spec)
+        passed = passed.to_numpy(dtype=bool, na_value=False) if hasattr(passed, 'to_numpy') else np.asarray(passed, dtype=bool)
+        if self.allow_null:
+            passed = passed | values.isna().to_numpy()
+        return passed
+
+class RuleSet:
+    """
+    Rules compiled into a single mask per batch.
+
+    Every rule is evaluated on the whole frame and combined into one boolean
+    mask; the frame is indexed once, and not at all when every row passes.
+    Rejected rows are returned with the names of the rules they failed, and
+    rejections are counted per rule.
+    """
+
+    def __init__(self, specs, source=None):
+        """
+        Parameters:
+            specs (list): Rule specifications (see Rule).
+            source (str, optional): Source the rules belong to, used in logs and metrics.
+        """
+        self.rules = [Rule(spec) for spec in specs]
+        self.source = source
+
+    def evaluate(self, df):
+        """
+        Evaluate every rule.
+
+        Parameters:
+            df (pandas.DataFrame): Frame to check.
+
+        Returns:
+            tuple: (mask of rows passing every rule, {rule name: failure mask}).
+        """
+        mask = np.ones(len(df), dtype=bool)
+        failures = {}
+        for rule in self.rules:
+            passed = rule.evaluate(df)
+            if passed is None:
+                continue
+            mask &= passed
+            failures[rule.name] = ~passed
+        return mask, failures
+
+    def apply(self, df):
+        """
+        Split a frame into passing and rejected rows.
+
+        Parameters:
+            df (pandas.DataFrame): Frame to check.
+
+        Returns:
+            dict: 'valid' rows, 'rejected' rows with a 'rejected_by' column listing
+            the failed rules, and 'counts' of rejections per rule.
+        """
+        mask, failures = self.evaluate(df)
+        counts = {name: int(failed.sum()) for name, failed in failures.items()}
+        if mask.all():
+            return {'valid': df, 'rejected': df.iloc[:0], 'counts': counts}
+        rejected = df[~mask].copy()
+        reasons = np.full(len(rejected), '', dtype=object)
+        for name, failed in failures.items():
+            failed = failed[~mask]
+            reasons[failed] = reasons[failed] + name + ','
+        rejected[QUARANTINE_REASON_COLUMN] = pd.Series(reasons, index=rejected.index).str.rstrip(',')
+        return {'valid': df[mask], 'rejected': rejected, 'counts': counts}
+
+    def filter(self, df):
+        """
+        Keep the rows passing every rule.
+
+        Parameters:
+            df (pandas.DataFrame): Frame to filter.
+
+        Returns:
+            pandas.DataFrame: Passing rows; the frame itself when all rows pass.
+        """
+        mask, _ = self.evaluate(df)
+        return df if mask.all() else df[mask]
+
+def compile_rules(config=None):
+    """
+    Compile the validation rules and named filters of every source.
+
+    Parameters:
+        config (dict, optional): Rule configuration; see DEFAULT_RULES and load_rules.
+
+    Returns:
+        dict: Source mapped to {'validate': RuleSet, 'filters': {name: RuleSet}}.
+    """
+    config = config if config is not None else load_rules()
+    return {
+        source: {
+            'validate': RuleSet(rules.get('validate', []), source),
+            'filters': {name: RuleSet(specs, source) for name, specs in rules.get('filters', {}).items()},
+        }
+        for source, rules in config.items()
+    }
@@ -0,0 +1,228 @@
+# pandas is imported where it is used, so commands that only need the
+# schemas (e.g. the sample data generator) start without loading it
+
+# Define constants
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Avro-style record schemas for every source. Timestamps are strings in the
+# raw files; their `format` attribute is used to parse them without inference.
+# Strings with an `encoding` attribute are dictionary-encoded in record
+# batches, 'ipv4' ones with the distinct addresses packed into uint32.
+AD_IMPRESSION_SCHEMA = {
+    "type": "record",
+    "name": "AdImpression",
+    "fields": [
+        {"name": "ad_creative_id", "type": "int"},
+        {"name": "user_id", "type": "int"},
+        {"name": "timestamp", "type": "string", "format": TIMESTAMP_FORMAT},
+        {"name": "website_url", "type": "string", "encoding": "dictionary"}
+    ]
+}
+
+CLICK_CONVERSION_SCHEMA = {
+    "type": "record",
+    "name": "ClickConversion",
+    "fields": [
+        {"name": "timestamp", "type": "string", "format": TIMESTAMP_FORMAT},
+        {"name": "user_id", "type": "int"},
+        {"name": "ad_campaign_id", "type": "int"},
+        {"name": "conversion_type", "type": {"type": "enum", "name": "ConversionType", "symbols": ["purchase", "signup", "visit"]}}
+    ]
+}
+
+BID_REQUEST_SCHEMA = {
+    "type": "record",
+    "name": "BidRequest",
+    "fields": [
+        {"name": "bid_amount", "type": "float"},
+        {"name": "user_id", "type": "int"},
+        {"name": "auction_id", "type": "string", "encoding": "dictionary"},
+        {"name": "ip_address", "type": "string", "encoding": "ipv4"}
+    ]
+}
+
+SCHEMAS = {
+    'ad_impressions': AD_IMPRESSION_SCHEMA,
+    'clicks_conversions': CLICK_CONVERSION_SCHEMA,
+    'bid_requests': BID_REQUEST_SCHEMA,
+}
+
+# Avro primitive types mapped to pandas dtypes
+AVRO_DTYPES = {
+    'int': 'int32',
+    'long': 'int64',
+    'float': 'float32',
+    'double': 'float64',
+    'boolean': 'bool',
+    'string': 'object',
+}
+
+# Older field names still accepted in place of the schema's
+LEGACY_COLUMNS = {'website': 'website_url', 'user_ip': 'ip_address'}
+
+# Integer dtypes mapped to their nullable counterparts, used when values are missing
+NULLABLE_DTYPES = {'int32': 'Int32', 'int64': 'Int64', 'bool': 'boolean'}
+
+def get_schema(source):
+    """
+    Get the record schema of a source.
+
+    Parameters:
+        source (str): 'ad_impressions', 'clicks_conversions' or 'bid_requests'.
+
+    Returns:
+        dict: Avro-style record schema.
+    """
+    try:
+        return SCHEMAS[source]
+    except KeyError:
+        raise ValueError(f"Unknown source: {source}")
+
+def infer_source(df):
+    """
+    Guess the source of a DataFrame from its columns.
+
+    Parameters:
+        df (pandas.DataFrame): Ingested or processed records.
+
+    Returns:
+        str: The source sharing the most columns with the frame, or None if it shares none.
+    """
+    columns = {LEGACY_COLUMNS.get(column, column) for column in df.columns}
+    overlaps = {
+        source: sum(field['name'] in columns for field in schema['fields'] if field['name'] not in ('user_id', 'timestamp'))
+        for source, schema in SCHEMAS.items()
+    }
+    source = max(overlaps, key=overlaps.get)
+    return source if overlaps[source] else None
+
+def field_dtype(field):
+    """
+    Get the pandas dtype of a schema field.
+
+    Parameters:
+        field (dict): Field of a record schema.
+
+    Returns:
+        The dtype: 'datetime64[ns]' for formatted timestamps, a CategoricalDtype
+        for enums, otherwise the mapping of the Avro primitive type.
+    """
+    import pandas as pd
+    field_type = field['type']
+    if isinstance(field_type, dict) and field_type.get('type') == 'enum':
+        return pd.CategoricalDtype(field_type['symbols'])
+    if 'format' in field:
+        return 'datetime64[ns]'
+    return AVRO_DTYPES.get(field_type, 'object')
+
+def column_encodings(source):
+    """
+    Get the dictionary-encoded columns of a source, under their current and legacy names.
+
+    Parameters:
+        source (str): Source name.
+
+    Returns:
+        dict: Column names mapped to 'dictionary' or 'ipv4'.
+    """
+    encodings = {field['name']: field['encoding'] for field in get_schema(source)['fields'] if 'encoding' in field}
+    encodings.update({legacy: encodings[name] for legacy, name in LEGACY_COLUMNS.items() if name in encodings})
+    return encodings
+
+def column_dtypes(source):
+    """
+    Get the column dtypes of a source.
+
+    Parameters:
+        source (str): Source name.
+
+    Returns:
+        dict: Column names mapped to pandas dtypes.
+    """
+    return {field['name']: field_dtype(field) for field in get_schema(source)['fields']}
+
+def coerce_frame(df, source):
+    """
+    Cast the schema columns of a DataFrame to their declared types.
+
+    Timestamps are parsed with the fixed format from the schema, ids become
+    32-bit integers and enums become categoricals. Values that do not fit
+    their type become missing (a nullable integer dtype is used then), and
+    columns outside the schema are left untouched.
+
+    Parameters:
+        df (pandas.DataFrame): DataFrame to cast in place.
+        source (str): Source name.
+
+    Returns:
+        pandas.DataFrame: The same DataFrame, typed.
+    """
+    import pandas as pd
+    for field in get_schema(source)['fields']:
+        name = field['name']
+        if name not in df.columns:
+            continue
+        dtype = field_dtype(field)
+        column = df[name]
+        if 'format' in field:
+            if not pd.api.types.is_datetime64_any_dtype(column):
+                df[name] = pd.to_datetime(column, format=field['format'], errors='coerce')
+        elif isinstance(dtype, pd.CategoricalDtype):
+            # Values outside the enum become missing
+            df[name] = column.where(column.isin(dtype.categories)).astype(dtype)
+        elif dtype in NULLABLE_DTYPES or dtype.startswith('float'):
+            if column.dtype != dtype:
+                column = pd.to_numeric(column, errors='coerce')
+                if column.isna().any() and dtype in NULLABLE_DTYPES:
+                    dtype = NULLABLE_DTYPES[dtype]
+                df[name] = column.astype(dtype)
+    return df
+
+def parse_records(records, source):
+    """
+    Build a typed DataFrame from ingested records.
+
+    Parameters:
+        records (list, pandas.DataFrame or batches.RecordBatch): Ingested records.
+        source (str): Source name.
+
+    Returns:
+        pandas.DataFrame: Typed DataFrame.
+    """
+    import pandas as pd
+    from batches import RecordBatch
+    if isinstance(records, RecordBatch):
+        # Batches are typed already; their arrays back the frame without a copy
+        return records.to_frame()
+    return coerce_frame(pd.DataFrame(records), source)
+
+def read_csv_typed(csv_file, source, **kwargs):
+    """
+    Read a CSV file straight into typed columns.
+
+    Integer and enum columns are typed by the CSV parser itself; timestamps
+    are then parsed with the schema's fixed format.
+
+    Parameters:
+        csv_file (str or file): CSV file to read.
+        source (str): Source name.
+        **kwargs: Extra `pandas.read_csv` arguments, e.g. `chunksize`.
+
+    Returns:
+        pandas.DataFrame, or an iterator of DataFrames when `chunksize` is given.
+    """
+    import pandas as pd
+    dtypes = {
+        name: dtype for name, dtype in column_dtypes(source).items()
+        if dtype != 'datetime64[ns]'
+    }
+    # Parse ids as nullable integers, so a missing value does not fail the read,
+    # and enums as plain categoricals, restricted to their symbols afterwards
+    dtypes = {
+        name: 'category' if isinstance(dtype, pd.CategoricalDtype) else NULLABLE_DTYPES.get(dtype, dtype)
+        for name, dtype in dtypes.items()
+    }
+    result = pd.read_csv(csv_file, dtype=dtypes, **kwargs)
+    if isinstance(result, pd.DataFrame):
+        return coerce_frame(result, source)
+    return (coerce_frame(chunk, source) for chunk in result)
@@ -0,0 +1,590 @@
+import base64
+import json
+import logging
+import struct
+
+import numpy as np
+import pandas as pd
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+DEFAULT_PRECISION = 12          # 4096 registers, about 1.6% standard error
+DEFAULT_CMS_WIDTH = 2048
+DEFAULT_CMS_DEPTH = 5
+DEFAULT_TOP_K = 100
+SKETCH_VERSION = 1
+HLL_MAGIC = b'AXHL'
+CMS_MAGIC = b'AXCM'
+SPACE_SAVING_MAGIC = b'AXSS'
+
+# Dimensions of processed frames that distinct users are counted for
+DISTINCT_DIMENSIONS = {
+    'campaign': 'ad_campaign_id',
+    'creative': 'ad_creative_id',
+    'domain': 'domain',
+}
+
+# Function to hash a column of values to 64 bits
+def hash_values(values):
+    """
+    Hash values to unsigned 64-bit integers.
+
+    The hash is stable across processes and runs, and does not depend on the
+    integer width, so sketches built by different workers can be merged.
+    Missing values are dropped.
+
+    Parameters:
+        values (pandas.Series or array-like): Values to hash.
+
+    Returns:
+        numpy.ndarray: uint64 hashes.
+    """
+    values = pd.Series(values)
+    values = values[values.notna()]
+    if pd.api.types.is_integer_dtype(values.dtype):
+        array = values.to_numpy('int64')
+    elif isinstance(values.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(values.dtype):
+        array = values.astype(str).to_numpy(object)
+    else:
+        array = values.to_numpy()
+    return pd.util.hash_array(array)
+
+# Function to count leading zero bits of 64-bit integers
+def leading_zeros(x):
+    """
+    Count the leading zero bits of each unsigned 64-bit integer.
+
+    Parameters:
+        x (numpy.ndarray): uint64 values.
+
+    Returns:
+        numpy.ndarray: Leading zero counts (64 for zero).
+    """
+    x = x.copy()
+    zeros = np.zeros(len(x), dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        mask = x < np.uint64(1 << (64 - shift))
+        zeros[mask] += shift
+        x[mask] <<= np.uint64(shift)
+    zeros[x == 0] = 64
+    return zeros
+
+# Function to get the HyperLogLog register and rank of each hash
+def hll_positions(hashes, precision):
+    """
+    Split hashes into a register index and the rank stored in it.
+
+    Parameters:
+        hashes (numpy.ndarray): uint64 hashes.
+        precision (int): Number of index bits.
+
+    Returns:
+        tuple: (register indexes, ranks) arrays.
+    """
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    rank = np.minimum(leading_zeros(hashes << np.uint64(precision)) + 1, 64 - precision + 1).astype(np.uint8)
+    return index, rank
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter.
+
+    Uses 2**precision one-byte registers whatever the number of values added.
+    Two sketches of the same precision merge into the sketch of the union
+    of their inputs.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        """
+        Parameters:
+            precision (int): Number of index bits, 4 to 18.
+            registers (numpy.ndarray, optional): Initial registers.
+        """
+        if not 4 <= precision <= 18:
+            raise ValueError(f"HyperLogLog precision must be between 4 and 18, got {precision}")
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+
+    def add_many(self, values):
+        """
+        Add a column of values.
+
+        Parameters:
+            values (pandas.Series or array-like): Values to count.
+
+        Returns:
+            HyperLogLog: This sketch.
+        """
+        return self.add_hashes(hash_values(values))
+
+    def add_hashes(self, hashes):
+        """Add already hashed values."""
+        index, rank = hll_positions(hashes, self.precision)
+        np.maximum.at(self.registers, index, rank)
+        return self
+
+    def count(self):
+        """
+        Estimate the number of distinct values added.
+
+        Returns:
+            int: Estimated distinct count.
+        """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        empty = np.count_nonzero(self.registers == 0)
+        # Linear counting is more accurate while many registers are still empty
+        if estimate <= 2.5 * m and empty:
+            estimate = m * np.log(m / empty)
+        return int(round(estimate))
+
+    def merge(self, other):
+        """
+        Merge another sketch into this one.
+
+        Parameters:
+            other (HyperLogLog): Sketch of the same precision.
+
+        Returns:
+            HyperLogLog: This sketch.
+        """
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge HyperLogLog sketches of precision {self.precision} and {other.precision}")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def copy(self):
+        return HyperLogLog(self.precision, self.registers.copy())
+
+    def to_bytes(self):
+        """Serialize the sketch."""
+        return struct.pack('<4sBB', HLL_MAGIC, SKETCH_VERSION, self.precision) + self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Deserialize a sketch written by `to_bytes`."""
+        magic, version, precision = struct.unpack_from('<4sBB', data)
+        if magic != HLL_MAGIC or version != SKETCH_VERSION:
+            raise ValueError("Not a serialized HyperLogLog sketch")
+        return cls(precision, np.frombuffer(data, dtype=np.uint8, offset=6).copy())
+
+class CountMinSketch:
+    """
+    Count-Min sketch of value frequencies.
+
+    Estimates never undercount; with width w they overcount by at most
+    about e/w of the total count with probability 1 - exp(-depth). Sketches
+    of the same shape merge by adding their tables.
+    """
+
+    def __init__(self, width=DEFAULT_CMS_WIDTH, depth=DEFAULT_CMS_DEPTH, table=None):
+        """
+        Parameters:
+            width (int): Counters per row.
+            depth (int): Number of rows (independent hash functions).
+            table (numpy.ndarray, optional): Initial counters.
+        """
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64) if table is None else table
+
+    def columns(self, hashes):
+        """Get the counter column of each hash in every row, by double hashing."""
+        low = (hashes & np.uint64(0xFFFFFFFF)).astype(np.int64)
+        high = (hashes >> np.uint64(32)).astype(np.int64) | 1
+        return [(low + row * high) % self.width for row in range(self.depth)]
+
+    def add_many(self, values, counts=None):
+        """
+        Add a column of values.
+
+        Parameters:
+            values (pandas.Series or array-like): Values to count.
+            counts (array-like, optional): Count of each value; 1 by default.
+
+        Returns:
+            CountMinSketch: This sketch.
+        """
+        values = pd.Series(values)
+        if counts is not None:
+            counts = np.asarray(counts)[values.notna().to_numpy()]
+        for row, columns in enumerate(self.columns(hash_values(values))):
+            self.table[row] += np.bincount(columns, weights=counts, minlength=self.width).astype(np.int64)
+        return self
+
+    def estimate(self, values):
+        """
+        Estimate the counts of values.
+
+        Parameters:
+            values (pandas.Series or array-like): Values to look up.
+
+        Returns:
+            numpy.ndarray: Estimated counts.
+        """
+        columns = self.columns(hash_values(values))
+        return np.min([self.table[row, column] for row, column in enumerate(columns)], axis=0)
+
+    @property
+    def total(self):
+        """Total count added."""
+        return int(self.table[0].sum())
+
+    def merge(self, other):
+        """
+        Merge another sketch into this one.
+
+        Parameters:
+            other (CountMinSketch): Sketch of the same width and depth.
+
+        Returns:
+            CountMinSketch: This sketch.
+        """
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Cannot merge Count-Min sketches of different shapes")
+        self.table += other.table
+        return self
+
+    def copy(self):
+        return CountMinSketch(self.width, self.depth, self.table.copy())
+
+    def to_bytes(self):
+        """Serialize the sketch."""
+        return struct.pack('<4sBIB', CMS_MAGIC, SKETCH_VERSION, self.width, self.depth) + self.table.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Deserialize a sketch written by `to_bytes`."""
+        magic, version, width, depth = struct.unpack_from('<4sBIB', data)
+        if magic != CMS_MAGIC or version != SKETCH_VERSION:
+            raise ValueError("Not a serialized Count-Min sketch")
+        table = np.frombuffer(data, dtype=np.int64, offset=struct.calcsize('<4sBIB')).reshape(depth, width).copy()
+        return cls(width, depth, table)
+
+class SpaceSaving:
+    """
+    Space-Saving summary of the most frequent values.
+
+    Keeps at most `capacity` counters. Each monitored value has an estimated
+    count that never undercounts and overcounts by at most its `error`, and no
+    value outside the summary occurs more than `floor` times. Summaries merge
+    by adding counts, so batches, workers and periods can be combined.
+    """
+
+    def __init__(self, capacity=DEFAULT_TOP_K, counts=None, errors=None, floor=0):
+        """
+        Parameters:
+            capacity (int): Maximum number of monitored values.
+            counts (pandas.Series, optional): Estimated counts indexed by value.
+            errors (pandas.Series, optional): Maximum overcount indexed by value.
+            floor (int): Upper bound on the count of unmonitored values.
+        """
+        self.capacity = capacity
+        self.counts = counts if counts is not None else pd.Series(dtype='int64')
+        self.errors = errors if errors is not None else pd.Series(0, index=self.counts.index, dtype='int64')
+        self.floor = floor
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add_many(self, values):
+        """
+        Add a column of values.
+
+        Parameters:
+            values (pandas.Series or array-like): Values to count.
+
+        Returns:
+            SpaceSaving: This summary.
+        """
+        counts = pd.Series(values).value_counts(dropna=True)
+        batch = SpaceSaving(self.capacity, counts.astype('int64'))
+        batch.truncate()
+        return self.merge(batch)
+
+    def truncate(self):
+        """Keep the `capacity` largest counters, raising the floor to the largest dropped count."""
+        if len(self.counts) > self.capacity:
+            order = self.counts.sort_values(ascending=False, kind='stable')
+            self.floor = max(self.floor, int(order.iloc[self.capacity]))
+            keep = order.index[:self.capacity]
+            self.counts = self.counts[keep]
+            self.errors = self.errors[keep]
+
+    def merge(self, other):
+        """
+        Merge another summary into this one.
+
+        Values monitored by only one summary may have occurred up to the other
+        summary's floor times, which is added to their count and error.
+
+        Parameters:
+            other (SpaceSaving): Summary to merge.
+
+        Returns:
+            SpaceSaving: This summary.
+        """
+        index = self.counts.index.union(other.counts.index)
+        self.counts = self.counts.reindex(index, fill_value=self.floor) + other.counts.reindex(index, fill_value=other.floor)
+        self.errors = (
+            self.errors.reindex(index, fill_value=self.floor) + other.errors.reindex(index, fill_value=other.floor)
+        )
+        self.floor += other.floor
+        self.truncate()
+        return self
+
+    def top(self, n=10):
+        """
+        Get the most frequent values.
+
+        Parameters:
+            n (int): Number of values.
+
+        Returns:
+            pandas.DataFrame: 'value', estimated 'count', 'error' and the
+            'guaranteed' count (count - error), most frequent first.
+        """
+        top = self.counts.sort_values(ascending=False, kind='stable').head(n)
+        errors = self.errors[top.index]
+        return pd.DataFrame({
+            'value': top.index,
+            'count': top.to_numpy(),
+            'error': errors.to_numpy(),
+            'guaranteed': (top - errors).to_numpy(),
+        })
+
+    def copy(self):
+        return SpaceSaving(self.capacity, self.counts.copy(), self.errors.copy(), self.floor)
+
+    def to_bytes(self):
+        """Serialize the summary."""
+        state = {
+            'capacity': self.capacity,
+            'floor': self.floor,
+            'values': self.counts.index.tolist(),
+            'counts': self.counts.tolist(),
+            'errors': self.errors.tolist(),
+        }
+        return struct.pack('<4sB', SPACE_SAVING_MAGIC, SKETCH_VERSION) + json.dumps(state).encode()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Deserialize a summary written by `to_bytes`."""
+        magic, version = struct.unpack_from('<4sB', data)
+        if magic != SPACE_SAVING_MAGIC or version != SKETCH_VERSION:
+            raise ValueError("Not a serialized Space-Saving summary")
+        state = json.loads(bytes(data[5:]).decode())
+        index = pd.Index(state['values'])
+        return cls(
+            state['capacity'],
+            pd.Series(state['counts'], index=index, dtype='int64'),
+            pd.Series(state['errors'], index=index, dtype='int64'),
+            state['floor'],
+        )
+
+# Deserializers by magic prefix
+SKETCH_TYPES = {HLL_MAGIC: HyperLogLog, CMS_MAGIC: CountMinSketch, SPACE_SAVING_MAGIC: SpaceSaving}
+
+def load_sketch(data):
+    """
+    Deserialize any sketch written by a `to_bytes` method.
+
+    Parameters:
+        data (bytes): Serialized sketch.
+
+    Returns:
+        HyperLogLog, CountMinSketch or SpaceSaving.
+    """
+    try:
+        return SKETCH_TYPES[bytes(data[:4])].from_bytes(data)
+    except KeyError:
+        raise ValueError("Unknown sketch type")
+
+def period_start(timestamps, freq):
+    """Get the start of the hour, day ('D') or week ('W') containing each timestamp."""
+    return timestamps.dt.to_period(freq).dt.start_time
+
+def distinct_by(df, key, value='user_id', time_column='timestamp', freq='h', precision=DEFAULT_PRECISION):
+    """
+    Build one HyperLogLog of `value` per key and period.
+
+    Register updates for all groups are computed in a single vectorized pass.
+
+    Parameters:
+        df (pandas.DataFrame): Processed events.
+        key (str): Column to group by, e.g. 'ad_campaign_id'.
+        value (str): Column whose distinct values are counted.
+        time_column (str): Event time column.
+        freq (str): Period length, e.g. 'h', 'D' or 'W'.
+        precision (int): HyperLogLog precision.
+
+    Returns:
+        dict: (key value, period start) mapped to a HyperLogLog.
+    """
+    df = df[df[key].notna() & df[value].notna() & df[time_column].notna()]
+    if df.empty:
+        return {}
+    groups = pd.MultiIndex.from_arrays([df[key], period_start(df[time_column], freq)])
+    codes, uniques = pd.factorize(groups)
+    index, rank = hll_positions(hash_values(df[value]), precision)
+    registers = np.zeros((len(uniques), 1 << precision), dtype=np.uint8)
+    np.maximum.at(registers, (codes, index), rank)
+    return {group: HyperLogLog(precision, registers[code]) for code, group in enumerate(uniques)}
+
+class CampaignSketches:
+    """
+    Constant-memory reporting sketches over processed event batches.
+
+    Tracks distinct users per campaign, creative and domain per period with
+    HyperLogLog, and the most frequent users and auctions with Space-Saving.
+    Instances built by different batches or workers merge together, and the
+    per-period sketches roll up to coarser periods.
+    """
+
+    def __init__(self, freq='h', precision=DEFAULT_PRECISION, top_k=DEFAULT_TOP_K):
+        """
+        Parameters:
+            freq (str): Period of the distinct counts, e.g. 'h'.
+            precision (int): HyperLogLog precision.
+            top_k (int): Capacity of the heavy-hitter summaries.
+        """
+        self.freq = freq
+        self.precision = precision
+        self.top_k = top_k
+        self.distinct = {}
+        self.heavy_hitters = {'user_id': SpaceSaving(top_k), 'auction_id': SpaceSaving(top_k)}
+
+    def update(self, df, time_column='timestamp'):
+        """
+        Add a processed batch; columns that are missing from it are skipped.
+
+        Parameters:
+            df (pandas.DataFrame): Processed ad impressions, clicks or bid requests.
+            time_column (str): Event time column.
+
+        Returns:
+            CampaignSketches: These sketches.
+        """
+        if 'user_id' in df.columns and time_column in df.columns:
+            for dimension, column in DISTINCT_DIMENSIONS.items():
+                if column in df.columns:
+                    for (key, period), sketch in distinct_by(df, column, 'user_id', time_column, self.freq, self.precision).items():
+                        self.add_distinct((dimension, key, period), sketch)
+        for column, summary in self.heavy_hitters.items():
+            if column in df.columns:
+                summary.add_many(df[column])
+        return self
+
+    def add_distinct(self, group, sketch):
+        """Merge a distinct-count sketch into the one of its (dimension, key, period) group."""
+        if group in self.distinct:
+            self.distinct[group].merge(sketch)
+        else:
+            self.distinct[group] = sketch.copy()
+
+    def merge(self, other):
+        """
+        Merge sketches built elsewhere, e.g. by another worker.
+
+        Parameters:
+            other (CampaignSketches): Sketches with the same period and precision.
+
+        Returns:
+            CampaignSketches: These sketches.
+        """
+        for group, sketch in other.distinct.items():
+            self.add_distinct(group, sketch)
+        for column, summary in other.heavy_hitters.items():
+            self.heavy_hitters[column].merge(summary)
+        return self
+
+    def rollup(self, freq):
+        """
+        Roll the distinct counts up to a coarser period.
+
+        Parameters:
+            freq (str): Coarser period, e.g. 'D' or 'W'.
+
+        Returns:
+            CampaignSketches: New sketches over `freq` periods.
+        """
+        rolled = CampaignSketches(freq, self.precision, self.top_k)
+        for (dimension, key, period), sketch in self.distinct.items():
+            start = pd.Timestamp(period).to_period(freq).start_time
+            rolled.add_distinct((dimension, key, start), sketch)
+        for column, summary in self.heavy_hitters.items():
+            rolled.heavy_hitters[column] = summary.copy()
+        return rolled
+
+    def unique_users(self, dimension=None):
+        """
+        Get the estimated distinct users per key and period.
+
+        Parameters:
+            dimension (str, optional): 'campaign', 'creative' or 'domain'; all by default.
+
+        Returns:
+            pandas.DataFrame: 'dimension', 'key', 'period' and 'unique_users'.
+        """
+        rows = [
+            (group_dimension, key, period, sketch.count())
+            for (group_dimension, key, period), sketch in self.distinct.items()
+            if dimension is None or group_dimension == dimension
+        ]
+        df = pd.DataFrame(rows, columns=['dimension', 'key', 'period', 'unique_users'])
+        return df.sort_values(['dimension', 'period', 'key'], ignore_index=True)
+
+    def top_users(self, n=10):
+        """Get the `n` most active users."""
+        return self.heavy_hitters['user_id'].top(n)
+
+    def top_auctions(self, n=10):
+        """Get the `n` most frequent auctions."""
+        return self.heavy_hitters['auction_id'].top(n)
+
+    def to_frame(self):
+        """
+        Serialize the sketches into a DataFrame, e.g. to store them with DataProcessor.store_data.
+
+        Returns:
+            pandas.DataFrame: 'dimension', 'key', 'period' and the base64-encoded
+            'sketch' per row, so it loads through COPY and executemany alike.
+            Heavy hitters are stored with dimension 'top_<column>' and no key or period.
+        """
+        def encode(sketch):
+            return base64.b64encode(sketch.to_bytes()).decode('ascii')
+
+        rows = [
+            (dimension, str(key), period, encode(sketch))
+            for (dimension, key, period), sketch in self.distinct.items()
+        ]
+        rows += [(f"top_{column}", None, None, encode(summary)) for column, summary in self.heavy_hitters.items()]
+        return pd.DataFrame(rows, columns=['dimension', 'key', 'period', 'sketch'])
+
+    @classmethod
+    def from_frame(cls, df, freq='h'):
+        """
+        Rebuild sketches from a frame written by `to_frame`.
+
+        Keys come back as strings. Rows of the same group are merged.
+
+        Parameters:
+            df (pandas.DataFrame): Serialized sketches.
+            freq (str): Period of the stored distinct counts.
+
+        Returns:
+            CampaignSketches: The sketches.
+        """
+        sketches = None
+        for dimension, key, period, data in df[['dimension', 'key', 'period', 'sketch']].itertuples(index=False):
+            sketch = load_sketch(base64.b64decode(data))
+            if sketches is None:
+                sketches = cls(freq, getattr(sketch, 'precision', DEFAULT_PRECISION))
+            if dimension.startswith('top_'):
+                sketches.heavy_hitters[dimension[4:]].merge(sketch)
+            else:
+                sketches.add_distinct((dimension, key, pd.Timestamp(period)), sketch)
+        return sketches or cls(freq)
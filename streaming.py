@@ -0,0 +1,614 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+import db
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+DEFAULT_BROKER_DIR = 'data/broker/'
+DEFAULT_GROUP = 'advertisex'
+DEFAULT_MAX_BATCH_SIZE = 10000
+DEFAULT_MAX_BATCH_LATENCY = 1.0
+DEFAULT_MAX_IN_FLIGHT = 2
+DEFAULT_MAX_RETRIES = 3
+POLL_TIMEOUT = 0.1
+
+# Topics consumed and the source each carries
+DEFAULT_TOPICS = {
+    'ad_impressions': 'ad_impressions',
+    'clicks_conversions': 'clicks_conversions',
+    'bid_requests': 'bid_requests',
+}
+
+# One consumed record; `offset` is the position to commit to resume after it
+Message = namedtuple('Message', ['topic', 'partition', 'offset', 'value'])
+
+def partition_for(value, partitions):
+    """
+    Choose the partition of a message value by its user_id.
+
+    CRC32 of the id's text is used instead of `hash`, which is randomized per
+    process for strings, so a user keeps its partition across restarts and
+    producers.
+
+    Parameters:
+        value (dict): Message value.
+        partitions (int): Partitions of the topic.
+
+    Returns:
+        int: Partition index.
+    """
+    return zlib.crc32(str(value.get('user_id')).encode('utf-8')) % partitions
+
+class Source:
+    """
+    Interface of a partitioned, offset-committing message source.
+
+    Implementations return messages in offset order per partition and only
+    remember positions passed to `commit`, so a restarted consumer resumes
+    after the last committed write.
+    """
+
+    def poll(self, max_records, timeout):
+        """
+        Fetch up to `max_records` messages, waiting at most `timeout` seconds for the first.
+
+        Returns:
+            list: Message tuples.
+        """
+        raise NotImplementedError
+
+    def commit(self, offsets):
+        """
+        Commit consumed positions.
+
+        Parameters:
+            offsets (dict): (topic, partition) mapped to the offset to resume from.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release the source's resources."""
+
+class MemoryBroker:
+    """In-process stand-in for a broker: topics of partitions of JSON-compatible values."""
+
+    def __init__(self, partitions=1):
+        """
+        Parameters:
+            partitions (int): Partitions per topic.
+        """
+        self.partitions = partitions
+        self.topics = {}
+        self.committed = {}
+        self.lock = threading.Condition()
+
+    def produce(self, topic, value, partition=None):
+        """
+        Append a value to a topic.
+
+        Parameters:
+            topic (str): Topic name.
+            value (dict): Message value.
+            partition (int, optional): Partition; by default chosen by the value's user_id.
+        """
+        self.produce_many(topic, [value], partition)
+
+    def produce_many(self, topic, values, partition=None):
+        """Append several values to a topic."""
+        with self.lock:
+            partitions = self.topics.setdefault(topic, [[] for _ in range(self.partitions)])
+            for value in values:
+                index = partition if partition is not None else partition_for(value, self.partitions)
+                partitions[index].append(value)
+            self.lock.notify_all()
+
+    def consumer(self, topics, group=DEFAULT_GROUP):
+        """Get a Source reading `topics` for a consumer group."""
+        return MemorySource(self, topics, group)
+
+class MemorySource(Source):
+    """Source reading a MemoryBroker."""
+
+    def __init__(self, broker, topics, group=DEFAULT_GROUP):
+        self.broker = broker
+        self.topics = list(topics)
+        self.group = group
+        with broker.lock:
+            self.positions = {
+                (topic, partition): broker.committed.get((group, topic, partition), 0)
+                for topic in self.topics for partition in range(broker.partitions)
+            }
+
+    def available(self):
+        """Get (topic, partition) and log of every partition with unread messages."""
+        logs = []
+        for (topic, partition), position in self.positions.items():
+            partitions = self.broker.topics.get(topic)
+            if partitions and position < len(partitions[partition]):
+                logs.append(((topic, partition), partitions[partition]))
+        return logs
+
+    def poll(self, max_records, timeout):
+        messages = []
+        with self.broker.lock:
+            if not self.available():
+                self.broker.lock.wait(timeout)
+            for (topic, partition), log in self.available():
+                start = self.positions[(topic, partition)]
+                end = min(len(log), start + max_records - len(messages))
+                messages.extend(Message(topic, partition, offset + 1, log[offset]) for offset in range(start, end))
+                self.positions[(topic, partition)] = end
+                if len(messages) >= max_records:
+                    break
+        return messages
+
+    def commit(self, offsets):
+        with self.broker.lock:
+            for (topic, partition), offset in offsets.items():
+                self.broker.committed[(self.group, topic, partition)] = offset
+
+class FileBroker:
+    """
+    File-backed stand-in for a broker, usable across processes.
+
+    Each topic partition is an append-only JSON Lines file
+    `<root>/<topic>-<partition>.jsonl`, and offsets are byte positions in it.
+    Committed offsets are kept per consumer group in `<root>/_offsets/<group>.json`,
+    replaced atomically on every commit.
+    """
+
+    def __init__(self, root=DEFAULT_BROKER_DIR, partitions=1):
+        """
+        Parameters:
+            root (str): Directory of the topic files.
+            partitions (int): Partitions per topic.
+        """
+        self.root = root
+        self.partitions = partitions
+        os.makedirs(os.path.join(root, '_offsets'), exist_ok=True)
+
+    def path(self, topic, partition):
+        return os.path.join(self.root, f"{topic}-{partition}.jsonl")
+
+    def produce_many(self, topic, values, partition=None):
+        """Append values to a topic, spreading them over partitions by user_id."""
+        lines = {}
+        for value in values:
+            index = partition if partition is not None else partition_for(value, self.partitions)
+            lines.setdefault(index, []).append(json.dumps(value) + '\n')
+        for index, partition_lines in lines.items():
+            with open(self.path(topic, index), 'a') as f:
+                f.writelines(partition_lines)
+
+    def produce(self, topic, value, partition=None):
+        """Append a value to a topic."""
+        self.produce_many(topic, [value], partition)
+
+    def offsets_path(self, group):
+        return os.path.join(self.root, '_offsets', f"{group}.json")
+
+    def committed(self, group):
+        """Get the committed offsets of a consumer group as {'topic-partition': offset}."""
+        try:
+            with open(self.offsets_path(group)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def commit(self, group, offsets):
+        """Merge offsets into a group's committed offsets, atomically."""
+        committed = self.committed(group)
+        committed.update({f"{topic}-{partition}": offset for (topic, partition), offset in offsets.items()})
+        tmp_path = self.offsets_path(group) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(committed, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offsets_path(group))
+
+    def consumer(self, topics, group=DEFAULT_GROUP):
+        """Get a Source reading `topics` for a consumer group."""
+        return FileSource(self, topics, group)
+
+class FileSource(Source):
+    """Source reading a FileBroker, resuming from the group's committed byte offsets."""
+
+    def __init__(self, broker, topics, group=DEFAULT_GROUP):
+        self.broker = broker
+        self.group = group
+        committed = broker.committed(group)
+        self.positions = {
+            (topic, partition): committed.get(f"{topic}-{partition}", 0)
+            for topic in topics for partition in range(broker.partitions)
+        }
+
+    def read(self, topic, partition, max_records):
+        path = self.broker.path(topic, partition)
+        if not os.path.exists(path):
+            return []
+        messages = []
+        with open(path, 'rb') as f:
+            f.seek(self.positions[(topic, partition)])
+            while len(messages) < max_records:
+                line = f.readline()
+                # A line without its newline is still being written
+                if not line.endswith(b'\n'):
+                    break
+                messages.append(Message(topic, partition, f.tell(), json.loads(line)))
+        if messages:
+            self.positions[(topic, partition)] = messages[-1].offset
+        return messages
+
+    def poll(self, max_records, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            messages = []
+            for topic, partition in self.positions:
+                messages.extend(self.read(topic, partition, max_records - len(messages)))
+                if len(messages) >= max_records:
+                    break
+            if messages or time.monotonic() >= deadline:
+                return messages
+            time.sleep(min(0.01, timeout))
+
+    def commit(self, offsets):
+        self.broker.commit(self.group, offsets)
+
+class KafkaSource(Source):
+    """
+    Source reading Kafka topics with confluent-kafka.
+
+    Auto-commit is disabled; offsets are committed synchronously only when
+    the consumer has written the batch they cover. Message values are
+    decoded as JSON unless a `deserializer` is given.
+    """
+
+    def __init__(self, topics, group=DEFAULT_GROUP, bootstrap_servers='localhost:9092', deserializer=None, **config):
+        """
+        Parameters:
+            topics (list): Topics to subscribe to.
+            group (str): Consumer group id.
+            bootstrap_servers (str): Kafka bootstrap servers.
+            deserializer (callable, optional): Function decoding a message value.
+            **config: Extra librdkafka settings, with dots written as underscores.
+        """
+        try:
+            from confluent_kafka import Consumer, TopicPartition
+        except ImportError:
+            raise ImportError("Kafka streaming requires the confluent-kafka package: pip install confluent-kafka")
+        self.TopicPartition = TopicPartition
+        settings = {
+            'bootstrap.servers': bootstrap_servers,
+            'group.id': group,
+            'enable.auto.commit': False,
+            'auto.offset.reset': 'earliest',
+        }
+        settings.update({name.replace('_', '.'): value for name, value in config.items()})
+        self.consumer = Consumer(settings)
+        self.consumer.subscribe(list(topics))
+        self.deserializer = deserializer or json.loads
+
+    def poll(self, max_records, timeout):
+        messages = []
+        for message in self.consumer.consume(num_messages=max_records, timeout=timeout):
+            if message.error():
+                logging.error(f"Kafka error on {message.topic()}: {message.error()}")
+                continue
+            messages.append(Message(message.topic(), message.partition(), message.offset() + 1, self.deserializer(message.value())))
+        return messages
+
+    def commit(self, offsets):
+        self.consumer.commit(
+            offsets=[self.TopicPartition(topic, partition, offset) for (topic, partition), offset in offsets.items()],
+            asynchronous=False,
+        )
+
+    def close(self):
+        self.consumer.close()
+
+class StreamConsumer:
+    """
+    Consume topics in micro-batches, process and store them, then commit offsets.
+
+    The poll loop collects messages until a batch holds `max_batch_size`
+    records or `max_batch_latency` seconds have passed since its first
+    record. Batches are handed to a writer thread through a queue of
+    `max_in_flight` batches; when processing or storage falls behind, the
+    queue fills and the poll loop blocks instead of fetching more, so memory
+    stays bounded. Every batch is written in one transaction, and its offsets
+    are committed only after that transaction succeeds, in batch order, so a
+    crash replays uncommitted batches instead of losing them.
+    """
+
+    def __init__(self, processor, source, topics=None, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_batch_latency=DEFAULT_MAX_BATCH_LATENCY, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 max_retries=DEFAULT_MAX_RETRIES, transform=None, validate=False):
+        """
+        Parameters:
+            processor (DataProcessor): Processor used to process and store batches.
+            source (Source): Message source.
+            topics (dict, optional): Topics mapped to the source they carry; DEFAULT_TOPICS by default.
+            max_batch_size (int): Maximum records per micro-batch.
+            max_batch_latency (float): Maximum seconds between a batch's first record and its dispatch.
+            max_in_flight (int): Batches allowed to wait for the writer before polling blocks.
+            max_retries (int): Attempts to write a batch before the consumer stops.
+            transform (callable, optional): Function (df, source) -> df applied before storing,
+                e.g. deduplication.
+            validate (bool): Validate every batch (DataProcessor.validate_data) in its
+                write transaction, so rejected rows are quarantined only if the batch is
+                stored and a retried or replayed batch is not quarantined twice.
+        """
+        self.processor = processor
+        self.source = source
+        self.topics = topics or DEFAULT_TOPICS
+        self.max_batch_size = max_batch_size
+        self.max_batch_latency = max_batch_latency
+        self.max_retries = max_retries
+        self.transform = transform
+        self.validate = validate
+        self.pending = queue.Queue(maxsize=max_in_flight)
+        self.done = queue.Queue()
+        self.stopping = threading.Event()
+        self.error = None
+        self.start_time = None
+        self.end_time = None
+        self.totals = {
+            'batches': 0,
+            'records': 0,
+            'commits': 0,
+            'backpressure_seconds': 0.0,
+            'latencies': [],
+        }
+
+    def prepare(self, messages):
+        """
+        Process and transform the records of one micro-batch.
+
+        The transform may be stateful (deduplication remembers every event it
+        lets through), so it runs once per batch; retries reuse its output.
+
+        Parameters:
+            messages (list): Messages of the batch.
+
+        Returns:
+            dict: Sources mapped to the DataFrame to store.
+        """
+        by_topic = {}
+        for message in messages:
+            by_topic.setdefault(message.topic, []).append(message.value)
+        frames = {}
+        for topic, records in by_topic.items():
+            source = self.topics[topic]
+            df = getattr(self.processor, f"process_{source}")(records)
+            if self.transform is not None:
+                df = self.transform(df, source)
+            frames[source] = df
+        return frames
+
+    def write(self, messages, frames=None):
+        """
+        Process and store one micro-batch in a single transaction.
+
+        Parameters:
+            messages (list): Messages of the batch.
+            frames (dict, optional): Output of `prepare` for these messages, if already computed.
+        """
+        if frames is None:
+            frames = self.prepare(messages)
+        stored = {}
+        with db.begin(self.processor.engine) as conn:
+            for source, df in frames.items():
+                if self.validate:
+                    df = self.processor.validate_data(df, source, conn=conn)
+                if not df.empty:
+                    self.processor.loader.load(df, source, conn=conn)
+                stored[source] = df
+        # Counted only once the batch is stored, so a retried batch is not counted twice
+        for source, df in stored.items():
+            self.processor.count_frequency(df, source)
+
+    def writer(self):
+        """Write queued batches in order, retrying failures, and report them for commit."""
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            messages, started = item
+            frames = None
+            for attempt in range(1, self.max_retries + 1):
+                try:
+                    if frames is None:
+                        frames = self.prepare(messages)
+                    self.write(messages, frames)
+                    break
+                except Exception as e:
+                    logging.error(f"Error writing batch of {len(messages)} records (attempt {attempt}): {e}")
+                    if attempt == self.max_retries:
+                        self.error = e
+                        self.stopping.set()
+                        return
+                    time.sleep(0.1 * 2 ** attempt)
+            self.done.put((messages, started))
+
+    def commit_done(self):
+        """Commit the offsets of every batch the writer has finished."""
+        while True:
+            try:
+                messages, started = self.done.get_nowait()
+            except queue.Empty:
+                return
+            offsets = {}
+            for message in messages:
+                offsets[(message.topic, message.partition)] = message.offset
+            self.source.commit(offsets)
+            self.totals['commits'] += 1
+            self.totals['latencies'].append(time.monotonic() - started)
+
+    def dispatch(self, messages, started):
+        """Queue a batch for the writer, blocking while too many batches are in flight."""
+        wait_start = time.monotonic()
+        while not self.stopping.is_set():
+            try:
+                self.pending.put((messages, started), timeout=POLL_TIMEOUT)
+                break
+            except queue.Full:
+                self.commit_done()
+        self.totals['backpressure_seconds'] += time.monotonic() - wait_start
+        self.totals['batches'] += 1
+        self.totals['records'] += len(messages)
+
+    def run(self, max_batches=None, idle_timeout=None):
+        """
+        Consume until stopped, a batch fails, `max_batches` batches are written
+        or nothing arrives for `idle_timeout` seconds. A partial batch is
+        written before returning.
+
+        Parameters:
+            max_batches (int, optional): Stop after this many batches.
+            idle_timeout (float, optional): Stop after this many seconds without messages.
+
+        Returns:
+            dict: Consumer statistics; see `stats`.
+        """
+        writer = threading.Thread(target=self.writer, name='stream-writer', daemon=True)
+        writer.start()
+        self.start_time = time.monotonic()
+        last_message = self.start_time
+        batch, started = [], None
+        try:
+            while not self.stopping.is_set():
+                messages = self.source.poll(self.max_batch_size - len(batch), POLL_TIMEOUT)
+                now = time.monotonic()
+                if messages:
+                    last_message = now
+                    if not batch:
+                        started = now
+                    batch.extend(messages)
+                if batch and (len(batch) >= self.max_batch_size or now - started >= self.max_batch_latency):
+                    self.dispatch(batch, started)
+                    batch = []
+                self.commit_done()
+                if max_batches is not None and self.totals['batches'] >= max_batches:
+                    break
+                if idle_timeout is not None and now - last_message >= idle_timeout:
+                    break
+        finally:
+            if batch and not self.stopping.is_set():
+                self.dispatch(batch, started)
+            # A writer that gave up no longer drains the queue, so never block on it
+            while writer.is_alive():
+                try:
+                    self.pending.put(None, timeout=POLL_TIMEOUT)
+                    break
+                except queue.Full:
+                    continue
+            writer.join()
+            self.commit_done()
+            self.end_time = time.monotonic()
+        if self.error is not None:
+            raise self.error
+        return self.stats()
+
+    def stop(self):
+        """Ask a running consumer to stop after its current batch."""
+        self.stopping.set()
+
+    def stats(self):
+        """
+        Get consumer statistics.
+
+        Returns:
+            dict: Batches, records and commits, seconds spent blocked by
+            backpressure, records per second, and median and 99th percentile
+            batch latency (first record polled to offsets committed).
+        """
+        seconds = ((self.end_time or time.monotonic()) - self.start_time) if self.start_time else 0.0
+        latencies = sorted(self.totals['latencies'])
+
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+
+        return {
+            'batches': self.totals['batches'],
+            'records': self.totals['records'],
+            'commits': self.totals['commits'],
+            'seconds': seconds,
+            'records_per_second': self.totals['records'] / seconds if seconds > 0 else 0.0,
+            'backpressure_seconds': self.totals['backpressure_seconds'],
+            'latency_p50': percentile(0.5),
+            'latency_p99': percentile(0.99),
+        }
+
+# Function to load data files into a broker's topics
+def produce_files(broker, data_dir, topics=None):
+    """
+    Publish the records of data files to the topic of their source.
+
+    Parameters:
+        broker (MemoryBroker or FileBroker): Broker to publish to.
+        data_dir (str): Data directory or glob pattern.
+        topics (dict, optional): Topics mapped to sources; DEFAULT_TOPICS by default.
+
+    Returns:
+        dict: Topics mapped to the number of records published.
+    """
+    from ingest import discover_files, read_file
+    source_topics = {source: topic for topic, source in (topics or DEFAULT_TOPICS).items()}
+    published = {}
+    for source, paths in discover_files(data_dir, list(source_topics)).items():
+        topic = source_topics[source]
+        for path in paths:
+            records = read_file(path)
+            broker.produce_many(topic, records)
+            published[topic] = published.get(topic, 0) + len(records)
+    return published
+
+if __name__ == '__main__':
+    # Configure command-line arguments
+    parser = argparse.ArgumentParser(description='Streaming Data Ingestion for AdvertiseX')
+    parser.add_argument('--broker', choices=['kafka', 'file'], default='file', help='Message source')
+    parser.add_argument('--bootstrap-servers', default='localhost:9092', help='Kafka bootstrap servers')
+    parser.add_argument('--broker-dir', default=DEFAULT_BROKER_DIR, help='Directory of the file broker')
+    parser.add_argument('--partitions', type=int, default=1, help='Partitions per topic of the file broker')
+    parser.add_argument('--produce-from', help='Publish the data files in this directory or glob to the file broker first')
+    parser.add_argument('--group', default=DEFAULT_GROUP, help='Consumer group')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE, help='Maximum records per micro-batch')
+    parser.add_argument('--batch-latency', type=float, default=DEFAULT_MAX_BATCH_LATENCY, help='Maximum seconds before a partial batch is written')
+    parser.add_argument('--max-in-flight', type=int, default=DEFAULT_MAX_IN_FLIGHT, help='Batches queued before polling blocks')
+    parser.add_argument('--idle-timeout', type=float, help='Stop after this many seconds without messages (default: run forever)')
+    parser.add_argument('--freqcap-snapshot', help='Restore the frequency-capping counters from this file, and save them to it on exit')
+    args = parser.parse_args()
+
+    if args.broker == 'kafka':
+        source = KafkaSource(list(DEFAULT_TOPICS), args.group, args.bootstrap_servers)
+    else:
+        broker = FileBroker(args.broker_dir, args.partitions)
+        if args.produce_from:
+            logging.info(f"Published {produce_files(broker, args.produce_from)} to {args.broker_dir}")
+        source = broker.consumer(DEFAULT_TOPICS, args.group)
+
+    from process import processor
+    if args.freqcap_snapshot and os.path.exists(args.freqcap_snapshot):
+        from freqcap import FrequencyCapStore
+        processor.frequency_caps = FrequencyCapStore.restore(args.freqcap_snapshot)
+    consumer = StreamConsumer(processor, source, max_batch_size=args.batch_size, max_batch_latency=args.batch_latency,
+                              max_in_flight=args.max_in_flight, validate=True,
+                              transform=lambda df, source: processor.deduplicate_data(df))
+    try:
+        logging.info(f"Streaming finished: {consumer.run(idle_timeout=args.idle_timeout)}")
+    except KeyboardInterrupt:
+        consumer.stop()
+    finally:
+        source.close()
+        if args.freqcap_snapshot:
+            processor.frequency_caps.snapshot(args.freqcap_snapshot)
@@ -0,0 +1,93 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+import generate_sample_data
+from advertisex.cli import main
+from advertisex.workers import WarmWorkerPool
+
+class TestPackage(unittest.TestCase):
+    def test_import_is_lazy_and_side_effect_free(self):
+        env = {key: value for key, value in os.environ.items() if key != 'DATABASE_URL'}
+        output = subprocess.run(
+            [sys.executable, '-c', "import sys, advertisex, advertisex.cli; print(sorted(m for m in ('pandas', 'sqlalchemy', 'geoip2') if m in sys.modules))"],
+            capture_output=True, text=True, env=env, check=True,
+        ).stdout.strip()
+        self.assertEqual(output, '[]')
+        # Importing process no longer reads DATABASE_URL or exits
+        result = subprocess.run([sys.executable, '-c', "import process; print(process._processor)"],
+                                capture_output=True, text=True, env=env)
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout.strip(), 'None')
+
+    def test_lazy_exports(self):
+        import advertisex
+        from process import DataProcessor
+        self.assertIs(advertisex.DataProcessor, DataProcessor)
+        with self.assertRaises(AttributeError):
+            advertisex.missing
+
+    def test_generate_command_runs_module_cli(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            argv = sys.argv
+            try:
+                main(['generate', '--rows', '10', '--data-dir', tmp_dir, '--sources', 'clicks_conversions'])
+            finally:
+                sys.argv = argv
+            self.assertEqual(os.listdir(tmp_dir), ['clicks_conversions.csv'])
+
+class TestWarmWorkerPool(unittest.TestCase):
+    def test_workers_stay_warm_across_jobs(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_url = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+            first = generate_sample_data.generate_source('clicks_conversions', 100, 1, tmp_dir)
+            second = generate_sample_data.generate_source('ad_impressions', 50, 1, tmp_dir)
+            with WarmWorkerPool(1, db_url) as pool:
+                results = pool.run(first) + pool.run(second)
+
+            self.assertEqual([result.get('error') for result in results], [None, None])
+            # One worker served both jobs
+            self.assertEqual(len({result['pid'] for result in results}), 1)
+            engine = create_engine(db_url)
+            with engine.connect() as conn:
+                self.assertEqual(pd.read_sql('SELECT COUNT(*) AS n FROM clicks_conversions', conn)['n'][0], results[0]['rows'])
+                self.assertGreater(pd.read_sql('SELECT COUNT(*) AS n FROM ad_impressions', conn)['n'][0], 0)
+            engine.dispose()
+
+    def test_repeated_runs_only_load_appended_rows(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_url = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+            path = os.path.join(tmp_dir, 'clicks_conversions.csv')
+            with open(path, 'w', newline='') as f:
+                f.write('timestamp,user_id,ad_campaign_id,conversion_type\r\n')
+                f.writelines(f'2024-04-01 10:00:00,{i},1,visit\r\n' for i in range(3))
+            # Separate pools, like separate cron runs
+            with WarmWorkerPool(1, db_url) as pool:
+                first = pool.run([path])
+            with WarmWorkerPool(1, db_url) as pool:
+                unchanged = pool.run([path])
+                with open(path, 'a', newline='') as f:
+                    f.write('2024-04-01 10:01:00,3,1,visit\r\n')
+                appended = pool.run([path])
+
+            self.assertEqual([result['rows'] for result in first + unchanged + appended], [3, 0, 1])
+            engine = create_engine(db_url)
+            with engine.connect() as conn:
+                self.assertEqual(pd.read_sql('SELECT COUNT(*) AS n FROM clicks_conversions', conn)['n'][0], 4)
+            engine.dispose()
+
+    def test_requires_database_url(self):
+        env = os.environ.pop('DATABASE_URL', None)
+        try:
+            self.assertEqual(main(['process', '--data-dir', 'data/']), 1)
+        finally:
+            if env is not None:
+                os.environ['DATABASE_URL'] = env
+
+if __name__ == '__main__':
+    unittest.main()
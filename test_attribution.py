@@ -0,0 +1,72 @@
+import unittest
+
+import pandas as pd
+
+from attribution import AttributionEngine, partition_by_user
+
+class TestAttributionEngine(unittest.TestCase):
+    def setUp(self):
+        self.impressions = pd.DataFrame({
+            'user_id': [101, 101, 102, 103],
+            'timestamp': pd.to_datetime(['2024-04-01 10:00:00', '2024-04-01 10:30:00', '2024-04-01 09:00:00', '2024-04-01 08:00:00']),
+            'ad_creative_id': [1, 2, 1, 3],
+        })
+        # CSV-style string values, as csv.DictReader produces them
+        self.clicks = pd.DataFrame({
+            'user_id': ['101', '102', '103', '104'],
+            'timestamp': ['2024-04-01 10:45:00', '2024-04-01 09:10:00', '2024-04-01 12:00:00', '2024-04-01 10:00:00'],
+            'ad_campaign_id': [5, 5, 6, 7],
+            'conversion_type': ['purchase', 'visit', 'signup', 'purchase'],
+        })
+
+    def attributed_creatives(self, **options):
+        attributed = AttributionEngine(lookback='1h', **options).attribute(self.impressions, self.clicks)
+        return attributed.set_index('user_id')['ad_creative_id'].to_dict()
+
+    def test_last_touch_picks_latest_impression_in_window(self):
+        creatives = self.attributed_creatives(model='last_touch')
+        self.assertEqual(creatives[101], 2)
+        self.assertEqual(creatives[102], 1)
+        # Impression outside the lookback window, and a user without impressions
+        self.assertTrue(pd.isna(creatives[103]))
+        self.assertTrue(pd.isna(creatives[104]))
+
+    def test_first_touch_picks_earliest_impression_in_window(self):
+        creatives = self.attributed_creatives(model='first_touch')
+        self.assertEqual(creatives[101], 1)
+        self.assertTrue(pd.isna(creatives[103]))
+
+    def test_partitioning_does_not_change_the_result(self):
+        unpartitioned = pd.Series(self.attributed_creatives(partitions=1)).fillna(0).to_dict()
+        partitioned = pd.Series(self.attributed_creatives(partitions=4)).fillna(0).to_dict()
+        self.assertEqual(unpartitioned, partitioned)
+
+    def test_partition_by_user_keeps_users_together(self):
+        parts = list(partition_by_user(pd.DataFrame({'user_id': [1, 2, 3, 1, 2, 3]}), 2))
+        self.assertEqual(sum(len(part) for part in parts), 6)
+        for part in parts:
+            self.assertEqual(part['user_id'].value_counts().tolist(), [2] * part['user_id'].nunique())
+
+    def test_bids_are_attached_to_attributed_impressions(self):
+        bids = pd.DataFrame({
+            'user_id': [101],
+            'timestamp': pd.to_datetime(['2024-04-01 10:29:00']),
+            'bid_amount': [1.5],
+        })
+        attributed = AttributionEngine(lookback='1h').attribute(self.impressions, self.clicks, bids)
+        self.assertEqual(attributed.set_index('user_id').loc[101, 'bid_amount_bid'], 1.5)
+
+    def test_campaign_report(self):
+        results = AttributionEngine(lookback='1h').run(self.impressions, self.clicks)
+        report = results['campaigns'].set_index('ad_campaign_id')
+
+        # Creatives 1 and 2 map to campaign 5 through the attributed clicks
+        self.assertEqual(report.loc[5, 'impressions'], 3)
+        self.assertEqual(report.loc[5, 'attributed_clicks'], 2)
+        self.assertEqual(report.loc[5, 'conversions'], 1)
+        self.assertAlmostEqual(report.loc[5, 'ctr'], 2 / 3)
+        self.assertAlmostEqual(report.loc[5, 'conversion_rate'], 0.5)
+        self.assertEqual(report.loc[7, 'clicks'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
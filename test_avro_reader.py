@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+import fastavro
+import numpy as np
+
+from avro_reader import decode_range, read_avro_columns, read_avro_frame, read_header, split_ranges
+from ingest import read_file
+from schemas import BID_REQUEST_SCHEMA
+
+class TestAvroReader(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'bid_requests.avro')
+        self.records = [
+            {'bid_amount': i / 4, 'user_id': i, 'auction_id': f'AUCTION-{i}', 'ip_address': f'10.0.{i // 256}.{i % 256}'}
+            for i in range(5000)
+        ]
+        with open(self.path, 'wb') as f:
+            # Small blocks, so the file has many sync markers to split at
+            fastavro.writer(f, fastavro.parse_schema(BID_REQUEST_SCHEMA), self.records, sync_interval=1000)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_columns_match_records(self):
+        columns = decode_range(self.path)
+        self.assertEqual(columns['user_id'].dtype, np.int32)
+        self.assertEqual(columns['bid_amount'].dtype, np.float32)
+        np.testing.assert_array_equal(columns['user_id'], [record['user_id'] for record in self.records])
+        self.assertEqual(list(columns['auction_id']), [record['auction_id'] for record in self.records])
+
+    def test_ranges_split_at_block_boundaries(self):
+        header = read_header(self.path)
+        ranges = split_ranges(self.path, 7)
+        self.assertEqual(len(ranges), 7)
+        self.assertEqual(ranges[0][0], header['data_start'])
+        self.assertEqual(ranges[-1][1], header['size'])
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+
+        parts = [decode_range(self.path, start, end)['user_id'] for start, end in ranges]
+        self.assertTrue(all(len(part) for part in parts))
+        np.testing.assert_array_equal(np.concatenate(parts), np.arange(5000))
+
+    def test_parallel_decode_matches_serial(self):
+        serial = read_avro_columns(self.path, workers=1)
+        parallel = read_avro_columns(self.path, workers=3, min_split_bytes=0)
+        for name in serial:
+            np.testing.assert_array_equal(parallel[name], serial[name])
+
+    def test_typed_read_uses_columnar_frame(self):
+        df = read_file(self.path, typed=True)
+        self.assertEqual(len(df), 5000)
+        self.assertEqual(df['user_id'].dtype, 'int32')
+        self.assertEqual(df['auction_id'].iloc[-1], 'AUCTION-4999')
+        self.assertTrue(read_avro_frame(self.path).equals(df))
+
+if __name__ == '__main__':
+    unittest.main()
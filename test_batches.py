@@ -0,0 +1,92 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import numpy as np
+import pandas as pd
+
+import generate_sample_data
+from batches import DictionaryArray, RecordBatch, pack_ipv4, unpack_ipv4
+from ingest import read_batch, read_file
+from process import DataProcessor
+from schemas import parse_records
+
+BIDS = [
+    {'bid_amount': 1.5, 'user_id': 1, 'auction_id': 'AUCTION-1', 'ip_address': '10.0.0.1'},
+    {'bid_amount': 2.0, 'user_id': 2, 'auction_id': 'AUCTION-2', 'ip_address': '192.168.1.255'},
+    {'bid_amount': 0.5, 'user_id': 1, 'auction_id': 'AUCTION-3', 'ip_address': '10.0.0.1'},
+    {'bid_amount': 3.0, 'user_id': 3, 'auction_id': None, 'ip_address': None},
+]
+
+class TestRecordBatch(unittest.TestCase):
+    def test_records_are_typed_and_encoded(self):
+        batch = RecordBatch.from_records(BIDS, 'bid_requests')
+
+        self.assertEqual(len(batch), 4)
+        self.assertEqual(batch['user_id'].dtype, np.int32)
+        self.assertEqual(batch['bid_amount'].dtype, np.float32)
+        ips = batch['ip_address']
+        self.assertTrue(ips.is_ipv4)
+        self.assertEqual(ips.dictionary.tolist(), [0x0A000001, 0xC0A801FF])
+        self.assertEqual(ips.codes.tolist(), [0, 1, 0, -1])
+        self.assertEqual(batch['auction_id'].decode().tolist(), ['AUCTION-1', 'AUCTION-2', 'AUCTION-3', None])
+
+    def test_frame_matches_parsed_records(self):
+        batch = RecordBatch.from_records(BIDS, 'bid_requests')
+        df = parse_records(batch, 'bid_requests')
+        expected = parse_records(BIDS, 'bid_requests')
+
+        self.assertIsInstance(df['ip_address'].dtype, pd.CategoricalDtype)
+        self.assertEqual(df['user_id'].dtype, expected['user_id'].dtype)
+        pd.testing.assert_frame_equal(df.astype(object).where(df.notna(), None), expected.astype(object).where(expected.notna(), None))
+
+    def test_non_ipv4_addresses_stay_strings(self):
+        ips = DictionaryArray.encode(['::1', '10.0.0.1', '010.0.0.1'], ipv4=True)
+        self.assertFalse(ips.is_ipv4)
+        self.assertEqual(ips.decode().tolist(), ['::1', '10.0.0.1', '010.0.0.1'])
+        with self.assertRaises(ValueError):
+            pack_ipv4(['10.1'])
+        self.assertEqual(unpack_ipv4(pack_ipv4(['0.0.0.0', '255.255.255.255'])).tolist(), ['0.0.0.0', '255.255.255.255'])
+
+    def test_projection_rename_and_slice_share_arrays(self):
+        batch = RecordBatch.from_records(BIDS, 'bid_requests')
+
+        projected = batch.select(['user_id', 'ip_address']).rename({'ip_address': 'user_ip'})
+        self.assertEqual(projected.column_names, ['user_id', 'user_ip'])
+        self.assertIs(projected['user_id'], batch['user_id'])
+        self.assertIs(projected['user_ip'], batch['ip_address'])
+
+        rows = batch.slice(1, 3)
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(np.shares_memory(rows['user_id'], batch['user_id']))
+        self.assertTrue(np.shares_memory(rows['ip_address'].codes, batch['ip_address'].codes))
+        self.assertIs(rows['ip_address'].dictionary, batch['ip_address'].dictionary)
+        self.assertEqual(batch.take(batch['user_id'] == 1)['bid_amount'].tolist(), [1.5, 0.5])
+
+        frame = batch.to_frame()
+        self.assertTrue(np.shares_memory(frame['user_id'].to_numpy(), batch['user_id']))
+
+    def test_unequal_columns_are_rejected(self):
+        with self.assertRaises(ValueError):
+            RecordBatch({'a': np.arange(2), 'b': np.arange(3)})
+
+class TestReadBatch(unittest.TestCase):
+    def test_every_format_reads_into_a_batch(self):
+        processor = DataProcessor('sqlite://')
+        processor._geoip = type('NoGeoIP', (), {'lookup_many': staticmethod(lambda ips: 'Unknown')})()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for source in generate_sample_data.SOURCES:
+                path, = generate_sample_data.generate_source(source, 2000, 1, tmp_dir)
+                batch = read_batch(path)
+                self.assertEqual(len(batch), len(read_file(path)))
+                # Dictionary-encoded batches pickle smaller than the typed frame
+                self.assertLessEqual(len(pickle.dumps(batch)), len(pickle.dumps(read_file(path, typed=True))))
+                processed = getattr(processor, f"process_{source}")(pickle.loads(pickle.dumps(batch)))
+                self.assertEqual(len(processor.validate_data(processed, source)), len(batch))
+        processor.engine.dispose()
+
+if __name__ == '__main__':
+    unittest.main()
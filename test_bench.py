@@ -0,0 +1,42 @@
+import json
+import tempfile
+import unittest
+
+import bench
+
+class TestBenchmark(unittest.TestCase):
+    def test_report_has_stage_timings_per_size(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            report = bench.run_benchmark([100, 200], work_dir=tmp_dir, sources=['clicks_conversions'])
+
+        json.dumps(report)
+        self.assertEqual([run['rows'] for run in report['runs']], [100, 200])
+        stages = report['runs'][1]['stages']
+        for stage in ('generate', 'read', 'read_batch', 'process', 'deduplicate', 'store'):
+            result = stages[f"{stage}_clicks_conversions"]
+            self.assertNotIn('error', result)
+            self.assertGreater(result['rows_per_second'], 0)
+            self.assertGreaterEqual(result['peak_rss_growth_mb'], 0)
+            self.assertIn('rss_delta_mb', result)
+        self.assertGreater(report['runs'][1]['peak_rss_mb'], 0)
+        self.assertEqual(stages['read_clicks_conversions']['rows'], 200)
+        self.assertIn('pickled_mb', stages['read_batch_clicks_conversions'])
+
+    def test_stream_stage_consumes_every_record(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            report = bench.run_benchmark([100], work_dir=tmp_dir, sources=['clicks_conversions'], stream_batch_size=30)
+
+        stream = report['runs'][0]['stages']['stream']
+        self.assertNotIn('error', stream)
+        self.assertEqual(stream['batches'], 4)
+        self.assertGreater(stream['latency_p50'], 0)
+
+    def test_failing_stage_is_recorded(self):
+        stages = {}
+        result = bench.measure(stages, 'broken', 10, lambda: 1 / 0)
+        self.assertIsNone(result)
+        self.assertIn('ZeroDivisionError', stages['broken']['error'])
+        self.assertIsNone(stages['broken']['rows_per_second'])
+
+if __name__ == '__main__':
+    unittest.main()
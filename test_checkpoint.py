@@ -0,0 +1,180 @@
+import os
+import tempfile
+import unittest
+
+import fastavro
+import pandas as pd
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import generate_sample_data
+from checkpoint import CheckpointStore, IncrementalIngestor
+from ingest import read_file
+from process import DataProcessor
+
+BID_REQUEST_SCHEMA = {
+    'type': 'record',
+    'name': 'BidRequest',
+    'fields': [{'name': 'user_id', 'type': 'int'}, {'name': 'ip_address', 'type': 'string'}],
+}
+
+class TestIncrementalIngestion(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.tmp_dir.name
+        self.processor = DataProcessor(f"sqlite:///{os.path.join(self.data_dir, 'test.db')}")
+        self.csv_file = os.path.join(self.data_dir, 'clicks_conversions.csv')
+
+    def tearDown(self):
+        self.processor.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def write_clicks(self, rows, mode='w'):
+        with open(self.csv_file, mode, newline='') as f:
+            if mode == 'w':
+                f.write('timestamp,user_id,ad_campaign_id,conversion_type\r\n')
+            for user_id in rows:
+                f.write(f'2024-04-01 10:00:00,{user_id},1,visit\r\n')
+
+    def count(self, table_name):
+        with self.processor.engine.connect() as conn:
+            return pd.read_sql(f"SELECT COUNT(*) AS n FROM {table_name}", conn)['n'][0]
+
+    def test_reruns_only_load_appended_rows(self):
+        ingestor = IncrementalIngestor(self.processor, batch_size=2)
+        self.write_clicks(range(5))
+        self.assertEqual(ingestor.run(self.data_dir)[self.csv_file], 5)
+
+        self.assertEqual(ingestor.run(self.data_dir)[self.csv_file], 0)
+
+        self.write_clicks(range(5, 8), mode='a')
+        self.assertEqual(ingestor.run(self.data_dir)[self.csv_file], 3)
+        self.assertEqual(self.count('clicks_conversions'), 8)
+        self.assertEqual(ingestor.store.get(self.csv_file)['records'], 8)
+
+    def test_incomplete_last_line_waits_for_the_next_run(self):
+        ingestor = IncrementalIngestor(self.processor)
+        self.write_clicks(range(2))
+        with open(self.csv_file, 'a', newline='') as f:
+            f.write('2024-04-01 10:00:00,99,1,vi')
+
+        self.assertEqual(ingestor.ingest_file(self.csv_file), 2)
+        with open(self.csv_file, 'a', newline='') as f:
+            f.write('sit\r\n')
+        self.assertEqual(ingestor.ingest_file(self.csv_file), 1)
+
+    def test_compressed_shards_are_loaded(self):
+        paths = [
+            generate_sample_data.generate_source(source, 300, 1, self.data_dir, compression='gzip')[0]
+            for source in ('ad_impressions', 'clicks_conversions')
+        ]
+        self.processor._geoip = type('NoGeoIP', (), {'lookup_many': staticmethod(lambda ips: 'Unknown')})()
+        ingestor = IncrementalIngestor(self.processor, batch_size=100)
+        self.assertEqual(ingestor.run(self.data_dir), {path: 300 for path in paths})
+        self.assertEqual(ingestor.run(self.data_dir), {path: 0 for path in paths})
+        self.assertEqual(self.count('clicks_conversions'), 300)
+
+        processed = self.processor.process_data({paths[0]: read_file(paths[0])})
+        self.assertEqual(len(processed[paths[0]]), 300)
+
+    def test_unterminated_last_line_is_loaded_once_the_file_settles(self):
+        self.write_clicks(range(2))
+        with open(self.csv_file, 'a', newline='') as f:
+            f.write('2024-04-01 10:00:00,99,1,visit')
+        self.assertEqual(IncrementalIngestor(self.processor).ingest_file(self.csv_file), 2)
+
+        ingestor = IncrementalIngestor(self.processor, settle_seconds=0)
+        self.assertEqual(ingestor.ingest_file(self.csv_file), 1)
+        self.assertEqual(ingestor.store.plan(self.csv_file)['status'], 'unchanged')
+        self.assertEqual(self.count('clicks_conversions'), 3)
+
+    def test_rewritten_file_is_detected(self):
+        store = CheckpointStore(self.processor.engine)
+        self.write_clicks(range(3))
+        IncrementalIngestor(self.processor, store).ingest_file(self.csv_file)
+        self.write_clicks([7])
+        self.assertEqual(store.plan(self.csv_file)['status'], 'rewritten')
+
+    def test_same_size_rewrite_is_detected_by_mtime(self):
+        store = CheckpointStore(self.processor.engine)
+        self.write_clicks(range(10, 13))
+        IncrementalIngestor(self.processor, store).ingest_file(self.csv_file)
+        stat = os.stat(self.csv_file)
+        self.write_clicks(range(10, 13))
+        os.utime(self.csv_file, (stat.st_atime, stat.st_mtime + 5))
+        self.assertEqual(store.plan(self.csv_file)['status'], 'rewritten')
+
+    def test_rewritten_file_is_quarantined_instead_of_reloaded(self):
+        ingestor = IncrementalIngestor(self.processor)
+        self.write_clicks(range(2))
+        self.assertEqual(ingestor.ingest_file(self.csv_file), 2)
+        stat = os.stat(self.csv_file)
+        os.utime(self.csv_file, (stat.st_atime, stat.st_mtime + 5))
+
+        self.assertEqual(ingestor.ingest_file(self.csv_file), 0)
+        self.assertEqual(self.count('clicks_conversions'), 2)
+        self.assertEqual(ingestor.store.quarantined()[self.csv_file]['reason'], 'rewritten after it was loaded')
+
+        ingestor.store.reset(self.csv_file)
+        self.assertEqual(ingestor.store.quarantined(), {})
+        self.assertEqual(ingestor.store.plan(self.csv_file)['status'], 'new')
+
+    def test_failed_write_does_not_commit_the_checkpoint(self):
+        ingestor = IncrementalIngestor(self.processor, batch_size=2)
+        self.write_clicks(range(4))
+        original_load = self.processor.loader.load
+        calls = []
+
+        def failing_load(df, table_name, **kwargs):
+            calls.append(len(df))
+            if len(calls) == 2:
+                raise RuntimeError("database went away")
+            return original_load(df, table_name, **kwargs)
+
+        self.processor.loader.load = failing_load
+        with self.assertRaises(RuntimeError):
+            ingestor.ingest_file(self.csv_file)
+        self.processor.loader.load = original_load
+
+        self.assertEqual(ingestor.store.get(self.csv_file)['records'], 2)
+        self.assertEqual(ingestor.ingest_file(self.csv_file), 2)
+        self.assertEqual(self.count('clicks_conversions'), 4)
+
+    def test_failed_write_does_not_quarantine_twice(self):
+        ingestor = IncrementalIngestor(self.processor, batch_size=4, validate=True)
+        with open(self.csv_file, 'w', newline='') as f:
+            f.write('timestamp,user_id,ad_campaign_id,conversion_type\r\n')
+            for user_id, conversion_type in enumerate(['visit', 'bogus', 'visit', 'bogus']):
+                f.write(f'2024-04-01 10:00:00,{user_id},1,{conversion_type}\r\n')
+        original_load = self.processor.loader.load
+
+        def failing_load(df, table_name, **kwargs):
+            if table_name == 'clicks_conversions':
+                raise RuntimeError("database went away")
+            return original_load(df, table_name, **kwargs)
+
+        self.processor.loader.load = failing_load
+        with self.assertRaises(RuntimeError):
+            ingestor.ingest_file(self.csv_file)
+        self.processor.loader.load = original_load
+
+        self.assertEqual(ingestor.ingest_file(self.csv_file), 4)
+        self.assertEqual(self.count('clicks_conversions'), 2)
+        self.assertEqual(self.count('clicks_conversions_quarantine'), 2)
+
+    def test_avro_resumes_from_block_positions(self):
+        avro_file = os.path.join(self.data_dir, 'bid_requests.avro')
+        records = [{'user_id': i, 'ip_address': 'not-an-ip'} for i in range(10)]
+        with open(avro_file, 'wb') as f:
+            fastavro.writer(f, BID_REQUEST_SCHEMA, records[:6], sync_interval=1)
+        ingestor = IncrementalIngestor(self.processor, batch_size=4)
+        self.processor._geoip = type('NoGeoIP', (), {'lookup_many': staticmethod(lambda ips: 'Unknown')})()
+        self.assertEqual(ingestor.ingest_file(avro_file), 6)
+
+        with open(avro_file, 'a+b') as f:
+            fastavro.writer(f, None, records[6:], sync_interval=1)
+        self.assertEqual(ingestor.ingest_file(avro_file), 4)
+        self.assertEqual(self.count('bid_requests'), 10)
+
+if __name__ == '__main__':
+    unittest.main()
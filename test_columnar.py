@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+from columnar import read_shards, write_shards
+
+class TestColumnarShards(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        self.clicks = [
+            {'timestamp': '2024-04-01 10:02:00', 'user_id': '101', 'ad_campaign_id': '1', 'conversion_type': 'purchase'},
+            {'timestamp': '2024-04-01 10:59:59', 'user_id': '102', 'ad_campaign_id': '2', 'conversion_type': 'signup'},
+            {'timestamp': '2024-04-01 11:05:00', 'user_id': '103', 'ad_campaign_id': '1', 'conversion_type': 'visit'},
+            {'timestamp': '2024-04-01 13:00:00', 'user_id': '104', 'ad_campaign_id': '3', 'conversion_type': 'visit'},
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_shards_are_partitioned_by_source_and_hour(self):
+        write_shards(self.clicks, 'clicks_conversions', self.root)
+        partitions = sorted(os.listdir(os.path.join(self.root, 'clicks_conversions')))
+        self.assertEqual(partitions, ['event_hour=2024-04-01T10', 'event_hour=2024-04-01T11', 'event_hour=2024-04-01T13'])
+
+    def test_read_back_typed_columns_with_projection_and_time_range(self):
+        for format in ('parquet', 'arrow'):
+            with self.subTest(format=format):
+                root = os.path.join(self.root, format)
+                write_shards(self.clicks, 'clicks_conversions', root, format=format)
+
+                df = read_shards('clicks_conversions', root, columns=['timestamp', 'user_id'],
+                                 start='2024-04-01 10:30:00', end='2024-04-01 13:00:00', format=format)
+
+                self.assertEqual(list(df.columns), ['timestamp', 'user_id'])
+                self.assertEqual(sorted(df['user_id'].tolist()), [102, 103])
+                self.assertEqual(df['user_id'].dtype.kind, 'i')
+                self.assertEqual(df['timestamp'].dtype.kind, 'M')
+
+    def test_records_without_timestamps_are_readable(self):
+        write_shards([{'user_id': 1, 'auction_id': 'A-1'}, {'user_id': 2, 'auction_id': 'A-2'}], 'bid_requests', self.root)
+        self.assertEqual(len(read_shards('bid_requests', self.root)), 2)
+        with self.assertRaisesRegex(ValueError, 'no timestamp column'):
+            read_shards('bid_requests', self.root, start='2024-04-01')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import db
+
+class TestEngineSettings(unittest.TestCase):
+    def test_pool_settings_from_env_and_overrides(self):
+        with mock.patch.dict(os.environ, {'DB_POOL_SIZE': '4', 'DB_POOL_PRE_PING': 'false'}):
+            settings = db.pool_settings_from_env(max_overflow=1)
+        self.assertEqual(settings['pool_size'], 4)
+        self.assertEqual(settings['max_overflow'], 1)
+        self.assertFalse(settings['pool_pre_ping'])
+
+    def test_in_memory_sqlite_skips_queue_pool_settings(self):
+        engine = db.create_db_engine('sqlite://')
+        self.assertTrue(engine.pool._pre_ping)
+        engine.dispose()
+
+class TestPoolMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_url = f"sqlite:///{os.path.join(self.tmp_dir.name, 'test.db')}"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_engine_is_shared_per_process(self):
+        engine = db.get_engine(self.db_url, pool_size=2)
+        self.assertIs(db.get_engine(self.db_url, pool_size=2), engine)
+        self.assertEqual(db.pool_size(engine), 2)
+        engine.dispose()
+
+    def test_concurrent_checkouts_are_counted(self):
+        engine = db.create_db_engine(self.db_url, pool_size=3, max_overflow=0)
+        barrier = threading.Barrier(3)
+
+        def hold_connection():
+            with db.connect(engine):
+                barrier.wait()
+
+        threads = [threading.Thread(target=hold_connection) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        metrics = engine.pool_metrics.snapshot()
+        self.assertEqual(metrics['checkouts'], 3)
+        self.assertEqual(metrics['max_checked_out'], 3)
+        self.assertEqual(metrics['checked_out'], 0)
+        self.assertLessEqual(metrics['connections_opened'], 3)
+        engine.dispose()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+import asyncio
+import gzip
+import os
+import struct
+import tempfile
+import unittest
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import decompress
+import generate_sample_data
+import ingest
+from pipeline import ingestion_pipeline, read_chunks
+from process import DataProcessor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def zstd_raw_frame(payload):
+    # Frame with a single-segment header, no checksum, and one raw last block
+    header = decompress.ZSTD_MAGIC + bytes([0x20, len(payload)])
+    block = (len(payload) << 3 | 1).to_bytes(3, 'little')
+    return header + block + payload
+
+class TestDecompression(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data = b''.join(f"line {i} {'x' * (i % 50)}\n".encode() for i in range(60000))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, data, codec=None):
+        path = os.path.join(self.tmp_dir.name, name)
+        with decompress.open_output(path, codec) as f:
+            f.write(data)
+        return path
+
+    def test_bgzf_members_decompress_in_parallel(self):
+        path = self.write('lines.txt.gz', self.data, 'gzip')
+        with open(path, 'rb') as f:
+            compressed = f.read()
+
+        self.assertEqual(decompress.detect_compression(path), 'gzip')
+        self.assertEqual(gzip.decompress(compressed), self.data)
+        members = decompress.gzip_members(compressed)
+        self.assertGreater(len(members), 4)
+        self.assertEqual(sum(end - start for start, end in members), len(compressed))
+        self.assertEqual(decompress.decompress_buffer(compressed, 'gzip', workers=4), self.data)
+        self.assertEqual(decompress.decompress_buffer(compressed, 'gzip', workers=1), self.data)
+
+    def test_single_stream_gzip_is_read_through_the_prefetch_thread(self):
+        path = os.path.join(self.tmp_dir.name, 'lines.txt.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(self.data)
+        self.assertIsNone(decompress.gzip_members(open(path, 'rb').read()))
+
+        with decompress.input_buffer(path) as data:
+            self.assertEqual(data, self.data)
+        with decompress.open_input(path) as f:
+            self.assertEqual(f.readline(), b'line 0 \n')
+            self.assertEqual(f.read(), self.data[len(b'line 0 \n'):])
+        # Closing before the end stops the decompression thread
+        with decompress.open_input(path, prefetch=1) as f:
+            f.read(10)
+        self.assertIn('gzip', decompress.read_stats())
+
+    def test_truncated_gzip_raises(self):
+        path = self.write('lines.txt.gz', self.data, 'gzip')
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) // 2)
+        with self.assertRaises(EOFError):
+            with decompress.open_input(path) as f:
+                f.read()
+
+    def test_plain_files_are_memory_mapped(self):
+        path = self.write('lines.txt', self.data)
+        self.assertIsNone(decompress.detect_compression(path))
+        with decompress.input_buffer(path) as data:
+            self.assertEqual(data[:], self.data)
+        with decompress.open_input(path, mapped=True) as f:
+            self.assertEqual(f.read(), self.data)
+        with decompress.input_buffer(self.write('empty.txt', b'')) as data:
+            self.assertEqual(data, b'')
+
+    def test_zstd_frames_are_walked_without_decompressing(self):
+        data = zstd_raw_frame(b'abc') + zstd_raw_frame(b'defg')
+        self.assertEqual(decompress.zstd_frames(data), [(0, 12), (12, 25)])
+        # Skippable frames hold no data and are left out
+        skippable = struct.pack('<II', decompress.ZSTD_SKIPPABLE_MAGIC, 2) + b'..'
+        self.assertEqual(decompress.zstd_frames(skippable + zstd_raw_frame(b'abc')), [(10, 22)])
+        self.assertIsNone(decompress.zstd_frames(data[:-1]))
+
+    @unittest.skipUnless(zstandard, 'zstandard is not installed')
+    def test_zstd_frames_decompress_in_parallel(self):
+        path = os.path.join(self.tmp_dir.name, 'lines.txt.zst')
+        with decompress.ZstdFrameWriter(open(path, 'wb'), frame_bytes=1 << 16) as f:
+            f.write(self.data)
+        with open(path, 'rb') as f:
+            compressed = f.read()
+        self.assertGreater(len(decompress.zstd_frames(compressed)), 4)
+        self.assertEqual(decompress.decompress_buffer(compressed, 'zstd', workers=4), self.data)
+        with decompress.open_input(path) as f:
+            self.assertEqual(f.read(), self.data)
+
+    @unittest.skipUnless(zstandard, 'zstandard is not installed')
+    def test_single_frame_zstd_is_streamed(self):
+        path = os.path.join(self.tmp_dir.name, 'lines.txt.zst')
+        with open(path, 'wb') as f:
+            f.write(zstandard.ZstdCompressor().compress(self.data))
+        with open(path, 'rb') as f:
+            compressed = f.read()
+
+        self.assertEqual(decompress.detect_compression(path), 'zstd')
+        self.assertEqual(len(decompress.zstd_frames(compressed)), 1)
+        self.assertEqual(decompress.decompress_buffer(compressed, 'zstd', workers=4), self.data)
+        with decompress.open_input(path) as f:
+            self.assertEqual(f.readline(), b'line 0 \n')
+            self.assertEqual(f.read(), self.data[len(b'line 0 \n'):])
+
+class TestCompressedIngestion(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.plain_dir = os.path.join(self.tmp_dir.name, 'plain')
+        self.gzip_dir = os.path.join(self.tmp_dir.name, 'gzip')
+        self.plain = {}
+        self.compressed = {}
+        os.makedirs(self.plain_dir)
+        os.makedirs(self.gzip_dir)
+        for source in ('ad_impressions', 'clicks_conversions'):
+            self.plain[source], = generate_sample_data.generate_source(source, 500, 1, self.plain_dir)
+            self.compressed[source], = generate_sample_data.generate_source(source, 500, 1, self.gzip_dir, compression='gzip')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_compressed_files_read_like_plain_ones(self):
+        self.assertTrue(self.compressed['ad_impressions'].endswith('.json.gz'))
+        self.assertEqual(ingest.discover_files(self.gzip_dir)['clicks_conversions'], [self.compressed['clicks_conversions']])
+        for source in self.plain:
+            plain, compressed = self.plain[source], self.compressed[source]
+            self.assertEqual(ingest.source_for_path(compressed), source)
+            self.assertEqual(list(ingest.read_file(compressed)), list(ingest.read_file(plain)))
+            self.assertEqual(ingest.read_batch(compressed).to_frame().to_dict('list'),
+                             ingest.read_batch(plain).to_frame().to_dict('list'))
+
+            async def stream(path):
+                return [record async for batch in ingest.stream_file(path, 64) for record in batch]
+            self.assertEqual(asyncio.run(stream(compressed)), asyncio.run(stream(plain)))
+
+    def test_compressed_files_resume_by_skipping_committed_records(self):
+        path = self.compressed['clicks_conversions']
+        batches = list(ingest.iter_file_from(path, batch_size=200))
+        self.assertEqual([len(records) for records, _ in batches], [200, 200, 100])
+        self.assertEqual([position for _, position in batches], [0, 0, os.path.getsize(path)])
+
+        resumed = list(ingest.iter_file_from(path, skip_records=400, batch_size=200))
+        self.assertEqual(resumed[0][0], batches[-1][0])
+
+    def test_pipeline_reads_compressed_chunks(self):
+        async def collect(paths):
+            return [(source, kind) async for source, kind, _ in read_chunks(paths, chunk_bytes=4096)]
+        chunks = asyncio.run(collect([self.compressed['clicks_conversions']]))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(set(chunks), {('clicks_conversions', 'csv')})
+
+        processor = DataProcessor('sqlite://')
+        processor._geoip = type('NoGeoIP', (), {'lookup_many': staticmethod(lambda ips: 'Unknown')})()
+        try:
+            stats = asyncio.run(ingestion_pipeline(processor, list(self.compressed.values()), chunk_bytes=4096, parse_workers=1).run())
+        finally:
+            processor.engine.dispose()
+        self.assertEqual(stats['write']['errors'], 0)
+        self.assertEqual(stats['parse']['rows'], 1000)
+
+    def test_deflate_avro(self):
+        path, = generate_sample_data.generate_source('bid_requests', 300, 1, self.gzip_dir, avro_codec='deflate')
+        plain, = generate_sample_data.generate_source('bid_requests', 300, 1, self.plain_dir)
+        self.assertEqual(list(ingest.read_file(path)), list(ingest.read_file(plain)))
+
+if __name__ == '__main__':
+    unittest.main()
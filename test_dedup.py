@@ -0,0 +1,92 @@
+import os
+import unittest
+
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from dedup import BloomFilter, StreamingDeduplicator
+from process import DataProcessor
+
+def events(minutes, users, auction_prefix='A'):
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime('2023-01-01') + pd.to_timedelta(minutes, unit='min'),
+        'user_id': users,
+        'auction_id': [f"{auction_prefix}{minute}-{user}" for minute, user in zip(minutes, users)],
+    })
+
+class TestStreamingDeduplicator(unittest.TestCase):
+    def test_drops_duplicates_within_and_across_batches(self):
+        deduplicator = StreamingDeduplicator(['auction_id', 'user_id', 'timestamp'])
+        first = deduplicator.deduplicate(events([0, 1, 1, 2], [1, 2, 2, 3]))
+        second = deduplicator.deduplicate(events([2, 3, 1], [3, 4, 2]))
+
+        self.assertEqual(first['user_id'].tolist(), [1, 2, 3])
+        self.assertEqual(second['user_id'].tolist(), [4])
+        self.assertEqual(deduplicator.stats()['duplicates_dropped'], 3)
+        self.assertEqual(deduplicator.stats()['rows_seen'], 7)
+
+    def test_keeps_every_event_of_a_user(self):
+        # drop_duplicates('user_id') kept one event per user; distinct events must survive
+        result = StreamingDeduplicator(['timestamp', 'user_id']).deduplicate(events([0, 1, 2], [7, 7, 7]))
+        self.assertEqual(len(result), 3)
+
+    def test_memory_is_bounded_by_the_window(self):
+        deduplicator = StreamingDeduplicator(['auction_id'], window='10min', bucket='1min')
+        for start in range(0, 600, 60):
+            minutes = np.arange(start, start + 60)
+            deduplicator.deduplicate(events(minutes, minutes % 5))
+        self.assertLessEqual(deduplicator.stats()['buckets'], 11)
+        self.assertLessEqual(deduplicator.stats()['remembered'], 11)
+
+    def test_events_older_than_the_window_pass_as_late(self):
+        deduplicator = StreamingDeduplicator(['auction_id'], window='10min', bucket='1min')
+        deduplicator.deduplicate(events([0, 60], [1, 1]))
+        result = deduplicator.deduplicate(events([0], [1]))
+        self.assertEqual(len(result), 1)
+        self.assertEqual(deduplicator.stats()['late_rows'], 1)
+
+    def test_frames_without_event_time_use_arrival_time(self):
+        deduplicator = StreamingDeduplicator(['auction_id'])
+        bids = pd.DataFrame({'auction_id': ['a', 'b', 'a']})
+        self.assertEqual(deduplicator.deduplicate(bids)['auction_id'].tolist(), ['a', 'b'])
+        self.assertTrue(deduplicator.deduplicate(bids).empty)
+
+    def test_bloom_filter_matches_hash_set_at_low_fp_rate(self):
+        minutes = np.arange(20000) // 400
+        batch = events(minutes, np.arange(20000) % 1000)
+        batch = pd.concat([batch, batch.sample(2000, random_state=0)], ignore_index=True)
+        exact = StreamingDeduplicator(['auction_id'])
+        bloom = StreamingDeduplicator(['auction_id'], method='bloom', fp_rate=0.001, bucket_capacity=1000)
+
+        self.assertEqual(len(exact.deduplicate(batch)), 20000)
+        kept = len(bloom.deduplicate(batch))
+        self.assertLessEqual(kept, 20000)
+        self.assertGreater(kept, 20000 * 0.99)
+        self.assertGreater(bloom.stats()['memory_bytes'], 0)
+
+class TestBloomFilter(unittest.TestCase):
+    def test_no_false_negatives_and_bounded_false_positives(self):
+        rng = np.random.default_rng(0)
+        added = rng.integers(0, 2 ** 63, 10000, dtype=np.int64).astype(np.uint64)
+        other = rng.integers(0, 2 ** 63, 10000, dtype=np.int64).astype(np.uint64)
+        bloom = BloomFilter(10000, 0.01)
+        bloom.add_many(added)
+        self.assertTrue(bloom.contains_many(added).all())
+        self.assertLess(bloom.contains_many(other).mean(), 0.03)
+
+class TestDeduplicateData(unittest.TestCase):
+    def test_processor_deduplicates_across_calls(self):
+        processor = DataProcessor('sqlite://')
+        records = [
+            {'timestamp': '2023-01-01 10:00:00', 'user_id': 1, 'ad_campaign_id': 1, 'conversion_type': 'visit'},
+            {'timestamp': '2023-01-01 10:05:00', 'user_id': 1, 'ad_campaign_id': 1, 'conversion_type': 'visit'},
+        ]
+        first = processor.deduplicate_data(processor.process_clicks_conversions(records))
+        second = processor.deduplicate_data(processor.process_clicks_conversions(records[1:]))
+        self.assertEqual(len(first), 2)
+        self.assertTrue(second.empty)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import numpy as np
+import pandas as pd
+
+from freqcap import ALL_CAMPAIGNS, FrequencyCapStore
+from process import DataProcessor
+
+START = pd.Timestamp('2024-04-01 10:00:00').value // 10**9
+
+def clicks(rows):
+    return pd.DataFrame(rows, columns=['timestamp', 'user_id', 'ad_campaign_id', 'conversion_type']).astype({'timestamp': 'datetime64[ns]'})
+
+class TestFrequencyCapStore(unittest.TestCase):
+    def test_counts_match_brute_force_per_window(self):
+        rng = np.random.default_rng(7)
+        store = FrequencyCapStore(windows=['10min', '1h'], buckets=6, ttl='1h')
+        users = rng.integers(1, 20, 3000)
+        campaigns = rng.integers(1, 4, 3000)
+        seconds = START + np.sort(rng.integers(0, 3 * 3600, 3000))
+        for begin in range(0, 3000, 250):
+            store.add('clicks', users[begin:begin + 250], campaigns[begin:begin + 250], seconds[begin:begin + 250])
+
+        now = int(seconds[-1])
+        for window, width in (('10min', 100), ('1h', 600)):
+            live = seconds // width > now // width - 6
+            for user in range(1, 20):
+                expected = int((live & (users == user) & (campaigns == 2)).sum())
+                self.assertEqual(store.lookup(user, 2)[window]['clicks'], expected)
+                self.assertEqual(store.lookup(user)[window]['clicks'], int((live & (users == user)).sum()))
+        # Batched lookups agree with single ones, and unknown users count zero
+        batch = store.lookup_many([3, 999], [2, 2])
+        self.assertEqual(batch.loc[0, 'clicks_1h'], store.lookup(3, 2)['1h']['clicks'])
+        self.assertEqual(batch.loc[1].sum(), 0)
+
+    def test_windows_slide_and_late_events_are_dropped(self):
+        store = FrequencyCapStore(windows=['10min', '1h'], buckets=6)
+        store.update(clicks([
+            ['2024-04-01 10:00:00', 1, 5, 'visit'],
+            ['2024-04-01 10:55:00', 1, 5, 'visit'],
+            ['2024-04-01 10:56:00', 1, 5, 'purchase'],
+        ]), 'clicks_conversions')
+        self.assertEqual(store.lookup(1, 5), {'10min': {'impressions': 0, 'clicks': 2}, '1h': {'impressions': 0, 'clicks': 3}})
+        self.assertEqual(store.lookup(1, 5, now='2024-04-01 11:30:00')['1h']['clicks'], 2)
+        self.assertEqual(store.lookup(1, 5, now='2024-04-01 12:00:00')['1h']['clicks'], 0)
+
+        # Out-of-order events inside the window are counted, older ones are not
+        store.update(clicks([['2024-04-01 10:30:00', 1, 5, 'visit'], ['2024-04-01 09:00:00', 1, 5, 'visit']]))
+        self.assertEqual(store.lookup(1, 5)['1h']['clicks'], 4)
+        self.assertEqual(store.stats()['late'], 2)
+
+    def test_impressions_use_creative_campaigns(self):
+        store = FrequencyCapStore(creative_campaigns={10: 1, 11: 2})
+        impressions = pd.DataFrame({
+            'ad_creative_id': [10, 11, 12], 'user_id': [1, 1, 1],
+            'timestamp': pd.to_datetime(['2024-04-01 10:00:00'] * 3), 'website_url': ['a', 'b', 'c'],
+        })
+        self.assertEqual(store.update(impressions), 3)
+        self.assertEqual(store.lookup(1, 1)['10min']['impressions'], 1)
+        self.assertEqual(store.lookup(1, 12)['10min']['impressions'], 0)
+        self.assertEqual(store.lookup(1, ALL_CAMPAIGNS)['24h']['impressions'], 3)
+        with self.assertRaises(ValueError):
+            store.update(pd.DataFrame({'bid_amount': [1.0], 'auction_id': ['A']}))
+
+    def test_memory_is_bounded_by_ttl_and_max_keys(self):
+        store = FrequencyCapStore(ttl='1h', max_keys=100, user_totals=False)
+        store.add('impressions', np.arange(80), np.ones(80), np.full(80, START))
+        store.add('impressions', np.arange(80, 160), np.ones(80), np.full(80, START + 60))
+        # The least recently seen keys made room
+        self.assertEqual(len(store), 100)
+        self.assertEqual(store.stats()['evicted'], 60)
+        self.assertEqual(store.lookup(0, 1)['10min']['impressions'], 0)
+        self.assertEqual(store.lookup(159, 1)['10min']['impressions'], 1)
+
+        store.add('impressions', [1000], [1], [START + 2 * 3600])
+        self.assertEqual(len(store), 1)
+        self.assertLessEqual(store.capacity, 100)
+
+    def test_snapshot_restore_round_trip(self):
+        store = FrequencyCapStore(windows=['1h'], buckets=4, creative_campaigns={7: 3})
+        store.add('impressions', [1, 2, 2], [3, 3, np.nan], [START, START + 10, START + 20])
+        store.add('clicks', [2], [3], [START + 30])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'caps.npz')
+            store.snapshot(path)
+            restored = FrequencyCapStore.restore(path)
+
+        pd.testing.assert_frame_equal(restored.lookup_many([1, 2, 2], [3, 3, ALL_CAMPAIGNS]), store.lookup_many([1, 2, 2], [3, 3, ALL_CAMPAIGNS]))
+        self.assertEqual(restored.windows, ['1h'])
+        self.assertEqual(restored.creative_campaigns.to_dict(), {7: 3})
+        restored.add('clicks', [2], [3], [START + 40])
+        self.assertEqual(restored.lookup(2, 3)['1h']['clicks'], 2)
+
+    def test_processor_counts_processed_batches(self):
+        processor = DataProcessor('sqlite://')
+        df = processor.process_clicks_conversions([
+            {'timestamp': '2024-04-01 10:00:00', 'user_id': 1, 'ad_campaign_id': 5, 'conversion_type': 'visit'},
+            {'timestamp': '2024-04-01 10:01:00', 'user_id': 1, 'ad_campaign_id': 5, 'conversion_type': 'signup'},
+        ])
+        self.assertEqual(processor.count_frequency(df), 2)
+        self.assertEqual(processor.count_frequency(pd.DataFrame({'bid_amount': [1.0], 'auction_id': ['A']})), 0)
+        self.assertEqual(processor.frequency_caps.lookup(1, 5)['10min']['clicks'], 2)
+        processor.engine.dispose()
+
+if __name__ == '__main__':
+    unittest.main()
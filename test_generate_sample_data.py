@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+import unittest
+
+import generate_sample_data
+import ingest
+
+class TestGenerateSampleData(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def generate(self, source, rows, shards=1, seed=7, config=None, name='out'):
+        data_dir = os.path.join(self.tmp_dir.name, name)
+        os.makedirs(data_dir, exist_ok=True)
+        return generate_sample_data.generate_source(source, rows, shards, data_dir, seed, config, chunk_size=100)
+
+    def test_same_seed_gives_same_files(self):
+        for source in generate_sample_data.SOURCES:
+            first = self.generate(source, 500, name='first')
+            second = self.generate(source, 500, name='second')
+            with open(first[0], 'rb') as a, open(second[0], 'rb') as b:
+                self.assertEqual(a.read(), b.read(), source)
+
+    def test_shards_split_rows_and_match_ingest_patterns(self):
+        paths = self.generate('clicks_conversions', 1001, shards=3)
+        self.assertEqual([os.path.basename(path) for path in paths],
+                         [f"clicks_conversions_0000{i}.csv" for i in range(3)])
+        self.assertEqual(sum(len(ingest.read_file(path)) for path in paths), 1001)
+        self.assertEqual(len(ingest.discover_files(os.path.dirname(paths[0]))['clicks_conversions']), 3)
+
+    def test_timestamps_are_ordered_without_late_events(self):
+        path = self.generate('ad_impressions', 1000, shards=2, config={'late_rate': 0})[1]
+        timestamps = [record['timestamp'] for record in ingest.read_file(path)]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+    def test_duplicates_and_skew(self):
+        path = self.generate('bid_requests', 2000, config={'duplicate_rate': 0.1})[0]
+        records = ingest.read_file(path)
+        auctions = [record['auction_id'] for record in records]
+        self.assertGreater(len(auctions) - len(set(auctions)), 100)
+        users = [record['user_id'] for record in records]
+        top_user = max(set(users), key=users.count)
+        # Under a uniform distribution over 90000 users no user would repeat this often
+        self.assertGreater(users.count(top_user), 20)
+
+    def test_json_output_is_compact(self):
+        path = self.generate('ad_impressions', 10)[0]
+        with open(path) as f:
+            content = f.read()
+        self.assertEqual(len(json.loads(content)), 10)
+        self.assertEqual(content.count('\n'), 12)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from types import SimpleNamespace
+
+import geoip2.errors
+import pandas as pd
+
+from geoip import GeoIPResolver, UNKNOWN_COUNTRY
+
+class FakeReader:
+    def __init__(self, countries):
+        self.countries = countries
+        self.calls = 0
+
+    def country(self, ip_address):
+        self.calls += 1
+        if ip_address not in self.countries:
+            raise geoip2.errors.AddressNotFoundError(ip_address)
+        return SimpleNamespace(country=SimpleNamespace(name=self.countries[ip_address]))
+
+class TestGeoIPResolver(unittest.TestCase):
+    def test_cache_hits_and_misses(self):
+        reader = FakeReader({'1.1.1.1': 'Australia'})
+        resolver = GeoIPResolver(reader=reader)
+
+        self.assertEqual(resolver.country('1.1.1.1'), 'Australia')
+        self.assertEqual(resolver.country('1.1.1.1'), 'Australia')
+        self.assertEqual(resolver.country('10.0.0.1'), UNKNOWN_COUNTRY)
+
+        self.assertEqual(reader.calls, 2)
+        self.assertEqual(resolver.stats()['hits'], 1)
+        self.assertEqual(resolver.stats()['misses'], 2)
+
+    def test_cache_evicts_least_recently_used(self):
+        reader = FakeReader({'1.1.1.1': 'A', '2.2.2.2': 'B', '3.3.3.3': 'C'})
+        resolver = GeoIPResolver(cache_size=2, reader=reader)
+        for ip_address in ['1.1.1.1', '2.2.2.2', '1.1.1.1', '3.3.3.3']:
+            resolver.country(ip_address)
+        self.assertEqual(list(resolver.cache), ['1.1.1.1', '3.3.3.3'])
+
+    def test_prefix_cache_shares_a_slash_24(self):
+        reader = FakeReader({'192.168.1.1': 'Nowhere'})
+        resolver = GeoIPResolver(prefix_cache=True, reader=reader)
+        self.assertEqual(resolver.country('192.168.1.1'), 'Nowhere')
+        self.assertEqual(resolver.country('192.168.1.200'), 'Nowhere')
+        self.assertEqual(reader.calls, 1)
+
+    def test_lookup_many_resolves_unique_ips_once(self):
+        reader = FakeReader({'1.1.1.1': 'Australia', '8.8.8.8': 'United States'})
+        resolver = GeoIPResolver(reader=reader)
+        ips = pd.Series(['1.1.1.1', '8.8.8.8', '1.1.1.1', None, '1.1.1.1'], index=[5, 6, 7, 8, 9])
+
+        countries = resolver.lookup_many(ips)
+
+        self.assertEqual(countries.tolist(), ['Australia', 'United States', 'Australia', UNKNOWN_COUNTRY, 'Australia'])
+        self.assertEqual(countries.index.tolist(), [5, 6, 7, 8, 9])
+        self.assertEqual(reader.calls, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import asyncio
+import csv
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import fastavro
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import ingest
+import process
+from process import DataProcessor
+
+class TestStreamingIngestion(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def collect(self, path, batch_size):
+        async def run():
+            return [batch async for batch in ingest.stream_file(path, batch_size)]
+        return asyncio.run(run())
+
+    def test_json_array_batches_across_chunk_boundaries(self):
+        records = [{'user_id': i, 'website_url': f'http://example.com/{i}'} for i in range(25)]
+        path = os.path.join(self.data_dir, 'ad_impressions.json')
+        with open(path, 'w') as f:
+            json.dump(records, f, indent=4)
+
+        original_chunk_size = ingest.READ_CHUNK_SIZE
+        ingest.READ_CHUNK_SIZE = 16
+        try:
+            batches = self.collect(path, 10)
+        finally:
+            ingest.READ_CHUNK_SIZE = original_chunk_size
+
+        self.assertEqual([len(batch) for batch in batches], [10, 10, 5])
+        self.assertEqual([record for batch in batches for record in batch], records)
+
+    def test_json_lines_batches(self):
+        records = [{'user_id': i} for i in range(7)]
+        path = os.path.join(self.data_dir, 'ad_impressions.jsonl')
+        with open(path, 'w') as f:
+            f.write('\n'.join(json.dumps(record) for record in records))
+
+        batches = self.collect(path, 3)
+
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+
+    def test_csv_batches_keep_multiline_fields_together(self):
+        path = os.path.join(self.data_dir, 'clicks_conversions.csv')
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['user_id', 'conversion_type'])
+            writer.writeheader()
+            writer.writerow({'user_id': '1', 'conversion_type': 'multi\nline'})
+            writer.writerow({'user_id': '2', 'conversion_type': 'visit'})
+            writer.writerow({'user_id': '3', 'conversion_type': 'signup'})
+
+        batches = self.collect(path, 2)
+
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        self.assertEqual(batches[0][0]['conversion_type'], 'multi\nline')
+
+    def test_avro_batches(self):
+        schema = {
+            'type': 'record',
+            'name': 'BidRequest',
+            'fields': [{'name': 'user_id', 'type': 'int'}, {'name': 'bid_amount', 'type': 'float'}],
+        }
+        path = os.path.join(self.data_dir, 'bid_requests.avro')
+        with open(path, 'wb') as f:
+            fastavro.writer(f, schema, [{'user_id': i, 'bid_amount': 1.0} for i in range(5)])
+
+        batches = self.collect(path, 2)
+
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+
+    def test_corrupt_file_raises_instead_of_ending_early(self):
+        path = os.path.join(self.data_dir, 'ad_impressions.jsonl')
+        with open(path, 'w') as f:
+            f.write('{"user_id": 1}\n{"user_id": \n{"user_id": 3}\n')
+
+        with self.assertRaises(ValueError):
+            self.collect(path, 1)
+
+    def test_streaming_mode_stores_every_batch(self):
+        with open(os.path.join(self.data_dir, 'clicks_conversions.csv'), 'w') as f:
+            f.write('timestamp,user_id,ad_campaign_id,conversion_type\n')
+            for user_id in range(5):
+                f.write(f'2024-04-01 10:00:00,{user_id},1,purchase\n')
+        processor = DataProcessor(f"sqlite:///{os.path.join(self.data_dir, 'test.db')}")
+        argv = ['ingest.py', '--data-dir', self.data_dir, '--batch-size', '2']
+        try:
+            with mock.patch.object(process, '_processor', processor), mock.patch.object(sys, 'argv', argv):
+                counts = asyncio.run(ingest.main())
+            with processor.engine.connect() as conn:
+                stored = conn.exec_driver_sql('SELECT COUNT(*) FROM clicks_conversions').scalar()
+        finally:
+            processor.engine.dispose()
+        self.assertEqual(list(counts.values()), [5])
+        self.assertEqual(stored, 5)
+
+class TestParallelIngestion(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.tmp_dir.name
+        for hour in range(3):
+            path = os.path.join(self.data_dir, f'ad_impressions_{hour:02d}.json')
+            with open(path, 'w') as f:
+                json.dump([{'user_id': hour * 10 + i} for i in range(10)], f)
+        with open(os.path.join(self.data_dir, 'clicks_conversions_00.csv'), 'w', newline='') as f:
+            f.write('user_id,conversion_type\r\n1,visit\r\n')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_discover_files_by_directory_and_glob(self):
+        files = ingest.discover_files(self.data_dir)
+        self.assertEqual(len(files['ad_impressions']), 3)
+        self.assertEqual(len(files['clicks_conversions']), 1)
+        self.assertEqual(files['bid_requests'], [])
+
+        files = ingest.discover_files(os.path.join(self.data_dir, '*.csv'))
+        self.assertEqual(list(files), ['clicks_conversions'])
+
+    def test_ingest_files_returns_every_shard(self):
+        paths = ingest.discover_files(self.data_dir)['ad_impressions']
+        results = dict(ingest.ingest_files(paths, workers=2))
+        self.assertEqual(sorted(results), paths)
+        self.assertEqual(sum(len(records) for records in results.values()), 30)
+
+    def test_ingest_files_applies_task_in_worker(self):
+        paths = ingest.discover_files(self.data_dir)['ad_impressions']
+        results = dict(ingest.ingest_files(paths, workers=2, task=len))
+        self.assertEqual(set(results.values()), {10})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from loader import BulkLoader, collapse_duplicate_keys
+
+class TestBulkLoader(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.tmp_dir.name, 'test.db')}")
+        self.loader = BulkLoader(self.engine, chunksize=2)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def read(self, table_name):
+        with self.engine.connect() as conn:
+            return pd.read_sql(f"SELECT * FROM {table_name} ORDER BY auction_id", conn)
+
+    def test_append_keeps_history(self):
+        df = pd.DataFrame({'auction_id': ['A-1', 'A-2', 'A-3'], 'bid_amount': [0.5, None, 2.0]})
+        stats = self.loader.load(df, 'bids')
+        self.loader.load(df.head(1), 'bids')
+
+        self.assertEqual(stats['rows'], 3)
+        self.assertGreater(stats['rows_per_second'], 0)
+        stored = self.read('bids')
+        self.assertEqual(len(stored), 4)
+        self.assertTrue(stored['bid_amount'].isna().any())
+
+    def test_upsert_updates_rows_with_the_same_key(self):
+        self.loader.load(pd.DataFrame({'auction_id': ['A-1', 'A-2'], 'bid_amount': [0.5, 0.8]}), 'bids', mode='upsert', key='auction_id')
+        self.loader.load(pd.DataFrame({'auction_id': ['A-2', 'A-3'], 'bid_amount': [9.0, 1.0]}), 'bids', mode='upsert', key='auction_id')
+
+        stored = self.read('bids')
+        self.assertEqual(stored['auction_id'].tolist(), ['A-1', 'A-2', 'A-3'])
+        self.assertEqual(stored['bid_amount'].tolist(), [0.5, 9.0, 1.0])
+
+    def test_duplicate_keys_in_one_upsert_are_collapsed(self):
+        df = pd.DataFrame({
+            'auction_id': ['A-1', 'A-2', 'A-1', 'A-1'],
+            'count': [1, 5, 2, 3],
+            'max_bid': [0.5, 1.0, 2.0, 0.1],
+            'bid_amount': [0.5, 1.0, None, 0.7],
+        })
+        merge = {'count': 'sum', 'max_bid': 'max'}
+        collapsed = collapse_duplicate_keys(df, ['auction_id'], merge).sort_values('auction_id')
+        self.assertEqual(collapsed.to_dict('list'), {
+            'auction_id': ['A-1', 'A-2'], 'count': [6, 5], 'max_bid': [2.0, 1.0], 'bid_amount': [0.7, 1.0],
+        })
+        self.assertEqual(collapse_duplicate_keys(df, ['auction_id']).sort_values('auction_id')['count'].tolist(), [3, 5])
+
+        # The same result the row-by-row upsert gives on SQLite
+        self.loader.load(df, 'bids', mode='upsert', key='auction_id', merge=merge)
+        self.assertEqual(self.read('bids').to_dict('list'), collapsed.to_dict('list'))
+
+    def test_replace_swaps_in_a_staging_table(self):
+        self.loader.load(pd.DataFrame({'auction_id': ['A-1', 'A-2'], 'bid_amount': [0.5, 0.8]}), 'bids')
+        self.loader.load(pd.DataFrame({'auction_id': ['A-9'], 'bid_amount': [3.0]}), 'bids', mode='replace')
+
+        self.assertEqual(self.read('bids')['auction_id'].tolist(), ['A-9'])
+        with self.engine.connect() as conn:
+            tables = pd.read_sql("SELECT name FROM sqlite_master WHERE type = 'table'", conn)['name'].tolist()
+        self.assertEqual(tables, ['bids'])
+
+    def test_upsert_requires_a_key(self):
+        with self.assertRaises(ValueError):
+            self.loader.load(pd.DataFrame({'auction_id': ['A-1']}), 'bids', mode='upsert')
+
+    def test_load_rolls_back_with_the_callers_transaction(self):
+        df = pd.DataFrame({'auction_id': ['A-1'], 'bid_amount': [0.5]})
+        self.loader.load(df, 'bids')
+        with self.assertRaises(RuntimeError):
+            with self.engine.begin() as conn:
+                self.loader.load(df, 'bids', conn=conn)
+                raise RuntimeError("write failed")
+        self.assertEqual(len(self.read('bids')), 1)
+
+if __name__ == '__main__':
+    unittest.main()
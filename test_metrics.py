@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+from prometheus_client import REGISTRY
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import ingest
+import metrics
+from process import DataProcessor
+
+def sample(name, labels=None):
+    return REGISTRY.get_sample_value(name, labels or {}) or 0
+
+class TestPipelineInstrumentation(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        metrics.instrument_pipeline()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.processor = DataProcessor(f"sqlite:///{os.path.join(self.tmp_dir.name, 'test.db')}")
+        metrics.instrument_engine(self.processor.engine)
+
+    def tearDown(self):
+        self.processor.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def test_readers_count_records_per_source(self):
+        csv_file = os.path.join(self.tmp_dir.name, 'clicks_conversions.csv')
+        with open(csv_file, 'w') as f:
+            f.write('timestamp,user_id,ad_campaign_id,conversion_type\n2024-04-01 10:00:00,1,1,visit\n')
+        before = sample('advertisex_records_total', {'source': 'clicks_conversions'})
+
+        ingest.read_file(csv_file)
+
+        self.assertEqual(sample('advertisex_records_total', {'source': 'clicks_conversions'}) - before, 1)
+
+    def test_failed_reads_count_as_ingestion_errors(self):
+        before = sample('data_ingestion_errors_total')
+        with self.assertRaises(FileNotFoundError):
+            ingest.read_file(os.path.join(self.tmp_dir.name, 'missing.csv'))
+        self.assertEqual(sample('data_ingestion_errors_total') - before, 1)
+
+    def test_processing_and_validation_metrics(self):
+        clicks_before = sample('clicks_total')
+        rejected_before = sample('data_validation_errors_total')
+
+        self.processor.process_clicks_conversions([
+            {'timestamp': '2024-04-01 10:00:00', 'user_id': '1', 'ad_campaign_id': '1', 'conversion_type': 'visit'},
+        ])
+        self.processor.validate_data(pd.DataFrame({'bid_amount': [1.0, -0.5, 2.0]}))
+
+        self.assertEqual(sample('clicks_total') - clicks_before, 1)
+        self.assertEqual(sample('data_validation_errors_total') - rejected_before, 1)
+        self.assertGreater(sample('advertisex_stage_duration_seconds_count', {'stage': 'process_clicks_conversions'}), 0)
+
+    def test_database_writes_are_timed(self):
+        before = sample('advertisex_db_rows_written_total', {'table': 'bids'})
+        self.processor.store_data(pd.DataFrame({'bid_amount': [1.0, 2.0]}), 'bids')
+        self.assertEqual(sample('advertisex_db_rows_written_total', {'table': 'bids'}) - before, 2)
+        self.assertGreater(sample('advertisex_query_duration_seconds_count'), 0)
+
+    def test_served_ingestion_validates_and_times_batches(self):
+        from checkpoint import IncrementalIngestor
+        with open(os.path.join(self.tmp_dir.name, 'clicks_conversions.csv'), 'w') as f:
+            f.write('timestamp,user_id,ad_campaign_id,conversion_type\n')
+            f.write('2024-04-01 10:00:00,1,1,visit\n2024-04-01 10:00:01,2,1,\n')
+        labels = {'source': 'clicks_conversions'}
+        batches_before = sample('advertisex_batch_duration_seconds_count', labels)
+        rejected_before = sample('data_validation_errors_total')
+
+        IncrementalIngestor(self.processor, validate=True).run(self.tmp_dir.name)
+
+        self.assertEqual(sample('advertisex_batch_duration_seconds_count', labels) - batches_before, 1)
+        # The second click has no conversion type and is rejected
+        self.assertEqual(sample('data_validation_errors_total') - rejected_before, 1)
+
+    def test_deduplication_metrics(self):
+        labels = {'keys': 'auction_id,user_id'}
+        before = sample('advertisex_dedup_duplicates_total', labels)
+        bids = pd.DataFrame({'auction_id': ['a', 'a', 'b'], 'user_id': [1, 1, 2], 'bid_amount': [1.0, 1.0, 2.0]})
+
+        self.processor.deduplicate_data(bids)
+
+        self.assertEqual(sample('advertisex_dedup_duplicates_total', labels) - before, 1)
+        self.assertGreater(sample('advertisex_dedup_memory_bytes', labels), 0)
+
+if __name__ == '__main__':
+    unittest.main()
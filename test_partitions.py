@@ -0,0 +1,142 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import pandas as pd
+from sqlalchemy import inspect
+
+import generate_sample_data
+from partitions import PartitionedStore
+from pipeline import ingestion_pipeline
+from process import DataProcessor
+from reports import CampaignReports
+
+def clicks(rows):
+    return pd.DataFrame(rows, columns=['timestamp', 'user_id', 'ad_campaign_id', 'conversion_type']).astype({'timestamp': 'datetime64[ns]'})
+
+CLICKS = clicks([
+    ['2024-04-01 09:00:00', 1, 5, 'Website Visit'],
+    ['2024-04-01 23:59:59', 2, 5, 'Purchase'],
+    ['2024-04-02 00:00:00', 1, 6, 'Sign-Up'],
+    ['2024-04-02 12:00:00', 3, 5, 'Website Visit'],
+    ['2024-04-03 08:00:00', 1, 5, 'Purchase'],
+])
+
+class TestPartitionedStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.processor = DataProcessor(f"sqlite:///{self.tmp_dir.name}/partitions.db")
+        self.store = self.processor.partitions
+
+    def tearDown(self):
+        self.processor.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def test_rows_are_split_into_indexed_daily_partitions(self):
+        written = self.store.write(CLICKS, 'clicks_conversions')
+        self.assertEqual(written, {
+            'clicks_conversions_p20240401': 2, 'clicks_conversions_p20240402': 2, 'clicks_conversions_p20240403': 1,
+        })
+        self.store.write(CLICKS.iloc[:1], 'clicks_conversions')
+
+        catalog = self.store.partitions('clicks_conversions')
+        self.assertEqual(catalog['row_count'].tolist(), [3, 2, 1])
+        self.assertEqual(catalog['version'].tolist(), [2, 1, 1])
+        indexes = {index['name'] for index in inspect(self.processor.engine).get_indexes('clicks_conversions_p20240402')}
+        self.assertEqual(indexes, {
+            'clicks_conversions_p20240402_timestamp_idx', 'clicks_conversions_p20240402_user_id_idx',
+            'clicks_conversions_p20240402_ad_campaign_id_idx',
+        })
+
+        # A time range only lists the partitions it overlaps
+        self.assertEqual(self.store.partitions('clicks_conversions', '2024-04-01 12:00', '2024-04-02')['day'].tolist(), ['2024-04-01'])
+        rows = self.store.read('clicks_conversions', '2024-04-01 12:00', '2024-04-02 12:00')
+        self.assertEqual(rows['user_id'].tolist(), [2, 1])
+
+    def test_bid_requests_are_partitioned_by_ingestion_day(self):
+        bids = pd.DataFrame({'bid_amount': [1.5], 'user_id': [1], 'auction_id': ['A-1']})
+        table_name, = self.processor.store_partitioned(bids)
+        self.assertEqual(table_name, f"bid_requests_p{pd.Timestamp.now():%Y%m%d}")
+        self.assertIn('ingested_at', self.store.read('bid_requests').columns)
+        with self.assertRaises(ValueError):
+            self.store.write(bids, 'ad_impressions')
+
+    def test_prune_drops_or_archives_old_partitions(self):
+        self.store.write(CLICKS, 'clicks_conversions')
+        archive_dir = os.path.join(self.tmp_dir.name, 'archive')
+
+        self.assertEqual(self.store.prune(keep_days=2, archive_dir=archive_dir), ['clicks_conversions_p20240401'])
+        archived = pd.read_parquet(os.path.join(archive_dir, 'clicks_conversions', '2024-04-01.parquet'))
+        self.assertEqual(archived['user_id'].tolist(), [1, 2])
+        self.assertEqual(self.store.partitions(archived=True)['table_name'].tolist(), ['clicks_conversions_p20240401'])
+        self.assertFalse(inspect(self.processor.engine).has_table('clicks_conversions_p20240401'))
+
+        self.assertEqual(self.store.prune('clicks_conversions', before='2024-04-03'), ['clicks_conversions_p20240402'])
+        self.assertEqual(self.store.partitions()['day'].tolist(), ['2024-04-03'])
+        # A pruned day is recreated when late rows arrive
+        self.store.write(CLICKS.iloc[2:3], 'clicks_conversions')
+        self.assertEqual(self.store.read('clicks_conversions', '2024-04-02', '2024-04-03')['user_id'].tolist(), [1])
+        with self.assertRaises(ValueError):
+            self.store.prune()
+
+    def test_pipeline_writes_partitions(self):
+        self.processor._geoip = type('NoGeoIP', (), {'lookup_many': staticmethod(lambda ips: 'Unknown')})()
+        paths = [
+            path for source in ('ad_impressions', 'clicks_conversions')
+            for path in generate_sample_data.generate_source(source, 1000, 1, self.tmp_dir.name)
+        ]
+        pipeline = ingestion_pipeline(self.processor, paths, chunk_bytes=16384, parse_workers=1, partitioned=True)
+        stats = asyncio.run(pipeline.run())
+
+        catalog = self.store.partitions()
+        self.assertEqual(stats['write']['errors'], 0)
+        self.assertEqual(int(catalog['row_count'].sum()), stats['write']['rows'])
+        self.assertEqual(set(catalog['source']), {'ad_impressions', 'clicks_conversions'})
+        self.assertFalse(inspect(self.processor.engine).has_table('ad_impressions'))
+
+class TestCampaignReports(unittest.TestCase):
+    def setUp(self):
+        self.processor = DataProcessor('sqlite://')
+        self.store = PartitionedStore(self.processor.engine, catalog_table='report_partitions')
+        self.store.write(CLICKS, 'clicks_conversions')
+        self.reports = CampaignReports(self.store)
+
+    def tearDown(self):
+        self.processor.engine.dispose()
+
+    def test_campaign_performance_in_a_time_range(self):
+        df = self.reports.campaign_performance('2024-04-01 12:00', '2024-04-03')
+        self.assertEqual(df.to_dict('records'), [
+            {'ad_campaign_id': 5, 'clicks': 2, 'users': 2, 'conversions': 1, 'conversion_rate': 0.5},
+            {'ad_campaign_id': 6, 'clicks': 1, 'users': 1, 'conversions': 1, 'conversion_rate': 1.0},
+        ])
+        self.assertEqual(self.reports.campaign_performance(campaigns=[6])['clicks'].tolist(), [1])
+        self.assertEqual(self.reports.top_campaigns(n=1, by='clicks')['ad_campaign_id'].tolist(), [5])
+        self.assertTrue(self.reports.campaign_performance('2025-01-01', '2025-01-02').empty)
+
+        activity = self.reports.user_activity(1)
+        self.assertEqual(activity.loc['clicks_conversions', 'events'], 3)
+        self.assertEqual(activity.loc['clicks_conversions', 'last_seen'], pd.Timestamp('2024-04-03 08:00:00'))
+        self.assertEqual(activity.loc['ad_impressions', 'events'], 0)
+        self.assertEqual(self.reports.daily_volume('clicks_conversions', end='2024-04-02').tolist(), [2])
+
+    def test_cache_is_invalidated_by_writes_to_the_range(self):
+        first = self.reports.campaign_performance('2024-04-02', '2024-04-03')
+        self.reports.campaign_performance('2024-04-02', '2024-04-03')
+        self.assertEqual(self.reports.stats(), {'hits': 1, 'misses': 1, 'entries': 1})
+
+        # Rows for another day leave the cached result valid
+        self.store.write(clicks([['2024-04-05 10:00:00', 9, 5, 'Purchase']]), 'clicks_conversions')
+        self.reports.campaign_performance('2024-04-02', '2024-04-03')
+        self.assertEqual(self.reports.stats()['hits'], 2)
+
+        self.store.write(clicks([['2024-04-02 18:00:00', 9, 5, 'Purchase']]), 'clicks_conversions')
+        updated = self.reports.campaign_performance('2024-04-02', '2024-04-03')
+        self.assertEqual(self.reports.stats()['misses'], 2)
+        self.assertEqual(updated['clicks'].sum(), first['clicks'].sum() + 1)
+
+if __name__ == '__main__':
+    unittest.main()
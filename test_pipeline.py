@@ -0,0 +1,99 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import generate_sample_data
+from pipeline import Pipeline, Stage, ingestion_pipeline, parse_chunk, read_chunks
+from process import DataProcessor
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+class TestPipeline(unittest.TestCase):
+    def test_bounded_queues_under_slow_stage(self):
+        written = []
+
+        def slow_write(item):
+            time.sleep(0.01)
+            written.append(item)
+            return item
+
+        pipeline = Pipeline(range(50), [
+            Stage('double', lambda item: item * 2, concurrency=2, queue_size=3),
+            Stage('write', slow_write, concurrency=1, executor='thread', queue_size=3),
+        ])
+        stats = asyncio.run(pipeline.run())
+
+        self.assertEqual(sorted(written), [item * 2 for item in range(50)])
+        self.assertEqual(stats['write']['items'], 50)
+        self.assertLessEqual(stats['write']['max_queue_depth'], 3)
+
+    def test_failed_items_are_dropped_and_counted(self):
+        def check(item):
+            if item == 3:
+                raise ValueError('bad item')
+            return item
+
+        pipeline = Pipeline(range(5), [Stage('check', check)])
+        stats = asyncio.run(pipeline.run())
+        self.assertEqual(stats['check']['items'], 4)
+        self.assertEqual(stats['check']['errors'], 1)
+
+    def test_failing_stage_stops_the_run(self):
+        def check(item):
+            if item == 3:
+                raise ValueError('bad item')
+            return item
+
+        pipeline = Pipeline(range(100), [
+            Stage('check', check, fail=True, queue_size=1),
+            Stage('write', lambda item: item, queue_size=1),
+        ])
+        with self.assertRaises(ValueError):
+            asyncio.run(pipeline.run())
+        self.assertEqual(pipeline.stats()['check']['errors'], 1)
+
+class TestIngestionPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.tmp_dir.name
+        self.paths = [
+            path for source in ('ad_impressions', 'clicks_conversions', 'bid_requests')
+            for path in generate_sample_data.generate_source(source, 2000, 1, self.data_dir)
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_chunks_parse_to_every_record(self):
+        chunks = asyncio.run(collect(read_chunks(self.paths, chunk_bytes=4096)))
+        counts = {}
+        for chunk in chunks:
+            source, df = parse_chunk(chunk)
+            counts[source] = counts.get(source, 0) + len(df)
+        self.assertGreater(len(chunks), 3)
+        self.assertEqual(counts, {'ad_impressions': 2000, 'clicks_conversions': 2000, 'bid_requests': 2000})
+
+    def test_loads_every_source(self):
+        processor = DataProcessor(f"sqlite:///{os.path.join(self.data_dir, 'test.db')}")
+        processor._geoip = type('NoGeoIP', (), {'lookup_many': staticmethod(lambda ips: 'Unknown')})()
+        try:
+            pipeline = ingestion_pipeline(processor, self.paths, chunk_bytes=16384, parse_workers=2, queue_size=2)
+            stats = asyncio.run(pipeline.run())
+            self.assertEqual(stats['parse']['rows'], 6000)
+            self.assertEqual(stats['parse']['errors'] + stats['enrich']['errors'] + stats['write']['errors'], 0)
+            with processor.engine.connect() as conn:
+                for source in ('ad_impressions', 'clicks_conversions', 'bid_requests'):
+                    count = pd.read_sql(f"SELECT COUNT(*) AS n FROM {source}", conn)['n'][0]
+                    self.assertEqual(count, 2000)
+        finally:
+            processor.engine.dispose()
+
+if __name__ == '__main__':
+    unittest.main()
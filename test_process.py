@@ -1,4 +1,8 @@
+import os
 import unittest
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
 from process import process_data
 
 class TestDataProcessing(unittest.TestCase):
@@ -0,0 +1,94 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import generate_sample_data
+import ingest
+import profiling
+import schemas
+from process import DataProcessor
+
+CLICKS = [{'timestamp': '2024-04-01 10:00:00', 'user_id': i, 'ad_campaign_id': 1, 'conversion_type': 'visit'} for i in range(50)]
+
+class TestProfiler(unittest.TestCase):
+    def test_records_stages_per_batch_and_restores_functions(self):
+        original_coerce = schemas.coerce_frame
+        original_reader = ingest.FILE_READERS['.csv']
+        processor = DataProcessor('sqlite://')
+        profiler = profiling.Profiler(['stages']).start()
+        try:
+            for _ in range(2):
+                processor.process_clicks_conversions(CLICKS)
+            self.assertIsNot(ingest.FILE_READERS['.csv'], original_reader)
+        finally:
+            profiler.stop()
+            processor.engine.dispose()
+
+        self.assertIs(schemas.coerce_frame, original_coerce)
+        self.assertIs(ingest.FILE_READERS['.csv'], original_reader)
+        summary = profiler.summary()
+        stage = summary['process_clicks_conversions']
+        self.assertEqual(stage['calls'], 2)
+        self.assertEqual(stage['rows_in'], 100)
+        self.assertEqual(stage['rows_out'], 100)
+        # Nested stages are recorded too
+        self.assertEqual(summary['coerce_frame']['calls'], 2)
+        batches = [batch['batch'] for batch in profiler.batches if batch['stage'] == 'process_clicks_conversions']
+        self.assertEqual(batches, [0, 1])
+
+    def test_ingest_batch_mode_profiles_lazily_imported_stages(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for source in ('ad_impressions', 'clicks_conversions'):
+                generate_sample_data.generate_source(source, 200, 1, tmp_dir)
+            output = os.path.join(tmp_dir, 'profile.json')
+            env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'test.db')}")
+            env.pop(profiling.PROFILE_ENV, None)
+            subprocess.run(
+                [sys.executable, os.path.abspath(ingest.__file__), '--data-dir', tmp_dir, '--batch-size', '100',
+                 '--profile', '--profile-output', output],
+                capture_output=True, env=env, check=True, cwd=tmp_dir,
+            )
+            with open(output) as f:
+                stages = json.load(f)['stages']
+
+        # process and loader are only imported after profiling starts
+        self.assertEqual(stages['process_ad_impressions']['calls'], 2)
+        self.assertEqual(stages['process_clicks_conversions']['calls'], 2)
+        for stage in ('validate_data', 'store_data', 'load'):
+            self.assertEqual(stages[stage]['calls'], 4)
+
+    def test_report_is_json_with_optional_profilers(self):
+        profiler = profiling.Profiler(['cprofile', 'tracemalloc']).start()
+        with profiler.stage('build', rows_in=3) as record:
+            record['rows_out'] = len([str(i) * 100 for i in range(1000)])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'profile.json')
+            profiler.write(path)
+            with open(path) as f:
+                report = json.load(f)
+
+        self.assertEqual(report['stages']['build']['rows_out'], 1000)
+        self.assertTrue(report['functions'])
+        self.assertTrue(report['allocations'])
+        self.assertIn('build', profiler.table())
+
+    def test_disabled_without_environment_variable(self):
+        with mock.patch.dict(os.environ, {profiling.PROFILE_ENV: '0'}):
+            self.assertIsNone(profiling.enable_from_env())
+        self.assertEqual(profiling.parse_modes('1, cprofile'), ['stages', 'cprofile'])
+        with self.assertRaises(ValueError):
+            profiling.Profiler(['perf'])
+
+    def test_inline_executor_runs_in_caller(self):
+        future = profiling.InlineExecutor(max_workers=4).submit(sum, [1, 2])
+        self.assertEqual(future.result(), 3)
+        self.assertIsInstance(profiling.InlineExecutor().submit(int, 'x').exception(), ValueError)
+
+if __name__ == '__main__':
+    unittest.main()
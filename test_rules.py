@@ -0,0 +1,100 @@
+import json
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from process import DataProcessor
+from rules import RuleSet, load_rules
+
+class TestRuleSet(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'bid_amount': [1.0, -0.5, None, 3.0, 12.0],
+            'ip_address': ['8.8.8.8', '192.168.1.256', '::1', None, '10.0.0.1'],
+            'auction_id': ['AUCTION-1', 'AUCTION-2', 'bad', 'AUCTION-4', 'AUCTION-5'],
+            'timestamp': pd.to_datetime(['2023-01-01', '2023-01-02', None, '1999-12-31', '2023-01-05']),
+        })
+
+    def test_rules_compile_into_one_mask_with_counts_and_reasons(self):
+        rules = RuleSet([
+            {'name': 'bid', 'column': 'bid_amount', 'type': 'range', 'min': 0, 'max': 10},
+            {'name': 'ip', 'column': ['user_ip', 'ip_address'], 'type': 'ip'},
+            {'name': 'auction', 'column': 'auction_id', 'type': 'regex', 'pattern': r'AUCTION-\d+'},
+            {'name': 'time', 'column': 'timestamp', 'type': 'timestamp', 'start': '2000-01-01'},
+            {'name': 'skipped', 'column': 'missing_column', 'type': 'not_null'},
+        ])
+
+        result = rules.apply(self.df)
+
+        self.assertEqual(result['valid'].index.tolist(), [0])
+        self.assertEqual(result['counts'], {'bid': 3, 'ip': 2, 'auction': 1, 'time': 2})
+        self.assertEqual(result['rejected']['rejected_by'].tolist(), ['bid,ip', 'bid,auction,time', 'ip,time', 'bid'])
+
+    def test_all_passing_frame_is_not_copied(self):
+        rules = RuleSet([{'column': 'auction_id', 'type': 'not_null'}])
+        self.assertIs(rules.apply(self.df)['valid'], self.df)
+        self.assertIs(rules.filter(self.df), self.df)
+
+    def test_enum_equals_and_allow_null(self):
+        rules = RuleSet([
+            {'column': 'auction_id', 'type': 'enum', 'values': ['AUCTION-1', 'AUCTION-4', 'bad']},
+            {'column': 'bid_amount', 'type': 'equals', 'value': 1.0, 'allow_null': True},
+        ])
+        self.assertEqual(rules.filter(self.df).index.tolist(), [0, 2])
+
+    def test_unknown_rule_type_is_rejected(self):
+        with self.assertRaises(ValueError):
+            RuleSet([{'column': 'bid_amount', 'type': 'between'}])
+
+    def test_rules_file_overrides_defaults(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump({'bid_requests': {'validate': [{'column': 'bid_amount', 'type': 'range', 'max': 2}], 'filters': {'cheap': []}}}, f)
+        try:
+            config = load_rules(f.name)
+        finally:
+            os.remove(f.name)
+        self.assertEqual(len(config['bid_requests']['validate']), 1)
+        self.assertIn('high_value', config['bid_requests']['filters'])
+        self.assertIn('cheap', config['bid_requests']['filters'])
+        self.assertTrue(config['ad_impressions']['validate'])
+
+class TestProcessorRules(unittest.TestCase):
+    def setUp(self):
+        self.processor = DataProcessor('sqlite://')
+        self.quarantined = []
+        self.processor.quarantine_sink = lambda rejected, source, conn=None: self.quarantined.append((source, rejected))
+        self.bids = pd.DataFrame({
+            'bid_amount': [0.5, -0.5, 8.0],
+            'user_id': [1, 2, 3],
+            'auction_id': ['AUCTION-1', 'AUCTION-2', 'AUCTION-3'],
+            'user_ip': ['192.168.1.1', '192.168.1.2', '192.168.1.256'],
+            'user_country': ['France', 'Spain', 'France'],
+        })
+
+    def test_validate_data_quarantines_rejected_rows(self):
+        valid = self.processor.validate_data(self.bids)
+
+        self.assertEqual(valid['user_id'].tolist(), [1])
+        source, rejected = self.quarantined[0]
+        self.assertEqual(source, 'bid_requests')
+        self.assertEqual(rejected['rejected_by'].tolist(), ['bid_amount_non_negative', 'ip_address_valid'])
+        self.assertEqual(self.processor.validation_counts['bid_requests']['ip_address_valid'], 1)
+
+    def test_default_quarantine_sink_stores_a_table(self):
+        processor = DataProcessor('sqlite://')
+        processor.validate_data(self.bids)
+        stored = pd.read_sql_table('bid_requests_quarantine', processor.engine)
+        self.assertEqual(len(stored), 2)
+
+    def test_filter_data_by_country_named_filter_or_rules(self):
+        self.assertEqual(self.processor.filter_data(self.bids, 'France')['user_id'].tolist(), [1, 3])
+        self.assertEqual(self.processor.filter_data(self.bids, 'high_value')['user_id'].tolist(), [3])
+        rules = [{'column': 'user_id', 'type': 'range', 'max': 2}]
+        self.assertEqual(self.processor.filter_data(self.bids, rules)['user_id'].tolist(), [1, 2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import io
+import unittest
+
+import pandas as pd
+
+from schemas import coerce_frame, column_dtypes, parse_records, read_csv_typed
+
+class TestSchemas(unittest.TestCase):
+    def test_column_dtypes_follow_the_schema(self):
+        dtypes = column_dtypes('clicks_conversions')
+        self.assertEqual(dtypes['user_id'], 'int32')
+        self.assertEqual(dtypes['timestamp'], 'datetime64[ns]')
+        self.assertEqual(list(dtypes['conversion_type'].categories), ['purchase', 'signup', 'visit'])
+        self.assertEqual(column_dtypes('bid_requests')['bid_amount'], 'float32')
+
+    def test_parse_records_types_csv_strings(self):
+        df = parse_records([
+            {'timestamp': '2024-04-01 10:02:00', 'user_id': '101', 'ad_campaign_id': '5', 'conversion_type': 'purchase'},
+            {'timestamp': '2024-04-01 10:20:00', 'user_id': '102', 'ad_campaign_id': '6', 'conversion_type': 'signup'},
+        ], 'clicks_conversions')
+
+        self.assertEqual(df['user_id'].dtype, 'int32')
+        self.assertEqual(df['ad_campaign_id'].dtype, 'int32')
+        self.assertEqual(df['timestamp'].iloc[0], pd.Timestamp('2024-04-01 10:02:00'))
+        self.assertIsInstance(df['conversion_type'].dtype, pd.CategoricalDtype)
+
+    def test_invalid_values_become_missing(self):
+        df = parse_records([
+            {'ad_creative_id': 'abc', 'user_id': 101, 'timestamp': '2024-04-01T13:20:00'},
+            {'ad_creative_id': 7, 'user_id': 102, 'timestamp': '2024-04-01 13:20:00'},
+        ], 'ad_impressions')
+
+        self.assertEqual(str(df['ad_creative_id'].dtype), 'Int32')
+        self.assertTrue(pd.isna(df['ad_creative_id'].iloc[0]))
+        self.assertTrue(pd.isna(df['timestamp'].iloc[0]))
+        self.assertEqual(df['user_id'].dtype, 'int32')
+
+    def test_columns_outside_the_schema_are_untouched(self):
+        df = coerce_frame(pd.DataFrame({'user_id': [1], 'user_ip': ['192.168.1.1']}), 'bid_requests')
+        self.assertEqual(df['user_ip'].iloc[0], '192.168.1.1')
+
+    def test_read_csv_typed(self):
+        csv_file = io.StringIO(
+            'timestamp,user_id,ad_campaign_id,conversion_type\n'
+            '2024-04-01 10:02:00,101,5,purchase\n'
+            '2024-04-01 10:20:00,102,6,comment\n'
+        )
+        df = read_csv_typed(csv_file, 'clicks_conversions')
+
+        self.assertEqual(df['user_id'].dtype, 'int32')
+        self.assertEqual(df['timestamp'].dtype.kind, 'M')
+        self.assertTrue(pd.isna(df['conversion_type'].iloc[1]))
+
+if __name__ == '__main__':
+    unittest.main()
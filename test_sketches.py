@@ -0,0 +1,95 @@
+import os
+import pickle
+import unittest
+
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from process import DataProcessor
+from sketches import CampaignSketches, CountMinSketch, HyperLogLog, SpaceSaving, load_sketch
+
+class TestHyperLogLog(unittest.TestCase):
+    def test_estimates_distinct_count_within_error(self):
+        values = pd.Series(np.random.default_rng(0).integers(0, 10 ** 12, 200000))
+        for precision in (10, 14):
+            estimate = HyperLogLog(precision).add_many(values).count()
+            self.assertLess(abs(estimate - 200000) / 200000, 4 * 1.04 / np.sqrt(1 << precision))
+
+    def test_merge_equals_union_and_survives_serialization(self):
+        first = HyperLogLog().add_many(pd.Series(range(0, 6000)))
+        second = HyperLogLog().add_many(pd.Series(range(3000, 9000), dtype='int32'))
+        union = HyperLogLog().add_many(pd.Series(range(0, 9000)))
+
+        merged = load_sketch(first.to_bytes()).merge(pickle.loads(pickle.dumps(second)))
+
+        np.testing.assert_array_equal(merged.registers, union.registers)
+        self.assertEqual(len(first.to_bytes()), len(HyperLogLog().add_many(pd.Series(range(10 ** 5))).to_bytes()))
+
+    def test_rejects_mismatched_precision(self):
+        with self.assertRaises(ValueError):
+            HyperLogLog(10).merge(HyperLogLog(12))
+
+class TestFrequencySketches(unittest.TestCase):
+    def setUp(self):
+        self.values = pd.Series(np.random.default_rng(1).zipf(1.3, 100000))
+        self.exact = self.values.value_counts()
+
+    def test_count_min_never_undercounts(self):
+        sketch = CountMinSketch(width=512)
+        for batch in np.array_split(self.values, 4):
+            sketch.merge(CountMinSketch(width=512).add_many(batch))
+        top = self.exact.head(20)
+        estimates = load_sketch(sketch.to_bytes()).estimate(top.index)
+        self.assertTrue((estimates >= top.to_numpy()).all())
+        self.assertTrue((estimates - top.to_numpy() <= 3 * len(self.values) / 512).all())
+        self.assertEqual(sketch.total, len(self.values))
+
+    def test_space_saving_finds_heavy_hitters_across_batches(self):
+        summaries = [SpaceSaving(50).add_many(batch) for batch in np.array_split(self.values, 5)]
+        merged = summaries[0]
+        for summary in summaries[1:]:
+            merged.merge(summary)
+        merged = load_sketch(merged.to_bytes())
+
+        top = merged.top(5)
+        self.assertEqual(top['value'].tolist(), self.exact.index[:5].tolist())
+        exact = self.exact[top['value']].to_numpy()
+        self.assertTrue((top['count'] >= exact).all())
+        self.assertTrue((top['guaranteed'] <= exact).all())
+        self.assertLessEqual(len(merged), 50)
+
+class TestCampaignSketches(unittest.TestCase):
+    def setUp(self):
+        self.processor = DataProcessor('sqlite://')
+        self.clicks = self.processor.process_clicks_conversions([
+            {'timestamp': f'2023-01-0{day} {hour:02d}:00:00', 'user_id': user, 'ad_campaign_id': campaign, 'conversion_type': 'visit'}
+            for day in (1, 2) for hour in (10, 11) for user in range(100) for campaign in (1, 2)
+        ])
+
+    def test_unique_users_per_campaign_hour_and_rollup(self):
+        sketches = self.processor.sketch_data(self.clicks)
+        hourly = sketches.unique_users('campaign')
+        self.assertEqual(len(hourly), 8)
+        self.assertTrue(hourly['unique_users'].between(97, 103).all())
+
+        daily = sketches.rollup('D').unique_users('campaign')
+        self.assertEqual(daily['period'].dt.day.tolist(), [1, 1, 2, 2])
+        self.assertTrue(daily['unique_users'].between(97, 103).all())
+
+    def test_batches_and_storage_round_trip(self):
+        first, second = self.clicks.iloc[:400], self.clicks.iloc[400:]
+        sketches = self.processor.sketch_data(first).merge(self.processor.sketch_data(second))
+        self.processor.store_data(sketches.to_frame(), 'campaign_sketches', mode='replace')
+        stored = pd.read_sql_table('campaign_sketches', self.processor.engine)
+
+        restored = CampaignSketches.from_frame(stored).rollup('W')
+
+        # 2023-01-01 is a Sunday, so the two days fall in different weeks
+        self.assertEqual(len(restored.unique_users()), 4)
+        self.assertTrue(restored.unique_users()['unique_users'].between(97, 103).all())
+        self.assertEqual(restored.top_users(1)['count'].iloc[0], 8)
+
+if __name__ == '__main__':
+    unittest.main()
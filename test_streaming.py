@@ -0,0 +1,176 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+
+import pandas as pd
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from process import DataProcessor
+from streaming import FileBroker, MemoryBroker, StreamConsumer, partition_for
+
+def clicks(start, count):
+    return [
+        {'timestamp': '2024-04-01 10:00:00', 'user_id': user_id, 'ad_campaign_id': 1, 'conversion_type': 'visit'}
+        for user_id in range(start, start + count)
+    ]
+
+class TestStreamConsumer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.processor = DataProcessor(f"sqlite:///{os.path.join(self.tmp_dir.name, 'test.db')}")
+
+    def tearDown(self):
+        self.processor.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def count(self, table_name):
+        with self.processor.engine.connect() as conn:
+            return pd.read_sql(f"SELECT COUNT(*) AS n FROM {table_name}", conn)['n'][0]
+
+    def test_batches_by_size_and_commits_after_write(self):
+        broker = MemoryBroker()
+        broker.produce_many('clicks_conversions', clicks(0, 25))
+        consumer = StreamConsumer(self.processor, broker.consumer(['clicks_conversions']), max_batch_size=10, max_batch_latency=60)
+        report = consumer.run(idle_timeout=0.3)
+
+        self.assertEqual(report['batches'], 3)
+        self.assertEqual(report['records'], 25)
+        self.assertEqual(self.count('clicks_conversions'), 25)
+        self.assertEqual(broker.committed[('advertisex', 'clicks_conversions', 0)], 25)
+
+    def test_partial_batch_is_written_after_latency(self):
+        broker = MemoryBroker()
+        broker.produce_many('clicks_conversions', clicks(0, 3))
+        consumer = StreamConsumer(self.processor, broker.consumer(['clicks_conversions']), max_batch_size=1000, max_batch_latency=0.2)
+        thread = threading.Thread(target=consumer.run)
+        thread.start()
+        time.sleep(1)
+        consumer.stop()
+        thread.join()
+
+        self.assertEqual(consumer.stats()['batches'], 1)
+        self.assertEqual(self.count('clicks_conversions'), 3)
+
+    def test_failed_write_is_not_committed(self):
+        broker = MemoryBroker()
+        broker.produce_many('clicks_conversions', clicks(0, 5))
+
+        def fail(df, source):
+            raise RuntimeError('storage unavailable')
+
+        consumer = StreamConsumer(self.processor, broker.consumer(['clicks_conversions']), max_batch_size=5,
+                                  max_retries=1, transform=fail)
+        with self.assertRaises(RuntimeError):
+            consumer.run(idle_timeout=0.3)
+        self.assertEqual(broker.committed, {})
+
+        # A new consumer of the group replays the uncommitted records
+        consumer = StreamConsumer(self.processor, broker.consumer(['clicks_conversions']), max_batch_size=5)
+        self.assertEqual(consumer.run(idle_timeout=0.3)['records'], 5)
+
+    def test_retried_write_reuses_the_deduplicated_batch(self):
+        broker = MemoryBroker()
+        broker.produce_many('clicks_conversions', clicks(0, 10))
+        load = self.processor.loader.load
+        failures = []
+
+        def fail_once(*args, **kwargs):
+            if not failures:
+                failures.append(True)
+                raise RuntimeError('storage unavailable')
+            return load(*args, **kwargs)
+
+        self.processor.loader.load = fail_once
+        consumer = StreamConsumer(self.processor, broker.consumer(['clicks_conversions']), max_batch_size=10,
+                                  transform=lambda df, source: self.processor.deduplicate_data(df))
+        consumer.run(idle_timeout=0.3)
+
+        self.assertEqual(failures, [True])
+        self.assertEqual(self.count('clicks_conversions'), 10)
+        self.assertEqual(broker.committed[('advertisex', 'clicks_conversions', 0)], 10)
+
+    def test_retried_write_quarantines_rejected_rows_once(self):
+        broker = MemoryBroker()
+        records = clicks(0, 10)
+        for record in records[:2]:
+            record['conversion_type'] = 'bogus'
+        broker.produce_many('clicks_conversions', records)
+        load = self.processor.loader.load
+        failures = []
+
+        def fail_first_batch_load(df, table_name, **kwargs):
+            if table_name == 'clicks_conversions' and not failures:
+                failures.append(True)
+                raise RuntimeError('storage unavailable')
+            return load(df, table_name, **kwargs)
+
+        self.processor.loader.load = fail_first_batch_load
+        consumer = StreamConsumer(self.processor, broker.consumer(['clicks_conversions']), max_batch_size=10, validate=True)
+        consumer.run(idle_timeout=0.3)
+
+        self.assertEqual(failures, [True])
+        self.assertEqual(self.count('clicks_conversions'), 8)
+        self.assertEqual(self.count('clicks_conversions_quarantine'), 2)
+
+    def test_failed_writer_does_not_hang_a_full_queue(self):
+        broker = MemoryBroker()
+        broker.produce_many('clicks_conversions', clicks(0, 50))
+
+        def slow_failure(df, source):
+            time.sleep(0.2)
+            raise RuntimeError('storage unavailable')
+
+        consumer = StreamConsumer(self.processor, broker.consumer(['clicks_conversions']), max_batch_size=5,
+                                  max_in_flight=2, max_retries=1, transform=slow_failure)
+        errors = []
+
+        def run():
+            try:
+                consumer.run(idle_timeout=5)
+            except RuntimeError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(broker.committed, {})
+
+    def test_backpressure_blocks_polling(self):
+        broker = MemoryBroker()
+        broker.produce_many('clicks_conversions', clicks(0, 20))
+
+        def slow(df, source):
+            time.sleep(0.1)
+            return df
+
+        consumer = StreamConsumer(self.processor, broker.consumer(['clicks_conversions']), max_batch_size=2,
+                                  max_in_flight=1, transform=slow)
+        report = consumer.run(idle_timeout=0.3)
+
+        self.assertEqual(self.count('clicks_conversions'), 20)
+        self.assertEqual(report['commits'], 10)
+        self.assertGreater(report['backpressure_seconds'], 0.3)
+
+    def test_file_broker_resumes_from_committed_offsets(self):
+        broker = FileBroker(os.path.join(self.tmp_dir.name, 'broker'), partitions=2)
+        broker.produce_many('clicks_conversions', clicks(0, 10))
+        StreamConsumer(self.processor, broker.consumer(['clicks_conversions'])).run(idle_timeout=0.3)
+
+        broker.produce_many('clicks_conversions', clicks(10, 4))
+        report = StreamConsumer(self.processor, broker.consumer(['clicks_conversions'])).run(idle_timeout=0.3)
+
+        self.assertEqual(report['records'], 4)
+        self.assertEqual(self.count('clicks_conversions'), 14)
+
+    def test_string_user_ids_partition_stably(self):
+        value = {'user_id': 'user-42'}
+        self.assertEqual(partition_for(value, 8), zlib.crc32(b'user-42') % 8)
+
+if __name__ == '__main__':
+    unittest.main()
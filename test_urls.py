@@ -0,0 +1,62 @@
+import os
+import unittest
+
+import pandas as pd
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from process import DataProcessor
+from urls import DomainDictionary, parse_urls
+
+class TestParseUrls(unittest.TestCase):
+    def test_parses_and_normalizes_urls(self):
+        urls = pd.Series([
+            'http://Example3.com/path/1',
+            'example.co.uk',
+            'https://news.bbc.co.uk:8080/a?b=1',
+            'HTTP://user@x.Example.org./p#frag',
+            '192.168.1.1/x',
+            None,
+        ], index=[10, 11, 12, 13, 14, 15])
+
+        df = parse_urls(urls)
+
+        self.assertEqual(list(df.index), [10, 11, 12, 13, 14, 15])
+        self.assertEqual(df.loc[[10, 12, 13], 'scheme'].tolist(), ['http', 'https', 'http'])
+        self.assertTrue(pd.isna(df.loc[11, 'scheme']))
+        self.assertEqual(df['host'].tolist()[:5], ['example3.com', 'example.co.uk', 'news.bbc.co.uk', 'x.example.org', '192.168.1.1'])
+        self.assertEqual(df['domain'].tolist()[:5], ['example3.com', 'example.co.uk', 'bbc.co.uk', 'example.org', '192.168.1.1'])
+        self.assertEqual(df['path'].tolist()[:5], ['/path/1', '/', '/a', '/p', '/x'])
+        self.assertTrue(df.loc[15].isna().all())
+        self.assertIsInstance(df['domain'].dtype, pd.CategoricalDtype)
+
+    def test_dictionary_keeps_codes_across_batches(self):
+        domains = DomainDictionary()
+        first = parse_urls(pd.Series(['http://a.com/1', 'http://b.com/2']), domains)['domain']
+        second = parse_urls(pd.Series(['http://c.com/', 'http://a.com/3']), domains)['domain']
+
+        self.assertEqual(len(domains), 3)
+        self.assertEqual(first.cat.codes.tolist(), [0, 1])
+        self.assertEqual(second.cat.codes.tolist(), [2, 0])
+        combined = pd.concat([first.astype(second.dtype), second])
+        self.assertEqual(combined.tolist(), ['a.com', 'b.com', 'c.com', 'a.com'])
+
+class TestProcessAdImpressions(unittest.TestCase):
+    def setUp(self):
+        self.processor = DataProcessor('sqlite://')
+
+    def test_accepts_both_url_field_names(self):
+        for field in ('website_url', 'website'):
+            df = self.processor.process_ad_impressions([
+                {'ad_creative_id': 1, 'user_id': 1, 'timestamp': '2023-01-01 00:00:00', field: 'http://www.example.com/x'},
+                {'ad_creative_id': 2, 'user_id': 2, 'timestamp': '2023-01-01 00:00:01', field: 'example.org'},
+            ])
+            self.assertEqual(df['domain'].tolist(), ['example.com', 'example.org'], field)
+            self.assertEqual(df['url_host'].tolist(), ['www.example.com', 'example.org'], field)
+
+    def test_missing_url_field_is_tolerated(self):
+        df = self.processor.process_ad_impressions([{'ad_creative_id': 1, 'timestamp': '2023-01-01 00:00:00'}])
+        self.assertNotIn('domain', df.columns)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from process import DataProcessor
+from windows import RollupEngine, WindowAggregator
+
+def bids(seconds, countries, amounts):
+    return pd.DataFrame({
+        'timestamp': pd.Timestamp('2023-01-01') + pd.to_timedelta(seconds, unit='s'),
+        'user_country': countries,
+        'bid_amount': amounts,
+    })
+
+class TestWindowAggregator(unittest.TestCase):
+    def test_incremental_updates_match_full_recompute(self):
+        rng = np.random.default_rng(0)
+        df = bids(np.sort(rng.integers(0, 600, 2000)), rng.choice(['France', 'Spain', None], 2000), rng.lognormal(0, 1, 2000))
+        aggregator = WindowAggregator('1min', dimensions=['user_country'], value='bid_amount', allowed_lateness='1h')
+        for start in range(0, len(df), 300):
+            aggregator.update(df.iloc[start:start + 300])
+
+        state = aggregator.state.sort_index()
+        expected = df.assign(window_start=df['timestamp'].dt.floor('1min'), user_country=df['user_country'].fillna('Unknown'))
+        expected = expected.groupby(['window_start', 'user_country'])['bid_amount'].agg(['count', 'sum', 'min', 'max'])
+        np.testing.assert_array_equal(state['count'].to_numpy(), expected['count'].to_numpy())
+        np.testing.assert_allclose(state['sum'].to_numpy(), expected['sum'].to_numpy())
+        np.testing.assert_allclose(state['max'].to_numpy(), expected['max'].to_numpy())
+
+    def test_returns_only_changed_windows_with_percentiles(self):
+        aggregator = WindowAggregator('1min', dimensions=['user_country'], value='bid_amount')
+        aggregator.update(bids([0, 10, 70], ['France', 'France', 'Spain'], [1.0, 3.0, 2.0]))
+        changed = aggregator.update(bids([80, 90], ['Spain', 'Spain'], [4.0, 6.0]))
+
+        self.assertEqual(len(changed), 1)
+        row = changed.iloc[0]
+        self.assertEqual((row['user_country'], row['count'], row['sum'], row['avg']), ('Spain', 3, 12.0, 4.0))
+        self.assertAlmostEqual(row['p50'], 4.0, delta=4.0 * 0.02)
+        self.assertAlmostEqual(row['p99'], 6.0, delta=6.0 * 0.02)
+        self.assertEqual(row['window_end'] - row['window_start'], pd.Timedelta('1min'))
+
+    def test_late_events_within_lateness_update_and_beyond_are_dropped(self):
+        aggregator = WindowAggregator('1min', value='bid_amount', allowed_lateness='2min')
+        aggregator.update(bids([0, 300], [None, None], [1.0, 1.0]))
+        # The watermark is now 00:03, closing earlier windows; 00:03:20 is within lateness, 00:00:30 is not
+        changed = aggregator.update(bids([200, 30], [None, None], [1.0, 1.0]))
+
+        self.assertEqual(changed['window_start'].tolist(), [pd.Timestamp('2023-01-01 00:03')])
+        self.assertEqual(aggregator.late_events, 1)
+        self.assertTrue((aggregator.state.index + pd.Timedelta('1min') > aggregator.watermark).all())
+
+    def test_sliding_windows(self):
+        aggregator = WindowAggregator('3min', slide='1min')
+        changed = aggregator.update(bids([0, 65, 130], [None] * 3, [1.0] * 3)).set_index('window_start')['count']
+        self.assertEqual(changed[pd.Timestamp('2023-01-01 00:00')], 3)
+        self.assertEqual(changed[pd.Timestamp('2023-01-01 00:01')], 2)
+        self.assertEqual(changed[pd.Timestamp('2022-12-31 23:58')], 1)
+
+class TestRollupTables(unittest.TestCase):
+    def test_processor_upserts_changed_rollup_rows(self):
+        processor = DataProcessor('sqlite://', rollup_options={'windows': ('1min', '1h')})
+        clicks = [
+            {'timestamp': '2023-01-01 10:00:05', 'user_id': 1, 'ad_campaign_id': 1, 'conversion_type': 'visit'},
+            {'timestamp': '2023-01-01 10:00:35', 'user_id': 2, 'ad_campaign_id': 1, 'conversion_type': 'visit'},
+            {'timestamp': '2023-01-01 10:01:05', 'user_id': 3, 'ad_campaign_id': 2, 'conversion_type': 'purchase'},
+        ]
+        written = processor.aggregate_data(processor.process_clicks_conversions(clicks[:2]))
+        self.assertEqual(written, {'clicks_conversions_rollup_1min': 1, 'clicks_conversions_rollup_1h': 1})
+        processor.aggregate_data(processor.process_clicks_conversions(clicks[2:]))
+
+        minutes = pd.read_sql_table('clicks_conversions_rollup_1min', processor.engine)
+        hours = pd.read_sql_table('clicks_conversions_rollup_1h', processor.engine).sort_values('ad_campaign_id')
+        self.assertEqual(len(minutes), 2)
+        self.assertEqual(hours['count'].tolist(), [2, 1])
+        self.assertEqual(hours['conversion_type'].tolist(), ['Website Visit', 'Purchase'])
+
+    def test_processed_bid_requests_are_rolled_up_by_ingestion_time(self):
+        processor = DataProcessor('sqlite://', rollup_options={'windows': ('1h',)})
+        processor._geoip = type('FranceGeoIP', (), {'lookup_many': staticmethod(lambda ips: 'France')})()
+        bid_requests = [
+            {'bid_amount': amount, 'user_id': i, 'auction_id': f'a{i}', 'ip_address': '192.0.2.1'}
+            for i, amount in enumerate([1.0, 2.0, 4.5])
+        ]
+        df = processor.process_bid_requests(bid_requests)
+        self.assertNotIn('timestamp', df.columns)
+
+        self.assertEqual(processor.aggregate_data(df, 'bid_requests'), {'bid_requests_rollup_1h': 1})
+        row = pd.read_sql_table('bid_requests_rollup_1h', processor.engine).iloc[0]
+        processor.engine.dispose()
+        self.assertEqual((row['user_country'], row['count'], row['sum'], row['max']), ('France', 3, 7.5, 4.5))
+        self.assertLess(pd.Timestamp.now() - pd.Timestamp(row['window_start']), pd.Timedelta('2h'))
+
+    def test_restarted_processes_add_to_stored_totals(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_url = f"sqlite:///{os.path.join(tmp_dir, 'rollups.db')}"
+            rollups = {'bid_requests': {'dimensions': ['user_country'], 'value': 'bid_amount'}}
+            # A second processor starts with empty windows, as after a restart or on the next cron run
+            for seconds, amounts in (([0, 60, 120, 180, 240], [1.0, 2.0, 3.0, 4.0, 5.0]), ([300, 360, 420], [0.5, 6.0, 1.0])):
+                processor = DataProcessor(db_url)
+                engine = RollupEngine(processor.loader, windows=('1h',), rollups=rollups)
+                engine.update(bids(seconds, ['France'] * len(seconds), amounts), 'bid_requests')
+                processor.engine.dispose()
+
+            processor = DataProcessor(db_url)
+            row = pd.read_sql_table('bid_requests_rollup_1h', processor.engine).iloc[0]
+            processor.engine.dispose()
+        self.assertEqual((row['count'], row['sum'], row['min'], row['max']), (8, 22.5, 0.5, 6.0))
+        self.assertAlmostEqual(row['avg'], 22.5 / 8)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+URL_COLUMNS = ['website_url', 'website']
+
+# Optional scheme, optional user info, host, optional port, then path
+URL_PATTERN = (
+    r'^\s*(?:(?P<scheme>[A-Za-z][A-Za-z0-9+.\-]*)://)?'
+    r'(?:[^@/?#]*@)?'
+    r'(?P<host>\[[^\]]*\]|[^/?#:]*)'
+    r'(?::\d*)?'
+    r'(?P<path>/[^?#]*)?'
+)
+
+# Public suffixes made of two labels, under which the registrable domain has three
+MULTI_LABEL_SUFFIXES = frozenset([
+    'co.uk', 'org.uk', 'ac.uk', 'gov.uk', 'me.uk', 'ltd.uk', 'plc.uk',
+    'com.au', 'net.au', 'org.au', 'edu.au', 'gov.au',
+    'co.jp', 'ne.jp', 'or.jp', 'ac.jp', 'go.jp',
+    'co.nz', 'org.nz', 'co.za', 'co.in', 'firm.in', 'net.in', 'org.in',
+    'com.br', 'com.cn', 'com.mx', 'com.tr', 'com.sg', 'com.hk', 'co.kr',
+])
+
+class DomainDictionary:
+    """
+    Categorical dictionary of domains shared across batches.
+
+    Domains get a fixed code the first time they are seen, and every batch is
+    encoded against the same, only growing, list of categories, so the codes
+    of earlier batches stay valid and batches concatenate cheaply.
+    """
+
+    def __init__(self):
+        self.categories = []
+        self.index = pd.Index([], dtype=object)
+
+    def __len__(self):
+        return len(self.categories)
+
+    def encode(self, values):
+        """
+        Encode values as a categorical over the shared dictionary.
+
+        Parameters:
+            values (pandas.Series): Domains; missing values stay missing.
+
+        Returns:
+            pandas.Series: Categorical series aligned with the input index.
+        """
+        codes, uniques = pd.factorize(values)
+        new = uniques[self.index.get_indexer(uniques) < 0]
+        if len(new):
+            self.categories.extend(new)
+            self.index = pd.Index(self.categories, dtype=object)
+        # Map batch-local codes to dictionary codes; -1 (missing) stays -1
+        dictionary_codes = np.append(self.index.get_indexer(uniques), -1)[codes]
+        dtype = pd.CategoricalDtype(self.index)
+        return pd.Series(pd.Categorical.from_codes(dictionary_codes, dtype=dtype), index=values.index, name=values.name)
+
+def registrable_domain(hosts):
+    """
+    Get the registrable domain of each host, e.g. 'news.example.co.uk' -> 'example.co.uk'.
+
+    IP addresses and single-label hosts are returned as they are.
+
+    Parameters:
+        hosts (pandas.Series): Lowercase host names.
+
+    Returns:
+        pandas.Series: Registrable domains.
+    """
+    last_two = hosts.str.extract(r'([^.]+\.[^.]+)$', expand=False)
+    last_three = hosts.str.extract(r'([^.]+\.[^.]+\.[^.]+)$', expand=False)
+    domains = last_two.where(~last_two.isin(MULTI_LABEL_SUFFIXES) | last_three.isna(), last_three)
+    is_ip = hosts.str.fullmatch(r'[\d.]+|\[.*\]', na=False)
+    return domains.where(~is_ip & domains.notna(), hosts)
+
+def parse_urls(urls, domains=None):
+    """
+    Parse a column of URLs into normalized scheme, host, registrable domain and path.
+
+    Every distinct URL is parsed once with vectorized string operations and
+    the result is broadcast back to the rows. URLs without a scheme (e.g.
+    'example.com/path') are accepted; scheme and host are lowercased, a
+    trailing dot and the port are dropped from the host, and an empty path
+    becomes '/'.
+
+    Parameters:
+        urls (pandas.Series): URLs.
+        domains (DomainDictionary, optional): Dictionary to intern domains into.
+
+    Returns:
+        pandas.DataFrame: Columns 'scheme', 'host', 'domain' and 'path', aligned
+        with the input index. 'domain' is categorical.
+    """
+    codes, uniques = pd.factorize(urls)
+    parts = pd.Series(uniques, dtype=object).astype(str).str.extract(URL_PATTERN)
+    parts['scheme'] = parts['scheme'].str.lower()
+    parts['host'] = parts['host'].str.lower().str.rstrip('.').replace('', np.nan)
+    parts['path'] = parts['path'].fillna('/').where(parts['host'].notna())
+    parts['domain'] = registrable_domain(parts['host'])
+    # Missing URLs get code -1, which picks the trailing all-missing row
+    parts = pd.concat([parts, pd.DataFrame([[np.nan] * len(parts.columns)], columns=parts.columns)], ignore_index=True)
+    df = parts.iloc[codes].reset_index(drop=True)[['scheme', 'host', 'domain', 'path']]
+    df.index = urls.index
+    if domains is not None:
+        df['domain'] = domains.encode(df['domain'])
+    else:
+        df['domain'] = df['domain'].astype('category')
+    return df
+
+def url_column(df):
+    """
+    Get the name of the URL column of an ad impressions DataFrame.
+
+    Parameters:
+        df (pandas.DataFrame): Ad impressions.
+
+    Returns:
+        str: 'website_url' or the legacy 'website', or None if there is neither.
+    """
+    for column in URL_COLUMNS:
+        if column in df.columns:
+            return column
+    return None
@@ -0,0 +1,326 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from partitions import INGESTED_COLUMN
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Define constants
+DEFAULT_WINDOWS = ('1min', '1h', '1D')
+DEFAULT_ALLOWED_LATENESS = '10min'
+PERCENTILES = (0.5, 0.9, 0.99)
+# Relative accuracy of the percentile histograms: bucket i holds values in (GAMMA**(i-1), GAMMA**i]
+HISTOGRAM_GAMMA = 1.02
+HISTOGRAM_MIN_VALUE = 1e-6
+MISSING_KEY = 'Unknown'
+
+# Dimensions, measured value and time column per source; only dimensions
+# present in the first batch are used, e.g. campaign and creative for bids
+# joined to impressions. Bid requests carry no event time, so they are
+# windowed by the time they were aggregated, as partitions.py does.
+DEFAULT_ROLLUPS = {
+    'ad_impressions': {'dimensions': ['ad_creative_id', 'domain']},
+    'clicks_conversions': {'dimensions': ['ad_campaign_id', 'conversion_type']},
+    'bid_requests': {
+        'dimensions': ['ad_campaign_id', 'ad_creative_id', 'domain', 'user_country'],
+        'value': 'bid_amount',
+        'time_column': INGESTED_COLUMN,
+    },
+}
+
+def window_label(window):
+    """Get a table-name friendly label of a window length, e.g. '1min', '1h' or '1d'."""
+    seconds = int(pd.Timedelta(window).total_seconds())
+    for unit, length in (('d', 86400), ('h', 3600), ('min', 60)):
+        if seconds % length == 0:
+            return f"{seconds // length}{unit}"
+    return f"{seconds}s"
+
+def histogram_bucket(values):
+    """Get the log-scaled histogram bucket of each value."""
+    return np.ceil(np.log(np.maximum(values, HISTOGRAM_MIN_VALUE)) / np.log(HISTOGRAM_GAMMA)).astype(np.int64)
+
+def bucket_value(buckets):
+    """Get a representative value of each histogram bucket, within the histogram's relative accuracy."""
+    return 2 * HISTOGRAM_GAMMA ** buckets / (HISTOGRAM_GAMMA + 1)
+
+class WindowAggregator:
+    """
+    Incremental tumbling or sliding window aggregates of one event stream.
+
+    Each batch only updates the windows its events fall in, and only those
+    rows are returned for writing. Events are counted per window and
+    dimension values; when a value column is set its sum, min, max, average
+    and percentiles (from mergeable log-scaled histograms) are kept too.
+
+    Windows stay open until the watermark, the latest event time seen minus
+    the allowed lateness, passes their end. Events for windows that are
+    already closed are dropped and counted in `late_events`, and closed
+    windows are evicted, so state is bounded by the number of open windows.
+    """
+
+    def __init__(self, window='1min', slide=None, dimensions=None, value=None, time_column='timestamp',
+                 allowed_lateness=DEFAULT_ALLOWED_LATENESS, percentiles=PERCENTILES):
+        """
+        Parameters:
+            window (str): Window length, e.g. '1min', '1h' or '1D'.
+            slide (str, optional): Distance between window starts for sliding windows;
+                tumbling windows (slide = window) by default.
+            dimensions (list, optional): Columns to group by within each window.
+            value (str, optional): Column to compute sum, avg and percentiles of.
+            time_column (str): Event time column.
+            allowed_lateness (str): How long after its end a window still accepts events.
+            percentiles (tuple): Percentiles of the value column to report.
+        """
+        self.window = pd.Timedelta(window)
+        self.slide = pd.Timedelta(slide) if slide else self.window
+        if self.window % self.slide:
+            raise ValueError(f"Window {window} must be a multiple of its slide {slide}")
+        self.dimensions = dimensions
+        self.value = value
+        self.time_column = time_column
+        self.allowed_lateness = pd.Timedelta(allowed_lateness)
+        self.percentiles = percentiles
+        self.keys = None
+        self.state = None
+        self.histogram = None
+        self.watermark = None
+        self.late_events = 0
+        # Counts (and sums, mins and maxes) added by the last batch, per changed window
+        self.increments = None
+
+    def assign_windows(self, df):
+        """
+        Repeat each event once per window containing it.
+
+        Returns:
+            pandas.DataFrame: 'window_start', the dimension columns and the value column.
+        """
+        times = df[self.time_column]
+        columns = {'window_start': times.dt.floor(self.slide)}
+        for column in self.dimensions:
+            values = df[column]
+            columns[column] = values.fillna(-1) if pd.api.types.is_numeric_dtype(values.dtype) else values.astype(object).fillna(MISSING_KEY)
+        if self.value:
+            columns[self.value] = df[self.value].astype('float64')
+        events = pd.DataFrame(columns)
+        windows_per_event = self.window // self.slide
+        if windows_per_event == 1:
+            return events
+        # Sliding windows: an event belongs to the windows starting at most window - slide before it
+        events = events.loc[events.index.repeat(windows_per_event)]
+        offsets = np.tile(np.arange(windows_per_event), len(df)) * self.slide
+        events['window_start'] = events['window_start'] - pd.to_timedelta(offsets)
+        return events
+
+    def update(self, df):
+        """
+        Add a batch of events.
+
+        Parameters:
+            df (pandas.DataFrame): Processed events with a datetime time column.
+
+        Returns:
+            pandas.DataFrame: The current aggregates of every window the batch changed.
+        """
+        if self.dimensions is None:
+            self.dimensions = []
+        if self.keys is None:
+            self.dimensions = [column for column in self.dimensions if column in df.columns]
+            self.keys = ['window_start'] + self.dimensions
+        df = df[df[self.time_column].notna()]
+        self.increments = None
+        if df.empty:
+            return self.empty_result()
+
+        latest = df[self.time_column].max()
+        if self.watermark is not None:
+            # Events whose last window ended before the watermark are too late
+            late = (df[self.time_column].dt.floor(self.slide) + self.window <= self.watermark).to_numpy()
+            self.late_events += int(late.sum())
+            df = df[~late]
+        if df.empty:
+            self.advance(latest)
+            return self.empty_result()
+
+        events = self.assign_windows(df)
+        if self.watermark is not None:
+            # Earlier sliding windows of an event may already be closed and written
+            events = events[(events['window_start'] + self.window > self.watermark).to_numpy()]
+
+        grouped = events.groupby(self.keys, sort=False)
+        batch = grouped.size().to_frame('count')
+        if self.value:
+            values = grouped[self.value]
+            batch['sum'] = values.sum()
+            batch['min'] = values.min()
+            batch['max'] = values.max()
+            buckets = events[self.keys].assign(bucket=histogram_bucket(events[self.value].to_numpy()))
+            histogram = buckets.groupby(self.keys + ['bucket'], sort=False).size()
+            self.histogram = histogram if self.histogram is None else (
+                pd.concat([self.histogram, histogram]).groupby(level=list(range(len(self.keys) + 1))).sum()
+            )
+
+        if self.state is None:
+            self.state = batch
+        else:
+            combined = pd.concat([self.state, batch])
+            aggregations = {'count': 'sum'}
+            if self.value:
+                aggregations.update({'sum': 'sum', 'min': 'min', 'max': 'max'})
+            self.state = combined.groupby(level=list(range(len(self.keys)))).agg(aggregations)
+
+        self.increments = batch
+        changed = self.result(batch.index)
+        self.advance(latest)
+        return changed
+
+    def advance(self, latest):
+        """Move the watermark to `latest` minus the allowed lateness and evict closed windows."""
+        watermark = latest - self.allowed_lateness
+        if self.watermark is not None and watermark <= self.watermark:
+            return
+        self.watermark = watermark
+        if self.state is not None:
+            starts = self.state.index.get_level_values('window_start')
+            self.state = self.state[starts + self.window > watermark]
+        if self.histogram is not None:
+            starts = self.histogram.index.get_level_values('window_start')
+            self.histogram = self.histogram[starts + self.window > watermark]
+
+    def result(self, index):
+        """
+        Build output rows for the given windows from the current state.
+
+        Parameters:
+            index (pandas.Index): (window_start, dimensions...) keys to output.
+
+        Returns:
+            pandas.DataFrame: One row per window and dimension values.
+        """
+        rows = self.state.loc[index].copy()
+        if self.value:
+            rows['avg'] = rows['sum'] / rows['count']
+            rows = rows.join(self.histogram_percentiles(index))
+        rows = rows.reset_index()
+        rows.insert(1, 'window_end', rows['window_start'] + self.window)
+        return rows
+
+    def histogram_percentiles(self, index):
+        """Compute the configured percentiles of the given windows from their histograms."""
+        levels = list(range(len(self.keys)))
+        histogram = self.histogram[self.histogram.index.droplevel('bucket').isin(index)].sort_index()
+        cumulative = histogram.groupby(level=levels).cumsum()
+        totals = histogram.groupby(level=levels).transform('sum')
+        buckets = histogram.index.get_level_values('bucket').to_numpy()
+        result = {}
+        for q in self.percentiles:
+            reached = cumulative.to_numpy() >= q * totals.to_numpy()
+            first = pd.Series(bucket_value(buckets[reached]), index=histogram.index[reached].droplevel('bucket'))
+            result[f"p{round(q * 100):g}"] = first.groupby(level=levels).first()
+        return pd.DataFrame(result)
+
+    def empty_result(self):
+        columns = ['window_start', 'window_end'] + (self.dimensions or []) + ['count']
+        if self.value:
+            columns += ['sum', 'min', 'max', 'avg'] + [f"p{round(q * 100):g}" for q in self.percentiles]
+        return pd.DataFrame(columns=columns)
+
+class RollupEngine:
+    """
+    Maintain rollup tables of several window lengths for every source.
+
+    Each (source, window) pair has a WindowAggregator and a compact table,
+    e.g. 'bid_requests_rollup_1min', keyed by window start and dimensions.
+    Each batch upserts only the window rows it changed, adding its counts
+    and sums to the stored ones (and merging mins and maxes), so totals
+    written by earlier runs or other processes are kept: an aggregator only
+    knows the events its own process saw. Percentiles cannot be merged and
+    reflect the events the last writing process saw in the window.
+    """
+
+    def __init__(self, loader, windows=DEFAULT_WINDOWS, slide=None, allowed_lateness=DEFAULT_ALLOWED_LATENESS, rollups=None):
+        """
+        Parameters:
+            loader (BulkLoader): Loader used to upsert changed rows.
+            windows (tuple): Window lengths.
+            slide (str, optional): Slide of sliding windows; tumbling windows by default.
+            allowed_lateness (str): How long after its end a window still accepts events.
+            rollups (dict, optional): Dimensions, value and time column per source; see DEFAULT_ROLLUPS.
+        """
+        self.loader = loader
+        self.windows = windows
+        self.slide = slide
+        self.allowed_lateness = allowed_lateness
+        self.rollups = rollups or DEFAULT_ROLLUPS
+        self.aggregators = {}
+
+    def aggregator(self, source, window):
+        key = (source, window)
+        if key not in self.aggregators:
+            spec = self.rollups[source]
+            slide = self.slide if self.slide and pd.Timedelta(window) % pd.Timedelta(self.slide) == pd.Timedelta(0) else None
+            self.aggregators[key] = WindowAggregator(
+                window, slide, list(spec.get('dimensions', [])), spec.get('value'),
+                time_column=spec.get('time_column', 'timestamp'), allowed_lateness=self.allowed_lateness,
+            )
+        return self.aggregators[key]
+
+    def table_name(self, source, window):
+        return f"{source}_rollup_{window_label(window)}"
+
+    def update(self, df, source, conn=None):
+        """
+        Aggregate a processed batch and upsert the changed window rows.
+
+        Parameters:
+            df (pandas.DataFrame): Processed events.
+            source (str): Source of the events.
+            conn (sqlalchemy.engine.Connection, optional): Transaction to write in.
+
+        Returns:
+            dict: Rollup table names mapped to the number of rows written.
+        """
+        time_column = self.rollups[source].get('time_column', 'timestamp')
+        if time_column not in df.columns:
+            if time_column != INGESTED_COLUMN:
+                raise ValueError(f"Cannot aggregate {source} data without a '{time_column}' column")
+            df = df.assign(**{INGESTED_COLUMN: pd.Timestamp.now().floor('s')})
+        written = {}
+        for window in self.windows:
+            aggregator = self.aggregator(source, window)
+            changed = aggregator.update(df)
+            table_name = self.table_name(source, window)
+            if not changed.empty:
+                # Write this batch's increments; the upsert adds them to the stored totals
+                measures = list(aggregator.increments.columns)
+                changed[measures] = aggregator.increments[measures].to_numpy()
+                merge = {'count': 'sum'}
+                if aggregator.value:
+                    changed['avg'] = changed['sum'] / changed['count']
+                    merge.update({
+                        'sum': 'sum', 'min': 'min', 'max': 'max',
+                        'avg': '(COALESCE({current[sum]}, 0) + {new[sum]}) / (COALESCE({current[count]}, 0) + {new[count]})',
+                    })
+                self.loader.load(changed, table_name, mode='upsert', key=aggregator.keys, conn=conn, merge=merge)
+            written[table_name] = len(changed)
+        return written
+
+    def stats(self):
+        """
+        Get open windows and late events per aggregator.
+
+        Returns:
+            dict: Table names mapped to their 'open_rows', 'late_events' and 'watermark'.
+        """
+        return {
+            self.table_name(source, window): {
+                'open_rows': 0 if aggregator.state is None else len(aggregator.state),
+                'late_events': aggregator.late_events,
+                'watermark': aggregator.watermark,
+            }
+            for (source, window), aggregator in self.aggregators.items()
+        }